@@ -7,14 +7,28 @@ from sqlalchemy import (
     DateTime,
     Float,
     Boolean,
+    LargeBinary,
+    ForeignKey,
+    Index,
+    JSON,
+    event,
+    inspect,
+    select,
+    text,
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, relationship, sessionmaker
 from datetime import datetime, timezone
+import hashlib
+import logging
 import os
+import zlib
 
-# データベースファイルのパス
-DB_PATH = os.path.join(os.path.dirname(__file__), "app.db")
+logger = logging.getLogger(__name__)
+
+# データベースファイルのパス（負荷試験などでは DATABASE_PATH で別のファイルを使う）
+DB_PATH = os.getenv("DATABASE_PATH", os.path.join(os.path.dirname(__file__), "app.db"))
 
 # SQLiteデータベースエンジンを作成
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
@@ -22,6 +36,14 @@ engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """WALモードにして、提出の書き込み中も読み取りをブロックしないようにする"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
 # セッションファクトリを作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -36,12 +58,19 @@ class ProblemModel(Base):
     """
 
     __tablename__ = "problems"
+    # 削除した問題のIDを新しい問題に使わない（バージョンの履歴が別の問題に続かないように）
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     title = Column(String, index=True)
     description = Column(Text)
     correct_code = Column(Text)
     test_input = Column(String, nullable=True)  # テストケース入力文字列
+    comparator = Column(String, nullable=True, default="exact")  # 出力の比較モード
+    comparator_options = Column(JSON, nullable=True)  # 比較モードの設定（許容誤差など）
+    checker_code = Column(Text, nullable=True)  # チェッカースクリプト
+    version = Column(Integer, nullable=True)  # 現在のバージョン番号（problem_versions）
+    version_hash = Column(String(64), nullable=True)  # 現在のバージョンの内容のハッシュ
     created_at = Column(DateTime, default=datetime.now(timezone.utc))
     updated_at = Column(
         DateTime,
@@ -50,28 +79,349 @@ class ProblemModel(Base):
     )
 
 
+class ProblemVersionModel(Base):
+    """
+    問題の内容のスナップショットを格納するデータベースモデル
+    作成・更新のたびに追加し、変更しない（提出はどのバージョンで判定したかを記録する）
+    """
+
+    __tablename__ = "problem_versions"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    problem_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)  # 問題ごとに1から増える番号
+    version_hash = Column(String(64), nullable=False)  # 内容のSHA-256
+    title = Column(String)
+    description = Column(Text)
+    correct_code = Column(Text)
+    test_input = Column(String, nullable=True)
+    comparator = Column(String, nullable=True)
+    comparator_options = Column(JSON, nullable=True)
+    checker_code = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("ix_problem_versions_problem_version", "problem_id", "version", unique=True),
+    )
+
+
+# blobsテーブルの圧縮レベル（zlib）
+BLOB_COMPRESSION_LEVEL = 6
+
+
+class BlobModel(Base):
+    """
+    内容アドレス方式で圧縮テキストを格納するデータベースモデル
+    同じ内容は同じハッシュになるため、再提出時も1行だけ保存される
+    """
+
+    __tablename__ = "blobs"
+
+    hash = Column(String(64), primary_key=True)  # UTF-8本文のSHA-256
+    data = Column(LargeBinary)  # zlib圧縮済みの本文
+    size = Column(Integer)  # 圧縮前のバイト数
+
+    @property
+    def text(self) -> str:
+        return zlib.decompress(self.data).decode("utf-8")
+
+
+def blob_hash(value: str) -> str:
+    """テキストのblobハッシュを計算する"""
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def compress_blob(value: str) -> bytes:
+    """テキストをblobsテーブル用に圧縮する"""
+    return zlib.compress(value.encode("utf-8"), BLOB_COMPRESSION_LEVEL)
+
+
+class BlobText:
+    """
+    ハッシュ列とblobsテーブルを介して透過的に圧縮・展開するテキスト属性
+    代入時はハッシュ列だけを更新し、本文はフラッシュ時にblobsへ書き込む
+    """
+
+    def __init__(self, hash_attr: str, blob_attr: str):
+        self.hash_attr = hash_attr
+        self.blob_attr = blob_attr
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        pending = obj.__dict__.get("_pending_blobs")
+        if pending is not None and self.name in pending:
+            return pending[self.name]
+        blob = getattr(obj, self.blob_attr)
+        return blob.text if blob is not None else None
+
+    def __set__(self, obj, value):
+        obj.__dict__.setdefault("_pending_blobs", {})[self.name] = value
+        setattr(obj, self.hash_attr, blob_hash(value) if value is not None else None)
+
+
+def _blob_relationship(hash_column):
+    return relationship(
+        BlobModel,
+        primaryjoin=lambda: BlobModel.hash == hash_column,
+        foreign_keys=lambda: [hash_column],
+        viewonly=True,
+        lazy="select",
+    )
+
+
 class SubmissionModel(Base):
     """
     提出情報を格納するデータベースモデル
+    コード・出力・アドバイスの本文はblobsテーブルに圧縮して保存する
     """
 
     __tablename__ = "submissions"
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     problem_id = Column(Integer, index=True)
-    user_code = Column(Text)
-    stdout = Column(Text, nullable=True)  # 実行標準出力
-    stderr = Column(Text, nullable=True)  # 実行標準エラー
+    problem_version = Column(Integer, nullable=True)  # 判定に使った問題のバージョン
+    submitter_id = Column(String, nullable=True)  # 提出者の識別子（学籍番号など）
+    user_code_hash = Column(String(64), ForeignKey("blobs.hash"), nullable=True)
+    stdout_hash = Column(String(64), ForeignKey("blobs.hash"), nullable=True)
+    stderr_hash = Column(String(64), ForeignKey("blobs.hash"), nullable=True)
     execution_time_ms = Column(Float, nullable=True)  # 実行時間（ミリ秒）
     exit_code = Column(Integer, nullable=True)  # 終了コード
-    advice_text = Column(Text, nullable=True)  # AIからのアドバイス保存用
+    error_type = Column(String, nullable=True)  # エラータイプ（NameErrorなど）
+    advice_text_hash = Column(String(64), ForeignKey("blobs.hash"), nullable=True)
     is_correct = Column(Boolean, nullable=True)  # 正解判定結果
     submitted_at = Column(DateTime, default=datetime.now(timezone.utc))
 
+    # 提出履歴のキーセットページング用の複合インデックス
+    # (submitted_at, id) の降順で走査するため、絞り込み列の後ろに並べる
+    __table_args__ = (
+        Index("ix_submissions_problem_submitted", "problem_id", "submitted_at", "id"),
+        Index(
+            "ix_submissions_submitter_submitted", "submitter_id", "submitted_at", "id"
+        ),
+        Index("ix_submissions_submitted", "submitted_at", "id"),
+        # アーカイブで削除した提出のIDを新しい提出に使い回さない
+        {"sqlite_autoincrement": True},
+    )
+
+    user_code_blob = _blob_relationship(user_code_hash)
+    stdout_blob = _blob_relationship(stdout_hash)
+    stderr_blob = _blob_relationship(stderr_hash)
+    advice_text_blob = _blob_relationship(advice_text_hash)
+
+    user_code = BlobText("user_code_hash", "user_code_blob")
+    stdout = BlobText("stdout_hash", "stdout_blob")  # 実行標準出力
+    stderr = BlobText("stderr_hash", "stderr_blob")  # 実行標準エラー
+    advice_text = BlobText("advice_text_hash", "advice_text_blob")  # AIからのアドバイス
+
+
+class ProblemStatsModel(Base):
+    """
+    問題ごとの提出統計を格納するデータベースモデル
+    提出の書き込みと同じトランザクションで差分更新される
+    """
+
+    __tablename__ = "problem_stats"
+
+    problem_id = Column(Integer, primary_key=True)
+    attempts = Column(Integer, default=0)  # 提出数
+    correct_count = Column(Integer, default=0)  # 正解数
+    error_count = Column(Integer, default=0)  # 実行エラー数
+    unjudged_count = Column(Integer, default=0)  # 期限切れで正解判定できなかった提出数
+    error_type_counts = Column(Text, nullable=True)  # エラータイプ別件数（JSON）
+    execution_time_sketch = Column(Text, nullable=True)  # 実行時間の分位点スケッチ（JSON）
+    updated_at = Column(DateTime, nullable=True)
+
+
+def _insert_blobs(conn, contents: dict[str, str]):
+    """未登録のblobだけを圧縮して挿入する"""
+    if not contents:
+        return
+    existing = set(
+        conn.execute(select(BlobModel.hash).where(BlobModel.hash.in_(contents)))
+        .scalars()
+        .all()
+    )
+    rows = [
+        {
+            "hash": digest,
+            "data": compress_blob(value),
+            "size": len(value.encode("utf-8")),
+        }
+        for digest, value in contents.items()
+        if digest not in existing
+    ]
+    if rows:
+        conn.execute(
+            sqlite_insert(BlobModel)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=["hash"])
+        )
+
+
+@event.listens_for(Session, "before_flush")
+def _store_pending_blobs(session, flush_context, instances):
+    """フラッシュ前に、代入されたテキストをblobsテーブルへ書き込む"""
+    contents = {}
+    for obj in list(session.new) + list(session.dirty):
+        pending = obj.__dict__.get("_pending_blobs")
+        if not pending:
+            continue
+        for value in pending.values():
+            if value is not None:
+                contents[blob_hash(value)] = value
+        # コミットまでは本文を保持する（ロールバック後に別のセッションで書き直せるように）
+        session.info.setdefault("pending_blob_owners", {})[id(obj)] = obj
+    _insert_blobs(session.connection(), contents)
+
+
+@event.listens_for(Session, "after_commit")
+def _release_pending_blobs(session):
+    """コミットした本文の控えを手放す（以後の読み取りはblobsテーブルから行う）"""
+    for obj in session.info.pop("pending_blob_owners", {}).values():
+        obj.__dict__.pop("_pending_blobs", None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_pending_blobs(session):
+    """ロールバックしたblobは書かれていないため、本文の控えは残したままにする"""
+    session.info.pop("pending_blob_owners", None)
+
+
+# blobsテーブルへ移行する旧形式のテキスト列
+_LEGACY_BLOB_COLUMNS = ("user_code", "stdout", "stderr", "advice_text")
+_MIGRATION_BATCH_SIZE = 500
+
+
+def _migrate_inline_text_to_blobs(conn):
+    """旧形式（submissionsに本文を直接保存）の行をblobsテーブルへ移行する"""
+    inspector = inspect(conn)
+    if not inspector.has_table("submissions"):
+        return
+    existing_columns = {c["name"] for c in inspector.get_columns("submissions")}
+    legacy_columns = [c for c in _LEGACY_BLOB_COLUMNS if c in existing_columns]
+    if not legacy_columns:
+        return
+
+    logger.info("Migrating inline submission text to blobs: %s", legacy_columns)
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text(
+                f"SELECT id, {', '.join(legacy_columns)} FROM submissions "
+                "WHERE id > :last_id ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": _MIGRATION_BATCH_SIZE},
+        ).fetchall()
+        if not rows:
+            break
+
+        contents = {}
+        updates = []
+        for row in rows:
+            values = dict(zip(legacy_columns, row[1:]))
+            update = {"id": row[0]}
+            for column, value in values.items():
+                digest = blob_hash(value) if value is not None else None
+                if digest is not None:
+                    contents[digest] = value
+                update[f"{column}_hash"] = digest
+            updates.append(update)
+        _insert_blobs(conn, contents)
+        conn.execute(
+            text(
+                "UPDATE submissions SET "
+                + ", ".join(f"{c}_hash = :{c}_hash" for c in legacy_columns)
+                + " WHERE id = :id"
+            ),
+            updates,
+        )
+        last_id = rows[-1][0]
+
+    # 旧列を削除して領域を解放する（実際のファイル縮小にはVACUUMが必要）
+    for column in legacy_columns:
+        conn.execute(text(f"ALTER TABLE submissions DROP COLUMN {column}"))
+
+
+def _migrate_schema(conn):
+    """既存テーブルに不足している列とインデックスを追加する"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(
+                text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            )
+        # create_allは既存テーブルにインデックスを追加しないため個別に作成する
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _migrate_autoincrement(conn):
+    """
+    sqlite_autoincrement を指定したテーブルが AUTOINCREMENT なしで作られていたら作り直す
+    （AUTOINCREMENT なしでは、末尾の行を削除するとそのIDが再び使われる）
+    """
+    for table in Base.metadata.sorted_tables:
+        if not table.dialect_options["sqlite"]["autoincrement"]:
+            continue
+        sql = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": table.name},
+        ).scalar()
+        if sql is None or "AUTOINCREMENT" in sql.upper():
+            continue
+        logger.info("Rebuilding %s with AUTOINCREMENT", table.name)
+        old_name = f"_{table.name}_before_autoincrement"
+        existing_columns = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        columns = ", ".join(c.name for c in table.columns if c.name in existing_columns)
+        conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old_name}"))
+        # インデックス名はデータベース全体で一意なので、古いテーブルのものを先に削除する
+        for index in inspect(conn).get_indexes(old_name):
+            conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+        table.create(conn)
+        conn.execute(
+            text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}")
+        )
+        conn.execute(text(f"DROP TABLE {old_name}"))
+
+
+def reserve_ids(conn, table_name: str, max_id: int | None) -> None:
+    """AUTOINCREMENT のテーブルで、max_id 以下のIDを今後使わないようにする"""
+    if not max_id:
+        return
+    updated = conn.execute(
+        text("UPDATE sqlite_sequence SET seq = MAX(seq, :max_id) WHERE name = :name"),
+        {"name": table_name, "max_id": max_id},
+    ).rowcount
+    if not updated:
+        conn.execute(
+            text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :max_id)"),
+            {"name": table_name, "max_id": max_id},
+        )
+
 
 # データベーステーブルを作成
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _migrate_schema(conn)
+        _migrate_inline_text_to_blobs(conn)
+        _migrate_autoincrement(conn)
+        # AUTOINCREMENT にする前に削除された問題のIDも、バージョンが残っていれば使わない
+        reserve_ids(
+            conn,
+            "problems",
+            conn.execute(text("SELECT max(problem_id) FROM problem_versions")).scalar(),
+        )
 
 
 # DBセッションを取得するヘルパー関数
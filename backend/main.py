@@ -1,15 +1,58 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import problems, submissions
-from database import create_tables
+from fastapi.responses import ORJSONResponse
+from middleware import CompressionMiddleware, TracingMiddleware
+from routers import admin, metrics, problems, submissions
+from database import create_tables, SessionLocal
+from services.archive_service import reserve_archived_ids
+from services.autoscaler import SANDBOX_AUTOSCALE
+from services.container_pool import SANDBOX_REUSE_CONTAINERS, container_pool
+from services.docker_async import close_docker_client
+from services.problem_versions import backfill_problem_versions
+from services.sandbox_dispatcher import sandbox_dispatcher
+from services.sandbox_service import sandbox_autoscaler
+from services.shared_state import shared_state
+from services.stats_service import backfill_problem_stats
+from services.tracing import install_log_record_factory
 import logging
 
-logging.basicConfig(level=logging.INFO)
+# ログにトレースIDを含め、1件の提出に関わるログを突き合わせられるようにする
+install_log_record_factory()
+logging.basicConfig(
+    level=logging.INFO, format="%(levelname)s:%(name)s:[%(trace_id)s] %(message)s"
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # uvicorn --workers で同時に起動したプロセスが、テーブル作成と移行を重ねて行わないようにする
+    with shared_state.startup_lock():
+        # データベーステーブルを作成（インポート時ではなく起動時に行う）
+        create_tables()
+        reserve_archived_ids()
+        # 統計テーブル導入前の提出があれば統計を作成する
+        with SessionLocal() as db:
+            backfill_problem_stats(db)
+            # バージョン導入前の問題には最初のバージョンを作る
+            backfill_problem_versions(db)
+    if SANDBOX_AUTOSCALE:
+        sandbox_autoscaler.start()
+    yield
+    await sandbox_autoscaler.stop()
+    # 終了時にキューに残っている提出結果をコミットする
+    await submissions.submission_writer.stop()
+    await sandbox_dispatcher.close()
+    if SANDBOX_REUSE_CONTAINERS:
+        # 空きのまま残っている再利用コンテナを削除する
+        await container_pool.close()
+    await close_docker_client()
 
-# データベーステーブルを作成
-create_tables()
 
-app = FastAPI(title="課題管理API")
+# 大きな出力を含むレスポンスを高速にシリアライズするためorjsonを使う
+app = FastAPI(
+    title="課題管理API", lifespan=lifespan, default_response_class=ORJSONResponse
+)
 
 # CORS設定
 app.add_middleware(
@@ -26,9 +69,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 一定サイズ以上のレスポンスをbrotli/gzipで圧縮
+app.add_middleware(CompressionMiddleware)
+
+# リクエスト全体をトレースするため最も外側に置く
+app.add_middleware(TracingMiddleware)
+
 # ルーターを登録
 app.include_router(problems.router, tags=["problems"])
 app.include_router(submissions.router, tags=["submissions"])
+app.include_router(admin.router, tags=["admin"])
+app.include_router(metrics.router, tags=["metrics"])
 
 
 @app.get("/")
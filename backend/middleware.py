@@ -0,0 +1,190 @@
+# レスポンス圧縮・トレーシングのミドルウェア
+import os
+import re
+import zlib
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from services.tracing import start_span
+
+# この大きさ（バイト）未満のレスポンスは圧縮しない
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# 動的なレスポンス向けに速度を優先した圧縮レベル
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+
+class _GzipCompressor:
+    encoding = "gzip"
+
+    def __init__(self):
+        # wbits=31 でgzipヘッダー付きのストリームを生成する
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    encoding = "br"
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def _negotiate(accept_encoding: str):
+    """Accept-Encodingからbr・gzipの順に使える圧縮方式を選ぶ"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for compressor in (_BrotliCompressor, _GzipCompressor):
+        if accepted.get(compressor.encoding, 0) > 0:
+            return compressor
+    return None
+
+
+class CompressionMiddleware:
+    """
+    一定サイズ以上のレスポンスを、クライアントに合わせてbrotliまたはgzipで圧縮する
+    ストリーミングレスポンスはチャンクごとに圧縮して送る
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        compressor = _negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if compressor is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressionResponder(send, compressor, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, send, compressor_class, minimum_size: int):
+        self._send = send
+        self._compressor_class = compressor_class
+        self._minimum_size = minimum_size
+        self._initial_message = None
+        self._started = False
+        self._passthrough = False
+        self._compressor = None
+
+    def _set_headers(self, streaming: bool, length: int | None = None):
+        headers = MutableHeaders(raw=self._initial_message["headers"])
+        headers["Content-Encoding"] = self._compressor.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if streaming:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(length)
+
+    async def send(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # 本文の大きさが分かるまでヘッダーの送信を遅らせる
+            self._initial_message = message
+            headers = Headers(raw=message["headers"])
+            self._passthrough = "content-encoding" in headers
+            return
+        if message_type != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self._started:
+            self._started = True
+            if self._passthrough or (len(body) < self._minimum_size and not more_body):
+                self._passthrough = True
+                await self._send(self._initial_message)
+                await self._send(message)
+                return
+            self._compressor = self._compressor_class()
+            if not more_body:
+                compressed = self._compressor.compress(body) + self._compressor.finish()
+                self._set_headers(streaming=False, length=len(compressed))
+                await self._send(self._initial_message)
+                await self._send({**message, "body": compressed})
+                return
+            self._set_headers(streaming=True)
+            await self._send(self._initial_message)
+            await self._send(
+                {**message, "body": self._compressor.compress(body)}
+            )
+            return
+
+        if self._passthrough:
+            await self._send(message)
+            return
+        chunk = self._compressor.compress(body)
+        if not more_body:
+            chunk += self._compressor.finish()
+        await self._send({**message, "body": chunk})
+
+
+# 呼び出し元から受け取るトレースIDの形式（英数字とハイフン、最大64文字）
+_TRACE_ID_PATTERN = re.compile(r"^[0-9A-Za-z\-]{1,64}$")
+
+
+class TracingMiddleware:
+    """
+    リクエストごとにルートスパンを開始し、トレースIDを X-Trace-Id ヘッダーで返す
+    呼び出し元が X-Trace-Id を付けていればそのIDを引き継ぐ
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = Headers(scope=scope).get("x-trace-id")
+        if incoming is not None and not _TRACE_ID_PATTERN.match(incoming):
+            incoming = None
+        span = start_span(
+            "request",
+            trace_id=incoming,
+            method=scope["method"],
+            path=scope["path"],
+        )
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("status_code", message["status"])
+                headers = MutableHeaders(scope=message)
+                headers["X-Trace-Id"] = span.trace_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        span.end()
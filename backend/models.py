@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Literal
 from datetime import datetime, timezone
 
 
@@ -11,6 +12,24 @@ class ProblemBase(BaseModel):
     description: str
     correct_code: str
     test_input: str | None = None  # テストケース入力文字列
+    # 出力の比較モード（services/comparators.py を参照）
+    comparator: Literal[
+        "exact", "lines", "tokens", "numeric", "unordered_lines", "checker"
+    ] = "exact"
+    comparator_options: dict | None = None  # numeric の abs_tol / rel_tol など
+    checker_code: str | None = None  # comparator が "checker" のときに実行するスクリプト
+
+    @field_validator("comparator", mode="before")
+    @classmethod
+    def _default_comparator(cls, value):
+        # 比較モードの列を追加する前に作られた問題（NULL）は exact として扱う
+        return value or "exact"
+
+    @model_validator(mode="after")
+    def _require_checker_code(self):
+        if self.comparator == "checker" and not (self.checker_code or "").strip():
+            raise ValueError("checker_code is required when comparator is 'checker'")
+        return self
 
 
 class ProblemCreate(ProblemBase):
@@ -27,6 +46,8 @@ class Problem(ProblemBase):
     """
 
     id: int
+    version: int | None = None  # 現在のバージョン番号
+    version_hash: str | None = None  # 現在のバージョンの内容のハッシュ
     created_at: datetime = datetime.now(timezone.utc)
     updated_at: datetime = datetime.now(timezone.utc)
 
@@ -34,6 +55,37 @@ class Problem(ProblemBase):
         from_attributes = True  # SQLAlchemyモデルからの変換を許可
 
 
+class ProblemVersion(ProblemBase):
+    """
+    問題のある時点の内容（変更されないスナップショット）
+    """
+
+    problem_id: int
+    version: int
+    version_hash: str
+    created_at: datetime
+
+    class Config:
+        from_attributes = True  # SQLAlchemyモデルからの変換を許可
+
+
+class ProblemStats(BaseModel):
+    """
+    問題ごとの提出統計を表すモデル
+    """
+
+    problem_id: int
+    attempts: int = 0  # 提出数
+    correct_count: int = 0  # 正解数
+    error_count: int = 0  # 実行エラー数
+    unjudged_count: int = 0  # 期限切れで正解判定できなかった提出数
+    pass_rate: float | None = None  # 正解率（判定できた提出のうち正解の割合）
+    median_execution_time_ms: float | None = None  # 実行時間の中央値
+    p95_execution_time_ms: float | None = None  # 実行時間の95パーセンタイル
+    most_common_error_type: str | None = None  # 最も多いエラータイプ
+    error_type_counts: dict[str, int] = {}  # エラータイプ別件数
+
+
 class SubmissionCreate(BaseModel):
     """
     コード提出情報を表すモデル
@@ -42,6 +94,21 @@ class SubmissionCreate(BaseModel):
     problem_id: int
     user_code: str
     code_type: str = "python"  # "python" または "notebook"
+    submitter_id: str | None = None  # 提出者の識別子（学籍番号など）
+    # Trueの場合はよくあるエラーでも定型のヒントを使わずLLMでアドバイスを生成する
+    force_llm_advice: bool = False
+
+
+class OutputMismatch(BaseModel):
+    """
+    正解の出力と最初に食い違った位置と、その前後の差分
+    """
+
+    line: int | None = None  # 提出コードの出力での行番号（1始まり）
+    column: int | None = None  # 行内の位置（1始まり）
+    expected: str | None = None  # 期待される行（語）
+    actual: str | None = None  # 実際の行（語）
+    snippet: str  # 前後数行の差分
 
 
 class SubmissionResponse(BaseModel):
@@ -55,7 +122,9 @@ class SubmissionResponse(BaseModel):
     execution_time_ms: float | None = None  # 実行時間（ミリ秒）
     exit_code: int | None = None  # 終了コード
     advice_text: str | None = None  # AIからのアドバイス
-    is_correct: bool  # 正解判定結果
+    advice_source: str | None = None  # アドバイスの生成元（"rule" または "llm"）
+    mismatch: OutputMismatch | None = None  # 不正解のとき、正解の出力と最初に食い違った位置
+    is_correct: bool | None  # 正解判定結果（正解コードの実行や判定が期限切れで判定できなければNone）
     # お手本の実行結果
     correct_stdout: str | None = None  # お手本の標準出力
     correct_stderr: str | None = None  # お手本の標準エラー
@@ -69,14 +138,56 @@ class Submission(BaseModel):
 
     id: int
     problem_id: int
+    problem_version: int | None = None  # 判定に使った問題のバージョン
+    submitter_id: str | None = None
     user_code: str
     stdout: str | None = None
     stderr: str | None = None
     execution_time_ms: float | None = None
     exit_code: int | None = None
     advice_text: str | None = None
-    is_correct: bool  # 正解判定結果
+    is_correct: bool | None  # 正解判定結果（判定できなかった提出はNone）
     submitted_at: datetime
 
     class Config:
         from_attributes = True  # SQLAlchemyモデルからの変換を許可
+
+
+class SubmissionSummary(BaseModel):
+    """
+    提出履歴一覧の1件分を表すモデル
+    コードや出力は要求された場合のみ含める
+    """
+
+    id: int
+    problem_id: int
+    problem_version: int | None = None  # 判定に使った問題のバージョン
+    submitter_id: str | None = None
+    is_correct: bool | None = None
+    exit_code: int | None = None
+    execution_time_ms: float | None = None
+    submitted_at: datetime
+    user_code: str | None = None
+    stdout: str | None = None
+    stderr: str | None = None
+    advice_text: str | None = None
+    archived: bool = False  # アーカイブ済みの提出かどうか
+
+
+class SubmissionPage(BaseModel):
+    """
+    提出履歴一覧のページ
+    next_cursorを次回のcursorに指定すると続きを取得できる
+    """
+
+    items: list[SubmissionSummary]
+    next_cursor: str | None = None
+
+
+class SandboxWorkerRegistration(BaseModel):
+    """
+    サンドボックスワーカーの登録（ハートビート）
+    """
+
+    address: str  # APIから接続するアドレス（host:port）
+    capacity: int = Field(ge=1)  # 同時実行数
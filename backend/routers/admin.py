@@ -0,0 +1,98 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from starlette.concurrency import run_in_threadpool
+from models import SandboxWorkerRegistration
+from services.archive_service import ARCHIVE_RETENTION_DAYS, archive_submissions
+from services.llm_providers import get_llm_router
+from services.sandbox_dispatcher import sandbox_dispatcher
+from services.sandbox_rpc import SANDBOX_WORKER_TOKEN
+from services.tracing import trace_buffer
+
+import hmac
+import os
+
+# 管理用エンドポイント（データの削除・トレースなどの参照）に必要なトークン（未設定なら使えない）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# 運用・保守用のエンドポイントをまとめるルーター
+router = APIRouter(prefix="/admin")
+
+
+def bearer_token_matches(authorization: str | None, token: str) -> bool:
+    """Authorization: Bearer <token> が token と一致するか（比較時間は一定）"""
+    scheme, _, value = (authorization or "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(value.encode(), token.encode())
+
+
+def require_admin_token(authorization: str | None = Header(None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=403, detail="Set ADMIN_TOKEN to enable this endpoint"
+        )
+    if not bearer_token_matches(authorization, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def require_worker_token(authorization: str | None = Header(None)) -> None:
+    if not SANDBOX_WORKER_TOKEN:
+        raise HTTPException(
+            status_code=403, detail="Set SANDBOX_WORKER_TOKEN to register sandbox workers"
+        )
+    if not bearer_token_matches(authorization, SANDBOX_WORKER_TOKEN):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid worker token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@router.post("/archive", dependencies=[Depends(require_admin_token)])
+async def run_archive(
+    older_than_days: int = Query(ARCHIVE_RETENTION_DAYS, ge=1),
+    vacuum: bool = False,
+):
+    """指定日数より古い提出をアーカイブし、submissionsテーブルから削除する"""
+    return await run_in_threadpool(
+        archive_submissions, older_than_days=older_than_days, vacuum=vacuum
+    )
+
+
+@router.get("/traces", dependencies=[Depends(require_admin_token)])
+async def list_traces(
+    limit: int = Query(50, ge=1, le=1000),
+    min_duration_ms: float = Query(0, ge=0),
+    name: str | None = None,
+):
+    """エクスポート済みのトレースを新しい順に返す"""
+    return trace_buffer.list(limit=limit, min_duration_ms=min_duration_ms, name=name)
+
+
+@router.get("/traces/{trace_id}", dependencies=[Depends(require_admin_token)])
+async def get_trace(trace_id: str):
+    """トレースIDを指定してスパンの一覧を返す"""
+    trace = trace_buffer.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found")
+    return trace
+
+
+@router.get("/llm-providers", dependencies=[Depends(require_admin_token)])
+async def llm_provider_stats():
+    """LLMプロバイダーごとの直近の遅延・エラー率"""
+    return get_llm_router().stats_summary()
+
+
+@router.post("/sandbox-workers", dependencies=[Depends(require_worker_token)])
+async def register_sandbox_worker(registration: SandboxWorkerRegistration):
+    """サンドボックスワーカーを登録する（ワーカーが定期的に呼び出す）"""
+    await sandbox_dispatcher.register(registration.address, registration.capacity)
+    return {"registered": registration.address}
+
+
+@router.get("/sandbox-workers", dependencies=[Depends(require_admin_token)])
+async def list_sandbox_workers():
+    """登録されているサンドボックスワーカーと実行中の数"""
+    return await sandbox_dispatcher.summary()
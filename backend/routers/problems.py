@@ -1,14 +1,65 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import List
-from models import Problem, ProblemCreate
-from database import get_db, ProblemModel
+from models import Problem, ProblemCreate, ProblemStats, ProblemVersion
+from database import (
+    get_db,
+    SessionLocal,
+    ProblemModel,
+    ProblemStatsModel,
+    ProblemVersionModel,
+)
+from services.bulk_service import (
+    ExportFormat,
+    ImportResult,
+    body_lines,
+    export_response,
+    import_problems,
+    stream_rows,
+)
+from services.problem_versions import record_version
+from services.stats_service import summarize_problem_stats
+from services.problem_cache import CachedProblems, problem_cache, http_date
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import csv
 
 # 関連するAPIエンドポイント（URL）をグループ化するために使われます。
 router = APIRouter()
 
 
+def _not_modified(request: Request, etag: str, last_modified: datetime | None) -> bool:
+    """条件付きリクエストに対して304を返せるか判定する"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            # 日時として読めないヘッダーは無視する
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # HTTPの日時は秒単位のため、Last-Modifiedとして送った値（秒未満を切り捨て）と比べる
+        return parsedate_to_datetime(http_date(last_modified)) <= since
+    return False
+
+
+def _cached_response(request: Request, entry: CachedProblems) -> Response:
+    """キャッシュ済みのJSON本文をそのまま返す（条件に合えば304）"""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if entry.last_modified is not None:
+        headers["Last-Modified"] = http_date(entry.last_modified)
+    if _not_modified(request, entry.etag, entry.last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
 @router.post("/problems/", response_model=Problem)
 async def create_problem(problem: ProblemCreate, db: Session = Depends(get_db)):
     """新しい問題を作成する"""
@@ -18,60 +69,91 @@ async def create_problem(problem: ProblemCreate, db: Session = Depends(get_db)):
         description=problem.description,
         correct_code=problem.correct_code,
         test_input=problem.test_input,  # test_inputフィールドを追加
+        comparator=problem.comparator,
+        comparator_options=problem.comparator_options,
+        checker_code=problem.checker_code,
         created_at=datetime.now(timezone.utc),
         updated_at=datetime.now(timezone.utc),
     )
     db.add(new_problem)
+    db.flush()  # バージョンに問題のIDが必要
+    record_version(db, new_problem)
     db.commit()
     db.refresh(new_problem)
+    await problem_cache.invalidate(new_problem.id)
 
     # Pydanticモデルに変換して返す
-    return Problem(
-        id=new_problem.id,
-        title=new_problem.title,
-        description=new_problem.description,
-        correct_code=new_problem.correct_code,
-        test_input=new_problem.test_input,  # test_inputフィールドを追加
-        created_at=new_problem.created_at,
-        updated_at=new_problem.updated_at,
-    )
+    return Problem.model_validate(new_problem)
 
 
 @router.get("/problems/", response_model=List[Problem])
-async def read_problems(db: Session = Depends(get_db)):
+async def read_problems(request: Request, db: Session = Depends(get_db)):
     """全ての問題を取得する"""
-    problems = db.query(ProblemModel).all()
-    return [
-        Problem(
-            id=problem.id,
-            title=problem.title,
-            description=problem.description,
-            correct_code=problem.correct_code,
-            test_input=problem.test_input,  # test_inputフィールドを追加
-            created_at=problem.created_at,
-            updated_at=problem.updated_at,
+    return _cached_response(request, await problem_cache.list(db))
+
+
+# /problems/{problem_id} より前に登録する（"export" を問題IDとして解釈しないように）
+_EXPORT_FIELDS = (
+    "id",
+    "version",
+    "title",
+    "description",
+    "correct_code",
+    "test_input",
+    "comparator",
+    "comparator_options",
+    "checker_code",
+    "created_at",
+    "updated_at",
+)
+
+
+@router.get("/problems/export")
+async def export_problems(format: ExportFormat = "ndjson"):
+    """全ての問題をID順にNDJSONかCSVで一括ダウンロードする（CSVの comparator_options はJSON）"""
+    return export_response(
+        stream_rows(
+            SessionLocal,
+            select(ProblemModel).order_by(ProblemModel.id),
+            lambda row: Problem.model_validate(row).model_dump(),
+        ),
+        _EXPORT_FIELDS,
+        format,
+        "problems",
+    )
+
+
+@router.post("/problems/import")
+async def import_problems_endpoint(request: Request, format: ExportFormat = "ndjson"):
+    """
+    NDJSONかCSV（エクスポートと同じ形式）の問題を新しい問題として一括で追加する
+    本文は受信しながら1件ずつ検証し、まとまった件数ごとにコミットする（不正な行は飛ばして報告する）
+    """
+    result = ImportResult()
+    try:
+        await run_in_threadpool(
+            import_problems, SessionLocal, body_lines(request.stream()), format, result
         )
-        for problem in problems
-    ]
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid import file after {result.imported} problems were imported: {e}",
+        )
+    finally:
+        if result.imported:
+            await problem_cache.invalidate()
+    return result.summary()
 
 
 @router.get("/problems/{problem_id}", response_model=Problem)
-async def read_problem(problem_id: int, db: Session = Depends(get_db)):
+async def read_problem(problem_id: int, request: Request, db: Session = Depends(get_db)):
     """指定されたIDの問題を取得する"""
-    problem = db.query(ProblemModel).filter(ProblemModel.id == problem_id).first()
-    if problem is None:
+    entry = await problem_cache.get(db, problem_id)
+    if entry is None:
         raise HTTPException(
             status_code=404, detail=f"Problem with ID {problem_id} not found"
         )
-    return Problem(
-        id=problem.id,
-        title=problem.title,
-        description=problem.description,
-        correct_code=problem.correct_code,
-        test_input=problem.test_input,  # test_inputフィールドを追加
-        created_at=problem.created_at,
-        updated_at=problem.updated_at,
-    )
+    return _cached_response(request, entry)
 
 
 @router.put("/problems/{problem_id}", response_model=Problem)
@@ -86,26 +168,24 @@ async def update_problem(
             status_code=404, detail=f"Problem with ID {problem_id} not found"
         )
 
-
     # 問題を更新
     db_problem.title = updated_problem.title
     db_problem.description = updated_problem.description
     db_problem.correct_code = updated_problem.correct_code
     db_problem.test_input = updated_problem.test_input  # test_inputフィールドを追加
+    # 比較モードは指定された場合だけ更新する（比較モードを送らない古いクライアント向け）
+    for field in ("comparator", "comparator_options", "checker_code"):
+        if field in updated_problem.model_fields_set:
+            setattr(db_problem, field, getattr(updated_problem, field))
     db_problem.updated_at = datetime.now(timezone.utc)
+    # 内容が変わっていれば新しいバージョンを追加する（以前のバージョンはそのまま残す）
+    record_version(db, db_problem)
 
     db.commit()
     db.refresh(db_problem)
+    await problem_cache.invalidate(problem_id)
 
-    return Problem(
-        id=db_problem.id,
-        title=db_problem.title,
-        description=db_problem.description,
-        correct_code=db_problem.correct_code,
-        test_input=db_problem.test_input,  # test_inputフィールドを追加
-        created_at=db_problem.created_at,
-        updated_at=db_problem.updated_at,
-    )
+    return Problem.model_validate(db_problem)
 
 
 @router.delete("/problems/{problem_id}")
@@ -118,8 +198,60 @@ async def delete_problem(problem_id: int, db: Session = Depends(get_db)):
             status_code=404, detail=f"Problem with ID {problem_id} not found"
         )
 
-    # 問題を削除
+    # 問題を削除（過去の提出が参照するバージョンは残す）
     db.delete(db_problem)
+    db.query(ProblemStatsModel).filter(
+        ProblemStatsModel.problem_id == problem_id
+    ).delete()
     db.commit()
+    await problem_cache.invalidate(problem_id)
 
     return {"message": f"Problem with ID {problem_id} has been deleted successfully"}
+
+
+@router.get("/problems/{problem_id}/stats", response_model=ProblemStats)
+async def read_problem_stats(problem_id: int, db: Session = Depends(get_db)):
+    """指定されたIDの問題の提出統計を取得する（履歴の件数に関係なく一定時間）"""
+    if db.get(ProblemModel, problem_id) is None:
+        raise HTTPException(
+            status_code=404, detail=f"Problem with ID {problem_id} not found"
+        )
+    stats = db.get(ProblemStatsModel, problem_id)
+    return ProblemStats(**summarize_problem_stats(problem_id, stats))
+
+
+@router.get("/problems/{problem_id}/versions", response_model=List[ProblemVersion])
+async def read_problem_versions(problem_id: int, db: Session = Depends(get_db)):
+    """指定されたIDの問題のバージョンを古い順に取得する"""
+    versions = (
+        db.query(ProblemVersionModel)
+        .filter(ProblemVersionModel.problem_id == problem_id)
+        .order_by(ProblemVersionModel.version)
+        .all()
+    )
+    if not versions and db.get(ProblemModel, problem_id) is None:
+        raise HTTPException(
+            status_code=404, detail=f"Problem with ID {problem_id} not found"
+        )
+    return [ProblemVersion.model_validate(v) for v in versions]
+
+
+@router.get("/problems/{problem_id}/versions/{version}", response_model=ProblemVersion)
+async def read_problem_version(
+    problem_id: int, version: int, db: Session = Depends(get_db)
+):
+    """指定されたIDの問題の、指定されたバージョンの内容を取得する"""
+    row = (
+        db.query(ProblemVersionModel)
+        .filter(
+            ProblemVersionModel.problem_id == problem_id,
+            ProblemVersionModel.version == version,
+        )
+        .first()
+    )
+    if row is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Version {version} of problem {problem_id} not found",
+        )
+    return ProblemVersion.model_validate(row)
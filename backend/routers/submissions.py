@@ -1,110 +1,297 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from sqlalchemy.orm import Session
-from models import SubmissionCreate, SubmissionResponse
-from database import get_db, SubmissionModel, ProblemModel
-from services.sandbox_service import execute_python_code_in_docker, notebook_to_python
-from services.advice_service import generate_advice_with_huggingface
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session, load_only, selectinload
+from itertools import chain
+from typing import Literal
+from models import (
+    OutputMismatch,
+    SubmissionCreate,
+    SubmissionResponse,
+    SubmissionSummary,
+    SubmissionPage,
+)
+from database import get_db, SessionLocal, SubmissionModel
+from services.sandbox_service import (
+    execute_python_code_in_docker,
+    notebook_to_python,
+    user_code_line_offset,
+)
+from services.comparators import ComparisonResult, judge_output
+from services.advice_service import ADVICE_ERROR_MESSAGE, generate_advice_with_huggingface
+from services.cancellation import SubmissionCancelled, run_cancellable
+from services.pipeline import Stage, StageDeadlineExceeded, run_stage_graph
+from services.prompt_builder import prepare_problem_context
+from services.problem_versions import (
+    advice_cache,
+    advice_key,
+    correct_code_cache,
+    problem_context_cache,
+)
+from services.reference_cache import reference_cache, reference_key
+from services.rule_advice import generate_rule_advice
+from services.submission_writer import SubmissionWriter
+from services.stats_service import update_problem_stats
+from services.archive_service import archive_reader
+from services.bulk_service import (
+    EXPORT_CHUNK_ROWS,
+    ExportFormat,
+    export_response,
+    stream_rows,
+)
+from services.problem_cache import problem_cache
+from services.metrics import (
+    ADVICE_SOURCE,
+    SUBMISSION_STAGE_SECONDS,
+    SUBMISSIONS_TOTAL,
+)
+from services.tracing import span
+from starlette.concurrency import run_in_threadpool
+from dataclasses import asdict
 from datetime import datetime, timezone
+import base64
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# 提出処理の各ステージの期限（秒）
+USER_RUN_DEADLINE_S = float(os.getenv("USER_RUN_DEADLINE_S", "60"))
+REFERENCE_RUN_DEADLINE_S = float(os.getenv("REFERENCE_RUN_DEADLINE_S", "60"))
+PROBLEM_CONTEXT_DEADLINE_S = float(os.getenv("PROBLEM_CONTEXT_DEADLINE_S", "5"))
+JUDGE_DEADLINE_S = float(os.getenv("JUDGE_DEADLINE_S", "60"))
+ADVICE_DEADLINE_S = float(os.getenv("ADVICE_DEADLINE_S", "90"))
+
 # コード提出に関するエンドポイントをグループ化するためのルーター
 router = APIRouter()
 
+# 提出結果はグループコミットでまとめて保存し、同じトランザクションで統計も更新する
+submission_writer = SubmissionWriter(SessionLocal, before_commit=update_problem_stats)
+
+
+def _fallback_verdict(user_result) -> ComparisonResult:
+    """正解コードの実行や判定がエラーになった場合は、エラーなく終了していれば正解とみなす"""
+    return ComparisonResult(user_result.exit_code == 0 and not user_result.stderr)
+
+
+def _timed_out(errors: dict[str, Exception], *stages: str) -> bool:
+    return any(isinstance(errors.get(stage), StageDeadlineExceeded) for stage in stages)
+
 
 async def _process_submission(
-    *, problem_id: int, user_code: str, code_type: str, db: Session
+    *,
+    problem_id: int,
+    user_code: str,
+    code_type: str,
+    db: Session,
+    submitter_id: str | None = None,
+    force_llm_advice: bool = False,
 ) -> SubmissionResponse:
     """Problem existence check, code execution, advice generation, DB save."""
-    # 問題が存在するか確認
-    problem = db.query(ProblemModel).filter(ProblemModel.id == problem_id).first()
-    if not problem:
+    # 問題が存在するか確認（プロセス内キャッシュを優先）
+    entry = await problem_cache.get(db, problem_id)
+    if entry is None:
         raise HTTPException(
             status_code=404, detail=f"Problem with ID {problem_id} not found"
         )
+    problem = entry.value
 
     # Notebookの場合はPythonコードに変換
     exec_code = user_code
     if code_type == "notebook":
         try:
-            exec_code = notebook_to_python(user_code)
+            with span("notebook_parse", histogram=SUBMISSION_STAGE_SECONDS):
+                exec_code = notebook_to_python(user_code)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Notebook parsing error: {e}")
 
-    # サンドボックスでユーザーコード実行
-    try:
-        user_result = await execute_python_code_in_docker(
+    # ユーザーコードの実行・正解コードの実行（キャッシュ）・プロンプト用の問題情報の準備は
+    # 互いに依存しないため同時に進め、判定とアドバイス生成は必要な結果がそろってから行う
+    async def user_run():
+        return await execute_python_code_in_docker(
             user_code=exec_code,
             stdin_input=problem.test_input,  # test_inputを標準入力として渡す
         )
 
-        # 正解コードも実行して結果を比較
-        is_correct = False
-        correct_result = None  # 正解コードの実行結果を保存
-        try:
-            # 正解コードを実行
-            correct_exec_code = problem.correct_code
-            if problem.correct_code.strip().startswith(("{", "<")):
-                # 正解コードがnotebook形式の場合はPythonコードに変換
-                try:
-                    correct_exec_code = notebook_to_python(problem.correct_code)
-                except Exception:
-                    correct_exec_code = problem.correct_code
-
-            correct_result = await execute_python_code_in_docker(
-                user_code=correct_exec_code,
-                stdin_input=problem.test_input,
-            )
+    def convert_correct_code():
+        if problem.correct_code.strip().startswith(("{", "<")):
+            # 正解コードがnotebook形式の場合はPythonコードに変換
+            try:
+                return notebook_to_python(problem.correct_code)
+            except Exception:
+                pass
+        return problem.correct_code
 
-            # 標準出力を比較して正解判定
-            user_stdout = user_result.stdout.strip() if user_result.stdout else ""
-            correct_stdout = (
-                correct_result.stdout.strip() if correct_result.stdout else ""
-            )
-            logger.debug("User stdout: %s", user_stdout)
-            logger.debug("Correct stdout: %s", correct_stdout)
-            is_correct = user_stdout == correct_stdout
+    async def reference_run():
+        # 変換結果は問題のバージョンごとに使い回す
+        correct_exec_code = correct_code_cache.get_or_compute(
+            problem.version_hash, convert_correct_code
+        )
+        return await reference_cache.get_or_run(
+            reference_key(correct_exec_code, problem.test_input),
+            lambda: execute_python_code_in_docker(
+                user_code=correct_exec_code, stdin_input=problem.test_input
+            ),
+        )
 
-        except Exception as e:
-            logger.warning("正解コード実行時にエラー: %s", e)
-            # 正解コード実行でエラーが発生した場合は、エラーがなければ正解とみなす
-            is_correct = user_result.exit_code == 0 and not user_result.stderr
+    async def problem_context():
+        cached = problem_context_cache.get(problem.version_hash, "problem_context")
+        if cached is not None:
+            return cached
+        context = await run_in_threadpool(
+            prepare_problem_context,
+            problem.title,
+            problem.description,
+            problem.correct_code,
+        )
+        problem_context_cache.put(problem.version_hash, "problem_context", context)
+        return context
+
+    # 任意のステージが期限切れ・失敗した理由（判定できないのか、判定を諦めてよいのか）
+    stage_errors: dict[str, Exception] = {}
+
+    async def judge(user_run, reference_run):
+        if reference_run is None:
+            # 期限切れは正解コードがまだ動いているだけかもしれないため、正解とも不正解ともしない
+            if _timed_out(stage_errors, "reference_run"):
+                return None
+            return _fallback_verdict(user_run)
+        # 問題ごとの比較モードで標準出力を比較して正解判定
+        logger.debug("User stdout: %s", user_run.stdout)
+        logger.debug("Correct stdout: %s", reference_run.stdout)
+        return await judge_output(problem, user_run.stdout, reference_run.stdout)
 
+    async def rule_advice(user_run):
+        # よくあるエラーは定型のヒントを返す。ユーザーコードの実行結果だけで決まるため、
+        # 正解コードの実行や判定を待たずに作る
+        if force_llm_advice:
+            return None
+        advice = generate_rule_advice(
+            user_run.exit_code,
+            user_run.stderr,
+            code=exec_code,
+            line_offset=user_code_line_offset(problem.test_input),
+        )
+        return (advice.text, "rule") if advice is not None else None
+
+    async def advice(user_run, reference_run, problem_context, judge, rule_advice):
+        # 定型のヒントがあればLLMは使わない
+        if rule_advice is not None:
+            return None
+        is_correct = judge is not None and judge.is_correct
+        reference_stdout = reference_run.stdout if reference_run else None
+        # 同じバージョンの問題への同じ提出・同じ結果には、生成済みのアドバイスを返す
+        key = advice_key(
+            user_code, user_run.stdout, user_run.stderr, is_correct, reference_stdout
+        )
+        cached = advice_cache.get(problem.version_hash, key)
+        if cached is not None:
+            return cached, "llm"
         advice_text = await generate_advice_with_huggingface(
             problem_title=problem.title,
             problem_description=problem.description,
             user_code=user_code,
-            execution_stdout=user_result.stdout,
-            execution_stderr=user_result.stderr,
+            execution_stdout=user_run.stdout,
+            execution_stderr=user_run.stderr,
             correct_code=problem.correct_code,
             is_correct=is_correct,
+            reference_stdout=reference_stdout,
+            problem_context=problem_context,
+        )
+        # 生成に失敗したときの定型文は保持しない
+        if advice_text != ADVICE_ERROR_MESSAGE:
+            advice_cache.put(problem.version_hash, key, advice_text)
+        return advice_text, "llm"
+
+    try:
+        results = await run_stage_graph(
+            [
+                Stage("user_run", user_run, deadline_s=USER_RUN_DEADLINE_S),
+                Stage(
+                    "reference_run",
+                    reference_run,
+                    deadline_s=REFERENCE_RUN_DEADLINE_S,
+                    required=False,
+                ),
+                Stage(
+                    "problem_context",
+                    problem_context,
+                    deadline_s=PROBLEM_CONTEXT_DEADLINE_S,
+                    required=False,
+                ),
+                Stage(
+                    "judge",
+                    judge,
+                    after=("user_run", "reference_run"),
+                    deadline_s=JUDGE_DEADLINE_S,
+                    required=False,
+                ),
+                Stage("rule_advice", rule_advice, after=("user_run",), required=False),
+                Stage(
+                    "advice",
+                    advice,
+                    after=("user_run", "reference_run", "problem_context", "judge", "rule_advice"),
+                    deadline_s=ADVICE_DEADLINE_S,
+                    required=False,
+                ),
+            ],
+            histogram=SUBMISSION_STAGE_SECONDS,
+            errors=stage_errors,
+        )
+        user_result = results["user_run"]
+        correct_result = results["reference_run"]
+        comparison = results["judge"]
+        if comparison is None and not _timed_out(stage_errors, "reference_run", "judge"):
+            comparison = _fallback_verdict(user_result)
+        # 判定が期限内に終わらなかった場合は None（判定できなかった）として保存する
+        is_correct = comparison.is_correct if comparison is not None else None
+        mismatch = None
+        if comparison is not None and comparison.mismatch is not None:
+            mismatch = OutputMismatch(**asdict(comparison.mismatch))
+        advice_text, advice_source = (
+            results["rule_advice"] or results["advice"] or (ADVICE_ERROR_MESSAGE, "llm")
         )
+        ADVICE_SOURCE.inc(source=advice_source)
 
         # 提出を保存
         new_submission = SubmissionModel(
             problem_id=problem_id,
+            problem_version=problem.version,
+            submitter_id=submitter_id,
             user_code=user_code,
             stdout=user_result.stdout,
             stderr=user_result.stderr,
             execution_time_ms=user_result.execution_time_ms,
             exit_code=user_result.exit_code,
+            error_type=user_result.error_type,
             advice_text=advice_text,
             is_correct=is_correct,
             submitted_at=datetime.now(timezone.utc),
         )
-        db.add(new_submission)
-        db.commit()
+        with span("db_commit", histogram=SUBMISSION_STAGE_SECONDS) as commit_span:
+            commit_span.set_attribute(
+                "submission_id", await submission_writer.write(new_submission)
+            )
+        if is_correct:
+            result = "correct"
+        elif user_result.exit_code != 0:
+            result = "error"
+        else:
+            result = "incorrect" if is_correct is False else "unjudged"
+        SUBMISSIONS_TOTAL.inc(result=result)
 
         # レスポンスを返す
         return SubmissionResponse(
-            message="コードの実行が完了しました",
+            message="コードの実行が完了しました"
+            if is_correct is not None
+            else "コードの実行が完了しました（正解判定は時間内に終わりませんでした）",
             stdout=user_result.stdout,
             stderr=user_result.stderr,
             execution_time_ms=user_result.execution_time_ms,
             exit_code=user_result.exit_code,
             advice_text=advice_text,
+            advice_source=advice_source,
             is_correct=is_correct,
+            mismatch=mismatch,
             # お手本の実行結果を追加
             correct_stdout=correct_result.stdout if correct_result else None,
             correct_stderr=correct_result.stderr if correct_result else None,
@@ -117,14 +304,18 @@ async def _process_submission(
         # 実行エラーの場合でも記録は残す
         new_submission = SubmissionModel(
             problem_id=problem_id,
+            problem_version=problem.version,
+            submitter_id=submitter_id,
             user_code=user_code,
             stderr=str(e),
             exit_code=-1,
+            error_type="UnexpectedError",
             is_correct=False,
             submitted_at=datetime.now(timezone.utc),
         )
-        db.add(new_submission)
-        db.commit()
+        with span("db_commit", histogram=SUBMISSION_STAGE_SECONDS):
+            await submission_writer.write(new_submission)
+        SUBMISSIONS_TOTAL.inc(result="error")
 
         return SubmissionResponse(
             message="コードの実行中にエラーが発生しました",
@@ -134,24 +325,59 @@ async def _process_submission(
         )
 
 
+async def _run_submission(request: Request, **kwargs) -> SubmissionResponse:
+    """
+    クライアントが切断した場合や、同じ提出者が同じ問題に出し直した場合は
+    処理中のサンドボックス実行とLLM呼び出しをキャンセルし、提出を保存しない
+    """
+    submitter_id = kwargs.get("submitter_id")
+    try:
+        return await run_cancellable(
+            _process_submission(**kwargs),
+            request=request,
+            supersede_key=(submitter_id, kwargs["problem_id"]) if submitter_id else None,
+        )
+    except SubmissionCancelled as e:
+        if e.reason == "superseded":
+            raise HTTPException(
+                status_code=409,
+                detail="A newer submission for this problem replaced this one",
+            )
+        # クライアントはすでに切断しているため、レスポンスは届かない
+        raise HTTPException(status_code=499, detail="Client closed request")
+
+
 @router.post("/submissions/", response_model=SubmissionResponse)
 async def create_submission(
-    submission: SubmissionCreate, db: Session = Depends(get_db)
+    submission: SubmissionCreate, request: Request, db: Session = Depends(get_db)
 ) -> SubmissionResponse:
     """JSON形式でコード提出を受け付けるエンドポイント"""
-    return await _process_submission(
+    with span(
+        "submission",
+        histogram=SUBMISSION_STAGE_SECONDS,
+        stage="total",
         problem_id=submission.problem_id,
-        user_code=submission.user_code,
         code_type=submission.code_type,
-        db=db,
-    )
+    ):
+        return await _run_submission(
+            request,
+            problem_id=submission.problem_id,
+            user_code=submission.user_code,
+            code_type=submission.code_type,
+            db=db,
+            submitter_id=submission.submitter_id,
+            force_llm_advice=submission.force_llm_advice,
+        )
 
 
 @router.post("/submissions/upload", response_model=SubmissionResponse)
 async def create_submission_file(
+    request: Request,
     problem_id: int = Form(...),
     file: UploadFile = File(...),
     code_type: str = Form("python"),
+    submitter_id: str | None = Form(None),
+    force_llm_advice: bool = Form(False),
     db: Session = Depends(get_db),
 ) -> SubmissionResponse:
     """ファイルアップロード形式でコード提出を受け付けるエンドポイント"""
@@ -161,9 +387,315 @@ async def create_submission_file(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid file encoding")
 
-    return await _process_submission(
+    with span(
+        "submission",
+        histogram=SUBMISSION_STAGE_SECONDS,
+        stage="total",
         problem_id=problem_id,
-        user_code=user_code,
         code_type=code_type,
-        db=db,
+    ):
+        return await _run_submission(
+            request,
+            problem_id=problem_id,
+            user_code=user_code,
+            code_type=code_type,
+            db=db,
+            submitter_id=submitter_id,
+            force_llm_advice=force_llm_advice,
+        )
+
+
+# 一覧取得時に常に読み込む軽量な列
+_SUMMARY_COLUMNS = (
+    SubmissionModel.id,
+    SubmissionModel.problem_id,
+    SubmissionModel.problem_version,
+    SubmissionModel.submitter_id,
+    SubmissionModel.is_correct,
+    SubmissionModel.exit_code,
+    SubmissionModel.execution_time_ms,
+    SubmissionModel.submitted_at,
+)
+
+
+def _to_naive_utc(value: datetime) -> datetime:
+    """DBに保存されている形式（タイムゾーンなしのUTC）に揃える"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _load_options(include_code: bool, include_output: bool, *extra_columns) -> list:
+    """一覧の列だけを読み、要求された本文はblobsからまとめて読み込むオプション"""
+    columns = [*_SUMMARY_COLUMNS, *extra_columns]
+    blobs = []
+    if include_code:
+        columns.append(SubmissionModel.user_code_hash)
+        blobs.append(SubmissionModel.user_code_blob)
+    if include_output:
+        columns.extend(
+            [
+                SubmissionModel.stdout_hash,
+                SubmissionModel.stderr_hash,
+                SubmissionModel.advice_text_hash,
+            ]
+        )
+        blobs.extend(
+            [
+                SubmissionModel.stdout_blob,
+                SubmissionModel.stderr_blob,
+                SubmissionModel.advice_text_blob,
+            ]
+        )
+    return [load_only(*columns), *(selectinload(blob) for blob in blobs)]
+
+
+def _filter_submissions(
+    query,
+    *,
+    problem_id: int | None,
+    submitter_id: str | None,
+    verdict: str | None,
+    submitted_after: datetime | None,
+    submitted_before: datetime | None,
+):
+    """提出履歴の絞り込み条件を追加する（Query と select のどちらにも使える）"""
+    if problem_id is not None:
+        query = query.filter(SubmissionModel.problem_id == problem_id)
+    if submitter_id is not None:
+        query = query.filter(SubmissionModel.submitter_id == submitter_id)
+    if verdict == "correct":
+        query = query.filter(SubmissionModel.is_correct.is_(True))
+    elif verdict == "incorrect":
+        # 実行は成功したが出力が一致しなかった提出
+        query = query.filter(
+            SubmissionModel.is_correct.is_(False),
+            or_(SubmissionModel.exit_code == 0, SubmissionModel.exit_code.is_(None)),
+        )
+    elif verdict == "error":
+        query = query.filter(SubmissionModel.exit_code != 0)
+    if submitted_after is not None:
+        query = query.filter(
+            SubmissionModel.submitted_at >= _to_naive_utc(submitted_after)
+        )
+    if submitted_before is not None:
+        query = query.filter(
+            SubmissionModel.submitted_at < _to_naive_utc(submitted_before)
+        )
+    return query
+
+
+def _encode_cursor(submitted_at: datetime, submission_id: int) -> str:
+    raw = f"{submitted_at.isoformat()}|{submission_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        submitted_at, submission_id = raw.rsplit("|", 1)
+        return _to_naive_utc(datetime.fromisoformat(submitted_at)), int(submission_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/submissions/", response_model=SubmissionPage)
+async def list_submissions(
+    problem_id: int | None = None,
+    submitter_id: str | None = None,
+    verdict: Literal["correct", "incorrect", "error"] | None = None,
+    submitted_after: datetime | None = None,
+    submitted_before: datetime | None = None,
+    cursor: str | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    include_code: bool = False,
+    include_output: bool = False,
+    include_archived: bool = False,
+    db: Session = Depends(get_db),
+) -> SubmissionPage:
+    """提出履歴を新しい順にキーセットページングで取得する"""
+    query = db.query(SubmissionModel).options(
+        *_load_options(include_code, include_output)
+    )
+    query = _filter_submissions(
+        query,
+        problem_id=problem_id,
+        submitter_id=submitter_id,
+        verdict=verdict,
+        submitted_after=submitted_after,
+        submitted_before=submitted_before,
+    )
+    cursor_key = _decode_cursor(cursor) if cursor is not None else None
+    if cursor_key is not None:
+        cursor_at, cursor_id = cursor_key
+        query = query.filter(
+            or_(
+                SubmissionModel.submitted_at < cursor_at,
+                and_(
+                    SubmissionModel.submitted_at == cursor_at,
+                    SubmissionModel.id < cursor_id,
+                ),
+            )
+        )
+
+    rows = (
+        query.order_by(SubmissionModel.submitted_at.desc(), SubmissionModel.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+
+    items = [
+        SubmissionSummary(
+            id=row.id,
+            problem_id=row.problem_id,
+            problem_version=row.problem_version,
+            submitter_id=row.submitter_id,
+            is_correct=row.is_correct,
+            exit_code=row.exit_code,
+            execution_time_ms=row.execution_time_ms,
+            submitted_at=row.submitted_at,
+            user_code=row.user_code if include_code else None,
+            stdout=row.stdout if include_output else None,
+            stderr=row.stderr if include_output else None,
+            advice_text=row.advice_text if include_output else None,
+        )
+        for row in rows
+    ]
+
+    # アーカイブ済みの提出はすべてホットテーブルの提出より古いので、続きとして読む
+    if include_archived and len(items) <= limit:
+        if items:
+            cursor_key = (_to_naive_utc(items[-1].submitted_at), items[-1].id)
+        records = await run_in_threadpool(
+            archive_reader.query,
+            problem_id=problem_id,
+            submitter_id=submitter_id,
+            verdict=verdict,
+            submitted_after=_to_naive_utc(submitted_after) if submitted_after else None,
+            submitted_before=(
+                _to_naive_utc(submitted_before) if submitted_before else None
+            ),
+            cursor=cursor_key,
+            limit=limit + 1 - len(items),
+        )
+        items.extend(
+            SubmissionSummary(
+                **{
+                    key: record[key]
+                    for key in (
+                        "id",
+                        "problem_id",
+                        "submitter_id",
+                        "is_correct",
+                        "exit_code",
+                        "execution_time_ms",
+                        "submitted_at",
+                    )
+                },
+                # バージョンを記録する前にアーカイブした提出にはない
+                problem_version=record.get("problem_version"),
+                user_code=record["user_code"] if include_code else None,
+                stdout=record["stdout"] if include_output else None,
+                stderr=record["stderr"] if include_output else None,
+                advice_text=record["advice_text"] if include_output else None,
+                archived=True,
+            )
+            for record in records
+        )
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = _encode_cursor(items[-1].submitted_at, items[-1].id)
+
+    return SubmissionPage(items=items, next_cursor=next_cursor)
+
+
+# エクスポートの列（本文は要求された場合のみ）
+_EXPORT_FIELDS = (
+    "id",
+    "problem_id",
+    "problem_version",
+    "submitter_id",
+    "is_correct",
+    "exit_code",
+    "error_type",
+    "execution_time_ms",
+    "submitted_at",
+)
+
+
+def _archived_chunks(**filters):
+    """アーカイブ済みの提出を新しい順に EXPORT_CHUNK_ROWS 件ずつ読む"""
+    cursor_key = None
+    while True:
+        records = archive_reader.query(
+            **filters, cursor=cursor_key, limit=EXPORT_CHUNK_ROWS
+        )
+        if not records:
+            return
+        for record in records:
+            record["archived"] = True
+        yield records
+        cursor_key = (records[-1]["submitted_at"], records[-1]["id"])
+
+
+@router.get("/submissions/export")
+async def export_submissions(
+    format: ExportFormat = "ndjson",
+    problem_id: int | None = None,
+    submitter_id: str | None = None,
+    verdict: Literal["correct", "incorrect", "error"] | None = None,
+    submitted_after: datetime | None = None,
+    submitted_before: datetime | None = None,
+    include_code: bool = False,
+    include_output: bool = False,
+    include_archived: bool = False,
+):
+    """
+    条件に合う提出を新しい順にNDJSONかCSVで一括ダウンロードする
+    件数によらず一定のメモリで、読んだ分から順に送る
+    """
+    filters = dict(
+        problem_id=problem_id,
+        submitter_id=submitter_id,
+        verdict=verdict,
+        submitted_after=submitted_after,
+        submitted_before=submitted_before,
     )
+    statement = _filter_submissions(
+        select(SubmissionModel).options(
+            *_load_options(include_code, include_output, SubmissionModel.error_type)
+        ),
+        **filters,
+    ).order_by(SubmissionModel.submitted_at.desc(), SubmissionModel.id.desc())
+
+    columns = _EXPORT_FIELDS
+    if include_code:
+        columns += ("user_code",)
+    if include_output:
+        columns += ("stdout", "stderr", "advice_text")
+
+    def to_record(row) -> dict:
+        return {column: getattr(row, column) for column in columns} | {"archived": False}
+
+    fields = columns
+    chunks = stream_rows(SessionLocal, statement, to_record)
+    if include_archived:
+        # アーカイブ済みの提出はすべてホットテーブルの提出より古いので、続きとして読む
+        fields += ("archived",)
+        chunks = chain(
+            chunks,
+            _archived_chunks(
+                **filters
+                | dict(
+                    submitted_after=(
+                        _to_naive_utc(submitted_after) if submitted_after else None
+                    ),
+                    submitted_before=(
+                        _to_naive_utc(submitted_before) if submitted_before else None
+                    ),
+                )
+            ),
+        )
+    return export_response(chunks, fields, format, "submissions")
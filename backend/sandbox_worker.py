@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+サンドボックスワーカー
+
+APIとは別のプロセス（別のホストでもよい）でコードを実行する。
+起動するとAPIに同時実行数を登録し、定期的に登録し直す（ハートビート）。
+APIからは長さ付きJSONのRPC（services/sandbox_rpc.py）でジョブを受け取る。
+登録とRPCの接続には、APIと同じ SANDBOX_WORKER_TOKEN（共有の秘密）が必要。
+
+使い方:
+    SANDBOX_WORKER_TOKEN=... python sandbox_worker.py --port 9101 --capacity 4 --api-url http://localhost:8000
+
+--simulate-ms を指定するとDockerを使わずに指定時間だけ待って結果を返す（負荷試験・動作確認用）
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import urllib.request
+
+from services.docker_async import close_docker_client
+from services.sandbox_rpc import (
+    SANDBOX_WORKER_TOKEN,
+    RPCProtocolError,
+    read_message,
+    token_matches,
+    write_message,
+)
+from services.sandbox_service import CodeExecutionResult, run_in_sandbox
+
+logger = logging.getLogger("sandbox_worker")
+
+# APIに登録し直す間隔（秒）
+HEARTBEAT_INTERVAL_S = 10
+# 接続してから hello が届くまで待つ秒数
+HANDSHAKE_TIMEOUT_S = 5
+
+
+class SandboxWorker:
+    """RPCでジョブを受け取り、同時実行数までサンドボックスで実行する"""
+
+    def __init__(
+        self,
+        capacity: int,
+        simulate_ms: float | None = None,
+        name: str = "",
+        token: str = SANDBOX_WORKER_TOKEN,
+    ):
+        self.capacity = capacity
+        self.simulate_ms = simulate_ms
+        self.name = name
+        self.token = token
+        self.in_flight = 0
+        self.completed = 0
+        self._slots = asyncio.Semaphore(capacity)
+
+    async def _run(
+        self, user_code: str, stdin_input: str | None, files: dict[str, str] | None
+    ) -> CodeExecutionResult:
+        if self.simulate_ms is not None:
+            await asyncio.sleep(self.simulate_ms / 1000)
+            return CodeExecutionResult(
+                stdout=f"simulated by {self.name}\n",
+                stderr="",
+                execution_time_ms=self.simulate_ms,
+                exit_code=0,
+                succeeded=True,
+            )
+        return await run_in_sandbox(user_code, stdin_input, files)
+
+    async def _execute(self, params: dict) -> dict:
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                result = await self._run(
+                    params["user_code"], params.get("stdin_input"), params.get("files")
+                )
+                self.completed += 1
+                return result.model_dump()
+            finally:
+                self.in_flight -= 1
+
+    async def _handshake(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bool:
+        """最初のメッセージが正しいトークンの hello なら応答してTrueを返す"""
+        hello = await asyncio.wait_for(read_message(reader), HANDSHAKE_TIMEOUT_S)
+        if hello is None:
+            return False
+        params = hello.get("params") or {}
+        if hello.get("method") != "hello" or not token_matches(params.get("token"), self.token):
+            logger.warning("Rejected a connection without a valid worker token")
+            await write_message(writer, {"id": hello.get("id"), "error": "Invalid worker token"})
+            return False
+        await write_message(writer, {"id": hello.get("id"), "result": self.status()})
+        return True
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """1本の接続で届くリクエストを同時に処理する"""
+        jobs: dict[int, asyncio.Task] = {}
+
+        async def respond(request_id, params):
+            try:
+                message = {"id": request_id, "result": await self._execute(params)}
+            except asyncio.CancelledError:
+                # キャンセルはAPIから頼まれたものなので応答しない
+                return
+            except Exception as e:
+                logger.exception("Job %s failed", request_id)
+                message = {"id": request_id, "error": f"{type(e).__name__}: {e}"}
+            finally:
+                jobs.pop(request_id, None)
+            try:
+                await write_message(writer, message)
+            except OSError:
+                pass
+
+        try:
+            if not await self._handshake(reader, writer):
+                return
+            while (message := await read_message(reader)) is not None:
+                request_id = message.get("id")
+                method = message.get("method")
+                params = message.get("params") or {}
+                if method == "execute":
+                    jobs[request_id] = asyncio.create_task(respond(request_id, params))
+                elif method == "cancel":
+                    task = jobs.get(params.get("job"))
+                    if task is not None:
+                        # 実行中ならコンテナを削除してから終わる
+                        task.cancel()
+                elif method == "status":
+                    await write_message(writer, {"id": request_id, "result": self.status()})
+                else:
+                    await write_message(
+                        writer, {"id": request_id, "error": f"Unknown method: {method}"}
+                    )
+        except (OSError, RPCProtocolError, TimeoutError) as e:
+            logger.warning("Connection error: %s", e)
+        finally:
+            # APIとの接続が切れたら、そのジョブは別のワーカーで再実行されるため止める
+            for task in list(jobs.values()):
+                task.cancel()
+            writer.close()
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+        }
+
+
+def register(api_url: str, address: str, capacity: int) -> None:
+    """APIにワーカーを登録する"""
+    request = urllib.request.Request(
+        f"{api_url.rstrip('/')}/admin/sandbox-workers",
+        data=json.dumps({"address": address, "capacity": capacity}).encode("utf-8"),
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {SANDBOX_WORKER_TOKEN}",
+        },
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=5) as response:
+        response.read()
+
+
+async def heartbeat(api_url: str, address: str, capacity: int) -> None:
+    while True:
+        try:
+            await asyncio.to_thread(register, api_url, address, capacity)
+        except Exception as e:
+            logger.warning("Failed to register with %s: %s", api_url, e)
+        await asyncio.sleep(HEARTBEAT_INTERVAL_S)
+
+
+async def serve(args) -> None:
+    address = args.advertise or f"{args.host}:{args.port}"
+    worker = SandboxWorker(args.capacity, args.simulate_ms, name=address)
+    server = await asyncio.start_server(worker.handle_connection, args.host, args.port)
+    logger.info("Sandbox worker %s listening (capacity=%d)", address, args.capacity)
+
+    heartbeat_task = None
+    if args.api_url:
+        heartbeat_task = asyncio.create_task(heartbeat(args.api_url, address, args.capacity))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with server:
+        await stop.wait()
+    if heartbeat_task is not None:
+        heartbeat_task.cancel()
+    await close_docker_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="サンドボックスワーカー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--capacity", type=int, default=4, help="同時実行数")
+    parser.add_argument("--api-url", help="登録先のAPI（例: http://localhost:8000）")
+    parser.add_argument("--advertise", help="APIに登録するアドレス（既定は host:port）")
+    parser.add_argument(
+        "--simulate-ms", type=float, help="Dockerを使わずに指定ミリ秒待って結果を返す"
+    )
+    args = parser.parse_args()
+    if not SANDBOX_WORKER_TOKEN:
+        parser.error("SANDBOX_WORKER_TOKEN must be set to the same value as the API")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
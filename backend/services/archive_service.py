@@ -0,0 +1,388 @@
+# 古い提出のアーカイブサービス
+"""
+一定期間より古い提出をsubmissionsテーブルから追記専用のセグメントファイルへ移す
+
+セグメントの形式:
+- segment-XXXXXX.ndjson.z: 提出をNDJSONにして ARCHIVE_BLOCK_SIZE 件ごとに
+  独立してzlib圧縮したブロックを連結したファイル
+- segment-XXXXXX.idx.json: ブロックごとのオフセット・長さ・期間・ID範囲・
+  問題ID・提出者IDを持つ小さなインデックス
+
+セグメントは一度書いたら変更しない。インデックスを最後に書くため、
+インデックスのあるセグメントだけが完成したものとして読まれる。
+読み取りはmmapしたセグメントから必要なブロックだけを展開する。
+"""
+
+import argparse
+import glob
+import json
+import logging
+import mmap
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.orm import selectinload
+
+from database import SessionLocal, SubmissionModel, engine, reserve_ids
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv(
+    "ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "archive")
+)
+# この日数より古い提出をアーカイブする
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "180"))
+# 1ブロックあたりの提出数
+ARCHIVE_BLOCK_SIZE = int(os.getenv("ARCHIVE_BLOCK_SIZE", "256"))
+
+_TEXT_FIELDS = ("user_code", "stdout", "stderr", "advice_text")
+
+
+def _timestamp(value: datetime) -> str:
+    """文字列のまま大小比較できるよう、マイクロ秒まで固定長で表す"""
+    return value.isoformat(timespec="microseconds")
+
+
+def _submission_to_record(submission: SubmissionModel) -> dict:
+    return {
+        "id": submission.id,
+        "problem_id": submission.problem_id,
+        "problem_version": submission.problem_version,
+        "submitter_id": submission.submitter_id,
+        "execution_time_ms": submission.execution_time_ms,
+        "exit_code": submission.exit_code,
+        "error_type": submission.error_type,
+        "is_correct": submission.is_correct,
+        "submitted_at": _timestamp(submission.submitted_at),
+        **{field: getattr(submission, field) for field in _TEXT_FIELDS},
+    }
+
+
+def matches_verdict(record: dict, verdict: str | None) -> bool:
+    """提出履歴APIのverdict条件と同じ判定をアーカイブ済みの提出に適用する"""
+    if verdict == "correct":
+        return record["is_correct"] is True
+    if verdict == "incorrect":
+        return record["is_correct"] is False and record["exit_code"] in (0, None)
+    if verdict == "error":
+        return record["exit_code"] not in (0, None)
+    return True
+
+
+class _SegmentWriter:
+    """ブロック単位で圧縮しながらセグメントファイルを書き出す"""
+
+    def __init__(self, directory: str, sequence: int, cutoff: datetime):
+        self.name = f"segment-{sequence:06d}"
+        self.data_path = os.path.join(directory, f"{self.name}.ndjson.z")
+        self.index_path = os.path.join(directory, f"{self.name}.idx.json")
+        self.cutoff = cutoff
+        self.blocks = []
+        self.records = 0
+        self._pending = []
+        self._offset = 0
+        self._file = open(self.data_path + ".tmp", "wb")
+
+    def add(self, record: dict):
+        self._pending.append(record)
+        if len(self._pending) >= ARCHIVE_BLOCK_SIZE:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._pending:
+            return
+        payload = "".join(
+            json.dumps(record, ensure_ascii=False) + "\n" for record in self._pending
+        )
+        data = zlib.compress(payload.encode("utf-8"), 9)
+        self._file.write(data)
+        self.blocks.append(
+            {
+                "offset": self._offset,
+                "length": len(data),
+                "count": len(self._pending),
+                "min_submitted_at": min(r["submitted_at"] for r in self._pending),
+                "max_submitted_at": max(r["submitted_at"] for r in self._pending),
+                "min_id": min(r["id"] for r in self._pending),
+                "max_id": max(r["id"] for r in self._pending),
+                "problem_ids": sorted({r["problem_id"] for r in self._pending}),
+                "submitter_ids": sorted(
+                    {r["submitter_id"] for r in self._pending if r["submitter_id"]}
+                ),
+            }
+        )
+        self._offset += len(data)
+        self.records += len(self._pending)
+        self._pending = []
+
+    def close(self):
+        """データを確定してからインデックスを書く"""
+        self._flush_block()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.data_path + ".tmp", self.data_path)
+
+        self.index = {
+            "segment": os.path.basename(self.data_path),
+            "cutoff": self.cutoff.isoformat(),
+            "records": self.records,
+            "blocks": self.blocks,
+        }
+        with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.data_path + ".tmp")
+
+
+def _load_indexes(directory: str) -> list[dict]:
+    indexes = []
+    for path in sorted(glob.glob(os.path.join(directory, "segment-*.idx.json"))):
+        with open(path, encoding="utf-8") as f:
+            indexes.append(json.load(f))
+    return indexes
+
+
+def _archived_max_id(indexes: list[dict]) -> int | None:
+    return max(
+        (block["max_id"] for index in indexes for block in index["blocks"]), default=None
+    )
+
+
+def reserve_archived_ids(directory: str = ARCHIVE_DIR) -> None:
+    """
+    アーカイブ済みの提出のIDを新しい提出に使わないようにする
+    （AUTOINCREMENT にする前のDBで、末尾の提出をアーカイブしていた場合のため）
+    """
+    max_id = _archived_max_id(_load_indexes(directory)) if os.path.isdir(directory) else None
+    with engine.begin() as conn:
+        reserve_ids(conn, "submissions", max_id)
+
+
+def _delete_archived_rows(session, cutoff: datetime) -> int:
+    """アーカイブ済みの提出と、参照されなくなったblobを削除する"""
+    deleted = (
+        session.query(SubmissionModel)
+        .filter(SubmissionModel.submitted_at < cutoff)
+        .delete(synchronize_session=False)
+    )
+    session.execute(
+        text(
+            "DELETE FROM blobs WHERE hash NOT IN ("
+            "SELECT user_code_hash FROM submissions WHERE user_code_hash IS NOT NULL "
+            "UNION SELECT stdout_hash FROM submissions WHERE stdout_hash IS NOT NULL "
+            "UNION SELECT stderr_hash FROM submissions WHERE stderr_hash IS NOT NULL "
+            "UNION SELECT advice_text_hash FROM submissions "
+            "WHERE advice_text_hash IS NOT NULL)"
+        )
+    )
+    session.commit()
+    return deleted
+
+
+def archive_submissions(
+    older_than_days: int = ARCHIVE_RETENTION_DAYS,
+    directory: str = ARCHIVE_DIR,
+    vacuum: bool = False,
+    batch_size: int = 1000,
+) -> dict:
+    """指定日数より古い提出をセグメントファイルに移し、submissionsから削除する"""
+    os.makedirs(directory, exist_ok=True)
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).replace(
+        tzinfo=None
+    )
+    indexes = _load_indexes(directory)
+
+    session = SessionLocal()
+    try:
+        # 前回の実行がセグメント作成後・削除前に中断していた場合の後始末
+        if indexes:
+            previous_cutoff = max(
+                datetime.fromisoformat(index["cutoff"]) for index in indexes
+            )
+            reserve_ids(session.connection(), "submissions", _archived_max_id(indexes))
+            _delete_archived_rows(session, previous_cutoff)
+
+        writer = None
+        last_id = 0
+        try:
+            while True:
+                submissions = (
+                    session.query(SubmissionModel)
+                    .options(
+                        selectinload(SubmissionModel.user_code_blob),
+                        selectinload(SubmissionModel.stdout_blob),
+                        selectinload(SubmissionModel.stderr_blob),
+                        selectinload(SubmissionModel.advice_text_blob),
+                    )
+                    .filter(
+                        SubmissionModel.submitted_at < cutoff,
+                        SubmissionModel.id > last_id,
+                    )
+                    .order_by(SubmissionModel.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not submissions:
+                    break
+                if writer is None:
+                    writer = _SegmentWriter(directory, len(indexes) + 1, cutoff)
+                for submission in submissions:
+                    writer.add(_submission_to_record(submission))
+                last_id = submissions[-1].id
+                session.expunge_all()
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+
+        if writer is None:
+            return {"archived": 0, "segment": None}
+        writer.close()
+        # 削除する提出のIDを、削除と同じトランザクションで使用済みにする
+        reserve_ids(session.connection(), "submissions", _archived_max_id([writer.index]))
+        deleted = _delete_archived_rows(session, cutoff)
+    finally:
+        session.close()
+
+    if vacuum:
+        # ファイルサイズを実際に縮めるにはトランザクション外でVACUUMが必要
+        with engine.connect() as conn:
+            conn.execute(text("VACUUM"))
+
+    archive_reader.refresh()
+    logger.info(
+        "Archived %s submissions into %s (deleted %s hot rows)",
+        writer.records,
+        writer.name,
+        deleted,
+    )
+    return {"archived": writer.records, "segment": writer.name}
+
+
+class ArchiveReader:
+    """セグメントファイルをmmapして、提出履歴APIと同じ条件で検索する"""
+
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._indexes: list[dict] | None = None
+        self._mtime_ns: int | None = None
+        self._maps: dict[str, mmap.mmap] = {}
+
+    def refresh(self):
+        with self._lock:
+            self._indexes = None
+
+    def _get_indexes(self) -> list[dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        # 別プロセス（CLI）で追加されたセグメントもディレクトリの更新時刻で検知する
+        mtime_ns = os.stat(self.directory).st_mtime_ns
+        with self._lock:
+            if self._indexes is None or self._mtime_ns != mtime_ns:
+                self._indexes = _load_indexes(self.directory)
+                self._mtime_ns = mtime_ns
+            return self._indexes
+
+    def _map(self, segment: str) -> mmap.mmap:
+        with self._lock:
+            mapped = self._maps.get(segment)
+            if mapped is None:
+                with open(os.path.join(self.directory, segment), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = mapped
+            return mapped
+
+    def _read_block(self, segment: str, block: dict) -> list[dict]:
+        mapped = self._map(segment)
+        data = mapped[block["offset"] : block["offset"] + block["length"]]
+        return [
+            json.loads(line)
+            for line in zlib.decompress(data).decode("utf-8").splitlines()
+        ]
+
+    def query(
+        self,
+        *,
+        problem_id: int | None = None,
+        submitter_id: str | None = None,
+        verdict: str | None = None,
+        submitted_after: datetime | None = None,
+        submitted_before: datetime | None = None,
+        cursor: tuple[datetime, int] | None = None,
+        limit: int = 50,
+    ) -> list[dict]:
+        """条件に合う提出を(submitted_at, id)の降順でlimit件まで返す"""
+        after = _timestamp(submitted_after) if submitted_after else None
+        before = _timestamp(submitted_before) if submitted_before else None
+        cursor_key = (_timestamp(cursor[0]), cursor[1]) if cursor else None
+
+        blocks = [
+            (index["segment"], block)
+            for index in self._get_indexes()
+            for block in index["blocks"]
+        ]
+        blocks.sort(key=lambda b: (b[1]["max_submitted_at"], b[1]["max_id"]), reverse=True)
+
+        results = []
+        for segment, block in blocks:
+            # 既に十分集まっていて、残りのブロックがすべて古ければ打ち切る
+            if len(results) >= limit and block["max_submitted_at"] < min(
+                r["submitted_at"] for r in results
+            ):
+                break
+            if problem_id is not None and problem_id not in block["problem_ids"]:
+                continue
+            if submitter_id is not None and submitter_id not in block["submitter_ids"]:
+                continue
+            if after and block["max_submitted_at"] < after:
+                continue
+            if before and block["min_submitted_at"] >= before:
+                continue
+            if cursor_key and block["min_submitted_at"] > cursor_key[0]:
+                continue
+
+            for record in self._read_block(segment, block):
+                key = (record["submitted_at"], record["id"])
+                if problem_id is not None and record["problem_id"] != problem_id:
+                    continue
+                if submitter_id is not None and record["submitter_id"] != submitter_id:
+                    continue
+                if not matches_verdict(record, verdict):
+                    continue
+                if after and record["submitted_at"] < after:
+                    continue
+                if before and record["submitted_at"] >= before:
+                    continue
+                if cursor_key and key >= cursor_key:
+                    continue
+                results.append(record)
+
+        results.sort(key=lambda r: (r["submitted_at"], r["id"]), reverse=True)
+        for record in results[:limit]:
+            record["submitted_at"] = datetime.fromisoformat(record["submitted_at"])
+        return results[:limit]
+
+
+# 提出履歴APIから使う共有リーダー
+archive_reader = ArchiveReader()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="古い提出をアーカイブする")
+    parser.add_argument(
+        "--older-than-days", type=int, default=ARCHIVE_RETENTION_DAYS
+    )
+    parser.add_argument("--vacuum", action="store_true", help="削除後にVACUUMする")
+    args = parser.parse_args()
+    print(archive_submissions(older_than_days=args.older_than_days, vacuum=args.vacuum))
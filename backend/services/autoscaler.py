@@ -0,0 +1,251 @@
+# サンドボックスの同時実行数の自動調整
+"""
+サンドボックスの同時実行数の上限を、観測した値からAIMD（足して増やし、掛けて減らす）で調整する
+
+- ホストのCPU（1分平均のロードアベレージ / CPU数）かメモリの使用率が高い → 減らす
+- 実行時間のp90が、最近の間隔で最も短かったp90の SANDBOX_AUTOSCALE_LATENCY_TOLERANCE 倍を超えた → 減らす
+  （本番ではコンテナの作成・リセット・削除にかかった時間を使う。ユーザーコードの実行やpip installの時間は
+  コードごとに違い、タイムアウトした実行は上限に張り付くため、ホストの混み具合の目安にならない）
+- 実行枠を待つ時間のp90が SANDBOX_AUTOSCALE_QUEUE_WAIT_S を超えた → 1つ増やす
+減らすときは SANDBOX_AUTOSCALE_DECREASE 倍にする（増やすのはゆっくり、減らすのはすばやく）
+
+上限は共有状態に置き、uvicorn --workers の全プロセスが同じ値を使う。
+判断は間隔ごとに最初に確認したプロセスが、そのプロセスで観測した値で行う。
+再利用コンテナの空きの数も、上限に合わせて同じ比率で増減する
+
+AIMDController は時刻やI/Oに依存しないため、test/sim_autoscaler.py のシミュレーションでも同じものを使う
+"""
+
+import asyncio
+import logging
+import math
+import os
+from collections import deque
+from dataclasses import dataclass, field
+
+from services.metrics import (
+    SANDBOX_AUTOSCALE_DECISIONS,
+    SANDBOX_CONCURRENCY_LIMIT,
+    SANDBOX_HOST_PRESSURE,
+)
+from services.shared_state import LocalSemaphore, SharedSemaphore, SharedState
+
+logger = logging.getLogger(__name__)
+
+SANDBOX_AUTOSCALE = os.getenv("SANDBOX_AUTOSCALE", "false").lower() == "true"
+# 上限を見直す間隔（秒）
+SANDBOX_AUTOSCALE_INTERVAL_S = float(os.getenv("SANDBOX_AUTOSCALE_INTERVAL_S", "5"))
+SANDBOX_AUTOSCALE_MIN = int(os.getenv("SANDBOX_AUTOSCALE_MIN", "1"))
+SANDBOX_AUTOSCALE_MAX = int(
+    os.getenv("SANDBOX_AUTOSCALE_MAX", str(4 * (os.cpu_count() or 1) + 4))
+)
+# 実行時間のp90が基準のこの倍数を超えたら、ホストが混み合っているとみなす
+SANDBOX_AUTOSCALE_LATENCY_TOLERANCE = float(
+    os.getenv("SANDBOX_AUTOSCALE_LATENCY_TOLERANCE", "2.0")
+)
+# 実行枠を待つ時間のp90がこれを超えたら増やす（秒）
+SANDBOX_AUTOSCALE_QUEUE_WAIT_S = float(os.getenv("SANDBOX_AUTOSCALE_QUEUE_WAIT_S", "0.1"))
+# CPUあたりのロードアベレージ・メモリの使用率がこれを超えたら減らす
+SANDBOX_AUTOSCALE_MAX_CPU = float(os.getenv("SANDBOX_AUTOSCALE_MAX_CPU", "2.0"))
+SANDBOX_AUTOSCALE_MAX_MEMORY = float(os.getenv("SANDBOX_AUTOSCALE_MAX_MEMORY", "0.9"))
+# 減らすときに掛ける値
+SANDBOX_AUTOSCALE_DECREASE = float(os.getenv("SANDBOX_AUTOSCALE_DECREASE", "0.75"))
+# 実行時間の基準にする直近の間隔の数
+SANDBOX_AUTOSCALE_BASELINE_WINDOWS = int(os.getenv("SANDBOX_AUTOSCALE_BASELINE_WINDOWS", "12"))
+
+# 共有状態に置く上限の名前
+_LIMIT_SETTING = "sandbox_concurrency_limit"
+# 1つの間隔に記録する観測値の上限（自動調整が止まっていても増え続けないように）
+_MAX_SAMPLES = 10000
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """最近傍法の分位点（値がなければNone）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+@dataclass
+class Signals:
+    """1つの間隔で観測した値"""
+
+    # 実行時間（SandboxAutoscaler ではコンテナの作成・リセット・削除にかかった時間）
+    run_seconds: list[float] = field(default_factory=list)
+    wait_seconds: list[float] = field(default_factory=list)
+    # CPUあたりのロードアベレージ・メモリの使用率（分からなければNone）
+    cpu_pressure: float | None = None
+    memory_pressure: float | None = None
+
+
+@dataclass
+class Decision:
+    limit: int
+    action: str  # increase / decrease / hold
+    reason: str
+
+
+class AIMDController:
+    """観測した値から次の同時実行数の上限を決める"""
+
+    def __init__(
+        self,
+        limit: int,
+        min_limit: int = SANDBOX_AUTOSCALE_MIN,
+        max_limit: int = SANDBOX_AUTOSCALE_MAX,
+        latency_tolerance: float = SANDBOX_AUTOSCALE_LATENCY_TOLERANCE,
+        queue_wait_s: float = SANDBOX_AUTOSCALE_QUEUE_WAIT_S,
+        max_cpu: float = SANDBOX_AUTOSCALE_MAX_CPU,
+        max_memory: float = SANDBOX_AUTOSCALE_MAX_MEMORY,
+        decrease: float = SANDBOX_AUTOSCALE_DECREASE,
+        baseline_windows: int = SANDBOX_AUTOSCALE_BASELINE_WINDOWS,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(limit, min_limit), max_limit)
+        self.latency_tolerance = latency_tolerance
+        self.queue_wait_s = queue_wait_s
+        self.max_cpu = max_cpu
+        self.max_memory = max_memory
+        self.decrease = decrease
+        # 直近の間隔ごとの実行時間のp90（最も短いものを混んでいないときの基準にする）
+        self._recent_p90 = deque(maxlen=baseline_windows)
+
+    def decide(self, signals: Signals) -> Decision:
+        run_p90 = percentile(signals.run_seconds, 90)
+        if run_p90 is not None:
+            self._recent_p90.append(run_p90)
+        if signals.cpu_pressure is not None and signals.cpu_pressure > self.max_cpu:
+            return self._decrease("cpu")
+        if signals.memory_pressure is not None and signals.memory_pressure > self.max_memory:
+            return self._decrease("memory")
+        if run_p90 is not None and run_p90 > min(self._recent_p90) * self.latency_tolerance:
+            return self._decrease("latency")
+        wait_p90 = percentile(signals.wait_seconds, 90)
+        if wait_p90 is not None and wait_p90 > self.queue_wait_s:
+            if self.limit >= self.max_limit:
+                return Decision(self.limit, "hold", "max")
+            self.limit += 1
+            return Decision(self.limit, "increase", "queue")
+        return Decision(self.limit, "hold", "steady")
+
+    def _decrease(self, reason: str) -> Decision:
+        if self.limit <= self.min_limit:
+            return Decision(self.limit, "hold", "min")
+        self.limit = max(self.min_limit, math.floor(self.limit * self.decrease))
+        return Decision(self.limit, "decrease", reason)
+
+
+def host_pressure() -> tuple[float | None, float | None]:
+    """CPUあたりのロードアベレージと、メモリの使用率"""
+    try:
+        cpu = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        cpu = None
+    memory = None
+    try:
+        with open("/proc/meminfo") as f:
+            info = {
+                name: int(value.split()[0])
+                for name, _, value in (line.partition(":") for line in f)
+                if name in ("MemTotal", "MemAvailable")
+            }
+        memory = 1 - info["MemAvailable"] / info["MemTotal"]
+    except (OSError, KeyError, ValueError, ZeroDivisionError):
+        pass
+    return cpu, memory
+
+
+class SandboxAutoscaler:
+    """実行の待ち時間・コンテナの準備と後片付けの時間を記録し、間隔ごとに全プロセス共通の上限を見直す"""
+
+    def __init__(
+        self,
+        semaphore: SharedSemaphore | LocalSemaphore,
+        shared: SharedState,
+        pool=None,
+        controller: AIMDController | None = None,
+        interval_s: float = SANDBOX_AUTOSCALE_INTERVAL_S,
+    ):
+        self.semaphore = semaphore
+        self.shared = shared
+        self.pool = pool
+        self.controller = controller or AIMDController(semaphore.limit)
+        self.interval_s = interval_s
+        # 空きのまま残す再利用コンテナの数は、設定した上限との比率を保つ
+        self._idle_ratio = pool.max_idle / semaphore.limit if pool is not None else 0
+        self._runs: deque[float] = deque(maxlen=_MAX_SAMPLES)
+        self._waits: deque[float] = deque(maxlen=_MAX_SAMPLES)
+        self._task: asyncio.Task | None = None
+        SANDBOX_CONCURRENCY_LIMIT.set(semaphore.limit)
+
+    def observe(self, wait_s: float, overhead_s: float | None) -> None:
+        """
+        1回の実行の、実行枠を待った時間と、コンテナの作成・リセット・削除にかかった時間を記録する
+        （コンテナを操作しなかった実行は overhead_s が None）
+        """
+        self._waits.append(wait_s)
+        if overhead_s is not None:
+            self._runs.append(overhead_s)
+
+    def _signals(self) -> Signals:
+        cpu, memory = host_pressure()
+        signals = Signals(list(self._runs), list(self._waits), cpu, memory)
+        self._runs.clear()
+        self._waits.clear()
+        for resource, value in (("cpu", cpu), ("memory", memory)):
+            if value is not None:
+                SANDBOX_HOST_PRESSURE.set(value, resource=resource)
+        return signals
+
+    async def tick(self) -> None:
+        signals = self._signals()
+        shared = self.shared
+        # この間隔で判断するのは1プロセスだけ（枠は解放せず、期限が切れると次の間隔で取れる）
+        leader = await shared.call(
+            shared.try_acquire_lease, "autoscaler", 1, self.interval_s * 0.9
+        )
+        current = await shared.call(shared.get_setting, _LIMIT_SETTING)
+        if leader is not None:
+            if current is not None:
+                # 他のプロセスが決めた値から続ける（設定の範囲が変わっていれば収める）
+                controller = self.controller
+                controller.limit = min(
+                    max(int(current), controller.min_limit), controller.max_limit
+                )
+            decision = self.controller.decide(signals)
+            SANDBOX_AUTOSCALE_DECISIONS.inc(action=decision.action, reason=decision.reason)
+            if decision.action != "hold":
+                logger.info(
+                    "サンドボックスの同時実行数を %d にします（%s）", decision.limit, decision.reason
+                )
+            if decision.limit != current:
+                await shared.call(shared.set_setting, _LIMIT_SETTING, decision.limit)
+            current = decision.limit
+        if current is not None:
+            self._apply(int(current))
+
+    def _apply(self, limit: int) -> None:
+        self.semaphore.limit = limit
+        if self.pool is not None:
+            self.pool.max_idle = max(1, round(limit * self._idle_ratio))
+        SANDBOX_CONCURRENCY_LIMIT.set(limit)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Failed to adjust sandbox concurrency")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
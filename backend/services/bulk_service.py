@@ -0,0 +1,221 @@
+# 提出・問題の一括エクスポートと問題の一括インポート
+"""
+どちらも件数によらず一定のメモリで動く
+
+- エクスポートは yield_per でDBから EXPORT_CHUNK_ROWS 件ずつ読み、
+  NDJSON（1行1件のJSON）かCSVにしてチャンクごとにレスポンスへ流す
+- インポートはリクエスト本文を行ごとに読み、1件ずつ検証して IMPORT_BATCH_SIZE 件ごとにコミットする。
+  検証に失敗した行は飛ばし、行番号とエラーを返す（先頭 IMPORT_MAX_ERRORS 件まで）
+"""
+
+import codecs
+import csv
+import io
+import os
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Literal
+
+import anyio.from_thread
+import orjson
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+
+from database import ProblemModel
+from models import ProblemCreate
+from services.problem_versions import record_version
+
+ExportFormat = Literal["ndjson", "csv"]
+
+# エクスポートで1回に読む行数（レスポンスのチャンクもこの件数ごと）
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "500"))
+# インポートで1回のトランザクションに入れる問題の数
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+# インポートの結果に含める失敗した行の数
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+
+_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def stream_rows(
+    session_factory,
+    statement,
+    to_record: Callable[[Any], dict],
+    chunk_rows: int = EXPORT_CHUNK_ROWS,
+) -> Iterator[list[dict]]:
+    """
+    select文の結果を chunk_rows 件ずつ辞書のリストにして返す（全件をメモリに載せない）
+    セッションは読み終えた行を弱参照でしか持たないため、変換後の行は解放される
+    """
+    with session_factory() as db:
+        result = db.scalars(statement.execution_options(yield_per=chunk_rows))
+        for rows in result.partitions():
+            yield [to_record(row) for row in rows]
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value).decode("utf-8")
+    return value
+
+
+def encode_chunks(
+    chunks: Iterable[list[dict]], fields: tuple[str, ...], fmt: ExportFormat
+) -> Iterator[bytes]:
+    """レコードのチャンクを NDJSON / CSV のバイト列にする（CSVは先頭に見出し行）"""
+    if fmt == "ndjson":
+        for records in chunks:
+            if records:
+                yield b"".join(
+                    orjson.dumps({field: r.get(field) for field in fields}) + b"\n"
+                    for r in records
+                )
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for records in chunks:
+        writer.writerows([_csv_value(r.get(field)) for field in fields] for r in records)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # 1件もなくても見出し行は返す
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def export_response(
+    chunks: Iterable[list[dict]], fields: tuple[str, ...], fmt: ExportFormat, name: str
+) -> StreamingResponse:
+    """チャンクごとに送るダウンロード用のレスポンス"""
+    return StreamingResponse(
+        encode_chunks(chunks, fields, fmt),
+        media_type=_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'},
+    )
+
+
+async def _next_chunk(stream: AsyncIterator[bytes]) -> bytes | None:
+    try:
+        return await anext(stream)
+    except StopAsyncIteration:
+        return None
+
+
+def body_lines(stream: AsyncIterator[bytes]) -> Iterator[str]:
+    """
+    ワーカースレッドから、イベントループ上で受信中のリクエスト本文を1行ずつ読む（改行は残す）
+    run_in_threadpool で動かしている処理からだけ使える
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    while (chunk := anyio.from_thread.run(_next_chunk, stream)) is not None:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _ndjson_records(lines: Iterable[str]) -> Iterator[tuple[int, Any]]:
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            yield line_number, e
+
+
+def _csv_records(lines: Iterable[str]) -> Iterator[tuple[int, Any]]:
+    reader = csv.DictReader(lines)
+    for row in reader:
+        # 空のセルは未指定として既定値を使う。comparator_options はJSONで書く
+        record = {
+            key: value
+            for key, value in row.items()
+            if key is not None and value not in ("", None)
+        }
+        if "comparator_options" in record:
+            try:
+                record["comparator_options"] = orjson.loads(record["comparator_options"])
+            except orjson.JSONDecodeError as e:
+                record = e
+        # 見出しを1行目として、レコードが終わった行の番号
+        yield reader.line_num, record
+
+
+class ImportResult:
+    """インポートの進み具合（途中で失敗しても、それまでにコミットした数が分かる）"""
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+
+    def fail(self, line: int, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def summary(self) -> dict:
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors}
+
+
+def _insert_problems(session_factory, problems: list[ProblemCreate]) -> None:
+    now = datetime.now(timezone.utc)
+    with session_factory() as db:
+        rows = [
+            ProblemModel(**problem.model_dump(), created_at=now, updated_at=now)
+            for problem in problems
+        ]
+        db.add_all(rows)
+        db.flush()  # バージョンに問題のIDが必要
+        for row in rows:
+            record_version(db, row)
+        db.commit()
+
+
+def import_problems(
+    session_factory,
+    lines: Iterable[str],
+    fmt: ExportFormat,
+    result: ImportResult,
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> ImportResult:
+    """
+    問題を1件ずつ検証し、batch_size 件ごとに新しい問題として追加する
+    （id などエクスポートにしかない列は無視する）
+    """
+    records = _ndjson_records(lines) if fmt == "ndjson" else _csv_records(lines)
+    batch: list[ProblemCreate] = []
+    for line_number, record in records:
+        if isinstance(record, Exception):
+            result.fail(line_number, str(record))
+            continue
+        try:
+            batch.append(ProblemCreate.model_validate(record))
+        except ValidationError as e:
+            result.fail(
+                line_number,
+                "; ".join(
+                    f"{'.'.join(map(str, err['loc'])) or 'record'}: {err['msg']}"
+                    for err in e.errors()
+                ),
+            )
+            continue
+        if len(batch) >= batch_size:
+            _insert_problems(session_factory, batch)
+            result.imported += len(batch)
+            batch = []
+    if batch:
+        _insert_problems(session_factory, batch)
+        result.imported += len(batch)
+    return result
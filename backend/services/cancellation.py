@@ -0,0 +1,111 @@
+# 提出処理のキャンセル
+"""
+クライアントが切断した提出や、同じ提出者が同じ問題に出し直した古い提出の処理をキャンセルする
+
+キャンセルはステージグラフを通じてサンドボックスの実行（コンテナを停止する）と
+LLMの呼び出しまで伝わり、キャンセルされた提出はDBに保存しない
+
+出し直しが別のワーカープロセスに届いた場合は、SharedStateのトークンが置き換わったことを
+切断の確認と同じ間隔で検知してキャンセルする
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from typing import Awaitable, Hashable, TypeVar
+
+from services.metrics import SUBMISSIONS_CANCELLED
+from services.shared_state import SharedState, cross_process_state
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# クライアントの切断を確認する間隔（秒）
+DISCONNECT_POLL_INTERVAL_S = float(os.getenv("DISCONNECT_POLL_INTERVAL_S", "0.5"))
+# 処理中のトークンを残して落ちたプロセスの分を消すまでの秒数
+SUPERSEDE_TTL_S = float(os.getenv("SUPERSEDE_TTL_S", "600"))
+
+# ワーカープロセス間で出し直しを伝える共有状態（Noneならプロセス内だけで判定する）
+shared: SharedState | None = cross_process_state
+
+
+class SubmissionCancelled(Exception):
+    """提出の処理がキャンセルされた（reason は "disconnect" または "superseded"）"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# 提出者と問題の組ごとに、処理中の提出のタスク
+_active: dict[Hashable, asyncio.Task] = {}
+# キャンセルしたタスクとその理由
+_reasons: dict[asyncio.Task, str] = {}
+
+
+def _cancel(task: asyncio.Task, reason: str) -> None:
+    if task.done() or task in _reasons:
+        return
+    _reasons[task] = reason
+    task.cancel()
+
+
+async def _watch(
+    request, task: asyncio.Task, shared_key: str | None, token: str | None
+) -> None:
+    while not task.done():
+        if request is not None and await request.is_disconnected():
+            logger.info("クライアントが切断したため提出の処理をキャンセルします")
+            _cancel(task, "disconnect")
+            return
+        if token is not None and await shared.call(shared.owner, shared_key) != token:
+            logger.info("別のプロセスに新しい提出が来たため古い提出の処理をキャンセルします")
+            _cancel(task, "superseded")
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL_S)
+
+
+async def run_cancellable(
+    work: Awaitable[T], *, request=None, supersede_key: Hashable | None = None
+) -> T:
+    """
+    work を実行し、request のクライアントが切断するか、
+    同じ supersede_key の新しい提出が来たらキャンセルして SubmissionCancelled を送出する
+    """
+    task = asyncio.ensure_future(work)
+    if supersede_key is not None:
+        previous = _active.get(supersede_key)
+        if previous is not None:
+            logger.info("新しい提出が来たため古い提出の処理をキャンセルします: %s", supersede_key)
+            _cancel(previous, "superseded")
+        _active[supersede_key] = task
+    shared_key = repr(supersede_key) if supersede_key is not None else None
+    token = None
+    watcher = None
+    try:
+        if shared is not None and supersede_key is not None:
+            token = uuid.uuid4().hex
+            await shared.call(shared.claim_owner, shared_key, token, SUPERSEDE_TTL_S)
+        if request is not None or token is not None:
+            watcher = asyncio.create_task(_watch(request, task, shared_key, token))
+        return await task
+    except asyncio.CancelledError:
+        reason = _reasons.get(task)
+        # 呼び出し元自身がキャンセルされた場合はそのまま伝える
+        if reason is None or asyncio.current_task().cancelling():
+            raise
+        SUBMISSIONS_CANCELLED.inc(reason=reason)
+        raise SubmissionCancelled(reason) from None
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if not task.done():
+            # トークンの登録中に呼び出し元がキャンセルされた
+            task.cancel()
+        if token is not None:
+            await shared.call(shared.release_owner, shared_key, token)
+        _reasons.pop(task, None)
+        if supersede_key is not None and _active.get(supersede_key) is task:
+            del _active[supersede_key]
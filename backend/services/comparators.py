@@ -0,0 +1,551 @@
+# 出力の正誤判定（比較モード）
+"""
+問題ごとに設定した比較モードで、提出コードの出力と正解コードの出力を比較する
+
+- exact: 前後の空白を除いて完全一致（従来の判定）
+- lines: 行ごとに空白の違い（連続・行末の空白）を無視し、末尾の空行も無視する
+- tokens: 空白・改行で区切った語の並びを比較する
+- numeric: tokens と同じく語ごとに比較し、数値同士は許容誤差（abs_tol / rel_tol）で比べる
+- unordered_lines: 行の順序を問わず、同じ行が同じ数だけあるか（空行は無視）
+- checker: 問題に登録したチェッカースクリプトをサンドボックスで実行して判定する
+
+出力は文字列のほか、文字列のチャンクのイテラブルも受け付け、
+行単位に区切りながら読み進めるため、出力全体を結合・分割したコピーを作らずに比較できる
+（サンドボックスの出力はexecの終了まで読み切ってから渡すため、入力はすでにメモリ上にある。
+ストリームを受け取りながら比較するわけではない）
+大きな出力の比較には100ミリ秒以上かかるため、judge_output はスレッドプールで比較する
+食い違いが見つかったら、最初の位置（行・列）と前後数行だけの差分を返す
+"""
+
+import json
+import logging
+import math
+import re
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+from starlette.concurrency import run_in_threadpool
+
+from services.sandbox_service import SANDBOX_FILES_DIR_ENV, execute_python_code_in_docker
+
+logger = logging.getLogger(__name__)
+
+COMPARATORS = ("exact", "lines", "tokens", "numeric", "unordered_lines", "checker")
+
+# numeric で許容誤差が指定されていないときの値
+DEFAULT_ABS_TOL = 1e-6
+DEFAULT_REL_TOL = 1e-6
+
+# 文字列の出力を区切るチャンクの大きさ
+CHUNK_SIZE = 64 * 1024
+
+# 差分に含める前後の行数と、1行あたりの最大文字数
+SNIPPET_CONTEXT_LINES = 2
+SNIPPET_MAX_LINE_CHARS = 200
+
+_TOKEN = re.compile(r"\S+")
+_CHECKER_RESULT_MARKER = "__CHECKER_RESULT__"
+
+# チェッカーは check(input_text, expected_output, actual_output) を定義し、
+# bool か (bool, メッセージ) を返す
+# 入出力はファイル（SANDBOX_FILES_DIR の input・expected・actual）で渡す
+# （引用符などを含む出力でも壊れず、大きな出力でもコマンドの引数の長さの上限に掛からないように）
+_CHECKER_TEMPLATE = """
+import json as _json, os as _os
+
+def _read_checker_input(name):
+    with open(_os.path.join(_os.environ[{files_env!r}], name), encoding="utf-8") as _file:
+        return _file.read()
+
+{checker_code}
+
+_result = check(
+    _read_checker_input("input"),
+    _read_checker_input("expected"),
+    _read_checker_input("actual"),
+)
+_ok, _message = _result if isinstance(_result, tuple) else (_result, "")
+print({marker!r} + _json.dumps({{"ok": bool(_ok), "message": str(_message)}}))
+"""
+
+
+@dataclass
+class Mismatch:
+    """最初に食い違った位置と、その前後の差分"""
+
+    line: int | None  # 提出コードの出力での行番号（1始まり）
+    column: int | None  # 行内の位置（1始まり）
+    expected: str | None  # 期待される行（語）
+    actual: str | None  # 実際の行（語）
+    snippet: str  # 前後数行の差分
+
+
+@dataclass
+class ComparisonResult:
+    """比較の結果"""
+
+    is_correct: bool
+    mismatch: Mismatch | None = None
+
+
+def iter_chunks(output: str | Iterable[str] | None, start: int = 0) -> Iterator[str]:
+    """文字列はCHUNK_SIZEごとに区切り、チャンクのイテラブルはそのまま返す"""
+    if output is None:
+        return
+    if isinstance(output, str):
+        for offset in range(start, len(output), CHUNK_SIZE):
+            yield output[offset : offset + CHUNK_SIZE]
+        return
+    yield from output
+
+
+def common_prefix_length(a: str, b: str, chunk: int = CHUNK_SIZE) -> int:
+    """2つの文字列の共通の先頭部分の長さ"""
+    limit = min(len(a), len(b))
+    i = 0
+    # 大きな出力でも行に分割せず、まとまった単位で比較する
+    while i < limit and a[i : i + chunk] == b[i : i + chunk]:
+        i += chunk
+    i = min(i, limit)
+    end = min(i + chunk, limit)
+    while i < end and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _resume_point(actual: str, expected: str) -> tuple[int, int] | None:
+    """
+    共通の先頭部分を読み飛ばせる位置（文字位置, その前の行数）
+    差分の文脈に使う数行前の行頭から読み始める
+    """
+    offset = common_prefix_length(actual, expected)
+    for _ in range(SNIPPET_CONTEXT_LINES + 1):
+        offset = actual.rfind("\n", 0, offset) + 1
+        if offset == 0:
+            return None
+        offset -= 1
+    offset += 1
+    # 先頭の空白だけを読み飛ばす場合は、通常どおり先頭から読む
+    if not actual[:offset].strip():
+        return None
+    return offset, actual.count("\n", 0, offset)
+
+
+class _LineReader:
+    """チャンクを行に区切りながら読み、直前の数行を覚えておく"""
+
+    def __init__(
+        self,
+        output,
+        skip_leading_whitespace: bool = False,
+        resume: tuple[int, int] | None = None,
+    ):
+        offset, self.line_number = resume or (0, 0)
+        self._chunks = iter_chunks(output, offset)
+        self._pending: deque[str] = deque()
+        self._partial = ""
+        self._done = False
+        self._skip_leading = skip_leading_whitespace and resume is None
+        # 直前の行（差分の前側の文脈）と、いま読んだ行
+        self.recent: deque[str] = deque(maxlen=SNIPPET_CONTEXT_LINES + 1)
+
+    def _read_chunk(self) -> bool:
+        """チャンクを1つ読んで行に区切る。読み終わっていればFalse"""
+        if self._done:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._done = True
+            if self._partial:
+                self._pending.append(self._partial)
+                self._partial = ""
+            return True
+        if self._skip_leading:
+            stripped = chunk.lstrip()
+            # 読み飛ばした空行の分も行番号に数える
+            self.line_number += chunk.count("\n", 0, len(chunk) - len(stripped))
+            if not stripped:
+                return True
+            chunk = stripped
+            self._skip_leading = False
+        parts = (self._partial + chunk).split("\n")
+        self._partial = parts.pop()
+        self._pending.extend(parts)
+        return True
+
+    def next_line(self) -> str | None:
+        """次の行（改行なし）を返す。終わりならNone"""
+        while not self._pending:
+            if not self._read_chunk():
+                return None
+        line = self._pending.popleft()
+        self.line_number += 1
+        self.recent.append(line)
+        return line
+
+    def peek_lines(self, count: int) -> list[str]:
+        """次の count 行を読み進めずに返す"""
+        while len(self._pending) < count and self._read_chunk():
+            pass
+        return [self._pending[i] for i in range(min(count, len(self._pending)))]
+
+    def rest_is_blank(self) -> bool:
+        """残りの行がすべて空白だけか"""
+        while (line := self.next_line()) is not None:
+            if line.strip():
+                return False
+        return True
+
+
+def _clip(line: str) -> str:
+    if len(line) <= SNIPPET_MAX_LINE_CHARS:
+        return line
+    return line[:SNIPPET_MAX_LINE_CHARS] + "…"
+
+
+def _position(reader: _LineReader, current: str | None) -> int:
+    """いま比べている行の行番号（出力が終わっていれば最後の行の次）"""
+    return reader.line_number if current is not None else reader.line_number + 1
+
+
+def _hunk(reader: _LineReader, current: str | None, mark: str) -> list[str]:
+    number = _position(reader, current)
+    if current is None:
+        return [f"{mark}{number:>5} | （出力の終わり）"]
+    rows = [f"{mark}{number:>5} | {_clip(current)}"]
+    for offset, line in enumerate(reader.peek_lines(SNIPPET_CONTEXT_LINES), 1):
+        rows.append(f"{mark}{number + offset:>5} | {_clip(line)}")
+    return rows
+
+
+def _snippet(
+    expected: _LineReader,
+    actual: _LineReader,
+    expected_line: str | None,
+    actual_line: str | None,
+) -> str:
+    """食い違った行の前後数行を unified diff に似た形でまとめる"""
+    before = list(actual.recent)
+    if actual_line is not None:
+        before.pop()
+    before = before[-SNIPPET_CONTEXT_LINES:]
+    first = _position(actual, actual_line) - len(before)
+    rows = ["--- 期待される出力", "+++ あなたの出力"]
+    rows += [f" {first + i:>5} | {_clip(line)}" for i, line in enumerate(before)]
+    rows += _hunk(expected, expected_line, "-")
+    rows += _hunk(actual, actual_line, "+")
+    return "\n".join(rows)
+
+
+def _mismatch(
+    expected: _LineReader,
+    actual: _LineReader,
+    expected_line: str | None,
+    actual_line: str | None,
+    column: int | None,
+    expected_text: str | None = None,
+    actual_text: str | None = None,
+) -> Mismatch:
+    if expected_text is None:
+        expected_text = expected_line
+    if actual_text is None:
+        actual_text = actual_line
+    return Mismatch(
+        line=_position(actual, actual_line),
+        column=column,
+        expected=_clip(expected_text) if expected_text is not None else None,
+        actual=_clip(actual_text) if actual_text is not None else None,
+        snippet=_snippet(expected, actual, expected_line, actual_line),
+    )
+
+
+def _common_prefix(a: str, b: str) -> int:
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return min(len(a), len(b))
+
+
+def _compare_exact(actual, expected, options: dict, resume=None) -> ComparisonResult:
+    """前後の空白を除いて一致するか（行ごとに読み、違いが出たら残りが空白だけか調べる）"""
+    expected_reader = _LineReader(expected, skip_leading_whitespace=True, resume=resume)
+    actual_reader = _LineReader(actual, skip_leading_whitespace=True, resume=resume)
+    while True:
+        expected_line = expected_reader.next_line()
+        actual_line = actual_reader.next_line()
+        if expected_line is None and actual_line is None:
+            return ComparisonResult(True)
+        if expected_line == actual_line:
+            continue
+        # 差分を先に作る（残りを読んだ後では前後の行がわからない）
+        mismatch = _mismatch(
+            expected_reader,
+            actual_reader,
+            expected_line,
+            actual_line,
+            _common_prefix(actual_line or "", expected_line or "") + 1,
+        )
+        # 行末の空白と末尾の空行だけの違いなら一致とみなす
+        if (
+            (actual_line or "").rstrip() == (expected_line or "").rstrip()
+            and expected_reader.rest_is_blank()
+            and actual_reader.rest_is_blank()
+        ):
+            return ComparisonResult(True)
+        return ComparisonResult(False, mismatch)
+
+
+def _token_column(line: str | None, index: int) -> int | None:
+    if line is None:
+        return None
+    for i, match in enumerate(_TOKEN.finditer(line)):
+        if i == index:
+            return match.start() + 1
+    return len(line) + 1
+
+
+def _compare_lines(actual, expected, options: dict, resume=None) -> ComparisonResult:
+    """行ごとに空白の違いを無視して比較する（先頭・末尾の空行も無視する）"""
+    expected_reader = _LineReader(expected, skip_leading_whitespace=True, resume=resume)
+    actual_reader = _LineReader(actual, skip_leading_whitespace=True, resume=resume)
+    while True:
+        expected_line = expected_reader.next_line()
+        actual_line = actual_reader.next_line()
+        if expected_line is None and actual_line is None:
+            return ComparisonResult(True)
+        expected_tokens = expected_line.split() if expected_line is not None else []
+        actual_tokens = actual_line.split() if actual_line is not None else []
+        if expected_tokens == actual_tokens:
+            continue
+        index = next(
+            (i for i, (a, b) in enumerate(zip(actual_tokens, expected_tokens)) if a != b),
+            min(len(actual_tokens), len(expected_tokens)),
+        )
+        return ComparisonResult(
+            False,
+            _mismatch(
+                expected_reader,
+                actual_reader,
+                expected_line,
+                actual_line,
+                _token_column(actual_line, index),
+            ),
+        )
+
+
+def _tokens(reader: _LineReader):
+    """(行, 行内で何番目の語か, 語) を順に返す"""
+    while (line := reader.next_line()) is not None:
+        for index, token in enumerate(line.split()):
+            yield line, index, token
+
+
+_NUMBER = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|[+-]?(?:inf|nan)", re.I)
+
+
+def _numbers_close(a: str, b: str, abs_tol: float, rel_tol: float) -> bool:
+    # float() は "1_000" なども受け付けるため、数値の形をしている語だけを比べる
+    if not (_NUMBER.fullmatch(a) and _NUMBER.fullmatch(b)):
+        return False
+    x, y = float(a), float(b)
+    if math.isnan(x) or math.isnan(y):
+        return math.isnan(x) and math.isnan(y)
+    return math.isclose(x, y, rel_tol=rel_tol, abs_tol=abs_tol)
+
+
+def _compare_tokens(
+    actual, expected, options: dict, resume=None, numeric: bool = False
+) -> ComparisonResult:
+    """空白・改行で区切った語の並びを比較する（numericなら数値は許容誤差で比べる）"""
+    abs_tol = float(options.get("abs_tol", DEFAULT_ABS_TOL))
+    rel_tol = float(options.get("rel_tol", DEFAULT_REL_TOL))
+    expected_reader = _LineReader(expected, resume=resume)
+    actual_reader = _LineReader(actual, resume=resume)
+    expected_tokens = _tokens(expected_reader)
+    actual_tokens = _tokens(actual_reader)
+    while True:
+        expected_item = next(expected_tokens, None)
+        actual_item = next(actual_tokens, None)
+        if expected_item is None and actual_item is None:
+            return ComparisonResult(True)
+        if expected_item is not None and actual_item is not None:
+            expected_token, actual_token = expected_item[2], actual_item[2]
+            if expected_token == actual_token or (
+                numeric and _numbers_close(actual_token, expected_token, abs_tol, rel_tol)
+            ):
+                continue
+        expected_line, _, expected_token = expected_item or (None, None, None)
+        actual_line, index, actual_token = actual_item or (None, None, None)
+        return ComparisonResult(
+            False,
+            _mismatch(
+                expected_reader,
+                actual_reader,
+                expected_line,
+                actual_line,
+                _token_column(actual_line, index),
+                expected_text=expected_token,
+                actual_text=actual_token,
+            ),
+        )
+
+
+def _compare_numeric(actual, expected, options: dict, resume=None) -> ComparisonResult:
+    return _compare_tokens(actual, expected, options, resume, numeric=True)
+
+
+def _compare_unordered_lines(actual, expected, options: dict, resume=None) -> ComparisonResult:
+    """
+    行の順序を問わずに比較する（空白の違いと空行は無視する）
+    期待される出力の行ごとの個数だけを保持し、提出コードの出力は読みながら照合する
+    """
+    remaining: Counter[str] = Counter()
+    expected_reader = _LineReader(expected)
+    while (line := expected_reader.next_line()) is not None:
+        if normalized := " ".join(line.split()):
+            remaining[normalized] += 1
+
+    actual_reader = _LineReader(actual)
+    while (line := actual_reader.next_line()) is not None:
+        normalized = " ".join(line.split())
+        if not normalized:
+            continue
+        if remaining[normalized] > 0:
+            remaining[normalized] -= 1
+            continue
+        return ComparisonResult(
+            False,
+            Mismatch(
+                line=actual_reader.line_number,
+                column=1,
+                expected=None,
+                actual=_clip(line),
+                snippet=(
+                    "期待される出力にない行（または多すぎる行）があります\n"
+                    f"+{actual_reader.line_number:>5} | {_clip(line)}"
+                ),
+            ),
+        )
+
+    missing = [(line, count) for line, count in remaining.items() if count > 0]
+    if not missing:
+        return ComparisonResult(True)
+    rows = ["期待される出力の行が足りません"]
+    rows += [
+        f"-{count:>4}行 | {_clip(line)}" for line, count in missing[: SNIPPET_CONTEXT_LINES * 2 + 1]
+    ]
+    return ComparisonResult(
+        False,
+        Mismatch(
+            line=actual_reader.line_number + 1,
+            column=None,
+            expected=_clip(missing[0][0]),
+            actual=None,
+            snippet="\n".join(rows),
+        ),
+    )
+
+
+_COMPARE_FUNCTIONS = {
+    "exact": _compare_exact,
+    "lines": _compare_lines,
+    "tokens": _compare_tokens,
+    "numeric": _compare_numeric,
+    "unordered_lines": _compare_unordered_lines,
+}
+
+
+def compare_outputs(
+    actual: str | Iterable[str] | None,
+    expected: str | Iterable[str] | None,
+    comparator: str | None = "exact",
+    options: dict | None = None,
+) -> ComparisonResult:
+    """比較モードに従って提出コードの出力（actual）と期待される出力（expected）を比べる"""
+    compare = _COMPARE_FUNCTIONS.get(comparator or "exact")
+    if compare is None:
+        raise ValueError(f"Unknown comparator: {comparator}")
+    resume = None
+    if isinstance(actual, (str, type(None))) and isinstance(expected, (str, type(None))):
+        actual, expected = actual or "", expected or ""
+        # 前後の空白を除いて同じなら、どのモードでも正解になる
+        if actual.strip() == expected.strip():
+            return ComparisonResult(True)
+        # 行の順序を問うモードでは、共通の先頭部分を行に分けずに読み飛ばす
+        if compare is not _compare_unordered_lines:
+            resume = _resume_point(actual, expected)
+    return compare(actual, expected, options or {}, resume)
+
+
+def build_checker_program(
+    checker_code: str,
+    test_input: str | None,
+    actual: str | Iterable[str] | None,
+    expected: str | Iterable[str] | None,
+) -> tuple[str, dict[str, str | Iterable[str]]]:
+    """
+    サンドボックスで実行するチェッカーのコードと、渡すファイルを作る
+    出力はチャンクのまま渡し、全体を1つの文字列にまとめない
+    """
+    code = _CHECKER_TEMPLATE.format(
+        checker_code=checker_code,
+        files_env=SANDBOX_FILES_DIR_ENV,
+        marker=_CHECKER_RESULT_MARKER,
+    )
+    files = {
+        "input": test_input or "",
+        "expected": iter_chunks(expected),
+        "actual": iter_chunks(actual),
+    }
+    return code, files
+
+
+def parse_checker_output(exit_code: int | None, stdout: str | None) -> ComparisonResult:
+    """チェッカーの出力の最後の判定結果を読み取る"""
+    verdict = None
+    for line in reversed((stdout or "").splitlines()):
+        if line.startswith(_CHECKER_RESULT_MARKER):
+            verdict = json.loads(line[len(_CHECKER_RESULT_MARKER) :])
+            break
+    if exit_code != 0 or verdict is None:
+        message = "チェッカーの実行に失敗しました"
+    elif verdict["ok"]:
+        return ComparisonResult(True)
+    else:
+        message = _clip(verdict["message"]) or "チェッカーが不正解と判定しました"
+    return ComparisonResult(
+        False,
+        Mismatch(line=None, column=None, expected=None, actual=None, snippet=message),
+    )
+
+
+async def run_checker(
+    checker_code: str,
+    test_input: str | None,
+    actual: str | Iterable[str] | None,
+    expected: str | Iterable[str] | None,
+) -> ComparisonResult:
+    """チェッカースクリプトをサンドボックスで実行して判定する"""
+    code, files = build_checker_program(checker_code, test_input, actual, expected)
+    result = await execute_python_code_in_docker(user_code=code, files=files)
+    if result.exit_code != 0:
+        logger.warning("チェッカーの実行に失敗しました: %s", (result.stderr or "")[-500:])
+    return parse_checker_output(result.exit_code, result.stdout)
+
+
+async def judge_output(
+    problem,
+    actual: str | Iterable[str] | None,
+    expected: str | Iterable[str] | None,
+) -> ComparisonResult:
+    """
+    問題に設定された比較モードで判定する（actual・expected はメモリ上の出力）
+    比較はイベントループを止めないようスレッドプールで行う。
+    ループ側で待つため、判定の期限（JUDGE_DEADLINE_S）も比較の途中で切れる
+    """
+    if problem.comparator == "checker" and problem.checker_code:
+        return await run_checker(problem.checker_code, problem.test_input, actual, expected)
+    return await run_in_threadpool(
+        compare_outputs, actual, expected, problem.comparator, problem.comparator_options
+    )
@@ -0,0 +1,253 @@
+# サンドボックスコンテナの再利用
+"""
+SANDBOX_REUSE_CONTAINERS=true のとき、実行ごとにコンテナを作成・削除せず使い回す
+
+- コンテナはルートファイルシステムを読み取り専用にし、書き込めるのはtmpfs（/sandbox・/tmp）と/dev/shmだけ
+- 各実行は非特権ユーザーの新しいプロセスとして、/sandbox/work（HOMEも同じ）で動かす
+- 実行後はrootで残ったプロセスをすべて止め、tmpfsを空にし、何も残っていないことを確かめてから空きに戻す
+  確かめられなければ（またはキャンセル・タイムアウトで止めたら）そのコンテナは捨てる
+- SANDBOX_RECYCLE_AFTER_RUNS 回使ったコンテナは作り直す
+
+空きのコンテナはSharedStateの在庫で管理し、uvicorn --workers の全プロセスで共有する
+"""
+
+import json
+import logging
+import os
+from dataclasses import dataclass
+
+from services.docker_async import get_docker_client
+from services.metrics import SANDBOX_CONTAINER_EVENTS, SANDBOX_STAGE_SECONDS
+from services.shared_state import SharedState, shared_state
+from services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+SANDBOX_REUSE_CONTAINERS = os.getenv("SANDBOX_REUSE_CONTAINERS", "false").lower() == "true"
+# 空きのまま残しておくコンテナ数（全プロセスの合計）
+SANDBOX_POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", "4"))
+# この回数使ったコンテナは作り直す
+SANDBOX_RECYCLE_AFTER_RUNS = int(os.getenv("SANDBOX_RECYCLE_AFTER_RUNS", "50"))
+# 作業用tmpfsの大きさ
+SANDBOX_TMPFS_SIZE = os.getenv("SANDBOX_TMPFS_SIZE", "64m")
+# コンテナ内のプロセス数の上限（フォーク爆弾で後片付けできなくならないように）
+SANDBOX_PIDS_LIMIT = int(os.getenv("SANDBOX_PIDS_LIMIT", "64"))
+# 使用中のまま更新されないコンテナを、落ちたプロセスの分とみなすまでの秒数
+SANDBOX_CONTAINER_STALE_S = float(os.getenv("SANDBOX_CONTAINER_STALE_S", "120"))
+
+# ユーザーコードを実行するユーザーと作業ディレクトリ（sandbox_docker/Dockerfile で作成）
+SANDBOX_USER = "sandbox_user"
+SANDBOX_WORKDIR = "/sandbox/work"
+_WIPED_DIRS = ("/sandbox", "/tmp", "/dev/shm")
+
+# rootで実行する後片付けと検証のスクリプト
+# 非特権ユーザーになって kill(-1) すると、そのユーザーのプロセスを（増殖中のものも含めて）一度に止められる
+_RESET_SCRIPT = f"""
+import json, os, pwd, shutil, signal, sys, time
+
+user = pwd.getpwnam({SANDBOX_USER!r})
+
+def user_processes():
+    found = []
+    for pid in os.listdir("/proc"):
+        if pid.isdigit():
+            try:
+                if os.stat("/proc/" + pid).st_uid == user.pw_uid:
+                    found.append(int(pid))
+            except FileNotFoundError:
+                pass
+    return found
+
+for _ in range(20):
+    if not user_processes():
+        break
+    child = os.fork()
+    if child == 0:
+        os.setgid(user.pw_gid)
+        os.setuid(user.pw_uid)
+        os.kill(-1, signal.SIGKILL)
+        os._exit(0)
+    os.waitpid(child, 0)
+    time.sleep(0.01)
+
+for root in {_WIPED_DIRS!r}:
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.unlink(path)
+os.makedirs({SANDBOX_WORKDIR!r})
+os.chown({SANDBOX_WORKDIR!r}, user.pw_uid, user.pw_gid)
+
+leftovers = {{
+    "processes": user_processes(),
+    "files": [
+        os.path.join(root, name)
+        for root in {_WIPED_DIRS!r}
+        for name in os.listdir(root)
+        if os.path.join(root, name) != "/sandbox/work"
+    ] + os.listdir({SANDBOX_WORKDIR!r}),
+}}
+print(json.dumps(leftovers))
+sys.exit(1 if any(leftovers.values()) else 0)
+"""
+
+
+@dataclass
+class PooledContainer:
+    """在庫から借りたコンテナ"""
+
+    container_id: str
+    runs: int = 0
+
+    @property
+    def exec_options(self) -> dict:
+        """ユーザーコードを実行するときの exec_run の引数"""
+        return {
+            "user": SANDBOX_USER,
+            "workdir": SANDBOX_WORKDIR,
+            "environment": {"HOME": SANDBOX_WORKDIR},
+        }
+
+
+class ContainerPool:
+    """再利用するサンドボックスコンテナの貸し出しと後片付け"""
+
+    def __init__(
+        self,
+        shared: SharedState,
+        max_idle: int = SANDBOX_POOL_SIZE,
+        recycle_after: int = SANDBOX_RECYCLE_AFTER_RUNS,
+        client_factory=get_docker_client,
+    ):
+        self.shared = shared
+        self.max_idle = max_idle
+        self.recycle_after = recycle_after
+        # 実行中のイベントループで使うDockerクライアントを返す関数
+        self._docker = client_factory
+
+    async def _create(self) -> str:
+        with span("container_create", histogram=SANDBOX_STAGE_SECONDS, pooled=True):
+            docker = self._docker()
+            container_id = await docker.create_container(
+                "python-sandbox",
+                ["sleep", "infinity"],
+                # 後片付けはrootで行い、ユーザーコードは exec_options のユーザーで実行する
+                user="root",
+                labels={"sandbox-pool": "1"},
+                network_disabled=True,
+                host_config={
+                    "Memory": 128 * 1024 * 1024,
+                    "ReadonlyRootfs": True,
+                    "Tmpfs": {
+                        "/sandbox": f"rw,nosuid,size={SANDBOX_TMPFS_SIZE},mode=0755",
+                        "/tmp": f"rw,nosuid,size={SANDBOX_TMPFS_SIZE},mode=1777",
+                    },
+                    "PidsLimit": SANDBOX_PIDS_LIMIT,
+                    # 親のいなくなったプロセスを回収させ、後片付けでゾンビが残らないようにする
+                    "Init": True,
+                },
+            )
+            await self.shared.call(self.shared.add_container, container_id)
+            SANDBOX_CONTAINER_EVENTS.inc(event="created")
+            try:
+                await docker.start(container_id)
+            except BaseException:
+                await self._discard(container_id, "reset_failed")
+                raise
+        if not await self._reset(container_id):
+            await self._discard(container_id, "reset_failed")
+            raise RuntimeError("New sandbox container failed the reset check")
+        return container_id
+
+    async def checkout(self) -> PooledContainer:
+        """空いているコンテナを借りる（なければ作る）"""
+        claimed, stale = await self.shared.call(
+            self.shared.claim_container, SANDBOX_CONTAINER_STALE_S
+        )
+        for container_id in stale:
+            logger.warning("使用中のまま残っていたコンテナを削除します: %s", container_id)
+            await self._remove(container_id)
+        if claimed is not None:
+            container_id, runs = claimed
+            try:
+                state = (await self._docker().inspect(container_id)).get("State", {})
+                if not state.get("Running"):
+                    raise RuntimeError(f"container is {state.get('Status')}")
+            except Exception as e:
+                logger.warning("在庫のコンテナ %s を取得できません: %s", container_id, e)
+                await self._discard(container_id, "discarded")
+                return await self.checkout()
+            SANDBOX_CONTAINER_EVENTS.inc(event="reused")
+            return PooledContainer(container_id, runs)
+        return PooledContainer(await self._create())
+
+    async def checkin(self, pooled: PooledContainer, healthy: bool) -> None:
+        """
+        実行が終わったコンテナを後片付けして返す
+        healthy でない（キャンセル・タイムアウトで止めた）コンテナや、
+        後片付けで何か残っていたコンテナは捨てる
+        """
+        pooled.runs += 1
+        container_id = pooled.container_id
+        if not healthy:
+            await self._discard(container_id, "discarded")
+            return
+        if pooled.runs >= self.recycle_after:
+            await self._discard(container_id, "recycled")
+            return
+        if not await self._reset(container_id):
+            await self._discard(container_id, "reset_failed")
+            return
+        returned = await self.shared.call(
+            self.shared.return_container, container_id, pooled.runs, self.max_idle
+        )
+        if not returned:
+            # 空きが十分にある
+            await self._remove(container_id)
+
+    async def _reset(self, container_id: str) -> bool:
+        """残ったプロセスを止め、tmpfsを空にし、何も残っていないことを確かめる"""
+        with span("container_reset", histogram=SANDBOX_STAGE_SECONDS):
+            try:
+                result = await self._docker().exec_run(
+                    container_id, ["python", "-c", _RESET_SCRIPT], user="root"
+                )
+            except Exception as e:
+                logger.warning("コンテナ %s の後片付けに失敗しました: %s", container_id, e)
+                return False
+        if result.exit_code == 0:
+            return True
+        output = result.output.decode("utf-8", "replace") if result.output else ""
+        try:
+            leftovers = json.loads(output.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            leftovers = output
+        logger.warning("コンテナ %s に前の実行の状態が残っています: %s", container_id, leftovers)
+        return False
+
+    async def _discard(self, container_id: str, event: str) -> None:
+        SANDBOX_CONTAINER_EVENTS.inc(event=event)
+        await self.shared.call(self.shared.remove_container, container_id)
+        await self._remove(container_id)
+
+    async def _remove(self, container_id: str) -> None:
+        with span("container_cleanup", histogram=SANDBOX_STAGE_SECONDS):
+            try:
+                await self._docker().remove(container_id, force=True)
+            except Exception as e:
+                logger.debug("Failed to remove container %s: %s", container_id, e)
+
+    async def close(self) -> None:
+        """空いているコンテナをすべて削除する（終了時）"""
+        while True:
+            claimed, _ = await self.shared.call(
+                self.shared.claim_container, SANDBOX_CONTAINER_STALE_S
+            )
+            if claimed is None:
+                return
+            await self._discard(claimed[0], "closed")
+
+
+container_pool = ContainerPool(shared_state)
@@ -0,0 +1,241 @@
+# asyncio で使うDocker Engine APIのクライアント
+"""
+サンドボックスの実行に必要な操作（コンテナの作成・起動・exec・強制停止・削除）だけを持つ、
+Docker Engine APIの軽量なクライアント
+
+- Unixソケット（DOCKER_HOST が unix://、既定は /var/run/docker.sock）か tcp:// にHTTPで接続する
+- 接続はhttpxのコネクションプールで使い回す（イベントループごとに1つのクライアント）
+- exec の出力は、Dockerが接続を乗っ取って流すストリームを読み切り、stdout/stderrの多重化を解く
+
+実行ごとにスレッドやdocker-pyのクライアントを作らないため、多数の実行を同時に待てる
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import weakref
+from dataclasses import dataclass
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DOCKER_HOST = os.getenv("DOCKER_HOST", "unix:///var/run/docker.sock")
+# Docker Engine APIのバージョン（docker-py 7.1.0 の既定と同じ）
+DOCKER_API_VERSION = os.getenv("DOCKER_API_VERSION", "1.45")
+# Dockerへの同時接続数の上限（実行中のexecは1本ずつ接続を使う）
+DOCKER_MAX_CONNECTIONS = int(os.getenv("DOCKER_MAX_CONNECTIONS", "256"))
+# exec以外のAPI呼び出しのタイムアウト（秒）
+DOCKER_API_TIMEOUT_S = float(os.getenv("DOCKER_API_TIMEOUT_S", "30"))
+# 出力を読み終えてから exec の終了（Running が false になる）を確かめる間隔（秒）
+DOCKER_EXEC_POLL_S = float(os.getenv("DOCKER_EXEC_POLL_S", "0.05"))
+
+_FRAME_HEADER = struct.Struct(">BxxxL")
+
+
+class DockerAPIError(Exception):
+    """Docker Engine APIがエラーを返した"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class ExecStateError(Exception):
+    """exec の終了コードが分からない（終わらない・終了コードがない）"""
+
+
+@dataclass
+class ExecResult:
+    """docker-py の exec_run と同じく、stdoutとstderrを出力順に結合した出力を持つ"""
+
+    exit_code: int
+    output: bytes
+
+
+def demultiplex(data: bytes) -> bytes:
+    """
+    多重化されたストリーム（8バイトのヘッダー + 本文の繰り返し）から本文だけを取り出す
+    ヘッダーとして読めなければ（TTYの場合など）そのまま返す
+    """
+    chunks = []
+    position = 0
+    while position < len(data):
+        if len(data) - position < _FRAME_HEADER.size:
+            return data
+        stream, size = _FRAME_HEADER.unpack_from(data, position)
+        if stream not in (0, 1, 2):
+            return data
+        position += _FRAME_HEADER.size
+        chunks.append(data[position : position + size])
+        position += size
+    return b"".join(chunks)
+
+
+def _transport_and_url(host: str) -> tuple[httpx.AsyncHTTPTransport, str]:
+    limits = httpx.Limits(
+        max_connections=DOCKER_MAX_CONNECTIONS,
+        max_keepalive_connections=min(DOCKER_MAX_CONNECTIONS, 32),
+    )
+    if host.startswith("unix://"):
+        transport = httpx.AsyncHTTPTransport(uds=host[len("unix://") :], limits=limits)
+        return transport, "http://docker"
+    if host.startswith("tcp://"):
+        return httpx.AsyncHTTPTransport(limits=limits), "http://" + host[len("tcp://") :]
+    raise ValueError(f"Unsupported DOCKER_HOST: {host}")
+
+
+class AsyncDockerClient:
+    """Docker Engine APIの非同期クライアント"""
+
+    def __init__(self, host: str | None = None):
+        transport, base_url = _transport_and_url(host or DOCKER_HOST)
+        self._http = httpx.AsyncClient(
+            transport=transport,
+            base_url=f"{base_url}/v{DOCKER_API_VERSION}",
+            timeout=DOCKER_API_TIMEOUT_S,
+        )
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        response = await self._http.request(method, path, **kwargs)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise DockerAPIError(response.status_code, message)
+        return response
+
+    async def create_container(
+        self,
+        image: str,
+        command: list[str],
+        *,
+        user: str | None = None,
+        labels: dict[str, str] | None = None,
+        network_disabled: bool = False,
+        host_config: dict | None = None,
+    ) -> str:
+        """コンテナを作成してIDを返す（host_config はEngine APIのHostConfigそのまま）"""
+        body = {
+            "Image": image,
+            "Cmd": command,
+            "Labels": labels or {},
+            "NetworkDisabled": network_disabled,
+            "HostConfig": host_config or {},
+        }
+        if user is not None:
+            body["User"] = user
+        response = await self._request("POST", "/containers/create", json=body)
+        return response.json()["Id"]
+
+    async def start(self, container_id: str) -> None:
+        await self._request("POST", f"/containers/{container_id}/start")
+
+    async def inspect(self, container_id: str) -> dict:
+        return (await self._request("GET", f"/containers/{container_id}/json")).json()
+
+    async def exec_run(
+        self,
+        container_id: str,
+        command: list[str],
+        *,
+        user: str | None = None,
+        workdir: str | None = None,
+        environment: dict[str, str] | None = None,
+    ) -> ExecResult:
+        """コンテナ内でコマンドを実行し、終了を待って終了コードと出力を返す"""
+        body = {"Cmd": command, "AttachStdout": True, "AttachStderr": True}
+        if user is not None:
+            body["User"] = user
+        if workdir is not None:
+            body["WorkingDir"] = workdir
+        if environment:
+            body["Env"] = [f"{key}={value}" for key, value in environment.items()]
+        exec_id = (
+            await self._request("POST", f"/containers/{container_id}/exec", json=body)
+        ).json()["Id"]
+
+        # 出力はコマンドの終了まで流れ続けるため、読み取りのタイムアウトは呼び出し元に任せる
+        request = self._http.build_request(
+            "POST",
+            f"/exec/{exec_id}/start",
+            json={"Detach": False, "Tty": False},
+            timeout=httpx.Timeout(DOCKER_API_TIMEOUT_S, read=None),
+        )
+        response = await self._http.send(request, stream=True)
+        try:
+            if response.status_code >= 400:
+                await response.aread()
+                raise DockerAPIError(response.status_code, response.text)
+            raw = b"".join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+
+        return ExecResult(exit_code=await self._exit_code(exec_id), output=demultiplex(raw))
+
+    async def _exit_code(self, exec_id: str) -> int:
+        """
+        exec の終了コードを返す
+        ストリームが閉じた直後はまだ Running で ExitCode が null のことがあるため、終わるまで待つ。
+        null を成功（0）とみなすと、失敗した実行を成功として扱ってしまう
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + DOCKER_API_TIMEOUT_S
+        while True:
+            info = (await self._request("GET", f"/exec/{exec_id}/json")).json()
+            if not info.get("Running"):
+                break
+            if loop.time() >= deadline:
+                raise ExecStateError(f"exec {exec_id} did not finish after its output ended")
+            await asyncio.sleep(DOCKER_EXEC_POLL_S)
+        exit_code = info.get("ExitCode")
+        if exit_code is None:
+            raise ExecStateError(f"exec {exec_id} finished without an exit code")
+        return exit_code
+
+    async def kill(self, container_id: str) -> None:
+        """コンテナを強制停止する（すでに止まっている・存在しない場合は何もしない）"""
+        try:
+            await self._request("POST", f"/containers/{container_id}/kill")
+        except DockerAPIError as e:
+            if e.status not in (404, 409):
+                raise
+
+    async def remove(self, container_id: str, force: bool = True) -> None:
+        """コンテナを削除する（force なら実行中でも止めて削除する）"""
+        try:
+            await self._request(
+                "DELETE",
+                f"/containers/{container_id}",
+                params={"force": "true" if force else "false"},
+            )
+        except DockerAPIError as e:
+            if e.status != 404:
+                raise
+
+    async def close(self) -> None:
+        await self._http.aclose()
+
+
+# httpxの接続はイベントループに結びつくため、ループごとにクライアントを持つ
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncDockerClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_docker_client() -> AsyncDockerClient:
+    """実行中のイベントループで共有するクライアントを返す"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncDockerClient()
+    return client
+
+
+async def close_docker_client() -> None:
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
@@ -0,0 +1,387 @@
+# LLMプロバイダーの切り替え・ヘッジ・フォールバック
+"""
+アドバイス生成に使うLLMプロバイダーを抽象化し、複数のプロバイダーに振り分けるルーター
+
+- LLM_PROVIDERS（カンマ区切り、先頭ほど優先）に並べたプロバイダーを順に使う
+- 最初のリクエストが、そのプロバイダーの直近の遅延の LLM_HEDGE_PERCENTILE を
+  超えても返らなければ、次のプロバイダー（1つだけなら同じプロバイダー）に
+  ヘッジリクエストを送り、先に返った方を使う
+- エラーやタイムアウトの場合は次のプロバイダーにフォールバックする
+- 連続して失敗したプロバイダーは一定時間、優先順位を最後に下げる
+- プロバイダーごとの遅延・エラー率を記録し、/metrics と /admin/llm-providers で公開する
+
+SDKは読み込みが重いため、各プロバイダーの初回呼び出し時にインポートする
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+from services.metrics import LLM_HEDGED_REQUESTS, LLM_REQUEST_SECONDS, LLM_REQUESTS
+from services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 設定を .env からも読めるよう、定数の読み込み前に環境変数を読み込む
+load_dotenv()
+
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "gemini")
+# 1回の呼び出しのタイムアウトと、フォールバックを含めた全体のタイムアウト（秒）
+LLM_REQUEST_TIMEOUT_S = float(os.getenv("LLM_REQUEST_TIMEOUT_S", "30"))
+LLM_TOTAL_TIMEOUT_S = float(os.getenv("LLM_TOTAL_TIMEOUT_S", "60"))
+# ヘッジリクエストを送るまでの待ち時間（直近の遅延の分位点）
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# 分位点を使うのに必要な直近のサンプル数（足りない間はヘッジしない）
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# 遅延・成否を保持する直近の件数
+LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+# 連続でこの回数失敗したら LLM_COOLDOWN_S 秒だけ優先順位を下げる
+LLM_FAILURE_THRESHOLD = int(os.getenv("LLM_FAILURE_THRESHOLD", "3"))
+LLM_COOLDOWN_S = float(os.getenv("LLM_COOLDOWN_S", "30"))
+
+
+class LLMUnavailableError(Exception):
+    """すべてのプロバイダーで生成に失敗した"""
+
+
+class LLMProvider:
+    """プロバイダーの基底クラス"""
+
+    name = "base"
+
+    async def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model: str | None = None, api_key: str | None = None):
+        self.model = model or os.getenv("GEMINI_MODEL", "gemini-2.0-flash-lite")
+        self._api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        self._client = None
+
+    async def generate(self, prompt: str) -> str:
+        if self._client is None:
+            from google import genai
+
+            self._client = genai.Client(api_key=self._api_key)
+        response = await self._client.aio.models.generate_content(
+            model=self.model, contents=prompt
+        )
+        return response.text
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, model: str | None = None, api_key: str | None = None):
+        self.model = model or os.getenv("OPENAI_MODEL", "gpt-4.1-nano")
+        self._api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self._client = None
+
+    async def generate(self, prompt: str) -> str:
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            self._client = AsyncOpenAI(api_key=self._api_key)
+        response = await self._client.responses.create(
+            model=self.model, input=[{"role": "user", "content": prompt}]
+        )
+        return response.output_text
+
+
+class HuggingFaceProvider(LLMProvider):
+    name = "huggingface"
+
+    def __init__(
+        self,
+        model: str | None = None,
+        api_key: str | None = None,
+        inference_provider: str | None = None,
+    ):
+        self.model = model or os.getenv(
+            "HUGGINGFACE_MODEL_ID", "Qwen/Qwen2.5-7B-Instruct"
+        )
+        self._api_key = api_key or os.getenv("HUGGINGFACE_API_KEY")
+        self._inference_provider = inference_provider or os.getenv(
+            "HUGGINGFACE_PROVIDER", "together"
+        )
+        self._client = None
+
+    def _generate_sync(self, prompt: str) -> str:
+        if self._client is None:
+            from huggingface_hub import InferenceClient
+
+            self._client = InferenceClient(
+                provider=self._inference_provider, token=self._api_key
+            )
+        completion = self._client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=1500,
+        )
+        return completion.choices[0].message.content
+
+    async def generate(self, prompt: str) -> str:
+        # 非同期クライアントは追加の依存が必要なため、同期クライアントをスレッドで呼ぶ
+        return await asyncio.to_thread(self._generate_sync, prompt)
+
+
+class StubProvider(LLMProvider):
+    """テスト・負荷試験用のローカルなプロバイダー（遅延と失敗率を指定できる）"""
+
+    def __init__(
+        self,
+        name: str = "stub",
+        latency_ms: float = 50,
+        jitter_ms: float = 0,
+        failure_rate: float = 0.0,
+        response: str = "（スタブ）コードを見直して、期待される出力と比べてみましょう。",
+        seed: int | None = None,
+    ):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.response = response
+        self._rng = random.Random(seed)
+
+    async def generate(self, prompt: str) -> str:
+        delay = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+        await asyncio.sleep(delay / 1000)
+        if self._rng.random() < self.failure_rate:
+            raise RuntimeError(f"{self.name}: simulated failure")
+        return self.response
+
+
+class ProviderStats:
+    """プロバイダーごとの直近の遅延と成否"""
+
+    def __init__(self, window: int = LLM_STATS_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record(self, outcome: str, latency: float):
+        # ヘッジで不要になり取り消した呼び出しは成否に数えない
+        if outcome == "cancelled":
+            return
+        self.outcomes.append(outcome == "success")
+        if outcome == "success":
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= LLM_FAILURE_THRESHOLD:
+                self.cooldown_until = time.monotonic() + LLM_COOLDOWN_S
+
+    def latency_percentile(self, q: float) -> float | None:
+        if len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float | None:
+        if not self.outcomes:
+            return None
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    @property
+    def cooling_down(self) -> bool:
+        return time.monotonic() < self.cooldown_until
+
+
+@dataclass
+class LLMResponse:
+    """生成結果と、それを返したプロバイダー"""
+
+    text: str
+    provider: str
+    latency_ms: float
+    hedged: bool
+
+
+class LLMRouter:
+    """優先順位・ヘッジ・フォールバックに従ってプロバイダーを呼び分ける"""
+
+    def __init__(
+        self,
+        providers: list[LLMProvider],
+        hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+        request_timeout: float = LLM_REQUEST_TIMEOUT_S,
+        total_timeout: float = LLM_TOTAL_TIMEOUT_S,
+    ):
+        if not providers:
+            raise ValueError("At least one LLM provider is required")
+        self.providers = providers
+        self.hedge_percentile = hedge_percentile
+        self.request_timeout = request_timeout
+        self.total_timeout = total_timeout
+        self.stats = {provider.name: ProviderStats() for provider in providers}
+
+    def _ordered_providers(self) -> list[LLMProvider]:
+        # 失敗が続いているプロバイダーは後回しにする（順序は保つ）
+        healthy = [p for p in self.providers if not self.stats[p.name].cooling_down]
+        cooling = [p for p in self.providers if self.stats[p.name].cooling_down]
+        return healthy + cooling
+
+    async def _attempt(self, provider: LLMProvider, prompt: str, hedge: bool) -> str:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("llm_call", provider=provider.name, hedge=hedge):
+                text = await asyncio.wait_for(
+                    provider.generate(prompt), self.request_timeout
+                )
+            outcome = "success"
+            return text
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stats[provider.name].record(outcome, elapsed)
+            LLM_REQUESTS.inc(provider=provider.name, outcome=outcome)
+            LLM_REQUEST_SECONDS.observe(elapsed, provider=provider.name)
+
+    async def generate(self, prompt: str) -> LLMResponse:
+        """
+        優先順位の高いプロバイダーから生成を試み、最初に成功した結果を返す
+        すべて失敗した場合はLLMUnavailableErrorを送出する
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.total_timeout
+        queue = self._ordered_providers()
+        running: dict[asyncio.Task, LLMProvider] = {}
+        errors = []
+        hedged = False
+
+        def launch(provider: LLMProvider, hedge: bool = False):
+            task = asyncio.ensure_future(self._attempt(provider, prompt, hedge))
+            running[task] = provider
+
+        first = queue.pop(0)
+        launch(first)
+        hedge_delay = self.stats[first.name].latency_percentile(self.hedge_percentile)
+        try:
+            while running:
+                timeout = deadline - loop.time()
+                if not hedged and hedge_delay is not None:
+                    timeout = min(timeout, start + hedge_delay - loop.time())
+                if timeout <= 0 and loop.time() >= deadline:
+                    break
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=max(timeout, 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    if loop.time() >= deadline:
+                        break
+                    # 直近の遅延の分位点を超えたのでヘッジリクエストを送る
+                    hedged = True
+                    target = queue.pop(0) if queue else first
+                    LLM_HEDGED_REQUESTS.inc(provider=target.name)
+                    logger.info(
+                        "LLM応答が%.1f秒を超えたため%sにヘッジリクエストを送ります",
+                        hedge_delay,
+                        target.name,
+                    )
+                    launch(target, hedge=True)
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        return LLMResponse(
+                            text=task.result(),
+                            provider=provider.name,
+                            latency_ms=(loop.time() - start) * 1000,
+                            hedged=hedged,
+                        )
+                    errors.append(f"{provider.name}: {type(error).__name__}: {error}")
+                    logger.warning(
+                        "LLMプロバイダー%sの呼び出しに失敗しました: %s: %s",
+                        provider.name,
+                        type(error).__name__,
+                        error,
+                    )
+                # 実行中のリクエストがなくなったら次のプロバイダーにフォールバックする
+                if not running and queue:
+                    hedge_delay = None
+                    launch(queue.pop(0))
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        if not errors:
+            errors.append(f"timed out after {self.total_timeout:.0f}s")
+        raise LLMUnavailableError("; ".join(errors))
+
+    def stats_summary(self) -> list[dict]:
+        """プロバイダーごとの直近の遅延とエラー率"""
+        summary = []
+        for provider in self.providers:
+            stats = self.stats[provider.name]
+            ordered = sorted(stats.latencies)
+
+            def percentile(q):
+                if not ordered:
+                    return None
+                return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+            summary.append(
+                {
+                    "provider": provider.name,
+                    "samples": len(stats.outcomes),
+                    "error_rate": stats.error_rate,
+                    "p50_ms": percentile(0.5),
+                    "p95_ms": percentile(0.95),
+                    "consecutive_failures": stats.consecutive_failures,
+                    "cooling_down": stats.cooling_down,
+                }
+            )
+        return summary
+
+
+def _create_provider(name: str) -> LLMProvider:
+    if name == "gemini":
+        return GeminiProvider()
+    if name == "openai":
+        return OpenAIProvider()
+    if name == "huggingface":
+        return HuggingFaceProvider()
+    if name.startswith("stub"):
+        return StubProvider(
+            name=name,
+            latency_ms=float(os.getenv("LLM_STUB_LATENCY_MS", "50")),
+            jitter_ms=float(os.getenv("LLM_STUB_JITTER_MS", "0")),
+            failure_rate=float(os.getenv("LLM_STUB_FAILURE_RATE", "0")),
+        )
+    raise ValueError(f"Unknown LLM provider: {name}")
+
+
+_router: LLMRouter | None = None
+
+
+def get_llm_router() -> LLMRouter:
+    """LLM_PROVIDERS の設定からルーターを作って返す（初回のみ作成）"""
+    global _router
+    if _router is None:
+        names = [name.strip() for name in LLM_PROVIDERS.split(",") if name.strip()]
+        _router = LLMRouter([_create_provider(name) for name in names])
+    return _router
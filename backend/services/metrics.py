@@ -0,0 +1,293 @@
+# Prometheus形式のメトリクス
+"""
+外部ライブラリに依存しない軽量なメトリクス実装
+
+記録はロック1回と配列の加算だけで済むようにし、
+文字列への変換は /metrics が呼ばれたときにだけ行う。
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# 秒単位のヒストグラムの既定バケット（コンテナ起動やLLM呼び出しの数十秒まで）
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    20.0,
+    30.0,
+    60.0,
+)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labelvalues, extra=None) -> str:
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """増減する現在値"""
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if not values and not self.labelnames:
+            values = {(): 0}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """固定バケットのヒストグラム"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [バケット別件数..., 合計値, 件数]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ブロックの実行時間（秒）を記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        lines = []
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames, key, ("le", _format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+def render_prometheus() -> str:
+    """登録済みの全メトリクスをPrometheusのテキスト形式で出力する"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# 提出処理の各段階の所要時間
+SUBMISSION_STAGE_SECONDS = Histogram(
+    "submission_stage_seconds",
+    "Time spent in each stage of submission processing",
+    labelnames=("stage",),
+)
+# サンドボックス実行の各段階の所要時間
+SANDBOX_STAGE_SECONDS = Histogram(
+    "sandbox_stage_seconds",
+    "Time spent in each stage of a sandbox run",
+    labelnames=("stage",),
+)
+SANDBOX_RUNS_IN_FLIGHT = Gauge(
+    "sandbox_runs_in_flight", "Sandbox runs currently executing"
+)
+SANDBOX_QUEUE_DEPTH = Gauge(
+    "sandbox_executor_queue_depth",
+    "Sandbox runs submitted to the executor but not yet started",
+)
+SUBMISSIONS_TOTAL = Counter(
+    "submissions_total", "Processed submissions by result", labelnames=("result",)
+)
+SUBMISSIONS_CANCELLED = Counter(
+    "submissions_cancelled_total",
+    "Submissions cancelled before completion (client disconnect or superseded)",
+    labelnames=("reason",),
+)
+# 全プロセス共通の実行枠が空くまでの待ち時間
+SHARED_LEASE_WAIT_SECONDS = Histogram(
+    "shared_lease_wait_seconds",
+    "Time spent waiting for a slot shared across API worker processes",
+    labelnames=("pool",),
+)
+# 再利用するサンドボックスコンテナ（created / reused / recycled / reset_failed / discarded）
+SANDBOX_CONTAINER_EVENTS = Counter(
+    "sandbox_container_events_total",
+    "Pooled sandbox container lifecycle events",
+    labelnames=("event",),
+)
+SANDBOX_WORKERS = Gauge(
+    "sandbox_workers", "Registered remote sandbox workers"
+)
+SANDBOX_DISPATCH_RETRIES = Counter(
+    "sandbox_dispatch_retries_total",
+    "Sandbox runs retried on another worker after a worker was lost",
+)
+SANDBOX_RUNS_CANCELLED = Counter(
+    "sandbox_runs_cancelled_total",
+    "Running sandbox containers killed because the caller cancelled",
+)
+# サンドボックスの同時実行数の自動調整
+SANDBOX_CONCURRENCY_LIMIT = Gauge(
+    "sandbox_concurrency_limit",
+    "Current limit on concurrent sandbox runs across API worker processes",
+)
+SANDBOX_AUTOSCALE_DECISIONS = Counter(
+    "sandbox_autoscale_decisions_total",
+    "Concurrency limit decisions by action (increase, decrease, hold) and reason",
+    labelnames=("action", "reason"),
+)
+SANDBOX_HOST_PRESSURE = Gauge(
+    "sandbox_host_pressure",
+    "Host pressure seen by the autoscaler (cpu: load per CPU, memory: used fraction)",
+    labelnames=("resource",),
+)
+# アドバイス生成に送るプロンプトの推定トークン数
+ADVICE_PROMPT_TOKENS = Histogram(
+    "advice_prompt_tokens",
+    "Estimated tokens in advice prompts",
+    buckets=(250, 500, 1000, 2000, 4000, 6000, 8000, 16000, 32000),
+)
+ADVICE_PROMPTS_TRUNCATED = Counter(
+    "advice_prompts_truncated_total",
+    "Advice prompts shortened to fit the token budget",
+)
+# LLMプロバイダーの呼び出し
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_seconds", "LLM call latency by provider", labelnames=("provider",)
+)
+LLM_REQUESTS = Counter(
+    "llm_requests_total",
+    "LLM calls by provider and outcome",
+    labelnames=("provider", "outcome"),
+)
+LLM_HEDGED_REQUESTS = Counter(
+    "llm_hedged_requests_total",
+    "Hedged LLM requests sent after the latency percentile was exceeded",
+    labelnames=("provider",),
+)
+ADVICE_SOURCE = Counter(
+    "advice_source_total",
+    "Advice returned by source (rule-based hints or LLM)",
+    labelnames=("source",),
+)
+REFERENCE_CACHE_REQUESTS = Counter(
+    "reference_cache_requests_total",
+    "Reference run lookups by result (hit, shared in-flight run, or miss)",
+    labelnames=("result",),
+)
@@ -0,0 +1,98 @@
+# 提出処理のステージグラフ
+"""
+依存関係のないステージ（ユーザーコードの実行・正解コードの実行・プロンプト用の問題情報の準備など）を
+同時に実行し、依存するステージは必要な結果がそろった時点で開始する
+
+- 各ステージは期限（deadline_s）付きで実行し、期限を過ぎたらキャンセルする
+- 必須のステージ（required=True）が失敗したら、実行中の他のステージもキャンセルして例外を送出する
+- 任意のステージ（required=False）が失敗・期限切れになった場合は結果をNoneとして続行する
+  （errors を渡すと、どちらだったかをステージ名ごとの例外で受け取れる）
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class StageDeadlineExceeded(TimeoutError):
+    """ステージが期限内に終わらなかった"""
+
+
+@dataclass
+class Stage:
+    """ステージグラフの1ステージ"""
+
+    name: str
+    run: Callable[..., Awaitable[Any]]  # 依存するステージの結果をキーワード引数で受け取る
+    after: tuple[str, ...] = ()  # 依存するステージ
+    deadline_s: float | None = None
+    required: bool = True
+
+
+def _check_graph(stages: list[Stage]) -> None:
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stage names: {names}")
+    # 依存先は自分より前に並んでいる必要がある（循環を防ぐ）
+    seen = set()
+    for stage in stages:
+        missing = [dep for dep in stage.after if dep not in seen]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown or later stages: {missing}")
+        seen.add(stage.name)
+
+
+async def run_stage_graph(
+    stages: list[Stage], histogram=None, errors: dict[str, Exception] | None = None
+) -> dict[str, Any]:
+    """
+    ステージグラフを実行し、ステージ名ごとの結果を返す
+    stages は依存先が先に来る順に並べる
+    errors には、結果がNoneになった任意のステージの例外（期限切れは StageDeadlineExceeded）を入れる
+    """
+    if errors is None:
+        errors = {}
+    _check_graph(stages)
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def run(stage: Stage):
+        inputs = {dep: await tasks[dep] for dep in stage.after}
+        with span(stage.name, histogram=histogram):
+            try:
+                async with asyncio.timeout(stage.deadline_s):
+                    return await stage.run(**inputs)
+            except TimeoutError as e:
+                error = StageDeadlineExceeded(
+                    f"Stage {stage.name} did not finish within {stage.deadline_s} seconds"
+                )
+                if stage.required:
+                    raise error from e
+                logger.warning("%s", error)
+                errors[stage.name] = error
+            except Exception as e:
+                if stage.required:
+                    raise
+                errors[stage.name] = e
+                logger.warning("ステージ %s が失敗しました: %s: %s", stage.name, type(e).__name__, e)
+        return None
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.create_task(run(stage), name=f"stage:{stage.name}")
+    try:
+        done, pending = await asyncio.wait(
+            tasks.values(), return_when=asyncio.FIRST_EXCEPTION
+        )
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        return {name: task.result() for name, task in tasks.items()}
+    finally:
+        # 失敗・キャンセル時は残りのステージを止める
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
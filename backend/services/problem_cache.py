@@ -0,0 +1,148 @@
+# 問題情報のプロセス内キャッシュ
+import hashlib
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+import orjson
+
+from database import ProblemModel
+from models import Problem
+from services.shared_state import SharedState, cross_process_state
+
+
+def _utc(value: datetime) -> datetime:
+    # DBの日時はタイムゾーンなしのUTCで保存されている
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def problem_etag(problem: Problem) -> str:
+    """問題のIDと更新日時から強いETagを作る"""
+    return f'"p{problem.id}-{int(_utc(problem.updated_at).timestamp() * 1_000_000)}"'
+
+
+def problems_etag(problems: list[Problem]) -> str:
+    """問題一覧のETag（各問題のIDと更新日時から計算）"""
+    digest = hashlib.sha1(
+        ",".join(problem_etag(p) for p in problems).encode("utf-8")
+    ).hexdigest()
+    return f'"list-{digest[:20]}"'
+
+
+def http_date(value: datetime) -> str:
+    """Last-Modifiedヘッダー用の日時文字列"""
+    return format_datetime(_utc(value).astimezone(timezone.utc), usegmt=True)
+
+
+@dataclass(frozen=True)
+class CachedProblems:
+    """キャッシュの1エントリ（問題、ETag、シリアライズ済みのJSON本文）"""
+
+    value: Problem | list[Problem]
+    etag: str
+    body: bytes
+    last_modified: datetime | None
+
+
+def _serialize(value: Problem | list[Problem]) -> bytes:
+    if isinstance(value, list):
+        return orjson.dumps([p.model_dump() for p in value])
+    return orjson.dumps(value.model_dump())
+
+
+class ProblemCache:
+    """
+    問題をプロセス内に保持するキャッシュ
+    問題の作成・更新・削除時にinvalidate()で破棄する
+
+    shared を渡すと、別のワーカープロセスでの破棄も共有の世代番号で検知して破棄する。
+    世代番号は問題ごと（problem:{id}）と一覧（problems）に分け、更新された問題のエントリだけを読み直す
+    """
+
+    def __init__(self, shared: SharedState | None = None):
+        self._lock = threading.Lock()
+        # 問題ID -> (読み込み前に確認した共有の世代番号, エントリ)
+        self._problems: dict[int, tuple[tuple | None, CachedProblems]] = {}
+        self._all: tuple[tuple | None, CachedProblems] | None = None
+        # DB読み込み中に破棄された古い値を保存しないための世代番号
+        self._generation = 0
+        self.shared = shared
+
+    async def _stamp(self, name: str) -> tuple | None:
+        """エントリが最新かを判断する共有の世代番号（全体の破棄と name の組）"""
+        if self.shared is None:
+            return None
+        return await self.shared.call(self.shared.generations, "problems:all", name)
+
+    async def get(self, db, problem_id: int) -> CachedProblems | None:
+        """問題のエントリを返す（存在しなければNone）"""
+        stamp = await self._stamp(f"problem:{problem_id}")
+        with self._lock:
+            cached = self._problems.get(problem_id)
+            generation = self._generation
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        row = db.get(ProblemModel, problem_id)
+        if row is None:
+            return None
+        entry = self._problem_entry(Problem.model_validate(row))
+        with self._lock:
+            if generation == self._generation:
+                self._problems[problem_id] = (stamp, entry)
+        return entry
+
+    async def list(self, db) -> CachedProblems:
+        """全問題のエントリを返す"""
+        stamp = await self._stamp("problems")
+        with self._lock:
+            cached = self._all
+            generation = self._generation
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        problems = [
+            Problem.model_validate(row)
+            for row in db.query(ProblemModel).order_by(ProblemModel.id).all()
+        ]
+        entry = CachedProblems(
+            value=problems,
+            etag=problems_etag(problems),
+            body=_serialize(problems),
+            last_modified=max((p.updated_at for p in problems), default=None),
+        )
+        with self._lock:
+            if generation == self._generation:
+                self._all = (stamp, entry)
+        return entry
+
+    @staticmethod
+    def _problem_entry(problem: Problem) -> CachedProblems:
+        return CachedProblems(
+            value=problem,
+            etag=problem_etag(problem),
+            body=_serialize(problem),
+            last_modified=problem.updated_at,
+        )
+
+    async def invalidate(self, problem_id: int | None = None):
+        """指定した問題（省略時は全問題）と一覧のキャッシュを破棄する"""
+        with self._lock:
+            self._generation += 1
+            if problem_id is None:
+                self._problems.clear()
+            else:
+                self._problems.pop(problem_id, None)
+            self._all = None
+        if self.shared is not None:
+            # 他のプロセスは読み込み前に世代番号を確認し、変わったエントリだけを読み直す
+            await self.shared.call(
+                self.shared.bump_generation,
+                "problems:all" if problem_id is None else f"problem:{problem_id}",
+            )
+            await self.shared.call(self.shared.bump_generation, "problems")
+
+
+# アプリ全体で共有するキャッシュ
+problem_cache = ProblemCache(shared=cross_process_state)
@@ -0,0 +1,151 @@
+# 問題のバージョン（変更しないスナップショット）
+"""
+問題を作成・更新するたびに、判定とアドバイスに使う内容（問題文・正解コード・テスト入力・比較モード）を
+problem_versions に変更しない行として残し、提出には判定に使ったバージョン番号を記録する
+
+- 内容のハッシュ（version_hash）が現在のバージョンと同じなら、新しいバージョンは作らない
+- 問題の内容から計算する値（変換した正解コード・プロンプト用の問題情報・アドバイス）は
+  version_hash を含むキーでキャッシュする。更新された問題の分だけが使われなくなり、LRUで押し出される
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+import orjson
+from sqlalchemy import func
+
+from database import ProblemModel, ProblemVersionModel
+
+# バージョンとして残す問題の項目
+VERSIONED_FIELDS = (
+    "title",
+    "description",
+    "correct_code",
+    "test_input",
+    "comparator",
+    "comparator_options",
+    "checker_code",
+)
+
+# バージョンごとにキャッシュする値の上限
+VERSION_CACHE_SIZE = int(os.getenv("VERSION_CACHE_SIZE", "256"))
+# 同じ問題のバージョン・同じ提出内容へのLLMのアドバイスを使い回す件数（0で使い回さない）
+ADVICE_CACHE_SIZE = int(os.getenv("ADVICE_CACHE_SIZE", "1024"))
+
+
+def version_fields(problem) -> dict:
+    """問題（DBの行・Pydanticモデル）からバージョンに残す項目を取り出す"""
+    fields = {name: getattr(problem, name) for name in VERSIONED_FIELDS}
+    # 比較モードの列を追加する前に作られた問題（NULL）は exact として扱う
+    fields["comparator"] = fields["comparator"] or "exact"
+    return fields
+
+
+def version_hash(fields: dict) -> str:
+    """バージョンの内容のハッシュ（項目の順序によらない）"""
+    return hashlib.sha256(orjson.dumps(fields, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def record_version(db, problem: ProblemModel) -> ProblemVersionModel | None:
+    """
+    問題の現在の内容をバージョンとして追加し、問題の version / version_hash を更新する
+    内容が現在のバージョンと同じなら何もしない（問題のIDが決まっている必要がある）
+    """
+    fields = version_fields(problem)
+    digest = version_hash(fields)
+    if problem.version is not None and problem.version_hash == digest:
+        return None
+    # 問題のIDは再利用されない（problems は AUTOINCREMENT）ため、その問題のバージョンだけを数える
+    latest = (
+        db.query(func.max(ProblemVersionModel.version))
+        .filter(ProblemVersionModel.problem_id == problem.id)
+        .scalar()
+    )
+    row = ProblemVersionModel(
+        problem_id=problem.id,
+        version=(latest or 0) + 1,
+        version_hash=digest,
+        created_at=datetime.now(timezone.utc),
+        **fields,
+    )
+    db.add(row)
+    problem.version = row.version
+    problem.version_hash = digest
+    return row
+
+
+def backfill_problem_versions(session) -> int:
+    """バージョン導入前の問題に最初のバージョンを作る（既存の提出のバージョンは不明のまま）"""
+    problems = session.query(ProblemModel).filter(ProblemModel.version.is_(None)).all()
+    for problem in problems:
+        record_version(session, problem)
+    if problems:
+        session.commit()
+    return len(problems)
+
+
+class VersionedCache:
+    """
+    問題のバージョンごとに計算した値を保持するLRU
+    キーに version_hash を含めるため、問題を更新しても明示的に破棄する必要はない
+    """
+
+    def __init__(self, maxsize: int = VERSION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._values: OrderedDict[tuple[str, str], Any] = OrderedDict()
+
+    def get(self, version: str | None, key: str = "") -> Any | None:
+        # バージョンのない問題（作成途中など）の値は保持しない
+        if version is None:
+            return None
+        with self._lock:
+            value = self._values.get((version, key))
+            if value is not None:
+                self._values.move_to_end((version, key))
+            return value
+
+    def put(self, version: str | None, key: str, value: Any) -> None:
+        if version is None or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._values[(version, key)] = value
+            self._values.move_to_end((version, key))
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def get_or_compute(self, version: str | None, compute: Callable[[], Any], key: str = "") -> Any:
+        value = self.get(version, key)
+        if value is None:
+            value = compute()
+            self.put(version, key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+def advice_key(
+    user_code: str,
+    stdout: str | None,
+    stderr: str | None,
+    is_correct: bool,
+    reference_stdout: str | None,
+) -> str:
+    """アドバイスの入力のうち提出ごとに変わる部分のハッシュ"""
+    return hashlib.sha256(
+        orjson.dumps([user_code, stdout, stderr, is_correct, reference_stdout])
+    ).hexdigest()
+
+
+# 正解コードをPythonコードに変換した結果（ノートブック形式の正解コード）
+correct_code_cache = VersionedCache()
+# プロンプト用の問題情報（prepare_problem_context の結果）
+problem_context_cache = VersionedCache()
+# LLMで生成したアドバイス
+advice_cache = VersionedCache(ADVICE_CACHE_SIZE)
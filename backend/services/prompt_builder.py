@@ -0,0 +1,342 @@
+# アドバイス生成用プロンプトの組み立て
+"""
+トークン数の上限（PROMPT_TOKEN_BUDGET）に収まるようにプロンプトを組み立てる
+
+- 出力は先頭と末尾だけを残し、正解コードの出力と最初に食い違う行を添える
+- 標準エラーはトレースバックの最後のフレームと例外の行にまとめる
+- ノートブックはコードセルだけにし、マジックコマンドやpip行などを取り除く
+- 上限を超える場合は、各セクションに重みに応じて予算を配り、
+  小さいセクションで余った分は他のセクションに回す
+
+トークン数は英数字4文字で1トークン、日本語などは1文字1トークンとして概算する
+（APIを呼ばずに高速に見積もるための近似）
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+
+from services.comparators import common_prefix_length
+from services.sandbox_service import notebook_to_python, remove_pip_install_lines
+
+# プロンプト全体のトークン数の上限
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+# 予算が足りないときの各セクションの重み
+SECTION_WEIGHTS = {
+    "problem_description": 2,
+    "user_code": 4,
+    "stdout": 2,
+    "stderr": 1,
+    "correct_code": 3,
+}
+
+_NOTEBOOK_BOILERPLATE = re.compile(
+    r"^\s*(?:[%!].*|# In\[[^\]]*\]:?\s*|get_ipython\(\).*)$", re.MULTILINE
+)
+_BLANK_LINES = re.compile(r"\n{3,}")
+_TRACEBACK_FRAME = re.compile(r'^\s*File "[^"]*", line \d+.*$', re.MULTILINE)
+
+
+def estimate_tokens(text: str | None) -> int:
+    """トークン数を概算する"""
+    if not text:
+        return 0
+    if text.isascii():
+        return (len(text) + 3) // 4
+    ascii_count = len(text.encode("ascii", "ignore"))
+    return (ascii_count + 3) // 4 + len(text) - ascii_count
+
+
+def _take_head(text: str, max_tokens: int) -> str:
+    chunk = text[: max_tokens * 4]
+    if estimate_tokens(chunk) > max_tokens:
+        chunk = text[:max_tokens]
+    # 行の途中で切れる場合は、なるべく行の区切りで切る
+    cut = chunk.rfind("\n")
+    if len(chunk) < len(text) and cut > len(chunk) // 2:
+        chunk = chunk[:cut]
+    return chunk
+
+
+def _take_tail(text: str, max_tokens: int) -> str:
+    chunk = text[-max_tokens * 4 :] if max_tokens > 0 else ""
+    if estimate_tokens(chunk) > max_tokens:
+        chunk = text[-max_tokens:] if max_tokens > 0 else ""
+    cut = chunk.find("\n")
+    if len(chunk) < len(text) and 0 <= cut < len(chunk) // 2:
+        chunk = chunk[cut + 1 :]
+    return chunk
+
+
+def truncate_middle(text: str, max_tokens: int) -> str:
+    """先頭と末尾を残して中間を省略し、max_tokens 程度に収める"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 省略の目印の分を差し引いて前後に半分ずつ配る
+    half = max(0, (max_tokens - 20) // 2)
+    head = _take_head(text, half)
+    tail = _take_tail(text, half)
+    omitted_lines = text.count("\n") - head.count("\n") - tail.count("\n")
+    omitted_chars = len(text) - len(head) - len(tail)
+    return (
+        f"{head}\n... （中略: 約{max(omitted_lines, 0)}行・{omitted_chars}文字） ...\n"
+        f"{tail}"
+    )
+
+
+def _line_at(text: str, start: int) -> str | None:
+    # 前後の空白を除いた文字列は改行で終わらないので、末尾の位置に行はない
+    if start >= len(text):
+        return None
+    end = text.find("\n", start)
+    return text[start:] if end < 0 else text[start:end]
+
+
+def first_mismatch(
+    actual: str | None, expected: str | None
+) -> tuple[int, str | None, str | None] | None:
+    """
+    前後の空白を除いた出力を行ごとに比べ、最初に食い違う行を返す
+    (行番号, 期待される行, 実際の行)。行が足りない側はNone。一致すればNone
+    """
+    a = (actual or "").strip()
+    e = (expected or "").strip()
+    if a == e:
+        return None
+    prefix = common_prefix_length(a, e)
+    line_start = a.rfind("\n", 0, prefix) + 1
+    number = a.count("\n", 0, prefix) + 1
+    actual_line = _line_at(a, line_start)
+    expected_line = _line_at(e, line_start)
+    if actual_line == expected_line:
+        # 一方がもう一方の先頭部分と一致する場合は、次の行で食い違う
+        line_start += len(actual_line) + 1
+        number += 1
+        actual_line = _line_at(a, line_start)
+        expected_line = _line_at(e, line_start)
+    return number, expected_line, actual_line
+
+
+def summarize_traceback(stderr: str | None) -> str:
+    """トレースバックを最後のフレームと例外の行にまとめる"""
+    if not stderr:
+        return ""
+    text = stderr.strip()
+    frames = list(_TRACEBACK_FRAME.finditer(text))
+    if not frames:
+        return text
+    last = frames[-1]
+    tail = text[last.start() :].strip("\n")
+    if len(frames) > 1:
+        return (
+            f"Traceback (most recent call last):\n"
+            f"  ...（{len(frames) - 1}個のフレームを省略）...\n{tail}"
+        )
+    return f"Traceback (most recent call last):\n{tail}"
+
+
+def strip_notebook_boilerplate(code: str) -> str:
+    """ノートブック形式ならコードセルを取り出し、マジックコマンドやpip行を除く"""
+    if code.strip().startswith(("{", "<")):
+        try:
+            code = notebook_to_python(code)
+        except Exception:
+            return code
+    code = remove_pip_install_lines(code)
+    code = _NOTEBOOK_BOILERPLATE.sub("", code)
+    return _BLANK_LINES.sub("\n\n", code).strip()
+
+
+def _summarize_stdout(stdout: str | None, reference_stdout: str | None) -> str:
+    if not stdout:
+        return "なし"
+    summary = stdout
+    if reference_stdout is not None:
+        mismatch = first_mismatch(stdout, reference_stdout)
+        if mismatch is not None:
+            number, expected, actual = mismatch
+            summary = (
+                f"（{number}行目が期待される出力と異なります: "
+                f"期待={expected!r} 実際={actual!r}）\n{stdout}"
+            )
+    return summary
+
+
+def _allocate(sizes: dict[str, int], budget: int) -> dict[str, int]:
+    """セクションごとの予算を重みに応じて配る（小さいセクションの余りは再配分）"""
+    allocation = {}
+    remaining = dict(sizes)
+    while remaining:
+        total_weight = sum(SECTION_WEIGHTS[name] for name in remaining)
+        fits = {
+            name: size
+            for name, size in remaining.items()
+            if size <= budget * SECTION_WEIGHTS[name] / total_weight
+        }
+        if not fits:
+            for name in remaining:
+                allocation[name] = int(budget * SECTION_WEIGHTS[name] / total_weight)
+            break
+        for name, size in fits.items():
+            allocation[name] = size
+            budget -= size
+            del remaining[name]
+    return allocation
+
+
+@dataclass
+class ProblemContext:
+    """提出内容に依存しない、プロンプト用の問題情報（提出コードの実行中に準備しておく）"""
+
+    problem_title: str
+    problem_description: str
+    correct_code: str | None  # ノートブックの定型部分を除いた正解コード
+
+
+def prepare_problem_context(
+    problem_title: str, problem_description: str, correct_code: str | None
+) -> ProblemContext:
+    """正解コードのノートブック変換など、問題側の前処理をする"""
+    return ProblemContext(
+        problem_title=problem_title,
+        problem_description=problem_description or "",
+        correct_code=strip_notebook_boilerplate(correct_code) if correct_code else None,
+    )
+
+
+@dataclass
+class AdvicePrompt:
+    """組み立てたプロンプトと、そのトークン数の内訳"""
+
+    text: str
+    tokens: int
+    truncated: bool
+    section_tokens: dict[str, int] = field(default_factory=dict)
+
+
+_TEMPLATE = """
+【判定結果】
+{verdict}
+
+あなたは、Pythonプログラミングを学ぶ初学者をサポートする親切なAIアシスタントです。
+以下の情報に基づいて、学習者が自分で間違いに気づき、解決できるようになるためのヒントやアドバイスを生成してください。
+
+【重要】
+- **絶対にコードの正解そのものを直接教えてはいけません。**
+- 指摘は具体的かつ建設的に行い、学習者のモチベーションを維持するよう努めてください。
+- 難しい専門用語は避け、分かりやすい言葉で説明してください。
+- アドバイスは日本語でお願いします。
+{correct_hint}
+
+【課題情報】
+タイトル: {problem_title}
+問題文:
+{problem_description}
+
+【学習者の提出コード】
+```python
+{user_code}
+```
+
+【コードの実行結果】
+標準出力:
+{stdout}
+標準エラー:
+{stderr}
+
+【アドバイスのポイント】
+1.  **エラーがある場合:**
+    - 上記の標準エラーのメッセージが何を意味するのか、考えられる原因は何かを優しく説明してください。
+    - エラーが発生している箇所を特定するためのデバッグ方法（例: print文の挿入箇所など）を提案してください。
+2.  **エラーがないが期待通りに動作しない場合 (または改善点がある場合):**
+    - コードのロジックで改善できる点や、より効率的な書き方があれば示唆してください。
+    - 変数名やコメントの付け方など、読みやすいコードにするための一般的なアドバイスも適宜含めてください。
+    - (もし正解コードが提供されていれば、それを直接見せるのではなく、学習者のコードとの違いからヒントを得られるような問いかけをしてください)
+3.  **よくある間違いの指摘:**
+    - 初学者が陥りやすい間違いのパターンに合致する場合は、それとなく教えてあげてください。
+      (例: for文の範囲、インデックスエラー、無限ループの可能性など)
+
+"""
+
+_CORRECT_CODE_SECTION = """【参考：正解コード】
+```python
+{correct_code}
+```
+
+"""
+
+_TEMPLATE_SECTIONS = ("problem_description", "user_code", "stdout", "stderr")
+
+_CLOSING = "上記を踏まえて、学習者へのアドバイスを生成してください。"
+
+
+def build_advice_prompt(
+    problem_title: str,
+    problem_description: str,
+    user_code: str,
+    execution_stdout: str | None,
+    execution_stderr: str | None,
+    correct_code: str | None = None,
+    is_correct: bool = False,
+    reference_stdout: str | None = None,
+    token_budget: int = PROMPT_TOKEN_BUDGET,
+    problem_context: ProblemContext | None = None,
+) -> AdvicePrompt:
+    """
+    トークン数の上限に収まるようにアドバイス生成用のプロンプトを組み立てる
+    problem_context を渡すと、問題側の前処理を省く
+    """
+    if problem_context is None:
+        problem_context = prepare_problem_context(
+            problem_title, problem_description, correct_code
+        )
+    problem_title = problem_context.problem_title
+    correct_code = problem_context.correct_code
+    sections = {
+        "problem_description": problem_context.problem_description,
+        "user_code": strip_notebook_boilerplate(user_code or ""),
+        "stdout": _summarize_stdout(execution_stdout, reference_stdout),
+        "stderr": summarize_traceback(execution_stderr) or "なし",
+    }
+    if correct_code:
+        sections["correct_code"] = correct_code
+
+    fixed_parts = {
+        "verdict": "正解です！素晴らしい！" if is_correct else "不正解です。",
+        "correct_hint": (
+            "- 正解の場合は、コードの改善点や別の解き方などを提案してください。"
+            if is_correct
+            else ""
+        ),
+        "problem_title": problem_title,
+    }
+    fixed_tokens = estimate_tokens(
+        _TEMPLATE.format(**fixed_parts, **dict.fromkeys(_TEMPLATE_SECTIONS, ""))
+        + (_CORRECT_CODE_SECTION.format(correct_code="") if correct_code else "")
+        + _CLOSING
+    )
+    sizes = {name: estimate_tokens(text) for name, text in sections.items()}
+    available = max(token_budget - fixed_tokens, 0)
+    truncated = sum(sizes.values()) > available
+    if truncated:
+        allocation = _allocate(sizes, available)
+        sections = {
+            name: truncate_middle(text, allocation[name])
+            for name, text in sections.items()
+        }
+
+    correct_code_text = sections.pop("correct_code", None)
+    text = _TEMPLATE.format(**fixed_parts, **sections)
+    if correct_code_text:
+        text += _CORRECT_CODE_SECTION.format(correct_code=correct_code_text)
+    text += _CLOSING
+    section_tokens = {name: estimate_tokens(value) for name, value in sections.items()}
+    if correct_code_text:
+        section_tokens["correct_code"] = estimate_tokens(correct_code_text)
+    return AdvicePrompt(
+        text=text,
+        tokens=estimate_tokens(text),
+        truncated=truncated,
+        section_tokens=section_tokens,
+    )
@@ -0,0 +1,142 @@
+# 正解コードの実行結果のキャッシュ
+"""
+正解コードの出力は問題の正解コードとテスト入力だけで決まるため、
+内容のハッシュをキーにしてプロセス内に保持し、提出のたびに再実行しない
+
+同じ問題の提出が同時に来た場合は、実行中の1回の結果を共有する
+正常終了した結果だけをキャッシュし、失敗は次の提出で再実行する
+
+shared を渡すと、結果をワーカープロセス間でも共有し（SharedStateのcache）、
+別のプロセスが実行中の場合はその結果を待つ
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import orjson
+
+from services.metrics import REFERENCE_CACHE_REQUESTS
+from services.sandbox_service import CodeExecutionResult
+from services.shared_state import SharedState, cross_process_state
+
+logger = logging.getLogger(__name__)
+
+# キャッシュする問題数の上限
+REFERENCE_CACHE_SIZE = int(os.getenv("REFERENCE_CACHE_SIZE", "256"))
+# 別のプロセスが実行中の結果を待つ間の確認間隔（秒）
+REFERENCE_SHARED_POLL_S = float(os.getenv("REFERENCE_SHARED_POLL_S", "0.05"))
+# 実行中の印を残して落ちたプロセスの分を諦めるまでの秒数
+REFERENCE_RUN_LEASE_TTL_S = float(os.getenv("REFERENCE_RUN_LEASE_TTL_S", "120"))
+
+_NAMESPACE = "reference"
+
+
+def reference_key(correct_code: str, test_input: str | None) -> str:
+    """正解コードとテスト入力から作るキャッシュのキー"""
+    digest = hashlib.sha256()
+    digest.update(correct_code.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update((test_input or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ReferenceCache:
+    """正解コードの実行結果をLRUで保持し、実行中の結果は共有する"""
+
+    def __init__(
+        self, maxsize: int = REFERENCE_CACHE_SIZE, shared: SharedState | None = None
+    ):
+        self.maxsize = maxsize
+        self.shared = shared
+        self._results: OrderedDict[str, CodeExecutionResult] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    async def get_or_run(
+        self, key: str, run: Callable[[], Awaitable[CodeExecutionResult]]
+    ) -> CodeExecutionResult:
+        """キャッシュにあれば返し、なければ run() で実行する"""
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+            REFERENCE_CACHE_REQUESTS.inc(result="hit")
+            return result
+
+        task = self._inflight.get(key)
+        if task is not None:
+            REFERENCE_CACHE_REQUESTS.inc(result="shared")
+        else:
+            task = asyncio.create_task(self._run_once(key, run))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        # 待っている提出の1つがキャンセルされても、共有している実行は続ける
+        return await asyncio.shield(task)
+
+    async def _run_once(
+        self, key: str, run: Callable[[], Awaitable[CodeExecutionResult]]
+    ) -> CodeExecutionResult:
+        """全プロセスで1回だけ実行する（sharedがなければこのプロセスで実行する）"""
+        if self.shared is None:
+            REFERENCE_CACHE_REQUESTS.inc(result="miss")
+            return await run()
+
+        waited = False
+        while True:
+            cached = await self.shared.call(self.shared.cache_get, _NAMESPACE, key)
+            if cached is not None:
+                REFERENCE_CACHE_REQUESTS.inc(result="shared" if waited else "hit")
+                return CodeExecutionResult(**orjson.loads(cached))
+            # 同じキーの実行枠を1つだけにして、別のプロセスと同時に実行しない
+            lease_id = await self.shared.call(
+                self.shared.try_acquire_lease,
+                f"{_NAMESPACE}:{key}",
+                1,
+                REFERENCE_RUN_LEASE_TTL_S,
+            )
+            if lease_id is not None:
+                break
+            waited = True
+            await asyncio.sleep(REFERENCE_SHARED_POLL_S)
+
+        try:
+            # 確認してから枠を取るまでの間に、別のプロセスが実行を終えて枠を返していることがある
+            cached = await self.shared.call(self.shared.cache_get, _NAMESPACE, key)
+            if cached is not None:
+                REFERENCE_CACHE_REQUESTS.inc(result="shared")
+                return CodeExecutionResult(**orjson.loads(cached))
+            REFERENCE_CACHE_REQUESTS.inc(result="miss")
+            result = await run()
+            if result.exit_code == 0:
+                await self.shared.call(
+                    self.shared.cache_put,
+                    _NAMESPACE,
+                    key,
+                    orjson.dumps(result.model_dump()),
+                    self.maxsize,
+                )
+            return result
+        finally:
+            await self.shared.call(self.shared.release_lease, lease_id)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        if result.exit_code != 0:
+            return
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    async def clear(self) -> None:
+        self._results.clear()
+        if self.shared is not None:
+            await self.shared.call(self.shared.cache_clear, _NAMESPACE)
+
+
+reference_cache = ReferenceCache(shared=cross_process_state)
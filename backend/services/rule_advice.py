@@ -0,0 +1,305 @@
+# よくあるエラーに対するルールベースのアドバイス
+"""
+トレースバックからエラーの種類・行番号・原因となった名前などを取り出し、
+初学者によくあるエラーには定型の日本語ヒントをすぐに返す
+
+確信を持って説明できるエラー（メッセージの形が決まっているもの）だけに答え、
+それ以外はNoneを返してLLMによるアドバイス生成に任せる
+"""
+
+import builtins
+import difflib
+import keyword
+import re
+from dataclasses import dataclass
+
+_FRAME = re.compile(r'^\s*File "(?P<file>[^"]*)", line (?P<line>\d+)', re.MULTILINE)
+_EXCEPTION_LINE = re.compile(
+    r"^(?P<type>[A-Za-z_][\w.]*(?:Error|Exception|Interrupt|Exit))(?::\s?(?P<message>.*))?$",
+    re.MULTILINE,
+)
+_IDENTIFIER = re.compile(r"\b[A-Za-z_]\w*\b")
+
+# 初学者がよく書き間違える名前と、意図していそうな名前
+_COMMON_TYPOS = {
+    "Print": "print",
+    "Input": "input",
+    "true": "True",
+    "false": "False",
+    "null": "None",
+    "none": "None",
+    "Int": "int",
+    "Str": "str",
+    "lenght": "len",
+    "rnage": "range",
+}
+
+
+@dataclass
+class ParsedError:
+    """トレースバックから取り出した情報"""
+
+    error_type: str
+    message: str
+    line: int | None
+    code_line: str | None
+
+
+@dataclass
+class RuleAdvice:
+    """ルールで生成したアドバイス"""
+
+    text: str
+    rule: str
+    error_type: str
+    line: int | None
+
+
+def parse_traceback(
+    stderr: str, code: str | None = None, line_offset: int = 0
+) -> ParsedError | None:
+    """
+    標準エラーから最後の例外と、ユーザーコード内で最後に実行された行を取り出す
+    line_offset はサンドボックスがコードの前に追加した行数
+    """
+    if not stderr:
+        return None
+    exceptions = list(_EXCEPTION_LINE.finditer(stderr))
+    if not exceptions:
+        return None
+    last = exceptions[-1]
+    error_type = last.group("type").rsplit(".", 1)[-1]
+    message = (last.group("message") or "").strip()
+
+    line = None
+    for frame in _FRAME.finditer(stderr[: last.start()]):
+        # 実行したコードは "<string>" として現れる
+        if frame.group("file") == "<string>":
+            line = int(frame.group("line")) - line_offset
+    if line is not None and line < 1:
+        line = None
+
+    code_line = None
+    if line is not None and code:
+        lines = code.splitlines()
+        if line <= len(lines):
+            code_line = lines[line - 1].strip() or None
+    return ParsedError(error_type, message, line, code_line)
+
+
+def _where(parsed: ParsedError) -> str:
+    if parsed.line is None:
+        return ""
+    if parsed.code_line:
+        return f"{parsed.line}行目（`{parsed.code_line}`）"
+    return f"{parsed.line}行目"
+
+
+def _similar_name(name: str, code: str | None) -> str | None:
+    if name in _COMMON_TYPOS:
+        return _COMMON_TYPOS[name]
+    candidates = set(dir(builtins)) | set(keyword.kwlist)
+    if code:
+        candidates |= set(_IDENTIFIER.findall(code))
+    candidates.discard(name)
+    matches = difflib.get_close_matches(name, candidates, n=1, cutoff=0.8)
+    return matches[0] if matches else None
+
+
+def _quoted(message: str) -> str | None:
+    match = re.search(r"'([^']*)'", message)
+    return match.group(1) if match else None
+
+
+def _name_error(parsed: ParsedError, code: str | None) -> tuple[str, str] | None:
+    name = _quoted(parsed.message)
+    if name is None or "is not defined" not in parsed.message:
+        return None
+    similar = _similar_name(name, code)
+    if similar:
+        hint = f"`{similar}` と書くつもりではありませんか？ 大文字・小文字やつづりを確認してみましょう。"
+    else:
+        hint = (
+            "その名前の変数や関数を使う前に、値を代入（定義）しているか確認しましょう。"
+            "文字列のつもりなら、引用符（' または \"）で囲む必要があります。"
+        )
+    return "name_error", f"`{name}` という名前が定義されていません。{hint}"
+
+
+def _syntax_error(parsed: ParsedError, code: str | None) -> tuple[str, str] | None:
+    message = parsed.message
+    if parsed.error_type == "IndentationError" or "indent" in message:
+        if "expected an indented block" in message:
+            return "indentation_expected", (
+                "`:` で終わる行（if・for・def など）の次の行は、字下げ（インデント）が必要です。"
+            )
+        if "unexpected indent" in message:
+            return "indentation_unexpected", (
+                "必要のない場所で字下げされています。前の行と字下げをそろえましょう。"
+            )
+        if "unindent does not match" in message:
+            return "indentation_mismatch", (
+                "字下げの深さが前のブロックとそろっていません。"
+                "スペースの数をそろえ、タブとスペースを混ぜないようにしましょう。"
+            )
+        return None
+    if "expected ':'" in message:
+        return "missing_colon", (
+            "if・for・while・def などの行の最後に `:`（コロン）が必要です。"
+        )
+    if "was never closed" in message or "unexpected EOF" in message:
+        return "unclosed_bracket", (
+            "開いた括弧 `(` `[` `{` が閉じられていません。対応する閉じ括弧があるか確認しましょう。"
+        )
+    if "does not match opening parenthesis" in message or "unmatched" in message:
+        return "mismatched_bracket", (
+            "括弧の対応が合っていません。開き括弧と閉じ括弧の種類と数を確認しましょう。"
+        )
+    if "unterminated string literal" in message or "EOL while scanning" in message:
+        return "unterminated_string", (
+            "文字列の引用符が閉じられていません。始めと終わりに同じ引用符があるか確認しましょう。"
+        )
+    if "invalid character" in message or "invalid non-printable" in message:
+        return "invalid_character", (
+            "全角の文字（括弧・コロン・スペースなど）が含まれています。"
+            "コードの記号は半角で入力しましょう。"
+        )
+    if "Perhaps you forgot a comma" in message:
+        return "missing_comma", "値と値の間にカンマ `,` が抜けていないか確認しましょう。"
+    if "Maybe you meant '=='" in message:
+        return "assignment_in_condition", (
+            "条件式で等しいかを調べるときは `=` ではなく `==` を使います。"
+        )
+    return None
+
+
+def _type_error(parsed: ParsedError, code: str | None) -> tuple[str, str] | None:
+    message = parsed.message
+    if "can only concatenate str" in message or (
+        "unsupported operand type" in message and "'str'" in message
+    ):
+        return "str_number_mix", (
+            "文字列と数値をそのまま組み合わせて計算・連結しようとしています。"
+            "`input()` の戻り値は文字列なので、数値として使うなら `int()` などで変換しましょう。"
+            "数値を文字列に連結するなら `str()` や f文字列を使います。"
+        )
+    if "object is not callable" in message:
+        return "not_callable", (
+            f"関数ではないもの（{_quoted(message) or '値'}）を `()` を付けて呼び出しています。"
+            "組み込み関数と同じ名前（list・sum・max など）を変数名に使っていないか確認しましょう。"
+        )
+    if "object is not subscriptable" in message:
+        return "not_subscriptable", (
+            f"{_quoted(message) or 'この値'} 型の値に `[]` でアクセスしています。"
+            "リストや文字列のつもりの変数に、別の種類の値が入っていないか確認しましょう。"
+        )
+    if "missing" in message and "required positional argument" in message:
+        return "missing_argument", (
+            "関数を呼び出すときの引数が足りません。関数の定義と呼び出しで引数の数をそろえましょう。"
+        )
+    return None
+
+
+def _value_error(parsed: ParsedError, code: str | None) -> tuple[str, str] | None:
+    message = parsed.message
+    if "invalid literal for int()" in message or "could not convert string to float" in message:
+        value = message.rsplit(":", 1)[-1].strip()
+        return "invalid_number", (
+            f"数値に変換できない文字列 {value} を変換しようとしています。"
+            "入力の形式（空白区切りか、1行に1つか）と、`split()` で分けているかを確認しましょう。"
+        )
+    if "not enough values to unpack" in message or "too many values to unpack" in message:
+        return "unpack_count", (
+            "左辺の変数の数と、右辺の値の数が合っていません。"
+            "入力を `split()` した結果がいくつになるか確認しましょう。"
+        )
+    return None
+
+
+def _simple_rules(parsed: ParsedError, code: str | None) -> tuple[str, str] | None:
+    message = parsed.message
+    error_type = parsed.error_type
+    if error_type == "ZeroDivisionError":
+        return "zero_division", (
+            "0 で割り算をしています。割る数が 0 になる場合があるか、"
+            "0 のときの処理を分ける必要がないか確認しましょう。"
+        )
+    if error_type == "IndexError" and "out of range" in message:
+        return "index_out_of_range", (
+            "リストや文字列の範囲外の位置を参照しています。"
+            "インデックスは 0 から始まり、最後は `len(...) - 1` です。"
+            "ループの範囲（`range`）の上限を確認しましょう。"
+        )
+    if error_type == "KeyError":
+        return "missing_key", (
+            f"辞書に存在しないキー {message or ''} を参照しています。"
+            "キーのつづりや、追加する前に参照していないかを確認しましょう。"
+            "`in` で存在を確かめるか、`get()` を使う方法もあります。"
+        )
+    if error_type == "EOFError":
+        return "eof_input", (
+            "入力がもう残っていないのに `input()` を呼んでいます。"
+            "入力の行数と `input()` を呼ぶ回数が合っているか確認しましょう。"
+        )
+    if error_type == "RecursionError":
+        return "recursion_depth", (
+            "関数が自分自身を呼び出し続けて止まらなくなっています。"
+            "再帰が終わる条件（ベースケース）に必ず到達するか確認しましょう。"
+        )
+    if error_type in ("ModuleNotFoundError", "ImportError") and "No module named" in message:
+        return "module_not_found", (
+            f"モジュール {_quoted(message) or ''} が見つかりません。名前のつづりを確認しましょう。"
+            "追加のライブラリが必要な場合は、コードの先頭に `!pip install ライブラリ名` を書くとインストールされます。"
+        )
+    if error_type == "AttributeError" and "has no attribute" in message:
+        return "missing_attribute", (
+            f"{message} というエラーです。メソッド名や属性名のつづりと、"
+            "その値が想定している型（リスト・文字列など）になっているかを確認しましょう。"
+        )
+    return None
+
+
+_RULES = {
+    "NameError": _name_error,
+    "SyntaxError": _syntax_error,
+    "IndentationError": _syntax_error,
+    "TabError": _syntax_error,
+    "TypeError": _type_error,
+    "ValueError": _value_error,
+}
+
+
+def generate_rule_advice(
+    exit_code: int | None,
+    stderr: str | None,
+    code: str | None = None,
+    line_offset: int = 0,
+) -> RuleAdvice | None:
+    """よくあるエラーなら定型のアドバイスを返す（確信がなければNone）"""
+    if exit_code == 124:
+        return RuleAdvice(
+            text=(
+                "【エラーの種類】タイムアウト\n"
+                "実行が制限時間内に終わりませんでした。while 文の条件がいつか偽になるか、"
+                "ループの中で条件に使う変数が更新されているかを確認しましょう。"
+                "入力を待ち続けていないかも確認してみてください。"
+            ),
+            rule="timeout",
+            error_type="TimeoutError",
+            line=None,
+        )
+    if exit_code in (0, None) or not stderr:
+        return None
+    parsed = parse_traceback(stderr, code, line_offset)
+    if parsed is None:
+        return None
+    rule = _RULES.get(parsed.error_type, _simple_rules)(parsed, code)
+    if rule is None:
+        return None
+    name, hint = rule
+    where = _where(parsed)
+    text = f"【エラーの種類】{parsed.error_type}\n"
+    if where:
+        text += f"【場所】{where}\n"
+    text += hint
+    return RuleAdvice(text=text, rule=name, error_type=parsed.error_type, line=parsed.line)
@@ -0,0 +1,364 @@
+# サンドボックスワーカーへの実行の振り分け
+"""
+サンドボックスワーカー（sandbox_worker.py）を登録しておくと、コードの実行をワーカーに振り分ける
+
+- 各ワーカーは同時実行数（capacity）を登録し、定期的に登録し直す（ハートビート）
+- 実行中の数 / capacity が最も小さいワーカーに送る。すべて埋まっていれば空くまで待つ
+- 接続が切れたワーカーは外し、実行中だったジョブは別のワーカーで再実行する
+- ワーカーが1台もなければ、APIと同じホストのDockerで実行する（SANDBOX_LOCAL_FALLBACK）
+
+静的なワーカーは SANDBOX_WORKERS にカンマ区切りの host:port で指定する（ハートビート不要）
+uvicorn --workers N ではハートビートがどれか1つのプロセスに届くため、登録はSharedStateで共有する
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+
+from services.metrics import SANDBOX_DISPATCH_RETRIES, SANDBOX_WORKERS
+from services.sandbox_rpc import (
+    SANDBOX_WORKER_TOKEN,
+    RPCProtocolError,
+    read_message,
+    write_message,
+)
+from services.shared_state import SharedState, shared_state
+
+logger = logging.getLogger(__name__)
+
+SANDBOX_WORKERS_ENV = os.getenv("SANDBOX_WORKERS", "")
+# 静的なワーカーの同時実行数
+SANDBOX_WORKER_CAPACITY = int(os.getenv("SANDBOX_WORKER_CAPACITY", "4"))
+# ハートビートが途絶えてからワーカーを外すまでの秒数
+SANDBOX_WORKER_TTL_S = float(os.getenv("SANDBOX_WORKER_TTL_S", "30"))
+# ワーカーが失われた場合に別のワーカーで再実行する回数
+SANDBOX_DISPATCH_RETRIES_MAX = int(os.getenv("SANDBOX_DISPATCH_RETRIES", "2"))
+# 静的なワーカーとの接続が切れてから、再び振り分けるまでの秒数
+SANDBOX_WORKER_RETRY_S = float(os.getenv("SANDBOX_WORKER_RETRY_S", "5"))
+SANDBOX_CONNECT_TIMEOUT_S = float(os.getenv("SANDBOX_CONNECT_TIMEOUT_S", "3"))
+SANDBOX_LOCAL_FALLBACK = os.getenv("SANDBOX_LOCAL_FALLBACK", "true").lower() == "true"
+# 他のプロセスが受け付けた登録を読み込む間隔（秒）
+SANDBOX_WORKER_SYNC_S = float(os.getenv("SANDBOX_WORKER_SYNC_S", "1"))
+
+
+class WorkerLost(Exception):
+    """ワーカーとの接続が切れた（別のワーカーで再実行できる）"""
+
+
+class NoWorkersAvailable(Exception):
+    """実行できるワーカーがない"""
+
+
+class _WorkerConnection:
+    """ワーカーへの1本の接続。複数のリクエストを同時に送り、idでレスポンスを対応付ける"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._reader_task = asyncio.create_task(self._read_loop())
+        self.closed = False
+
+    @classmethod
+    async def open(cls, address: str) -> "_WorkerConnection":
+        host, port = address.rsplit(":", 1)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, int(port)), SANDBOX_CONNECT_TIMEOUT_S
+        )
+        connection = cls(reader, writer)
+        try:
+            # 共有の秘密を知っている相手からの接続だと、ワーカーに確かめてもらう
+            await asyncio.wait_for(
+                connection.call("hello", {"token": SANDBOX_WORKER_TOKEN}),
+                SANDBOX_CONNECT_TIMEOUT_S,
+            )
+        except RuntimeError as e:
+            await connection.close()
+            raise WorkerLost(f"Worker {address} rejected the connection: {e}") from e
+        except BaseException:
+            await connection.close()
+            raise
+        return connection
+
+    async def _read_loop(self) -> None:
+        error: Exception = WorkerLost("Connection closed by worker")
+        try:
+            while (message := await read_message(self._reader)) is not None:
+                future = self._pending.pop(message.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+        except (OSError, RPCProtocolError) as e:
+            error = WorkerLost(f"Connection to worker failed: {e}")
+        finally:
+            self._fail_pending(error)
+
+    def _fail_pending(self, error: Exception) -> None:
+        self.closed = True
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+        self._writer.close()
+
+    async def call(self, method: str, params: dict | None = None):
+        if self.closed:
+            raise WorkerLost("Connection already closed")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await write_message(
+                self._writer, {"id": request_id, "method": method, "params": params or {}}
+            )
+            return await future
+        except OSError as e:
+            raise WorkerLost(f"Failed to send to worker: {e}") from e
+        except asyncio.CancelledError:
+            # 呼び出し元がキャンセルしたら、ワーカー側の実行も止める
+            self._pending.pop(request_id, None)
+            if not self.closed:
+                try:
+                    await write_message(
+                        self._writer,
+                        {"id": next(self._ids), "method": "cancel", "params": {"job": request_id}},
+                    )
+                except OSError:
+                    pass
+            raise
+
+    async def close(self) -> None:
+        self._reader_task.cancel()
+        await asyncio.gather(self._reader_task, return_exceptions=True)
+
+
+@dataclass
+class WorkerState:
+    """登録されたワーカーの状態"""
+
+    address: str
+    capacity: int
+    in_flight: int = 0
+    static: bool = False
+    last_seen: float = field(default_factory=time.monotonic)
+    down_until: float = 0.0
+    completed: int = 0
+    failures: int = 0
+    connection: _WorkerConnection | None = None
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.capacity
+
+    def available(self, now: float) -> bool:
+        if now < self.down_until:
+            return False
+        return self.static or now - self.last_seen <= SANDBOX_WORKER_TTL_S
+
+
+class SandboxDispatcher:
+    """登録されたワーカーに、負荷の最も小さい順で実行を振り分ける"""
+
+    def __init__(
+        self,
+        static_workers: str = "",
+        static_capacity: int = SANDBOX_WORKER_CAPACITY,
+        shared: SharedState | None = None,
+    ):
+        self.workers: dict[str, WorkerState] = {}
+        self.shared = shared
+        self._synced_at = float("-inf")
+        self._slot_freed: asyncio.Condition | None = None
+        for address in filter(None, (a.strip() for a in static_workers.split(","))):
+            self.workers[address] = WorkerState(address, static_capacity, static=True)
+        SANDBOX_WORKERS.set(len(self.workers))
+
+    def _condition(self) -> asyncio.Condition:
+        # イベントループの中で作る（インポート時にはループがないため）
+        if self._slot_freed is None:
+            self._slot_freed = asyncio.Condition()
+        return self._slot_freed
+
+    async def register(self, address: str, capacity: int) -> WorkerState:
+        """ワーカーを登録する（登録済みならハートビートとして扱う）"""
+        if self.shared is not None:
+            await self.shared.call(self.shared.upsert_worker, address, capacity)
+        return self._register_local(address, capacity, time.monotonic())
+
+    def _register_local(self, address: str, capacity: int, last_seen: float) -> WorkerState:
+        worker = self.workers.get(address)
+        if worker is None:
+            logger.info("サンドボックスワーカーを登録しました: %s (capacity=%d)", address, capacity)
+            worker = self.workers[address] = WorkerState(address, capacity)
+        worker.capacity = capacity
+        worker.last_seen = last_seen
+        worker.down_until = 0.0
+        SANDBOX_WORKERS.set(len(self.workers))
+        self._notify()
+        return worker
+
+    async def _sync_shared(self) -> None:
+        """他のプロセスが受け付けたハートビートを取り込む"""
+        now = time.monotonic()
+        if self.shared is None or now - self._synced_at < SANDBOX_WORKER_SYNC_S:
+            return
+        self._synced_at = now
+        wall_now = time.time()
+        for address, capacity, last_seen_wall in await self.shared.call(
+            self.shared.list_workers
+        ):
+            # 共有の時刻はUNIX時刻のため、このプロセスの単調時計に換算する
+            last_seen = now - max(0.0, wall_now - last_seen_wall)
+            worker = self.workers.get(address)
+            if worker is None or (not worker.static and last_seen > worker.last_seen):
+                if worker is None and now - last_seen > SANDBOX_WORKER_TTL_S:
+                    continue
+                self._register_local(address, capacity, last_seen)
+
+    async def has_workers(self) -> bool:
+        await self._sync_shared()
+        now = time.monotonic()
+        return any(w.available(now) for w in self.workers.values())
+
+    async def _remove(
+        self, worker: WorkerState, reason: str, connection: _WorkerConnection | None
+    ) -> None:
+        if connection is not None and worker.connection is not connection:
+            # 同じ接続で実行中だった別のジョブが、すでに外している
+            return
+        logger.warning("サンドボックスワーカー %s を外します: %s", worker.address, reason)
+        worker.failures += 1
+        if worker.connection is not None:
+            asyncio.create_task(worker.connection.close())
+            worker.connection = None
+        if worker.static:
+            # 静的なワーカーは外さず、しばらく選ばれないようにする
+            worker.down_until = time.monotonic() + SANDBOX_WORKER_RETRY_S
+            return
+        self.workers.pop(worker.address, None)
+        if self.shared is not None:
+            # 次のハートビートで登録し直されるまで、他のプロセスからも外す
+            await self.shared.call(self.shared.remove_worker, worker.address)
+        SANDBOX_WORKERS.set(len(self.workers))
+
+    def _notify(self) -> None:
+        if self._slot_freed is None:
+            return
+
+        async def notify():
+            async with self._slot_freed:
+                self._slot_freed.notify_all()
+
+        asyncio.get_running_loop().create_task(notify())
+
+    def _pick(self, exclude: set[str]) -> WorkerState | None:
+        now = time.monotonic()
+        candidates = [
+            w
+            for w in list(self.workers.values())
+            if w.address not in exclude and w.available(now)
+        ]
+        free = [w for w in candidates if w.in_flight < w.capacity]
+        if not free:
+            return None
+        return min(free, key=lambda w: (w.load, w.in_flight))
+
+    async def _acquire(self, exclude: set[str]) -> WorkerState:
+        """空きのあるワーカーを選ぶ（すべて埋まっていれば空くまで待つ）"""
+        condition = self._condition()
+        async with condition:
+            while True:
+                worker = self._pick(exclude)
+                if worker is not None:
+                    worker.in_flight += 1
+                    return worker
+                now = time.monotonic()
+                if not any(
+                    w.available(now) and w.address not in exclude
+                    for w in self.workers.values()
+                ):
+                    raise NoWorkersAvailable("No sandbox workers are registered")
+                # ハートビートの期限切れにも気づけるよう、一定時間で起きて確認する
+                try:
+                    await asyncio.wait_for(condition.wait(), SANDBOX_WORKER_TTL_S)
+                except TimeoutError:
+                    pass
+
+    async def _release(self, worker: WorkerState) -> None:
+        condition = self._condition()
+        async with condition:
+            worker.in_flight -= 1
+            condition.notify()
+
+    async def _connection(self, worker: WorkerState) -> _WorkerConnection:
+        if worker.connection is None or worker.connection.closed:
+            try:
+                worker.connection = await _WorkerConnection.open(worker.address)
+            except (OSError, TimeoutError) as e:
+                raise WorkerLost(f"Cannot connect to {worker.address}: {e}") from e
+        return worker.connection
+
+    async def execute(
+        self,
+        user_code: str,
+        stdin_input: str | None = None,
+        files: dict[str, str] | None = None,
+    ) -> dict:
+        """ワーカーでコードを実行し、CodeExecutionResultの内容を辞書で返す"""
+        params = {"user_code": user_code, "stdin_input": stdin_input}
+        if files:
+            params["files"] = files
+        tried: set[str] = set()
+        last_error: Exception | None = None
+        for _ in range(SANDBOX_DISPATCH_RETRIES_MAX + 1):
+            try:
+                worker = await self._acquire(tried)
+            except NoWorkersAvailable:
+                break
+            connection = None
+            try:
+                connection = await self._connection(worker)
+                result = await connection.call("execute", params)
+                worker.completed += 1
+                return result
+            except WorkerLost as e:
+                last_error = e
+                tried.add(worker.address)
+                await self._remove(worker, str(e), connection)
+                SANDBOX_DISPATCH_RETRIES.inc()
+            finally:
+                await self._release(worker)
+        raise NoWorkersAvailable(f"All sandbox workers failed: {last_error}")
+
+    async def summary(self) -> list[dict]:
+        await self._sync_shared()
+        now = time.monotonic()
+        return [
+            {
+                "address": w.address,
+                "capacity": w.capacity,
+                "in_flight": w.in_flight,
+                "completed": w.completed,
+                "failures": w.failures,
+                "static": w.static,
+                "seconds_since_heartbeat": round(now - w.last_seen, 1),
+                "available": w.available(now),
+            }
+            for w in self.workers.values()
+        ]
+
+    async def close(self) -> None:
+        for worker in self.workers.values():
+            if worker.connection is not None:
+                await worker.connection.close()
+                worker.connection = None
+
+
+sandbox_dispatcher = SandboxDispatcher(SANDBOX_WORKERS_ENV, shared=shared_state)
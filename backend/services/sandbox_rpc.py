@@ -0,0 +1,79 @@
+# サンドボックスワーカーとのRPCのメッセージ形式
+"""
+APIとサンドボックスワーカーの間は、TCP上で長さ付きのJSONメッセージをやりとりする
+
+- 1メッセージ = 4バイトのビッグエンディアンの長さ + UTF-8のJSON本文
+- リクエスト: {"id": 番号, "method": "execute" | "cancel" | "status", "params": {...}}
+- レスポンス: {"id": 番号, "result": {...}} または {"id": 番号, "error": "メッセージ"}
+
+1つの接続で複数のリクエストを同時に送り、レスポンスは id で対応付ける
+接続の最初のリクエストは {"method": "hello", "params": {"token": SANDBOX_WORKER_TOKEN}} とし、
+ワーカーはトークンが一致しない接続をエラーを返して閉じる
+"""
+
+import asyncio
+import hmac
+import os
+import struct
+
+import orjson
+
+# 1メッセージの最大サイズ（大きな出力を含む実行結果を想定）
+SANDBOX_RPC_MAX_MESSAGE_BYTES = int(
+    os.getenv("SANDBOX_RPC_MAX_MESSAGE_BYTES", str(64 * 1024 * 1024))
+)
+
+# APIとワーカーで共有する秘密（ワーカーの登録とRPCの最初のhelloで確かめる。未設定なら受け付けない）
+SANDBOX_WORKER_TOKEN = os.getenv("SANDBOX_WORKER_TOKEN", "")
+
+_HEADER = struct.Struct(">I")
+
+
+class RPCProtocolError(Exception):
+    """壊れたメッセージや大きすぎるメッセージを受け取った"""
+
+
+async def read_message(reader: asyncio.StreamReader) -> dict | None:
+    """メッセージを1つ読む。接続が閉じていればNone"""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise RPCProtocolError("Connection closed in the middle of a header") from e
+        return None
+    (length,) = _HEADER.unpack(header)
+    if length > SANDBOX_RPC_MAX_MESSAGE_BYTES:
+        raise RPCProtocolError(f"Message too large: {length} bytes")
+    try:
+        body = await reader.readexactly(length)
+    except asyncio.IncompleteReadError as e:
+        raise RPCProtocolError("Connection closed in the middle of a message") from e
+    try:
+        message = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise RPCProtocolError(f"Invalid JSON message: {e}") from e
+    if not isinstance(message, dict):
+        raise RPCProtocolError("Message must be a JSON object")
+    return message
+
+
+def encode_message(message: dict) -> bytes:
+    body = orjson.dumps(message)
+    if len(body) > SANDBOX_RPC_MAX_MESSAGE_BYTES:
+        raise RPCProtocolError(f"Message too large: {len(body)} bytes")
+    return _HEADER.pack(len(body)) + body
+
+
+async def write_message(writer: asyncio.StreamWriter, message: dict) -> None:
+    """メッセージを1つ書き込む"""
+    writer.write(encode_message(message))
+    await writer.drain()
+
+
+def token_matches(token, expected: str) -> bool:
+    """受け取ったトークンが expected と一致するか（expected が空なら常に不一致。比較時間は一定）"""
+    return (
+        bool(expected)
+        and isinstance(token, str)
+        and hmac.compare_digest(token.encode(), expected.encode())
+    )
@@ -1,20 +1,54 @@
 # サンドボックスサービス - 完全版
 import asyncio
-import docker
+import base64
+import os
 import time
 import json
 import re
 import logging
-from typing import Optional, List
+import uuid
+from typing import Iterable, Iterator, Optional, List
 from pydantic import BaseModel
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
-import nbformat
+from services.autoscaler import SandboxAutoscaler
+from services.container_pool import SANDBOX_REUSE_CONTAINERS, container_pool
+from services.docker_async import get_docker_client
+from services.metrics import (
+    SANDBOX_QUEUE_DEPTH,
+    SANDBOX_RUNS_CANCELLED,
+    SANDBOX_RUNS_IN_FLIGHT,
+    SANDBOX_STAGE_SECONDS,
+)
+from services.sandbox_dispatcher import (
+    SANDBOX_LOCAL_FALLBACK,
+    NoWorkersAvailable,
+    sandbox_dispatcher,
+)
+from services.shared_state import process_semaphore, shared_state
+from services.tracing import current_trace_id, span
+
+# nbformatは読み込みが重いため、使用する関数の中で遅延インポートする
 
 logger = logging.getLogger(__name__)
 
+# このホストで同時に動かすコンテナ数の上限（uvicorn --workers の全プロセスの合計）
+# 既定は以前のスレッドプールの既定の大きさ（1プロセスで動かしていたときの上限）と同じ
+SANDBOX_MAX_CONCURRENT_RUNS = int(
+    os.getenv("SANDBOX_MAX_CONCURRENT_RUNS", str(min(32, (os.cpu_count() or 1) + 4)))
+)
+# 実行枠を解放せずに落ちたプロセスの枠を回収するまでの秒数（タイムアウト30秒＋後片付け）
+SANDBOX_LEASE_TTL_S = float(os.getenv("SANDBOX_LEASE_TTL_S", "120"))
+
+sandbox_slots = process_semaphore("sandbox", SANDBOX_MAX_CONCURRENT_RUNS, SANDBOX_LEASE_TTL_S)
+# SANDBOX_AUTOSCALE=true のとき、起動時に start() して上限を自動調整する
+sandbox_autoscaler = SandboxAutoscaler(
+    sandbox_slots, shared_state, pool=container_pool if SANDBOX_REUSE_CONTAINERS else None
+)
+
 
 def notebook_to_python(notebook_str: str) -> str:
     """Jupyter Notebook文字列からPythonコードを抽出する"""
+    import nbformat
+
     try:
         # VSCode形式のXMLnotebookかどうかをチェック
         if notebook_str.strip().startswith("<"):
@@ -139,228 +173,381 @@ class CodeExecutionResult(BaseModel):
     succeeded: bool
 
 
-def execute_python_code_sync(
-    user_code: str, stdin_input: Optional[str] = None
-) -> CodeExecutionResult:
+def classify_error_type(exit_code: int, stderr: str) -> Optional[str]:
+    """終了コードと標準エラーからエラータイプを判定する"""
+    if exit_code == 0:
+        return None
+    if exit_code == 124:
+        return "TimeoutError"
+    elif "SyntaxError" in stderr:
+        return "SyntaxError"
+    elif "NameError" in stderr:
+        return "NameError"
+    elif "TypeError" in stderr:
+        return "TypeError"
+    elif "ValueError" in stderr:
+        return "ValueError"
+    elif "IndexError" in stderr:
+        return "IndexError"
+    elif "KeyError" in stderr:
+        return "KeyError"
+    elif "ZeroDivisionError" in stderr:
+        return "ZeroDivisionError"
+    else:
+        return "RuntimeError"
+
+
+def validate_package_name(package: str) -> bool:
+    """パッケージ名の安全性を検証"""
+    # 基本的なパッケージ名パターンの検証
+    if not re.match(r"^[a-zA-Z0-9\-_\.]+([<>=!]+[a-zA-Z0-9\-_\.]+)*$", package):
+        return False
+
+    # 危険なパッケージ名のブラックリスト
+    dangerous_patterns = [
+        r"\.\./",  # パストラバーサル
+        r"[;&|]",  # コマンドインジェクション
+        "sudo",  # 権限昇格
+        "rm",  # ファイル削除
+        "chmod",  # 権限変更
+    ]
+
+    for pattern in dangerous_patterns:
+        if re.search(pattern, package, re.IGNORECASE):
+            return False
+
+    return True
+
+
+def extract_pip_packages(code: str) -> List[str]:
+    """コードから pip install が必要なライブラリ名を抽出"""
+    # !pip install パターン (Jupyter Notebook風)
+    pip_pattern = r"^!pip install\s+(.+)"
+    # pip install パターン (通常のスクリプト)
+    pip_pattern2 = r"^pip install\s+(.+)"
+
+    matches = re.findall(pip_pattern, code, re.MULTILINE)
+    matches.extend(re.findall(pip_pattern2, code, re.MULTILINE))
+
+    packages = []
+    for match in matches:
+        # パッケージ名をスペースで分割して個別のパッケージとして追加
+        # バージョン指定やオプションも含めて適切に処理
+        parts = match.strip().split()
+        for part in parts:
+            # オプション（--upgrade, --quiet等）をスキップ
+            if not part.startswith("-"):
+                packages.append(part)
+
+    # 重複を除去し、安全なパッケージ名のみを許可
+    safe_packages = []
+    for pkg in set(packages):
+        # セキュリティ検証
+        if validate_package_name(pkg):
+            safe_packages.append(pkg)
+        else:
+            logger.warning("Potentially unsafe package name rejected: %s", pkg)
+
+    return safe_packages
+
+
+def remove_pip_install_lines(code: str) -> str:
+    """コードから !pip install と pip install の行を削除"""
+    # !pip install パターン
+    pip_pattern1 = r"^!pip install\s+.+$"
+    # pip install パターン
+    pip_pattern2 = r"^pip install\s+.+$"
+
+    code = re.sub(pip_pattern1, "", code, flags=re.MULTILINE)
+    code = re.sub(pip_pattern2, "", code, flags=re.MULTILINE)
+
+    return code
+
+
+def user_code_line_offset(stdin_input: Optional[str]) -> int:
     """
-    Dockerコンテナ内でPythonコードを同期的に実行する関数
+    実行時にユーザーコードの前に追加される行数
+    （トレースバックの行番号を提出コードの行番号に直すために使う）
     """
-    start_time = time.time()
+    if not stdin_input:
+        return 0
+    # 空行・import 2行・StringIOの行（標準入力の改行の分だけ増える）・空行
+    return 5 + stdin_input.count("\n")
+
+
+# ユーザーコードの実行の制限時間（秒）（パッケージのインストールを含む）
+SANDBOX_TIMEOUT_S = 30
+
+# 実行するコードに渡すファイル（files）を置いたディレクトリを知らせる環境変数
+SANDBOX_FILES_DIR_ENV = "SANDBOX_FILES_DIR"
+# ファイルは exec の引数にbase64で入れて送る。Linuxでは引数1つが128KiBまで、
+# 引数全体でも2MiB程度までのため、1つの引数に入れる量（base64の前）と1回のexecで送る量を分ける
+SANDBOX_UPLOAD_CHUNK_BYTES = int(os.getenv("SANDBOX_UPLOAD_CHUNK_BYTES", str(72 * 1024)))
+SANDBOX_UPLOAD_EXEC_BYTES = int(os.getenv("SANDBOX_UPLOAD_EXEC_BYTES", str(768 * 1024)))
+
+# 同時実行数の自動調整でホストの混み具合の目安にする、コンテナを操作するスパン
+_CONTAINER_OVERHEAD_SPANS = ("container_create", "container_reset", "container_cleanup")
+
+# 引数の（パス, base64の内容）の組をファイルの末尾に書き足す
+_UPLOAD_SCRIPT = """
+import base64, os, sys
+for path, data in zip(sys.argv[1::2], sys.argv[2::2]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(base64.b64decode(data))
+"""
 
-    def validate_package_name(package: str) -> bool:
-        """パッケージ名の安全性を検証"""
-        # 基本的なパッケージ名パターンの検証
-        if not re.match(r"^[a-zA-Z0-9\-_\.]+([<>=!]+[a-zA-Z0-9\-_\.]+)*$", package):
-            return False
 
-        # 危険なパッケージ名のブラックリスト
-        dangerous_patterns = [
-            r"\.\./",  # パストラバーサル
-            r"[;&|]",  # コマンドインジェクション
-            "sudo",  # 権限昇格
-            "rm",  # ファイル削除
-            "chmod",  # 権限変更
-        ]
-
-        for pattern in dangerous_patterns:
-            if re.search(pattern, package, re.IGNORECASE):
-                return False
-
-        return True
-
-    def extract_pip_packages(code: str) -> List[str]:
-        """コードから pip install が必要なライブラリ名を抽出"""
-        # !pip install パターン (Jupyter Notebook風)
-        pip_pattern = r"^!pip install\s+(.+)"
-        # pip install パターン (通常のスクリプト)
-        pip_pattern2 = r"^pip install\s+(.+)"
-
-        matches = re.findall(pip_pattern, code, re.MULTILINE)
-        matches.extend(re.findall(pip_pattern2, code, re.MULTILINE))
-
-        packages = []
-        for match in matches:
-            # パッケージ名をスペースで分割して個別のパッケージとして追加
-            # バージョン指定やオプションも含めて適切に処理
-            parts = match.strip().split()
-            for part in parts:
-                # オプション（--upgrade, --quiet等）をスキップ
-                if not part.startswith("-"):
-                    packages.append(part)
-
-        # 重複を除去し、安全なパッケージ名のみを許可
-        safe_packages = []
-        for pkg in set(packages):
-            # セキュリティ検証
-            if validate_package_name(pkg):
-                safe_packages.append(pkg)
-            else:
-                logger.warning("Potentially unsafe package name rejected: %s", pkg)
-
-        return safe_packages
-
-    def remove_pip_install_lines(code: str) -> str:
-        """コードから !pip install と pip install の行を削除"""
-        # !pip install パターン
-        pip_pattern1 = r"^!pip install\s+.+$"
-        # pip install パターン
-        pip_pattern2 = r"^pip install\s+.+$"
-
-        code = re.sub(pip_pattern1, "", code, flags=re.MULTILINE)
-        code = re.sub(pip_pattern2, "", code, flags=re.MULTILINE)
-
-        return code
-
-    def run_container():
-        """コンテナ実行を行う内部関数"""
-        client = docker.from_env()
+def _build_program(user_code: str, stdin_input: Optional[str]) -> tuple[List[str], str]:
+    """インストールするライブラリと、コンテナで実行するコードを返す"""
+    # pip install が必要なライブラリを抽出
+    pip_packages = extract_pip_packages(user_code)
+    # pip install 行を削除したコードを作成
+    cleaned_code = remove_pip_install_lines(user_code)
 
-        try:
-            # pip install が必要なライブラリを抽出
-            pip_packages = extract_pip_packages(user_code)
-            # pip install 行を削除したコードを作成
-            cleaned_code = remove_pip_install_lines(user_code)
-
-            # 標準入力がある場合はそれを含めたコードを作成
-            if stdin_input:
-                # 標準入力をハードコーディングしたコードを生成
-                full_code = f"""
+    # 標準入力がある場合はそれを含めたコードを作成
+    # （前に追加する行数を変えたら user_code_line_offset も合わせる）
+    if stdin_input:
+        # 標準入力をハードコーディングしたコードを生成
+        full_code = f"""
 import sys
 from io import StringIO
 sys.stdin = StringIO('''{stdin_input}''')
 
 {cleaned_code}
 """
-            else:
-                full_code = cleaned_code
-
-            # コンテナを起動
-            container = client.containers.run(
-                image="python-sandbox",
-                command=["sleep", "30"],  # 一時的にsleepで起動
-                network_disabled=True,
-                mem_limit="128m",
-                detach=True,
-            )
+    else:
+        full_code = cleaned_code
+    return pip_packages, full_code
+
 
+async def _install_packages(
+    docker, container_id: str, pip_packages: List[str], exec_options: dict
+) -> str:
+    """
+    コンテナにライブラリをインストールし、失敗したものがあれば標準エラーに出す警告を返す
+    （再利用するコンテナでは非特権ユーザーのHOMEに入り、後片付けで消える）
+    """
+    if not pip_packages:
+        return ""
+    logger.info("Installing packages: %s", pip_packages)
+    # キャンセル・タイムアウトで抜けても、スパンを終えて現在のスパンを元に戻す
+    with span("pip_install", histogram=SANDBOX_STAGE_SECONDS, packages=len(pip_packages)):
+        installed_packages = []
+        failed_packages = []
+
+        for package in pip_packages:
             try:
-                # 変数を初期化
-                stderr = ""
-
-                # 必要なライブラリをインストール
-                if pip_packages:
-                    logger.info("Installing packages: %s", pip_packages)
-                    installed_packages = []
-                    failed_packages = []
-
-                    for package in pip_packages:
-                        try:
-                            # より詳細なインストールオプション
-                            install_result = container.exec_run(
-                                [
-                                    "pip",
-                                    "install",
-                                    "--no-cache-dir",
-                                    "--disable-pip-version-check",
-                                    "--quiet",
-                                    package,
-                                ],
-                                stdout=True,
-                                stderr=True,
-                            )
-
-                            if install_result.exit_code == 0:
-                                installed_packages.append(package)
-                                logger.info("Successfully installed: %s", package)
-                            else:
-                                failed_packages.append(package)
-                                error_msg = (
-                                    install_result.output.decode("utf-8")
-                                    if install_result.output
-                                    else "Unknown error"
-                                )
-                                logger.warning("Failed to install package %s: %s", package, error_msg)
-
-                        except Exception as e:
-                            failed_packages.append(package)
-                            logger.warning("Exception during package installation %s: %s", package, str(e))
-
-                    # インストール結果をログに記録
-                    if installed_packages:
-                        logger.info("Successfully installed packages: %s", installed_packages)
-                    if failed_packages:
-                        logger.warning("Failed to install packages: %s", failed_packages)
-                        # 失敗したパッケージがあることをstderrに記録（ユーザーに通知）
-                        if not stderr:
-                            stderr = f"Warning: Could not install some packages: {', '.join(failed_packages)}\n"
-
-                # 実際のコードを実行
-                exec_result = container.exec_run(["python", "-c", full_code])
-
-                stdout = (
-                    exec_result.output.decode("utf-8") if exec_result.output else ""
+                # より詳細なインストールオプション
+                install_result = await docker.exec_run(
+                    container_id,
+                    [
+                        "pip",
+                        "install",
+                        "--no-cache-dir",
+                        "--disable-pip-version-check",
+                        "--quiet",
+                        package,
+                    ],
+                    **exec_options,
                 )
-                # exit_codeが0でない場合はstdoutをstderrとして扱う
-                if exec_result.exit_code != 0:
-                    stderr = stdout
-                    stdout = ""
 
-                exit_code = exec_result.exit_code
+                if install_result.exit_code == 0:
+                    installed_packages.append(package)
+                    logger.info("Successfully installed: %s", package)
+                else:
+                    failed_packages.append(package)
+                    error_msg = (
+                        install_result.output.decode("utf-8")
+                        if install_result.output
+                        else "Unknown error"
+                    )
+                    logger.warning("Failed to install package %s: %s", package, error_msg)
+
+            except Exception as e:
+                failed_packages.append(package)
+                logger.warning("Exception during package installation %s: %s", package, str(e))
+
+        # インストール結果をログに記録
+        if installed_packages:
+            logger.info("Successfully installed packages: %s", installed_packages)
+        stderr = ""
+        if failed_packages:
+            logger.warning("Failed to install packages: %s", failed_packages)
+            # 失敗したパッケージがあることをstderrに記録（ユーザーに通知）
+            stderr = f"Warning: Could not install some packages: {', '.join(failed_packages)}\n"
+    return stderr
+
+
+def _file_pieces(
+    directory: str, files: dict[str, str | Iterable[str]]
+) -> Iterator[tuple[str, bytes]]:
+    """ファイルの内容を、全体を1つにまとめずに SANDBOX_UPLOAD_CHUNK_BYTES 以下ずつ返す"""
+    size = SANDBOX_UPLOAD_CHUNK_BYTES
+    for name, content in files.items():
+        path = f"{directory}/{name}"
+        # 空のファイルも作る
+        yield path, b""
+        texts = content
+        if isinstance(content, str):
+            texts = (content[i : i + size] for i in range(0, len(content), size))
+        pending = bytearray()
+        for text in texts:
+            pending += text.encode("utf-8")
+            while len(pending) >= size:
+                yield path, bytes(pending[:size])
+                del pending[:size]
+        if pending:
+            yield path, bytes(pending)
+
+
+async def _upload_files(
+    docker, container_id: str, files: dict[str, str | Iterable[str]], exec_options: dict
+) -> str:
+    """ファイルをコンテナの一時ディレクトリに書き込み、そのディレクトリを返す"""
+    directory = f"/tmp/sandbox-files-{uuid.uuid4().hex}"
+
+    async def append(args: list[str]) -> None:
+        result = await docker.exec_run(
+            container_id, ["python", "-c", _UPLOAD_SCRIPT, *args], **exec_options
+        )
+        if result.exit_code != 0:
+            output = result.output.decode("utf-8", "replace") if result.output else ""
+            raise RuntimeError(f"Failed to upload input files: {output[-500:]}")
+
+    args: list[str] = []
+    size = 0
+    for path, data in _file_pieces(directory, files):
+        encoded = base64.b64encode(data).decode("ascii")
+        if args and size + len(path) + len(encoded) > SANDBOX_UPLOAD_EXEC_BYTES:
+            await append(args)
+            args, size = [], 0
+        args += [path, encoded]
+        size += len(path) + len(encoded)
+    if args:
+        await append(args)
+    return directory
+
+
+async def _run_container(
+    user_code: str,
+    stdin_input: Optional[str],
+    files: dict[str, str | Iterable[str]] | None = None,
+) -> tuple[str, str, int]:
+    """
+    コンテナでコードを実行し、標準出力・標準エラー・終了コードを返す
+    files はコンテナの一時ディレクトリに書き込み、その場所を環境変数 SANDBOX_FILES_DIR で知らせる
+    キャンセル（タイムアウトを含む）されたら、実行中のコンテナを強制削除する
+    """
+    pip_packages, full_code = _build_program(user_code, stdin_input)
+    docker = get_docker_client()
+    pooled = None
+    container_id = None
+    completed = False
+    try:
+        if SANDBOX_REUSE_CONTAINERS:
+            # 在庫のコンテナを借り、非特権ユーザーの新しいプロセスとして実行する
+            pooled = await container_pool.checkout()
+            container_id = pooled.container_id
+            exec_options = pooled.exec_options
+        else:
+            # コンテナを起動（どの提出のコンテナか追えるようにトレースIDをラベルに付ける）
+            trace_id = current_trace_id()
+            with span("container_create", histogram=SANDBOX_STAGE_SECONDS):
+                container_id = await docker.create_container(
+                    "python-sandbox",
+                    ["sleep", str(SANDBOX_TIMEOUT_S)],  # 一時的にsleepで起動
+                    labels={"trace_id": trace_id} if trace_id else None,
+                    network_disabled=True,
+                    host_config={"Memory": 128 * 1024 * 1024},
+                )
+                await docker.start(container_id)
+            exec_options = {}
+
+        # 必要なライブラリをインストール
+        stderr = await _install_packages(docker, container_id, pip_packages, exec_options)
+
+        run_options = exec_options
+        if files:
+            # 大きな入出力もコードの引数の長さの上限に掛からないよう、ファイルで渡す
+            with span("upload_files", histogram=SANDBOX_STAGE_SECONDS):
+                directory = await _upload_files(docker, container_id, files, exec_options)
+            run_options = {
+                **exec_options,
+                "environment": {
+                    **(exec_options.get("environment") or {}),
+                    SANDBOX_FILES_DIR_ENV: directory,
+                },
+            }
+
+        # 実際のコードを実行
+        with span("exec", histogram=SANDBOX_STAGE_SECONDS) as exec_span:
+            exec_result = await docker.exec_run(
+                container_id, ["python", "-c", full_code], **run_options
+            )
+            exec_span.set_attribute("exit_code", exec_result.exit_code)
 
-            finally:
-                # コンテナを停止・削除
-                container.stop()
-                container.remove()
+        stdout = exec_result.output.decode("utf-8") if exec_result.output else ""
+        # exit_codeが0でない場合はstdoutをstderrとして扱う
+        if exec_result.exit_code != 0:
+            stderr = stdout
+            stdout = ""
+        completed = True
+        return stdout, stderr, exec_result.exit_code
+
+    finally:
+        if container_id is not None:
+            # 後片付けは呼び出し元がキャンセルされても最後まで行う
+            await asyncio.shield(_cleanup(docker, container_id, pooled, completed))
+
+
+async def _cleanup(docker, container_id: str, pooled, completed: bool) -> None:
+    if pooled is not None:
+        # 後片付けして在庫に戻す（途中で止めたコンテナは捨てる）
+        await container_pool.checkin(pooled, healthy=completed)
+        return
+    # 停止を待たずに強制削除する（stopは猶予期間の分だけ待たされる）
+    with span("container_cleanup", histogram=SANDBOX_STAGE_SECONDS):
+        try:
+            await docker.remove(container_id, force=True)
+        except Exception as e:
+            logger.warning("Failed to remove container %s: %s", container_id, e)
 
-        except docker.errors.ContainerError as e:
-            # Docker SDK 7.1.0 での ContainerError 処理
-            stdout = ""  # ContainerError時はstdoutは空
-            stderr = e.stderr.decode("utf-8") if e.stderr else ""
-            exit_code = e.exit_status
 
+async def run_in_sandbox(
+    user_code: str,
+    stdin_input: Optional[str] = None,
+    files: dict[str, str | Iterable[str]] | None = None,
+) -> CodeExecutionResult:
+    """
+    Dockerコンテナ内でPythonコードを実行する
+    待っている間はスレッドを使わないため、多数の実行を同時に待てる
+    """
+    start_time = time.time()
+    try:
+        try:
+            # タイムアウト付きでコンテナを実行（30秒に延長してパッケージインストールに対応）
+            async with asyncio.timeout(SANDBOX_TIMEOUT_S):
+                stdout, stderr, exit_code = await _run_container(user_code, stdin_input, files)
+        except TimeoutError:
+            # 実行中のコンテナは _run_container の後片付けで削除済み
+            stdout = ""
+            stderr = f"Code execution timed out ({SANDBOX_TIMEOUT_S} seconds)"
+            exit_code = 124
+        except asyncio.CancelledError:
+            SANDBOX_RUNS_CANCELLED.inc()
+            raise
         except Exception as e:
-            # その他のDocker関連エラー
+            # Docker関連エラー
             stdout = ""
             stderr = f"Docker error: {str(e)}"
             exit_code = 1
 
-        return stdout, stderr, exit_code
-
-    try:
-        # タイムアウト付きでコンテナを実行（30秒に延長してパッケージインストールに対応）
-        with ThreadPoolExecutor() as executor:
-            future = executor.submit(run_container)
-            try:
-                stdout, stderr, exit_code = future.result(timeout=30)
-            except FuturesTimeoutError:
-                stdout = ""
-                stderr = "Code execution timed out (30 seconds)"
-                exit_code = 124
-
         # 実行時間を計算
         execution_time = (time.time() - start_time) * 1000
 
         # エラータイプを判定
-        error_type = None
-        if exit_code != 0:
-            if exit_code == 124:
-                error_type = "TimeoutError"
-            elif "SyntaxError" in stderr:
-                error_type = "SyntaxError"
-            elif "NameError" in stderr:
-                error_type = "NameError"
-            elif "TypeError" in stderr:
-                error_type = "TypeError"
-            elif "ValueError" in stderr:
-                error_type = "ValueError"
-            elif "IndexError" in stderr:
-                error_type = "IndexError"
-            elif "KeyError" in stderr:
-                error_type = "KeyError"
-            elif "ZeroDivisionError" in stderr:
-                error_type = "ZeroDivisionError"
-            else:
-                error_type = "RuntimeError"
+        error_type = classify_error_type(exit_code, stderr)
 
         # 成功判定
         succeeded = exit_code == 0 and not stderr.strip()
@@ -386,14 +573,87 @@ sys.stdin = StringIO('''{stdin_input}''')
         )
 
 
-async def execute_python_code_in_docker(
+def execute_python_code_sync(
     user_code: str, stdin_input: Optional[str] = None
+) -> CodeExecutionResult:
+    """Dockerコンテナ内でPythonコードを同期的に実行する関数（スクリプト・テスト用）"""
+    return asyncio.run(run_in_sandbox(user_code, stdin_input))
+
+
+async def execute_python_code_in_docker(
+    user_code: str,
+    stdin_input: Optional[str] = None,
+    files: dict[str, str | Iterable[str]] | None = None,
 ) -> CodeExecutionResult:
     """
     Dockerコンテナ内でPythonコードを非同期で実行する関数
+    サンドボックスワーカーが登録されていればワーカーで、なければこのホストで実行する
+    files（名前 -> 内容）は実行するコードから SANDBOX_FILES_DIR のファイルとして読める
+    """
+    if await sandbox_dispatcher.has_workers():
+        if files:
+            # ワーカーへはJSONで送るため文字列にする（このホストで実行し直す場合にも使う）
+            files = {
+                name: content if isinstance(content, str) else "".join(content)
+                for name, content in files.items()
+            }
+        try:
+            return CodeExecutionResult(
+                **await sandbox_dispatcher.execute(user_code, stdin_input, files)
+            )
+        except NoWorkersAvailable as e:
+            if not SANDBOX_LOCAL_FALLBACK:
+                stderr = f"Sandbox unavailable: {e}"
+                return CodeExecutionResult(
+                    stdout="",
+                    stderr=stderr,
+                    execution_time_ms=0.0,
+                    exit_code=1,
+                    error_type=classify_error_type(1, stderr),
+                    succeeded=False,
+                )
+            logger.warning("ワーカーで実行できないため、このホストで実行します: %s", e)
+    return await _execute_locally(user_code, stdin_input, files)
+
+
+def _container_overhead_s(parent) -> float | None:
+    """
+    parent の子スパンのうち、コンテナの作成・リセット・削除にかかった時間の合計（秒）
+    ユーザーコードの実行とpip installの時間は含めない（コンテナを操作しなかった場合はNone）
+    """
+    durations = [
+        child.duration_ms
+        for child in parent.trace.spans
+        if child.parent_id == parent.span_id and child.name in _CONTAINER_OVERHEAD_SPANS
+    ]
+    return sum(durations) / 1000 if durations else None
+
+
+async def _execute_locally(
+    user_code: str,
+    stdin_input: Optional[str] = None,
+    files: dict[str, str | Iterable[str]] | None = None,
+) -> CodeExecutionResult:
+    """
+    このホストのDockerで非同期に実行する
+    同時に動かすコンテナ数は、全ワーカープロセスの合計で SANDBOX_MAX_CONCURRENT_RUNS まで
+    キャンセルされた場合は実行中のコンテナを止める
     """
-    # 同期関数を非同期で実行
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(
-        None, execute_python_code_sync, user_code, stdin_input
-    )
+    SANDBOX_QUEUE_DEPTH.inc()
+    queued_at = time.perf_counter()
+    try:
+        lease_id = await sandbox_slots.acquire()
+    finally:
+        SANDBOX_QUEUE_DEPTH.dec()
+    started_at = time.perf_counter()
+    SANDBOX_RUNS_IN_FLIGHT.inc()
+    try:
+        with span("sandbox", histogram=SANDBOX_STAGE_SECONDS, stage="total") as sandbox_span:
+            result = await run_in_sandbox(user_code, stdin_input, files)
+        # 同時実行数の自動調整に、枠を待った時間とコンテナの操作にかかった時間を渡す
+        sandbox_autoscaler.observe(started_at - queued_at, _container_overhead_s(sandbox_span))
+        return result
+    finally:
+        SANDBOX_RUNS_IN_FLIGHT.dec()
+        # キャンセルされてもコンテナの削除が終わってから枠を解放する
+        await sandbox_slots.release(lease_id)
@@ -0,0 +1,529 @@
+# 複数のAPIワーカープロセスで共有する状態
+"""
+uvicorn --workers N で起動すると、各プロセスが別々のスレッドプール・キャッシュを持つ。
+プロセスをまたいで揃える必要がある状態は、SQLiteのファイル（SHARED_STATE_PATH）に置く
+（UVICORN_WORKERS が1のときは、実行枠・キャッシュの世代番号・出し直しの検知はプロセス内で済ませる）
+
+- leases: 同時実行数の上限（サンドボックスの実行枠など）。期限付きで、落ちたプロセスの分は期限で消える
+- lease_tickets: 枠を待っている順番（空いた枠は先に待ち始めたものから確保する）
+- cache: プロセスをまたいで使い回す結果（正解コードの実行結果など）
+- generations: キャッシュの世代番号（どれかのプロセスが更新したら他のプロセスも破棄する）
+- owners: キーごとの処理中のトークン（同じ提出者の出し直しを別のプロセスに伝える）
+- sandbox_workers: 登録されたサンドボックスワーカー（ハートビートはどれか1つのプロセスに届く）
+- containers: 再利用するサンドボックスコンテナの在庫（どのプロセスも空いているものを使える）
+- settings: 実行中に調整する設定値（自動調整したサンドボックスの同時実行数など）
+
+どの操作も短いトランザクション1回で終わる。待ちが発生しうる操作は call() で専用のスレッドで行う
+"""
+
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from services.metrics import SHARED_LEASE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 既定ではアプリのDBと同じディレクトリに置く（DBを一時ファイルにした負荷試験などでも分かれる）
+_DB_PATH = os.getenv(
+    "DATABASE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.db"),
+)
+SHARED_STATE_PATH = os.getenv(
+    "SHARED_STATE_PATH", os.path.join(os.path.dirname(_DB_PATH), "shared_state.db")
+)
+# 他のプロセスの書き込みを待つ最大秒数
+SHARED_STATE_BUSY_TIMEOUT_S = float(os.getenv("SHARED_STATE_BUSY_TIMEOUT_S", "5"))
+# 実行枠が空くのを待つ間の確認間隔の上限（秒）
+SHARED_LEASE_MAX_POLL_S = float(os.getenv("SHARED_LEASE_MAX_POLL_S", "0.1"))
+# 待っている順番を、確認が途絶えてから消すまでの秒数（落ちたプロセスの順番が列を止めないように）
+SHARED_LEASE_TICKET_TTL_S = float(os.getenv("SHARED_LEASE_TICKET_TTL_S", "5"))
+# APIのワーカープロセス数（Dockerイメージでは uvicorn --workers に渡す値）
+UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS", "1"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    id TEXT PRIMARY KEY,
+    pool TEXT NOT NULL,
+    pid INTEGER,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_leases_pool ON leases (pool, expires_at);
+CREATE TABLE IF NOT EXISTS lease_tickets (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    pool TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_lease_tickets_pool ON lease_tickets (pool, seq);
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS ix_cache_created ON cache (namespace, created_at);
+CREATE TABLE IF NOT EXISTS generations (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS owners (
+    key TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sandbox_workers (
+    address TEXT PRIMARY KEY,
+    capacity INTEGER NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS containers (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+class SharedState:
+    """プロセス間で共有する状態を置くSQLiteファイル"""
+
+    def __init__(self, path: str = SHARED_STATE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._executor: ThreadPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3の接続はスレッドをまたいで使えないため、スレッドごとに持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=SHARED_STATE_BUSY_TIMEOUT_S, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # 読んでから書く操作が他のプロセスと交互にならないよう、最初に書き込みロックを取る
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=4, thread_name_prefix="shared-state"
+                    )
+        return self._executor
+
+    async def call(self, fn, *args):
+        """他のプロセスのロックを待つことがある操作を、イベントループを止めずに行う"""
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), fn, *args)
+
+    def submit(self, fn, *args) -> None:
+        """結果を待たない操作（コールバックからの解放など）をスレッドで行う（失敗はログに残す）"""
+
+        def log_failure(future):
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(
+                    "Shared state operation %s failed",
+                    getattr(fn, "__name__", fn),
+                    exc_info=future.exception(),
+                )
+
+        self._pool().submit(fn, *args).add_done_callback(log_failure)
+
+    # --- 同時実行数の上限 ---
+
+    def try_acquire_lease(
+        self, pool: str, limit: int, ttl_s: float, ticket: str | None = None
+    ) -> str | None:
+        """
+        pool の枠が limit 未満なら1つ確保してIDを返す（空きがなければNone）
+        先に待っている順番があれば、空きの数より後ろの順番では確保しない。
+        ticket を渡すと、確保できなかったときにその順番を列の最後に加える（加えてあれば期限を延ばす）
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE pool = ? AND expires_at < ?", (pool, now))
+            conn.execute(
+                "DELETE FROM lease_tickets WHERE pool = ? AND expires_at < ?", (pool, now)
+            )
+            (in_use,) = conn.execute(
+                "SELECT COUNT(*) FROM leases WHERE pool = ?", (pool,)
+            ).fetchone()
+            # 自分より前の順番の数（列にまだいなければ、待っているすべて）
+            row = conn.execute(
+                "SELECT seq FROM lease_tickets WHERE id = ?", (ticket,)
+            ).fetchone()
+            (ahead,) = conn.execute(
+                "SELECT COUNT(*) FROM lease_tickets WHERE pool = ? AND seq < ?",
+                (pool, row[0] if row is not None else float("inf")),
+            ).fetchone()
+            if in_use + ahead >= limit:
+                if ticket is not None:
+                    conn.execute(
+                        "INSERT INTO lease_tickets (id, pool, expires_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT (id) DO UPDATE SET expires_at = excluded.expires_at",
+                        (ticket, pool, now + SHARED_LEASE_TICKET_TTL_S),
+                    )
+                return None
+            if ticket is not None:
+                conn.execute("DELETE FROM lease_tickets WHERE id = ?", (ticket,))
+            lease_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO leases (id, pool, pid, expires_at) VALUES (?, ?, ?, ?)",
+                (lease_id, pool, os.getpid(), now + ttl_s),
+            )
+        return lease_id
+
+    def release_lease(self, lease_id: str) -> None:
+        self._connect().execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+    def release_ticket(self, ticket: str) -> None:
+        """待つのをやめた順番を列から外す"""
+        self._connect().execute("DELETE FROM lease_tickets WHERE id = ?", (ticket,))
+
+    def leases_in_use(self, pool: str) -> int:
+        (count,) = self._connect().execute(
+            "SELECT COUNT(*) FROM leases WHERE pool = ? AND expires_at >= ?",
+            (pool, time.time()),
+        ).fetchone()
+        return count
+
+    # --- キャッシュ ---
+
+    def cache_get(self, namespace: str, key: str) -> bytes | None:
+        row = self._connect().execute(
+            "SELECT value FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def cache_put(self, namespace: str, key: str, value: bytes, max_entries: int) -> None:
+        """値を保存し、namespace ごとに古いものから max_entries 件を超えた分を消す"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (namespace, key, value, time.time()),
+            )
+            conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache WHERE namespace = ? "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (namespace, namespace, max_entries),
+            )
+
+    def cache_clear(self, namespace: str) -> None:
+        self._connect().execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+    # --- 世代番号 ---
+
+    def generation(self, name: str) -> int:
+        row = self._connect().execute(
+            "SELECT value FROM generations WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row is not None else 0
+
+    def generations(self, *names: str) -> tuple[int, ...]:
+        """複数の世代番号を1回の問い合わせで読む（names と同じ順）"""
+        rows = dict(
+            self._connect().execute(
+                f"SELECT name, value FROM generations WHERE name IN ({','.join('?' * len(names))})",
+                names,
+            )
+        )
+        return tuple(rows.get(name, 0) for name in names)
+
+    def bump_generation(self, name: str) -> int:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO generations (name, value) VALUES (?, 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1",
+                (name,),
+            )
+            (value,) = conn.execute(
+                "SELECT value FROM generations WHERE name = ?", (name,)
+            ).fetchone()
+        return value
+
+    # --- キーごとの処理中のトークン ---
+
+    def claim_owner(self, key: str, token: str, ttl_s: float) -> None:
+        """key の処理中のトークンを token に置き換える（前の持ち主は owner() で気づく）"""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO owners (key, token, expires_at) VALUES (?, ?, ?)",
+            (key, token, time.time() + ttl_s),
+        )
+
+    def owner(self, key: str) -> str | None:
+        row = self._connect().execute(
+            "SELECT token FROM owners WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def release_owner(self, key: str, token: str) -> None:
+        self._connect().execute(
+            "DELETE FROM owners WHERE key = ? AND token = ?", (key, token)
+        )
+
+    # --- サンドボックスワーカー ---
+
+    def upsert_worker(self, address: str, capacity: int) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO sandbox_workers (address, capacity, last_seen) "
+            "VALUES (?, ?, ?)",
+            (address, capacity, time.time()),
+        )
+
+    def remove_worker(self, address: str) -> None:
+        self._connect().execute("DELETE FROM sandbox_workers WHERE address = ?", (address,))
+
+    def list_workers(self) -> list[tuple[str, int, float]]:
+        """(address, capacity, 最後のハートビートのUNIX時刻) の一覧"""
+        return self._connect().execute(
+            "SELECT address, capacity, last_seen FROM sandbox_workers"
+        ).fetchall()
+
+    # --- 再利用するコンテナの在庫 ---
+
+    def add_container(self, container_id: str) -> None:
+        """作成したコンテナを使用中として登録する"""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO containers (id, state, runs, updated_at) "
+            "VALUES (?, 'busy', 0, ?)",
+            (container_id, time.time()),
+        )
+
+    def claim_container(self, stale_s: float) -> tuple[tuple[str, int] | None, list[str]]:
+        """
+        空いているコンテナを1つ使用中にして (ID, 実行回数) を返す
+        stale_s 秒より長く使用中のままのもの（落ちたプロセスの分）は在庫から外してIDを返す
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            stale = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT id FROM containers WHERE state = 'busy' AND updated_at < ?",
+                    (now - stale_s,),
+                )
+            ]
+            if stale:
+                conn.executemany("DELETE FROM containers WHERE id = ?", [(i,) for i in stale])
+            # 最近使われたもの（ページキャッシュなどが温まっている）から使う
+            row = conn.execute(
+                "SELECT id, runs FROM containers WHERE state = 'idle' "
+                "ORDER BY updated_at DESC LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE containers SET state = 'busy', updated_at = ? WHERE id = ?",
+                    (now, row[0]),
+                )
+        return (row[0], row[1]) if row is not None else None, stale
+
+    def return_container(self, container_id: str, runs: int, max_idle: int) -> bool:
+        """コンテナを空きに戻す。空きが max_idle 個あれば在庫から外してFalseを返す"""
+        with self._transaction() as conn:
+            (idle,) = conn.execute(
+                "SELECT COUNT(*) FROM containers WHERE state = 'idle'"
+            ).fetchone()
+            if idle >= max_idle:
+                conn.execute("DELETE FROM containers WHERE id = ?", (container_id,))
+                return False
+            conn.execute(
+                "UPDATE containers SET state = 'idle', runs = ?, updated_at = ? WHERE id = ?",
+                (runs, time.time(), container_id),
+            )
+        return True
+
+    def remove_container(self, container_id: str) -> None:
+        self._connect().execute("DELETE FROM containers WHERE id = ?", (container_id,))
+
+    def container_counts(self) -> dict[str, int]:
+        return dict(
+            self._connect().execute(
+                "SELECT state, COUNT(*) FROM containers GROUP BY state"
+            ).fetchall()
+        )
+
+    # --- 実行中に調整する設定値 ---
+
+    def get_setting(self, name: str) -> float | None:
+        row = self._connect().execute(
+            "SELECT value FROM settings WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def set_setting(self, name: str, value: float) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)", (name, value)
+        )
+
+    @contextmanager
+    def startup_lock(self):
+        """テーブル作成などの起動処理を、同時に起動したプロセスの間で1つずつ行う"""
+        import fcntl
+
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SharedSemaphore:
+    """全プロセスで合計 limit 件までに制限するセマフォ（待ち始めた順に確保し、取得した枠はIDで解放する）"""
+
+    def __init__(self, store: SharedState, pool: str, limit: int, ttl_s: float):
+        self.store = store
+        self.pool = pool
+        self.limit = limit
+        # 解放されずに落ちたプロセスの枠を回収するまでの秒数（1回の実行より長くする）
+        self.ttl_s = ttl_s
+
+    async def acquire(self) -> str:
+        """枠が空くまで待って、待ち始めた順に確保する"""
+        start = time.perf_counter()
+        delay = 0.005
+        ticket = uuid.uuid4().hex
+        while True:
+            attempt = asyncio.ensure_future(
+                self.store.call(
+                    self.store.try_acquire_lease, self.pool, self.limit, self.ttl_s, ticket
+                )
+            )
+            try:
+                lease_id = await asyncio.shield(attempt)
+            except asyncio.CancelledError:
+                # 問い合わせ中にキャンセルされたら、終わるのを待って確保できてしまった枠と順番を返す
+                attempt.add_done_callback(lambda done: self._release_abandoned(done, ticket))
+                raise
+            if lease_id is not None:
+                SHARED_LEASE_WAIT_SECONDS.observe(time.perf_counter() - start, pool=self.pool)
+                return lease_id
+            # 複数のプロセスが同じ間隔で問い合わせないよう、ばらつきを入れる
+            try:
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            except asyncio.CancelledError:
+                self.store.submit(self.store.release_ticket, ticket)
+                raise
+            delay = min(delay * 2, SHARED_LEASE_MAX_POLL_S)
+
+    def _release_abandoned(self, attempt: asyncio.Future, ticket: str) -> None:
+        # コールバックの中では待てないため、解放はスレッドに任せる
+        self.store.submit(self.store.release_ticket, ticket)
+        if not attempt.cancelled() and attempt.exception() is None and attempt.result():
+            self.store.submit(self.store.release_lease, attempt.result())
+
+    async def release(self, lease_id: str) -> None:
+        try:
+            await self.store.call(self.store.release_lease, lease_id)
+        except sqlite3.Error:
+            # 解放に失敗しても、枠は期限切れで回収される
+            logger.exception("Failed to release shared lease %s", lease_id)
+
+    def in_use(self) -> int:
+        return self.store.leases_in_use(self.pool)
+
+
+class LocalSemaphore:
+    """
+    ワーカープロセスが1つのときに SharedSemaphore の代わりに使う、プロセス内のセマフォ
+    共有状態に問い合わせずに待ち、空いた枠は待ち始めた順に渡す（limit は実行中に変えられる）
+    """
+
+    def __init__(self, pool: str, limit: int):
+        self.pool = pool
+        self._limit = limit
+        self._leases: set[str] = set()
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @limit.setter
+    def limit(self, value: int) -> None:
+        self._limit = value
+        # 上限を上げたら、増えた分だけ待っているものに渡す
+        self._wake()
+
+    async def acquire(self) -> str:
+        """枠が空くまで待って、待ち始めた順に確保する"""
+        start = time.perf_counter()
+        if self._waiters or len(self._leases) >= self._limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                lease_id = await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # 枠を渡された直後にキャンセルされたら、次に待っているものに回す
+                    self._leases.discard(waiter.result())
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self._wake()
+                raise
+        else:
+            lease_id = uuid.uuid4().hex
+            self._leases.add(lease_id)
+        SHARED_LEASE_WAIT_SECONDS.observe(time.perf_counter() - start, pool=self.pool)
+        return lease_id
+
+    def _wake(self) -> None:
+        while self._waiters and len(self._leases) < self._limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                lease_id = uuid.uuid4().hex
+                self._leases.add(lease_id)
+                waiter.set_result(lease_id)
+
+    async def release(self, lease_id: str) -> None:
+        self._leases.discard(lease_id)
+        self._wake()
+
+    def in_use(self) -> int:
+        return len(self._leases)
+
+
+# アプリ全体で共有する状態
+shared_state = SharedState()
+# プロセスをまたいで揃える処理（実行枠・キャッシュ・出し直しの検知）で使う共有状態
+# （ワーカープロセスが1つならNoneで、共有状態に問い合わせずプロセス内で済ませる）
+cross_process_state: SharedState | None = shared_state if UVICORN_WORKERS > 1 else None
+
+
+def process_semaphore(pool: str, limit: int, ttl_s: float) -> SharedSemaphore | LocalSemaphore:
+    """ワーカープロセスが複数なら全プロセスで共有するセマフォ、1つならプロセス内のセマフォを返す"""
+    if cross_process_state is None:
+        return LocalSemaphore(pool, limit)
+    return SharedSemaphore(cross_process_state, pool, limit, ttl_s)
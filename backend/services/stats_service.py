@@ -0,0 +1,173 @@
+# 問題ごとの提出統計サービス
+import json
+import math
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from database import ProblemStatsModel, SubmissionModel
+from services.sandbox_service import classify_error_type
+
+
+class QuantileSketch:
+    """
+    対数バケットによるストリーミング分位点スケッチ（DDSketch方式）
+    相対誤差 relative_accuracy 以内で分位点を返し、サイズは値の範囲にのみ依存する
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float):
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse_lowest()
+
+    def _collapse_lowest(self):
+        # 最も小さい2つのバケットをまとめて上限を守る
+        lowest, second = sorted(self.buckets)[:2]
+        self.buckets[second] += self.buckets.pop(lowest)
+
+    def quantile(self, q: float) -> float | None:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                return 2 * self.gamma**key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "a": self.relative_accuracy,
+                "z": self.zero_count,
+                "b": {str(k): v for k, v in self.buckets.items()},
+            }
+        )
+
+    @classmethod
+    def from_json(cls, data: str | None) -> "QuantileSketch":
+        if not data:
+            return cls()
+        raw = json.loads(data)
+        sketch = cls(relative_accuracy=raw["a"])
+        sketch.zero_count = raw["z"]
+        sketch.buckets = {int(k): v for k, v in raw["b"].items()}
+        sketch.count = sketch.zero_count + sum(sketch.buckets.values())
+        return sketch
+
+
+def _apply(stats: ProblemStatsModel, submissions: list, sketch: QuantileSketch):
+    error_type_counts = Counter(json.loads(stats.error_type_counts or "{}"))
+    for submission in submissions:
+        stats.attempts = (stats.attempts or 0) + 1
+        if submission.is_correct:
+            stats.correct_count = (stats.correct_count or 0) + 1
+        elif submission.is_correct is None:
+            stats.unjudged_count = (stats.unjudged_count or 0) + 1
+        if submission.exit_code not in (0, None):
+            stats.error_count = (stats.error_count or 0) + 1
+        if submission.error_type:
+            error_type_counts[submission.error_type] += 1
+        if submission.execution_time_ms is not None:
+            sketch.add(submission.execution_time_ms)
+    stats.error_type_counts = json.dumps(dict(error_type_counts))
+    stats.execution_time_sketch = sketch.to_json()
+    stats.updated_at = datetime.now(timezone.utc)
+
+
+def update_problem_stats(session, submissions: list):
+    """書き込み中の提出をもとに、同じトランザクション内で統計を更新する"""
+    by_problem = defaultdict(list)
+    for submission in submissions:
+        by_problem[submission.problem_id].append(submission)
+
+    existing = {
+        stats.problem_id: stats
+        for stats in session.query(ProblemStatsModel)
+        .filter(ProblemStatsModel.problem_id.in_(by_problem))
+        .all()
+    }
+    for problem_id, problem_submissions in by_problem.items():
+        stats = existing.get(problem_id)
+        if stats is None:
+            stats = ProblemStatsModel(problem_id=problem_id)
+            session.add(stats)
+        sketch = QuantileSketch.from_json(stats.execution_time_sketch)
+        _apply(stats, problem_submissions, sketch)
+
+
+def rebuild_problem_stats(session, batch_size: int = 1000):
+    """提出テーブルを走査して統計を作り直す（既存データの初回移行用）"""
+    session.query(ProblemStatsModel).delete()
+    last_id = 0
+    while True:
+        submissions = (
+            session.query(SubmissionModel)
+            .filter(SubmissionModel.id > last_id)
+            .order_by(SubmissionModel.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not submissions:
+            break
+        for submission in submissions:
+            # error_type列がなかった頃の提出は標準エラーから判定する
+            if submission.error_type is None and submission.exit_code not in (0, None):
+                submission.error_type = classify_error_type(
+                    submission.exit_code, submission.stderr or ""
+                )
+        update_problem_stats(session, submissions)
+        session.flush()
+        last_id = submissions[-1].id
+    session.commit()
+
+
+def backfill_problem_stats(session):
+    """統計が未作成で提出がある場合だけ作り直す"""
+    if session.query(ProblemStatsModel.problem_id).first() is not None:
+        return
+    if session.query(SubmissionModel.id).first() is None:
+        return
+    rebuild_problem_stats(session)
+
+
+def summarize_problem_stats(problem_id: int, stats: ProblemStatsModel | None) -> dict:
+    """統計行をAPIレスポンス用の値に変換する"""
+    if stats is None:
+        return {"problem_id": problem_id}
+    sketch = QuantileSketch.from_json(stats.execution_time_sketch)
+    error_type_counts = json.loads(stats.error_type_counts or "{}")
+    attempts = stats.attempts or 0
+    unjudged = stats.unjudged_count or 0
+    # 正解率は判定できた提出だけで計算する（サンドボックスの期限切れで下がらないように）
+    judged = attempts - unjudged
+    return {
+        "problem_id": problem_id,
+        "attempts": attempts,
+        "correct_count": stats.correct_count or 0,
+        "error_count": stats.error_count or 0,
+        "unjudged_count": unjudged,
+        "pass_rate": (stats.correct_count or 0) / judged if judged else None,
+        "median_execution_time_ms": sketch.quantile(0.5),
+        "p95_execution_time_ms": sketch.quantile(0.95),
+        "most_common_error_type": max(
+            error_type_counts, key=error_type_counts.get, default=None
+        ),
+        "error_type_counts": error_type_counts,
+    }
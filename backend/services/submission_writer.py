@@ -0,0 +1,153 @@
+# 提出結果のグループコミット書き込みサービス
+"""
+提出結果をバックグラウンドでまとめてコミットするライター
+
+耐久性について:
+- write() はその提出を含むバッチの COMMIT が完了してから返る。
+  そのためレスポンスを返した提出は、従来の add() + commit() と同様に
+  SQLite 上で永続化済みであることが保証される。
+- 1件あたりの待ち時間は最大でバッチ窓（SUBMISSION_WRITE_WINDOW_MS）と
+  直前のバッチのコミット時間の合計だけ増える。
+- プロセスが異常終了した場合、キューに入っていてまだコミットされていない
+  提出は失われるが、それらのリクエストにはレスポンスが返っていない。
+- バッチのコミットが失敗した場合は1件ずつコミットし直し、
+  失敗した提出の呼び出し元にだけ例外を返す。
+- before_commit に渡した関数（統計の更新など）は提出と同じトランザクションで
+  実行されるため、提出と派生データが食い違うことはない。
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# バッチを待つ最大時間（ミリ秒）と1バッチの最大件数
+SUBMISSION_WRITE_WINDOW_MS = float(os.getenv("SUBMISSION_WRITE_WINDOW_MS", "5"))
+SUBMISSION_WRITE_MAX_BATCH = int(os.getenv("SUBMISSION_WRITE_MAX_BATCH", "64"))
+
+
+class SubmissionWriter:
+    """提出のINSERTをまとめて1トランザクションでコミットするライター"""
+
+    def __init__(
+        self,
+        session_factory,
+        window_ms: float = SUBMISSION_WRITE_WINDOW_MS,
+        max_batch: int = SUBMISSION_WRITE_MAX_BATCH,
+        before_commit=None,
+    ):
+        self._session_factory = session_factory
+        self._before_commit = before_commit
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and self._loop is loop and not self._task.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        # 最初に書き込んだリクエストのトレースを引き継がないよう空のコンテキストで動かす
+        self._task = loop.create_task(self._run(), context=contextvars.Context())
+
+    async def write(self, submission) -> int:
+        """提出をキューに入れ、コミット完了後に採番されたIDを返す"""
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((submission, future))
+        return await future
+
+    async def stop(self):
+        """キューに残った提出をコミットしてからライターを停止する"""
+        if self._task is None or self._task.done():
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _collect_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.window_ms / 1000
+        while len(batch) < self.max_batch:
+            # すでにキューにある分は待たずに取り込む
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            try:
+                results = await asyncio.to_thread(
+                    self._commit_batch, [submission for submission, _ in batch]
+                )
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _commit_batch(self, submissions: list) -> list:
+        """バッチを1トランザクションでコミットし、各提出のIDを返す"""
+        # 失敗時に採番済みIDを元に戻すため、代入前のIDを控えておく
+        preset_ids = [submission.id for submission in submissions]
+        session = self._session_factory()
+        try:
+            session.add_all(submissions)
+            session.flush()
+            ids = [submission.id for submission in submissions]
+            if self._before_commit is not None:
+                self._before_commit(session, submissions)
+            session.commit()
+            return ids
+        except Exception as e:
+            session.rollback()
+            logger.warning("Group commit failed, retrying one by one: %s", e)
+        finally:
+            session.close()
+
+        results = []
+        for submission, preset_id in zip(submissions, preset_ids):
+            submission.id = preset_id
+            session = self._session_factory()
+            try:
+                session.add(submission)
+                session.flush()
+                submission_id = submission.id
+                if self._before_commit is not None:
+                    self._before_commit(session, [submission])
+                session.commit()
+                results.append(submission_id)
+            except Exception as e:
+                session.rollback()
+                logger.error("Failed to save submission: %s", e)
+                results.append(e)
+            finally:
+                session.close()
+        return results
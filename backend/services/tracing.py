@@ -0,0 +1,226 @@
+# リクエストトレーシング
+"""
+1件の提出に関わる処理（ノートブック変換・ユーザーコード実行・正解コード実行・
+アドバイス生成・コミット）をトレースIDで結び付ける軽量なトレーシング
+
+- トレースIDはcontextvarsで伝播し、ログレコード（%(trace_id)s）と
+  サンドボックスコンテナのラベルにも付与する
+- スパンは常に記録するが、エクスポートするのはサンプリングされたトレースと、
+  TRACE_SLOW_MS を超えた遅いトレースだけにして負荷を抑える
+- エクスポート先はメモリ上のリングバッファ（管理用エンドポイントから参照）と、
+  TRACE_EXPORT_FILE を指定した場合のローテーションするJSON Linesファイル
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import random
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 通常のトレースをエクスポートする割合
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+# この時間（ミリ秒）を超えたトレースはサンプリングに関係なくエクスポートする
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "10000"))
+# リングバッファに保持するトレース数
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+# 指定するとトレースをJSON Linesでファイルにも書き出す
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+TRACE_EXPORT_MAX_BYTES = int(os.getenv("TRACE_EXPORT_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_EXPORT_BACKUP_COUNT = int(os.getenv("TRACE_EXPORT_BACKUP_COUNT", "5"))
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class _Trace:
+    """1つのトレースに属するスパンの集まり"""
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: list[Span] = []
+
+
+class Span:
+    """処理の1区間"""
+
+    def __init__(self, trace: _Trace, name: str, parent: "Span | None", attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms: float | None = None
+        self._histogram = None
+        self._stage = name
+        self._token = None
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self, error: BaseException | None = None):
+        if self.duration_ms is not None:
+            return
+        elapsed = time.perf_counter() - self._start
+        self.duration_ms = elapsed * 1000
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+        if self._histogram is not None:
+            self._histogram.observe(elapsed, stage=self._stage)
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        self.trace.spans.append(self)
+        if self.parent_id is None:
+            _export(self.trace, self)
+
+    def to_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def current_trace_id() -> str | None:
+    """実行中のトレースIDを返す（トレース外ならNone）"""
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def start_span(
+    name: str,
+    histogram=None,
+    stage: str | None = None,
+    trace_id: str | None = None,
+    **attributes,
+):
+    """
+    スパンを開始して現在のスパンにする（end()で終了）
+    親がなければ新しいトレースを開始し、ここでサンプリングを決める
+    histogramを渡すと、同じ所要時間をメトリクスにも stage（省略時はname）で記録する
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        trace = parent.trace
+    else:
+        trace = _Trace(
+            trace_id or secrets.token_hex(16), random.random() < TRACE_SAMPLE_RATE
+        )
+    span = Span(trace, name, parent, attributes)
+    span._histogram = histogram
+    span._stage = stage or name
+    span._token = _current_span.set(span)
+    return span
+
+
+@contextmanager
+def span(name: str, histogram=None, stage: str | None = None, **attributes):
+    """ブロックをスパンとして記録する"""
+    current = start_span(name, histogram=histogram, stage=stage, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    current.end()
+
+
+class _TraceBuffer:
+    """エクスポート済みトレースのリングバッファ"""
+
+    def __init__(self, size: int):
+        self._lock = threading.Lock()
+        self._traces = deque(maxlen=size)
+
+    def add(self, trace: dict):
+        with self._lock:
+            self._traces.append(trace)
+
+    def list(
+        self, limit: int = 50, min_duration_ms: float = 0, name: str | None = None
+    ) -> list[dict]:
+        with self._lock:
+            traces = list(self._traces)
+        result = []
+        for trace in reversed(traces):
+            if trace["duration_ms"] < min_duration_ms:
+                continue
+            if name is not None and trace["name"] != name:
+                continue
+            result.append(trace)
+            if len(result) >= limit:
+                break
+        return result
+
+    def get(self, trace_id: str) -> dict | None:
+        with self._lock:
+            for trace in reversed(self._traces):
+                if trace["trace_id"] == trace_id:
+                    return trace
+        return None
+
+
+trace_buffer = _TraceBuffer(TRACE_BUFFER_SIZE)
+
+_file_logger = None
+if TRACE_EXPORT_FILE:
+    _file_logger = logging.getLogger("trace_export")
+    _file_logger.propagate = False
+    _file_handler = logging.handlers.RotatingFileHandler(
+        TRACE_EXPORT_FILE,
+        maxBytes=TRACE_EXPORT_MAX_BYTES,
+        backupCount=TRACE_EXPORT_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    _file_handler.setFormatter(logging.Formatter("%(message)s"))
+    _file_logger.addHandler(_file_handler)
+    _file_logger.setLevel(logging.INFO)
+
+
+def _export(trace: _Trace, root: Span):
+    if not trace.sampled and root.duration_ms < TRACE_SLOW_MS:
+        return
+    exported = {
+        "trace_id": trace.trace_id,
+        "name": root.name,
+        "start_time": root.start_time,
+        "duration_ms": root.duration_ms,
+        "status": root.status,
+        "attributes": root.attributes,
+        "spans": [s.to_dict() for s in sorted(trace.spans, key=lambda s: s.start_time)],
+    }
+    trace_buffer.add(exported)
+    if _file_logger is not None:
+        _file_logger.info(json.dumps(exported, ensure_ascii=False))
+
+
+def install_log_record_factory():
+    """すべてのログレコードに trace_id 属性を付ける"""
+    original_factory = logging.getLogRecordFactory()
+
+    def factory(*args, **kwargs):
+        record = original_factory(*args, **kwargs)
+        record.trace_id = current_trace_id() or "-"
+        return record
+
+    logging.setLogRecordFactory(factory)
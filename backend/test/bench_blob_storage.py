@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+提出データの保存容量比較ベンチマーク
+旧形式（submissionsに本文を直接保存）とblobsテーブル（圧縮・重複排除）の
+データベースファイルサイズを、test/配下の実際のNotebookを使ったデータで比較する
+"""
+
+import glob
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from database import Base, SubmissionModel
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ADVICE_SENTENCES = [
+    "コードはよく書けています。",
+    "変数名をもう少し具体的にすると読みやすくなります。",
+    "ループの範囲が正しいか、print文で確認してみましょう。",
+    "エラーメッセージの最後の行に原因が書かれています。",
+    "関数に分けると処理の流れが分かりやすくなります。",
+    "入力が空の場合にどうなるか考えてみましょう。",
+    "インデックスが0から始まることに注意しましょう。",
+    "正解です！別の解き方として内包表記も試してみてください。",
+]
+
+
+def build_dataset(students: int, attempts: int, seed: int = 0):
+    """実際のNotebookを元に、再提出を含む提出データを生成する"""
+    rng = random.Random(seed)
+    notebooks = []
+    for path in sorted(glob.glob(os.path.join(TEST_DIR, "*.ipynb"))):
+        with open(path, encoding="utf-8") as f:
+            notebooks.append(f.read())
+
+    submissions = []
+    start = datetime(2025, 4, 1)
+    for student in range(students):
+        for problem_id, notebook in enumerate(notebooks, start=1):
+            # 学習者ごとに少しだけ異なるコード
+            code = notebook.replace("print(", f"print(  # student {student % 40}\n", 1)
+            for attempt in range(rng.randint(1, attempts)):
+                # 修正せずに再提出するケースも多い
+                if rng.random() < 0.4:
+                    code = code + f"\n# fix {attempt}"
+                failed = rng.random() < 0.3
+                stdout = "" if failed else f"Result: {problem_id * 42}\n" * 20
+                stderr = (
+                    "Traceback (most recent call last):\n"
+                    '  File "<string>", line 12, in <module>\n'
+                    "NameError: name 'x' is not defined\n"
+                    if failed
+                    else ""
+                )
+                advice = "\n".join(rng.sample(ADVICE_SENTENCES, 4)) * 3
+                submissions.append(
+                    {
+                        "problem_id": problem_id,
+                        "submitter_id": f"s{student:05d}",
+                        "user_code": code,
+                        "stdout": stdout,
+                        "stderr": stderr,
+                        "advice_text": advice,
+                        "exit_code": 1 if failed else 0,
+                        "is_correct": not failed,
+                        "submitted_at": start
+                        + timedelta(minutes=len(submissions)),
+                    }
+                )
+    return submissions
+
+
+def legacy_db_size(path: str, submissions) -> int:
+    con = sqlite3.connect(path)
+    con.execute(
+        "CREATE TABLE submissions (id INTEGER PRIMARY KEY, problem_id INTEGER, "
+        "submitter_id VARCHAR, user_code TEXT, stdout TEXT, stderr TEXT, "
+        "execution_time_ms FLOAT, exit_code INTEGER, advice_text TEXT, "
+        "is_correct BOOLEAN, submitted_at DATETIME)"
+    )
+    con.executemany(
+        "INSERT INTO submissions (problem_id, submitter_id, user_code, stdout, "
+        "stderr, exit_code, advice_text, is_correct, submitted_at) VALUES "
+        "(:problem_id, :submitter_id, :user_code, :stdout, :stderr, :exit_code, "
+        ":advice_text, :is_correct, :submitted_at)",
+        [dict(row, submitted_at=row["submitted_at"].isoformat(" ")) for row in submissions],
+    )
+    con.commit()
+    con.execute("VACUUM")
+    con.close()
+    return os.path.getsize(path)
+
+
+def blob_db_size(path: str, submissions) -> int:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        for i in range(0, len(submissions), 500):
+            session.add_all(
+                SubmissionModel(**row) for row in submissions[i : i + 500]
+            )
+            session.commit()
+    engine.dispose()
+    con = sqlite3.connect(path)
+    con.execute("VACUUM")
+    con.close()
+    return os.path.getsize(path)
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    submissions = build_dataset(students=students, attempts=6)
+    raw_bytes = sum(
+        len((row[key] or "").encode("utf-8"))
+        for row in submissions
+        for key in ("user_code", "stdout", "stderr", "advice_text")
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = legacy_db_size(os.path.join(tmp, "legacy.db"), submissions)
+        blobs = blob_db_size(os.path.join(tmp, "blobs.db"), submissions)
+
+    print("=== 提出データ保存容量の比較 ===")
+    print(f"提出数: {len(submissions)}  (学習者 {students} 人)")
+    print(f"本文の合計サイズ: {raw_bytes / 1024 / 1024:.2f} MiB")
+    print(f"旧形式 (インライン Text): {legacy / 1024 / 1024:.2f} MiB")
+    print(f"blobs (圧縮 + 重複排除): {blobs / 1024 / 1024:.2f} MiB")
+    print(f"削減率: {(1 - blobs / legacy) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+提出結果のグループコミットベンチマーク
+1件ずつコミットする従来方式と、バッチ窓を変えたSubmissionWriterの
+1秒あたりの書き込み件数を比較する
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from database import Base, SubmissionModel
+from services.submission_writer import SubmissionWriter
+
+TOTAL_SUBMISSIONS = 2000
+CONCURRENCY = 64
+WINDOWS_MS = [0, 1, 5, 20]
+
+
+def make_session_factory(path: str):
+    engine = create_engine(
+        f"sqlite:///{path}", connect_args={"check_same_thread": False}
+    )
+
+    @event.listens_for(engine, "connect")
+    def _wal(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    Base.metadata.create_all(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine), engine
+
+
+def make_submission(i: int) -> SubmissionModel:
+    return SubmissionModel(
+        problem_id=i % 10,
+        submitter_id=f"s{i % 500:05d}",
+        user_code=f"print({i})",
+        stdout=f"{i}\n",
+        stderr="",
+        execution_time_ms=120.0,
+        exit_code=0,
+        advice_text="よく書けています。",
+        is_correct=True,
+        submitted_at=datetime.now(timezone.utc),
+    )
+
+
+async def run_producers(write):
+    counter = iter(range(TOTAL_SUBMISSIONS))
+
+    async def producer():
+        for i in counter:
+            await write(make_submission(i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer() for _ in range(CONCURRENCY)))
+    return TOTAL_SUBMISSIONS / (time.perf_counter() - start)
+
+
+async def bench_per_request_commit(session_factory):
+    def commit_one(submission):
+        session = session_factory()
+        try:
+            session.add(submission)
+            session.commit()
+        finally:
+            session.close()
+
+    return await run_producers(lambda s: asyncio.to_thread(commit_one, s))
+
+
+async def bench_group_commit(session_factory, window_ms: float):
+    writer = SubmissionWriter(session_factory, window_ms=window_ms)
+    rate = await run_producers(writer.write)
+    await writer.stop()
+    return rate
+
+
+async def main():
+    print("=== 提出結果の書き込みスループット ===")
+    print(f"提出数: {TOTAL_SUBMISSIONS}  同時実行数: {CONCURRENCY}")
+    with tempfile.TemporaryDirectory() as tmp:
+        session_factory, engine = make_session_factory(os.path.join(tmp, "base.db"))
+        rate = await bench_per_request_commit(session_factory)
+        engine.dispose()
+        print(f"1件ずつコミット         : {rate:8.0f} 件/秒")
+
+        for window_ms in WINDOWS_MS:
+            session_factory, engine = make_session_factory(
+                os.path.join(tmp, f"group-{window_ms}.db")
+            )
+            rate = await bench_group_commit(session_factory, window_ms)
+            engine.dispose()
+            print(f"グループコミット {window_ms:>3}ms窓 : {rate:8.0f} 件/秒")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+提出処理のホットパス（純Python部分）のマイクロベンチマーク
+ノートブック変換・pip行の抽出と削除・エラー分類・プロンプト生成・出力比較を
+代表的な入力（test/ 内の実際のノートブックを含む）で計測し、
+保存済みのベースラインより閾値以上遅くなったら終了コード1で終了する
+
+使い方:
+    python backend/test/bench_hot_paths.py                     # ベースラインと比較
+    python backend/test/bench_hot_paths.py --update-baseline   # ベースラインを更新
+    python backend/test/bench_hot_paths.py --threshold 0.5 --filter notebook
+
+マシン間の速度差を打ち消すため、各結果は同じ実行で計測した
+校正用ループの時間との比で比較する
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from services.comparators import compare_outputs
+from services.prompt_builder import build_advice_prompt
+from services.sandbox_service import (
+    classify_error_type,
+    extract_pip_packages,
+    notebook_to_python,
+    remove_pip_install_lines,
+)
+
+BASELINE_PATH = os.path.join(TEST_DIR, "bench_hot_paths_baseline.json")
+# 既定で許容する遅くなる割合（0.25 = 25%）
+DEFAULT_THRESHOLD = 0.25
+# 1ケースあたりの計測時間の目安（秒）と繰り返し回数
+TARGET_SECONDS = 0.2
+REPEATS = 5
+
+
+def _read(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def _vscode_notebook(cells: int) -> str:
+    body = "".join(
+        f'<VSCode.Cell id="{i}" language="python">\nx{i} = {i}\nprint(x{i} * 2)\n</VSCode.Cell>\n'
+        f'<VSCode.Cell id="m{i}" language="markdown">\n# 説明 {i}\n</VSCode.Cell>\n'
+        for i in range(cells)
+    )
+    return f"<VSCode.Notebook>\n{body}</VSCode.Notebook>"
+
+
+def _code_with_pip_lines(lines: int) -> str:
+    code = []
+    for i in range(lines):
+        if i % 50 == 0:
+            code.append("!pip install --quiet numpy pandas==2.2.0 scikit-learn")
+        elif i % 50 == 25:
+            code.append("pip install requests")
+        else:
+            code.append(f"value_{i} = sum(range({i}))")
+    return "\n".join(code)
+
+
+STDERR_SAMPLES = [
+    (1, '  File "<string>", line 1\n    print(\nSyntaxError: unexpected EOF'),
+    (1, "Traceback (most recent call last):\nNameError: name 'x' is not defined"),
+    (1, "Traceback (most recent call last):\nKeyError: 'missing'"),
+    (1, "Traceback (most recent call last):\nZeroDivisionError: division by zero"),
+    (1, "Traceback (most recent call last):\nRuntimeError: something failed"),
+    (124, "Code execution timed out (30 seconds)"),
+    (0, ""),
+]
+
+
+def build_cases() -> dict:
+    """ケース名 → 引数なしで呼べる関数"""
+    cases = {}
+    for path in sorted(glob.glob(os.path.join(TEST_DIR, "*.ipynb"))):
+        notebook = _read(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        cases[f"notebook_to_python[{name}]"] = lambda nb=notebook: notebook_to_python(
+            nb
+        )
+    vscode = _vscode_notebook(200)
+    cases["notebook_to_python[vscode_xml_200_cells]"] = lambda: notebook_to_python(
+        vscode
+    )
+
+    small_code = _code_with_pip_lines(40)
+    large_code = _code_with_pip_lines(5000)
+    cases["extract_pip_packages[40_lines]"] = lambda: extract_pip_packages(small_code)
+    cases["extract_pip_packages[5000_lines]"] = lambda: extract_pip_packages(large_code)
+    cases["remove_pip_install_lines[5000_lines]"] = (
+        lambda: remove_pip_install_lines(large_code)
+    )
+
+    def classify_all():
+        for exit_code, stderr in STDERR_SAMPLES:
+            classify_error_type(exit_code, stderr)
+
+    cases["classify_error_type[7_samples]"] = classify_all
+    long_traceback = "Traceback (most recent call last):\n" + (
+        '  File "<string>", line 3, in f\n    return f(n - 1)\n' * 1000
+    ) + "RecursionError: maximum recursion depth exceeded"
+    cases["classify_error_type[recursion_traceback]"] = lambda: classify_error_type(
+        1, long_traceback
+    )
+
+    assignment = _read(os.path.join(TEST_DIR, "test_assignment_notebook.ipynb"))
+    small_stdout = "\n".join(str(i) for i in range(20))
+    large_stdout = "\n".join(f"line {i}: {i * i}" for i in range(100_000))
+    cases["build_advice_prompt[small]"] = lambda: build_advice_prompt(
+        problem_title="2つの整数の和",
+        problem_description="2つの整数を読み込み、その和を出力してください。",
+        user_code="a, b = map(int, input().split())\nprint(a + b)",
+        execution_stdout=small_stdout,
+        execution_stderr="",
+        correct_code="print(sum(map(int, input().split())))",
+        is_correct=True,
+    )
+    cases["build_advice_prompt[notebook_100k_lines]"] = lambda: build_advice_prompt(
+        problem_title="深層生成モデル",
+        problem_description="ノートブックの課題を完成させてください。",
+        user_code=large_code,
+        execution_stdout=large_stdout,
+        execution_stderr=long_traceback,
+        correct_code=assignment,
+        is_correct=False,
+    )
+    reference_stdout = large_stdout.replace("line 50000:", "line 50000: 0 +", 1)
+    cases["build_advice_prompt[100k_lines_with_reference]"] = lambda: build_advice_prompt(
+        problem_title="深層生成モデル",
+        problem_description="ノートブックの課題を完成させてください。",
+        user_code=assignment,
+        execution_stdout=large_stdout,
+        execution_stderr="",
+        correct_code=assignment,
+        reference_stdout=reference_stdout,
+    )
+
+    mismatch = large_stdout[:-1] + "0"
+    cases["compare_outputs[exact_100k_lines_equal]"] = lambda: compare_outputs(
+        large_stdout + "\n", large_stdout
+    )
+    cases["compare_outputs[exact_100k_lines_last_differs]"] = lambda: compare_outputs(
+        mismatch, large_stdout
+    )
+    float_stdout = "\n".join(f"{i / 7:.6f}" for i in range(100_000))
+    rounded_stdout = "\n".join(f"{i / 7:.5f}" for i in range(100_000))
+    cases["compare_outputs[numeric_100k_lines_within_tolerance]"] = lambda: compare_outputs(
+        rounded_stdout, float_stdout, "numeric", {"abs_tol": 1e-4}
+    )
+    cases["compare_outputs[unordered_100k_lines]"] = lambda: compare_outputs(
+        "\n".join(reversed(large_stdout.split("\n"))), large_stdout, "unordered_lines"
+    )
+    return cases
+
+
+def _calibration():
+    total = 0
+    for i in range(20000):
+        total += i * i % 7
+    return total
+
+
+def measure(func) -> float:
+    """1回あたりの実行時間（マイクロ秒、REPEATS回の最小値）"""
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= TARGET_SECONDS / REPEATS or number >= 1_000_000:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(TARGET_SECONDS / REPEATS / elapsed))
+    best = elapsed
+    for _ in range(REPEATS - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number * 1_000_000
+
+
+def run(filter_text: str | None = None) -> dict:
+    calibration_us = measure(_calibration)
+    results = {}
+    for name, func in build_cases().items():
+        if filter_text and filter_text not in name:
+            continue
+        results[name] = measure(func)
+    # 計測中の負荷の変化に引きずられないよう、前後で測った校正値の小さい方を使う
+    calibration_us = min(calibration_us, measure(_calibration))
+    return {"calibration_us": calibration_us, "results_us": results}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """ベースラインより threshold 以上遅くなったケースの名前を返す"""
+    scale = current["calibration_us"] / baseline["calibration_us"]
+    regressions = []
+    print(f"{'case':<48}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, current_us in current["results_us"].items():
+        baseline_us = baseline["results_us"].get(name)
+        if baseline_us is None:
+            print(f"{name:<48}{'-':>12}{current_us:>12.1f}{'new':>9}")
+            continue
+        expected_us = baseline_us * scale
+        change = current_us / expected_us - 1
+        mark = ""
+        if change > threshold:
+            regressions.append(name)
+            mark = "  << REGRESSION"
+        print(
+            f"{name:<48}{expected_us:>12.1f}{current_us:>12.1f}{change:>+9.1%}{mark}"
+        )
+    print(f"(µs per call; baseline scaled by machine speed x{scale:.2f})")
+    return regressions
+
+
+def test_hot_path_cases_run():
+    """全ケースが例外なく実行できるか"""
+    for name, func in build_cases().items():
+        func()
+    assert compare_outputs("1\n2\n", "1\n2").is_correct
+    assert not compare_outputs("1\n3", "1\n2").is_correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ホットパスのマイクロベンチマーク")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--filter", help="名前にこの文字列を含むケースだけ実行する")
+    args = parser.parse_args()
+
+    current = run(args.filter)
+    if args.update_baseline:
+        baseline = {"calibration_us": current["calibration_us"], "results_us": {}}
+        if args.filter and os.path.exists(args.baseline):
+            baseline = json.loads(_read(args.baseline))
+            baseline["results_us"].update(
+                {
+                    name: value * baseline["calibration_us"] / current["calibration_us"]
+                    for name, value in current["results_us"].items()
+                }
+            )
+        else:
+            baseline["results_us"] = current["results_us"]
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        for name, value in current["results_us"].items():
+            print(f"{name:<48}{value:>12.1f}")
+        print(f"ベースラインを保存しました: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"ベースラインがありません。--update-baseline で作成してください: {args.baseline}")
+        sys.exit(2)
+    regressions = compare(current, json.loads(_read(args.baseline)), args.threshold)
+    if regressions:
+        print(f"NG: {len(regressions)}件のケースが{args.threshold:.0%}以上遅くなりました")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
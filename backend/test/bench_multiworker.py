@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+uvicorn のワーカープロセス数を変えたときのスループットの比較
+
+ワーカー数ごとに一時DB・一時の共有状態でサーバーを起動し、load_test.py と同じ負荷をかける。
+サンドボックスはコンテナの代わりに指定時間だけ待つ偽物にするが、全プロセス共通の実行枠
+（SANDBOX_MAX_CONCURRENT_RUNS）は本物と同じく通る。
+API側の処理（ノートブック変換・判定・シリアライズ・DB書き込み）がCPUを使うため、
+コア数までワーカーを増やすとスループットが伸びる
+
+例:
+    python backend/test/bench_multiworker.py --workers 1,2,4 --requests 1000
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(TEST_DIR, "..")
+sys.path.append(BACKEND_DIR)
+
+
+def create_app():
+    """サーバーの各ワーカープロセスで呼ばれるアプリのファクトリ（偽のサンドボックスを入れる）"""
+    import logging
+
+    import main
+    import routers.submissions as submissions
+    import services.sandbox_service as sandbox_service
+
+    logging.getLogger().setLevel(logging.WARNING)
+    sandbox_seconds = float(os.environ["BENCH_SANDBOX_MS"]) / 1000
+    advice_seconds = float(os.environ["BENCH_ADVICE_MS"]) / 1000
+
+    async def fake_run_in_sandbox(user_code, stdin_input=None):
+        await asyncio.sleep(sandbox_seconds)
+        if "# error" in user_code:
+            stderr = (
+                "Traceback (most recent call last):\n"
+                '  File "<string>", line 1, in <module>\n'
+                "NameError: name 'undefined_name' is not defined\n"
+            )
+            return sandbox_service.CodeExecutionResult(
+                stdout="",
+                stderr=stderr,
+                execution_time_ms=sandbox_seconds * 1000,
+                exit_code=1,
+                error_type="NameError",
+                succeeded=False,
+            )
+        return sandbox_service.CodeExecutionResult(
+            stdout="4\n" if "# wrong" in user_code else "3\n",
+            stderr="",
+            execution_time_ms=sandbox_seconds * 1000,
+            exit_code=0,
+            succeeded=True,
+        )
+
+    async def fake_advice(**kwargs) -> str:
+        await asyncio.sleep(advice_seconds)
+        return "正解です。" if kwargs.get("is_correct") else "出力を確認しましょう。"
+
+    sandbox_service.run_in_sandbox = fake_run_in_sandbox
+    submissions.generate_advice_with_huggingface = fake_advice
+    return main.app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers: int, workdir: str, args) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DATABASE_PATH=os.path.join(workdir, "app.db"),
+        SHARED_STATE_PATH=os.path.join(workdir, "shared_state.db"),
+        ARCHIVE_DIR=os.path.join(workdir, "archive"),
+        SANDBOX_MAX_CONCURRENT_RUNS=str(args.sandbox_slots),
+        # 1プロセスのときは実行枠などをプロセス内で扱う（本番のDockerイメージと同じ）
+        UVICORN_WORKERS=str(workers),
+        BENCH_SANDBOX_MS=str(args.sandbox_ms),
+        BENCH_ADVICE_MS=str(args.advice_ms),
+    )
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "bench_multiworker:create_app",
+            "--factory",
+            "--app-dir",
+            TEST_DIR,
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(base_url: str, process: subprocess.Popen, timeout_s: float = 30):
+    import httpx
+
+    deadline = time.monotonic() + timeout_s
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            try:
+                if (await client.get("/problems/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise TimeoutError(f"Server at {base_url} did not become ready")
+
+
+async def measure(workers: int, args) -> dict:
+    import httpx
+    import load_test
+
+    load_args = load_test.parse_args(
+        [
+            "--concurrency",
+            str(args.concurrency),
+            "--requests",
+            str(args.requests),
+            "--mix",
+            args.mix,
+            # 同じ提出者の出し直し（409）で計測がぶれないよう、提出者を十分に散らす
+            "--submitters",
+            "100000",
+        ]
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        process, base_url = start_server(workers, workdir, args)
+        try:
+            await wait_ready(base_url, process)
+            async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+                summary, elapsed = await load_test.run_load(client, load_args)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    overall = summary["all"]
+    return {
+        "workers": workers,
+        "throughput_rps": overall["requests"] / elapsed,
+        "p50_ms": overall["p50_ms"],
+        "p95_ms": overall["p95_ms"],
+        "errors": overall["errors"],
+    }
+
+
+def print_report(results: list[dict]) -> None:
+    base = results[0]["throughput_rps"]
+    print(f"{'workers':>8}{'req/s':>10}{'speedup':>9}{'p50':>9}{'p95':>9}{'errors':>8}")
+    for r in results:
+        print(
+            f"{r['workers']:>8}{r['throughput_rps']:>10.1f}{r['throughput_rps'] / base:>8.2f}x"
+            f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['errors']:>8}"
+        )
+    print(f"(latency in ms, {os.cpu_count()} CPUs)")
+
+
+async def main_async(args) -> list[dict]:
+    results = []
+    for workers in [int(w) for w in args.workers.split(",")]:
+        results.append(await measure(workers, args))
+    print_report(results)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ワーカープロセス数ごとのスループット")
+    parser.add_argument("--workers", default="1,2,4", help="比較するワーカー数")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--mix", default="submit=4,upload=1,list_problems=2,get_problem=2")
+    parser.add_argument("--sandbox-ms", type=float, default=5)
+    parser.add_argument("--advice-ms", type=float, default=5)
+    parser.add_argument(
+        "--sandbox-slots", type=int, default=8, help="全プロセス共通の実行枠"
+    )
+    return parser.parse_args(argv)
+
+
+def test_multiworker_smoke():
+    """複数のワーカープロセスで起動しても、共有状態を使ってエラーなく処理できるか"""
+    args = parse_args(["--workers", "2", "--requests", "60", "--concurrency", "8"])
+    (result,) = asyncio.run(main_async(args))
+    assert result["errors"] == 0
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async(parse_args()))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+エンドポイントごとのJSONシリアライズ・圧縮コストのマイクロベンチマーク
+従来の経路（Pydanticモデルの再構築 + 標準json）と、
+orjson・キャッシュ済み本文を使う現在の経路を比較する
+"""
+
+import os
+import sys
+import timeit
+from datetime import datetime, timezone
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from middleware import _BrotliCompressor, _GzipCompressor
+from models import Problem, SubmissionPage, SubmissionResponse, SubmissionSummary
+from services.problem_cache import _serialize
+
+
+class _Row:
+    """SQLAlchemyの行の代わり"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_problem_rows(n: int):
+    now = datetime.now(timezone.utc)
+    return [
+        _Row(
+            id=i,
+            title=f"問題 {i}",
+            description="リストの合計を求めるプログラムを書いてください。" * 20,
+            correct_code="print(sum(map(int, input().split())))\n" * 10,
+            test_input="1 2 3",
+            created_at=now,
+            updated_at=now,
+        )
+        for i in range(n)
+    ]
+
+
+def legacy_problems(rows):
+    problems = [
+        Problem(
+            id=r.id,
+            title=r.title,
+            description=r.description,
+            correct_code=r.correct_code,
+            test_input=r.test_input,
+            created_at=r.created_at,
+            updated_at=r.updated_at,
+        )
+        for r in rows
+    ]
+    return JSONResponse(jsonable_encoder(problems)).body
+
+
+def make_submission_response(output_lines: int) -> SubmissionResponse:
+    stdout = "".join(f"{i}: 計算結果 {i * 3.14159:.5f}\n" for i in range(output_lines))
+    return SubmissionResponse(
+        message="コードの実行が完了しました",
+        stdout=stdout,
+        stderr="",
+        execution_time_ms=1234.5,
+        exit_code=0,
+        advice_text="よく書けています。" * 200,
+        is_correct=False,
+        correct_stdout=stdout,
+        correct_stderr="",
+        correct_execution_time_ms=1200.0,
+    )
+
+
+def make_page(n: int) -> SubmissionPage:
+    now = datetime.now(timezone.utc)
+    return SubmissionPage(
+        items=[
+            SubmissionSummary(
+                id=i,
+                problem_id=i % 10,
+                submitter_id=f"s{i:05d}",
+                is_correct=i % 2 == 0,
+                exit_code=0,
+                execution_time_ms=100.0 + i,
+                submitted_at=now,
+            )
+            for i in range(n)
+        ],
+        next_cursor="MjAyNS0wMS0wMVQwMDowMDowMHwxMjM=",
+    )
+
+
+def bench(label: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"  {label:<40} {seconds * 1e6:10.1f} µs")
+
+
+def main():
+    print("=== JSONシリアライズのコスト（1リクエストあたり）===")
+
+    rows = make_problem_rows(200)
+    problems = [Problem.model_validate(r) for r in rows]
+    cached_body = _serialize(problems)
+    print("GET /problems/ (200問)")
+    bench("従来: モデル再構築 + 標準json", lambda: legacy_problems(rows), 50)
+    bench("orjson (キャッシュ再構築時)", lambda: _serialize(problems), 50)
+    bench("キャッシュ済み本文", lambda: cached_body, 50000)
+
+    print("GET /problems/{id}")
+    bench("従来: モデル再構築 + 標準json", lambda: legacy_problems(rows[:1]), 5000)
+    bench("キャッシュ済み本文", lambda: cached_body, 50000)
+
+    for lines in (100, 20000):
+        response = make_submission_response(lines)
+        print(f"POST /submissions/ (出力 {lines} 行, {len(response.stdout) // 1024} KiB)")
+        bench(
+            "標準json (jsonable_encoder)",
+            lambda: JSONResponse(jsonable_encoder(response)).body,
+            20,
+        )
+        bench(
+            "orjson (model_dump)",
+            lambda: ORJSONResponse(response.model_dump()).body,
+            20,
+        )
+
+    page = make_page(500)
+    print("GET /submissions/ (500件)")
+    bench("標準json (jsonable_encoder)", lambda: JSONResponse(jsonable_encoder(page)).body, 20)
+    bench("orjson (model_dump)", lambda: ORJSONResponse(page.model_dump()).body, 20)
+
+    print()
+    print("=== 圧縮のコストと圧縮率 ===")
+    body = ORJSONResponse(make_submission_response(20000).model_dump()).body
+    for compressor_class in (_GzipCompressor, _BrotliCompressor):
+
+        def compress():
+            compressor = compressor_class()
+            return compressor.compress(body) + compressor.finish()
+
+        size = len(compress())
+        bench(
+            f"{compressor_class.encoding} {len(body) // 1024} KiB -> {size // 1024} KiB",
+            compress,
+            10,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+APIの負荷試験
+サンドボックス実行とアドバイス生成をプロセス内の偽物（遅延の分布を指定可能）に置き換え、
+DockerやAPIキーなしでリクエスト処理そのもののスループットと遅延を測る
+
+例:
+    python backend/test/load_test.py --concurrency 32 --requests 2000
+    python backend/test/load_test.py --sandbox-latency lognormal:300:0.5 \\
+        --advice-latency lognormal:1500:0.8 --fail-p95-ms 3000
+    # 起動済みのサーバーに対して実行する（偽物は使わない）
+    python backend/test/load_test.py --base-url http://localhost:8000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+import httpx
+
+# 各エンドポイントの既定の比率
+DEFAULT_MIX = "submit=4,upload=1,list_problems=2,get_problem=2,stats=1,history=1"
+
+CORRECT_CODE = "print(sum(map(int, input().split())))"
+WRONG_CODE = "print(sum(map(int, input().split())) + 1)  # wrong"
+ERROR_CODE = "print(undefined_name)  # error"
+
+
+class LatencyDistribution:
+    """
+    偽物の処理時間の分布（ミリ秒）
+    fixed:50 / uniform:20:80 / exp:100 / lognormal:中央値:シグマ
+    """
+
+    def __init__(self, spec: str, rng: random.Random):
+        kind, *params = spec.split(":")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        self.rng = rng
+        expected = {"fixed": 1, "uniform": 2, "exp": 1, "lognormal": 2}
+        if expected.get(kind) != len(self.params):
+            raise ValueError(f"Invalid latency distribution: {spec}")
+
+    def sample_seconds(self) -> float:
+        if self.kind == "fixed":
+            value = self.params[0]
+        elif self.kind == "uniform":
+            value = self.rng.uniform(*self.params)
+        elif self.kind == "exp":
+            value = self.rng.expovariate(1 / self.params[0])
+        else:
+            median, sigma = self.params
+            value = median * self.rng.lognormvariate(0, sigma)
+        return max(value, 0) / 1000
+
+
+def install_fakes(sandbox_latency, advice_latency, sandbox_mode: str):
+    """サンドボックスとアドバイス生成を偽物に差し替える"""
+    import routers.submissions as submissions
+    from services.sandbox_service import CodeExecutionResult
+
+    def fake_result(user_code: str, elapsed: float) -> CodeExecutionResult:
+        if "# error" in user_code:
+            stderr = (
+                "Traceback (most recent call last):\n"
+                '  File "<string>", line 1, in <module>\n'
+                "NameError: name 'undefined_name' is not defined\n"
+            )
+            return CodeExecutionResult(
+                stdout="",
+                stderr=stderr,
+                execution_time_ms=elapsed * 1000,
+                exit_code=1,
+                error_type="NameError",
+                succeeded=False,
+            )
+        stdout = "4\n" if "# wrong" in user_code else "3\n"
+        return CodeExecutionResult(
+            stdout=stdout,
+            stderr="",
+            execution_time_ms=elapsed * 1000,
+            exit_code=0,
+            succeeded=True,
+        )
+
+    async def fake_execute(user_code: str, stdin_input=None) -> CodeExecutionResult:
+        delay = sandbox_latency.sample_seconds()
+        if sandbox_mode == "thread":
+            # 以前の実装（docker-pyをスレッドプールで待つ）と同じくスレッドを占有させる
+            await asyncio.get_running_loop().run_in_executor(None, time.sleep, delay)
+        else:
+            # 本物と同じく、スレッドを使わずにイベントループ上で待つ
+            await asyncio.sleep(delay)
+        return fake_result(user_code, delay)
+
+    async def fake_advice(**kwargs) -> str:
+        await asyncio.sleep(advice_latency.sample_seconds())
+        if kwargs.get("is_correct"):
+            return "正解です。"
+        return "出力が期待される結果と一致しません。入力の扱いを確認しましょう。"
+
+    submissions.execute_python_code_in_docker = fake_execute
+    submissions.generate_advice_with_huggingface = fake_advice
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(REQUESTS)
+    if unknown:
+        raise ValueError(f"Unknown endpoints in mix: {sorted(unknown)}")
+    return mix
+
+
+def pick_code(rng: random.Random, args) -> str:
+    roll = rng.random()
+    if roll < args.error_rate:
+        return ERROR_CODE
+    if roll < args.error_rate + args.wrong_rate:
+        return WRONG_CODE
+    return CORRECT_CODE
+
+
+async def request_submit(client, rng, problem_ids, args):
+    return await client.post(
+        "/submissions/",
+        json={
+            "problem_id": rng.choice(problem_ids),
+            "user_code": pick_code(rng, args),
+            "code_type": "python",
+            "submitter_id": f"student-{rng.randrange(args.submitters)}",
+        },
+    )
+
+
+async def request_upload(client, rng, problem_ids, args):
+    return await client.post(
+        "/submissions/upload",
+        data={
+            "problem_id": str(rng.choice(problem_ids)),
+            "code_type": "python",
+            "submitter_id": f"student-{rng.randrange(args.submitters)}",
+        },
+        files={"file": ("answer.py", pick_code(rng, args).encode("utf-8"))},
+    )
+
+
+async def request_list_problems(client, rng, problem_ids, args):
+    return await client.get("/problems/")
+
+
+async def request_get_problem(client, rng, problem_ids, args):
+    return await client.get(f"/problems/{rng.choice(problem_ids)}")
+
+
+async def request_stats(client, rng, problem_ids, args):
+    return await client.get(f"/problems/{rng.choice(problem_ids)}/stats")
+
+
+async def request_history(client, rng, problem_ids, args):
+    return await client.get(
+        "/submissions/", params={"problem_id": rng.choice(problem_ids), "limit": 20}
+    )
+
+
+REQUESTS = {
+    "submit": request_submit,
+    "upload": request_upload,
+    "list_problems": request_list_problems,
+    "get_problem": request_get_problem,
+    "stats": request_stats,
+    "history": request_history,
+}
+
+
+async def create_problems(client, count: int) -> list[int]:
+    problem_ids = []
+    for i in range(count):
+        response = await client.post(
+            "/problems/",
+            json={
+                "title": f"負荷試験用の問題 {i + 1}",
+                "description": "2つの整数を読み込み、その和を出力してください。",
+                "correct_code": CORRECT_CODE,
+                "test_input": "1 2",
+            },
+        )
+        response.raise_for_status()
+        problem_ids.append(response.json()["id"])
+    return problem_ids
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(
+    latencies: dict, errors: dict, elapsed: float, superseded: dict | None = None
+) -> dict:
+    superseded = superseded or {}
+    summary = {}
+    all_latencies = []
+    for name in sorted(set(latencies) | set(errors) | set(superseded)):
+        values = sorted(latencies.get(name, []))
+        all_latencies.extend(values)
+        summary[name] = _stats(values, errors.get(name, 0), elapsed, superseded.get(name, 0))
+    summary["all"] = _stats(
+        sorted(all_latencies), sum(errors.values()), elapsed, sum(superseded.values())
+    )
+    return summary
+
+
+def _stats(values: list[float], error_count: int, elapsed: float, superseded: int = 0) -> dict:
+    requests = len(values) + error_count + superseded
+    return {
+        "requests": requests,
+        "errors": error_count,
+        "superseded": superseded,
+        "throughput_rps": requests / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def print_report(summary: dict, elapsed: float, args):
+    print(
+        f"\n=== 負荷試験結果 (concurrency={args.concurrency}, "
+        f"{elapsed:.2f}s) ==="
+    )
+    header = (
+        f"{'endpoint':<14}{'reqs':>7}{'errs':>6}{'409':>6}"
+        f"{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for name, stats in summary.items():
+        print(
+            f"{name:<14}{stats['requests']:>7}{stats['errors']:>6}{stats['superseded']:>6}"
+            f"{stats['throughput_rps']:>9.1f}{stats['p50_ms']:>9.1f}"
+            f"{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}"
+        )
+    print("(latency in ms; 409 = 同じ提出者が同じ問題に出し直して置き換えられた提出)")
+
+
+async def run_load(client, args) -> tuple[dict, float]:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    problem_ids = await create_problems(client, args.problems)
+
+    # ウォームアップ（キャッシュやDB接続を温めてから計測する）
+    for name in names:
+        await REQUESTS[name](client, rng, problem_ids, args)
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    # 同じ提出者・同じ問題の提出が同時に処理中だと、古い方は409で置き換えられる（想定どおりの結果）
+    superseded = defaultdict(int)
+    schedule = rng.choices(names, weights=weights, k=args.requests)
+    position = 0
+    deadline = time.perf_counter() + args.duration if args.duration else None
+
+    async def worker(worker_id: int):
+        nonlocal position
+        worker_rng = random.Random(args.seed * 1000 + worker_id)
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return
+                name = worker_rng.choices(names, weights=weights)[0]
+            else:
+                if position >= len(schedule):
+                    return
+                name = schedule[position]
+                position += 1
+            start = time.perf_counter()
+            try:
+                response = await REQUESTS[name](client, worker_rng, problem_ids, args)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = None
+            if status == 409:
+                superseded[name] += 1
+            elif status is not None and status < 400:
+                latencies[name].append(time.perf_counter() - start)
+            else:
+                errors[name] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed, superseded), elapsed
+
+
+async def main_async(args) -> dict:
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=120) as client:
+            summary, elapsed = await run_load(client, args)
+    else:
+        import logging
+
+        logging.getLogger().setLevel(logging.WARNING)
+        rng = random.Random(args.seed)
+        install_fakes(
+            LatencyDistribution(args.sandbox_latency, rng),
+            LatencyDistribution(args.advice_latency, rng),
+            args.sandbox_mode,
+        )
+        summary, elapsed = await testenv.with_client(
+            run_load, args, base_url="http://loadtest", timeout=120
+        )
+    print_report(summary, elapsed, args)
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="APIの負荷試験")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="総リクエスト数")
+    parser.add_argument(
+        "--duration", type=float, default=0, help="指定すると秒数で打ち切る"
+    )
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="エンドポイントの比率")
+    parser.add_argument("--problems", type=int, default=10)
+    parser.add_argument("--submitters", type=int, default=200)
+    parser.add_argument("--wrong-rate", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--sandbox-latency", default="lognormal:50:0.5")
+    parser.add_argument("--advice-latency", default="lognormal:200:0.7")
+    parser.add_argument(
+        "--sandbox-mode",
+        choices=["async", "thread"],
+        default="async",
+        help="async: 本物と同じくスレッドを使わずに待つ / "
+        "thread: 以前の実装と同じくスレッドプールを占有して待つ（比較用）",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base-url", help="起動済みのサーバーに対して実行する")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument(
+        "--fail-p95-ms",
+        type=float,
+        help="全体のp95がこれを超えたら終了コード1で終了する",
+    )
+    return parser.parse_args(argv)
+
+
+def test_load_smoke():
+    """少数のリクエストでエラーなく完走するか（出し直しによる409はエラーに数えない）"""
+    args = parse_args(
+        [
+            "--concurrency",
+            "8",
+            "--requests",
+            "60",
+            "--sandbox-latency",
+            "fixed:1",
+            "--advice-latency",
+            "fixed:1",
+        ]
+    )
+    summary = asyncio.run(main_async(args))
+    assert summary["all"]["errors"] == 0
+    assert summary["all"]["requests"] == 60
+
+
+def test_resubmissions_are_counted_separately():
+    """1人の提出者が同時に出し直して置き換えられた提出（409）を、エラーとは別に数えるか"""
+    args = parse_args(
+        [
+            "--concurrency",
+            "8",
+            "--requests",
+            "40",
+            "--mix",
+            "submit=1",
+            "--problems",
+            "1",
+            "--submitters",
+            "1",
+            "--sandbox-latency",
+            "fixed:20",
+            "--advice-latency",
+            "fixed:1",
+        ]
+    )
+    summary = asyncio.run(main_async(args))
+    assert summary["all"]["errors"] == 0
+    assert summary["all"]["superseded"] > 0
+    assert summary["all"]["requests"] == 40
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    summary = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    if args.fail_p95_ms is not None and summary["all"]["p95_ms"] > args.fail_p95_ms:
+        print(
+            f"NG: p95 {summary['all']['p95_ms']:.1f}ms > {args.fail_p95_ms:.1f}ms"
+        )
+        sys.exit(1)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+サンドボックスの同時実行数の自動調整（services/autoscaler.py）のシミュレーション
+
+到着の記録（トレース）を、CPU数・メモリの限られたホストのモデルに流し、
+固定の上限と自動調整（本番と同じ AIMDController）で待ち時間＋実行時間を比べる。
+時刻は仮想時間なので、長いトレースもすぐに終わる
+
+ホストのモデル:
+- 実行中の数がCPU数以下なら各実行は単独のときの速さで進み、超えるとCPUを分け合う。
+  さらに超えた分だけ切り替えのコストで全体の効率が落ちる（--thrash）
+- 実行ごとにメモリを使い（--run-memory-mb）、ホストのメモリを超えると大きく遅くなる
+- CPUの圧力は、ロードアベレージと同じく実行中の数を指数移動平均した値 / CPU数
+
+トレースはCSV（arrival_s,service_s: 到着時刻と単独で動かしたときの実行時間、秒）。
+--from-db でアプリのDBの提出（提出時刻と実行時間）から作れる
+
+例:
+    python backend/test/sim_autoscaler.py --static 2,4,8,16,32
+    python backend/test/sim_autoscaler.py --from-db backend/app.db --save-trace trace.csv
+    python backend/test/sim_autoscaler.py --trace trace.csv --cores 8
+"""
+
+import argparse
+import csv
+import math
+import random
+import sqlite3
+from collections import deque
+from datetime import datetime
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from services.autoscaler import AIMDController, Signals, percentile
+
+
+def synthetic_trace(seed: int = 1, cores: int = 4) -> list[tuple[float, float]]:
+    """落ち着いた時間・提出が集中する時間・落ち着いた時間が続く到着（ポアソン過程）"""
+    rng = random.Random(seed)
+    # （続く秒数, 1秒あたりの到着数）。実行時間の平均は約0.57秒なので、集中時はCPUの9割近くを使う
+    phases = [(60, 0.5 * cores), (120, 1.5 * cores), (60, 0.5 * cores)]
+    trace, now = [], 0.0
+    for duration, rate in phases:
+        end = now + duration
+        while True:
+            now += rng.expovariate(rate)
+            if now >= end:
+                now = end
+                break
+            trace.append((now, rng.lognormvariate(math.log(0.5), 0.5)))
+    return trace
+
+
+def load_trace(path: str) -> list[tuple[float, float]]:
+    with open(path, newline="") as f:
+        return sorted((float(r["arrival_s"]), float(r["service_s"])) for r in csv.DictReader(f))
+
+
+def save_trace(trace: list[tuple[float, float]], path: str) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["arrival_s", "service_s"])
+        writer.writerows(trace)
+
+
+def trace_from_db(path: str) -> list[tuple[float, float]]:
+    """提出の時刻と実行時間から到着のトレースを作る（実行時間のない提出は除く）"""
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT submitted_at, execution_time_ms FROM submissions "
+            "WHERE submitted_at IS NOT NULL AND execution_time_ms IS NOT NULL "
+            "ORDER BY submitted_at"
+        ).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return []
+    times = [datetime.fromisoformat(submitted_at) for submitted_at, _ in rows]
+    return [
+        ((t - times[0]).total_seconds(), ms / 1000) for t, (_, ms) in zip(times, rows)
+    ]
+
+
+def simulate(trace, args, static_limit: int | None = None) -> dict:
+    """static_limit を指定すると固定の上限、Noneなら自動調整で流す"""
+    controller = None
+    if static_limit is None:
+        controller = AIMDController(
+            args.initial, min_limit=1, max_limit=args.max_limit
+        )
+    limit = static_limit or controller.limit
+
+    dt = args.dt
+    arrivals = deque(trace)
+    queue: deque[tuple[float, float]] = deque()
+    # 実行中: [到着時刻, 開始時刻, 残りの仕事量（単独で動かしたときの秒数）]
+    running: list[list[float]] = []
+    latencies, run_seconds, wait_seconds = [], [], []
+    load = 0.0
+    now = 0.0
+    next_tick = args.interval
+    limit_time = peak = 0.0
+    decisions: dict[str, int] = {}
+
+    while arrivals or queue or running:
+        while arrivals and arrivals[0][0] <= now:
+            queue.append(arrivals.popleft())
+        while queue and len(running) < limit:
+            arrival, service = queue.popleft()
+            running.append([arrival, now, service])
+            wait_seconds.append(now - arrival)
+
+        n = len(running)
+        peak = max(peak, n)
+        memory = args.base_memory + n * args.run_memory_mb / args.memory_mb
+        if n:
+            rate = min(1.0, args.cores / n)
+            if n > args.cores:
+                rate /= 1 + args.thrash * (n - args.cores) / args.cores
+            if memory > 1:
+                rate *= args.swap_slowdown
+            finished = []
+            for job in running:
+                job[2] -= rate * dt
+                if job[2] <= 0:
+                    finished.append(job)
+            for job in finished:
+                running.remove(job)
+                latencies.append(now + dt - job[0])
+                run_seconds.append(now + dt - job[1])
+        # ロードアベレージと同じ指数移動平均
+        load += (n - load) * (1 - math.exp(-dt / args.load_tau))
+        now += dt
+        limit_time += limit * dt
+
+        if controller is not None and now >= next_tick:
+            next_tick += args.interval
+            decision = controller.decide(
+                Signals(run_seconds, wait_seconds, load / args.cores, min(memory, 1.0))
+            )
+            decisions[decision.action] = decisions.get(decision.action, 0) + 1
+            limit = decision.limit
+            run_seconds, wait_seconds = [], []
+        elif controller is None:
+            run_seconds.clear()
+            wait_seconds.clear()
+
+    return {
+        "policy": f"static {static_limit}" if static_limit else "adaptive",
+        "completed": len(latencies),
+        "duration_s": now,
+        "p50_s": percentile(latencies, 50) or 0.0,
+        "p95_s": percentile(latencies, 95) or 0.0,
+        "p99_s": percentile(latencies, 99) or 0.0,
+        "mean_limit": limit_time / now if now else 0.0,
+        "peak_running": int(peak),
+        "decisions": decisions,
+    }
+
+
+def print_report(results: list[dict]) -> None:
+    print(f"{'policy':>12}{'done':>7}{'time':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'limit':>7}{'peak':>6}")
+    for r in results:
+        print(
+            f"{r['policy']:>12}{r['completed']:>7}{r['duration_s']:>8.1f}"
+            f"{r['p50_s']:>8.2f}{r['p95_s']:>8.2f}{r['p99_s']:>8.2f}"
+            f"{r['mean_limit']:>7.1f}{r['peak_running']:>6}"
+        )
+    print("(seconds from arrival to completion; limit = time-weighted mean)")
+
+
+def run(args) -> list[dict]:
+    if args.from_db:
+        trace = trace_from_db(args.from_db)
+    elif args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.seed, args.cores)
+    if args.save_trace:
+        save_trace(trace, args.save_trace)
+    if not trace:
+        raise SystemExit("The trace is empty")
+    results = [simulate(trace, args, int(s)) for s in args.static.split(",") if s]
+    results.append(simulate(trace, args))
+    print(f"{len(trace)} arrivals, {args.cores} CPUs")
+    print_report(results)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="同時実行数の自動調整のシミュレーション")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--trace", help="到着のトレース（CSV: arrival_s,service_s）")
+    source.add_argument("--from-db", help="アプリのDB（SQLite）の提出からトレースを作る")
+    parser.add_argument("--save-trace", help="使ったトレースをCSVに保存する")
+    parser.add_argument("--seed", type=int, default=1, help="合成トレースの乱数の種")
+    parser.add_argument("--static", default="1,2,4,8,16,32", help="比べる固定の上限")
+    parser.add_argument("--initial", type=int, default=8, help="自動調整の最初の上限")
+    parser.add_argument("--max-limit", type=int, default=64)
+    parser.add_argument("--interval", type=float, default=5.0, help="上限を見直す間隔（秒）")
+    parser.add_argument("--cores", type=int, default=4)
+    parser.add_argument("--thrash", type=float, default=0.3, help="CPU数を超えた分の効率の低下")
+    parser.add_argument("--memory-mb", type=float, default=4096)
+    parser.add_argument("--run-memory-mb", type=float, default=128)
+    parser.add_argument("--base-memory", type=float, default=0.3, help="実行以外のメモリ使用率")
+    parser.add_argument("--swap-slowdown", type=float, default=0.2)
+    parser.add_argument("--load-tau", type=float, default=60.0, help="ロードアベレージの時定数")
+    parser.add_argument("--dt", type=float, default=0.01, help="シミュレーションの刻み（秒）")
+    return parser.parse_args(argv)
+
+
+def test_adaptive_limit_on_synthetic_trace():
+    """自動調整が、小さすぎる・大きすぎる固定の上限より待ち時間＋実行時間を短くするか"""
+    results = {r["policy"]: r for r in run(parse_args(["--static", "1,64", "--dt", "0.02"]))}
+    adaptive = results["adaptive"]
+    assert adaptive["completed"] == results["static 1"]["completed"]
+    assert adaptive["p95_s"] < results["static 1"]["p95_s"]
+    assert adaptive["p95_s"] < results["static 64"]["p95_s"]
+    assert adaptive["decisions"].get("decrease") and adaptive["decisions"].get("increase")
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+古い提出のアーカイブ（services/archive_service.py）のテスト
+"""
+
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.schema import CreateTable
+
+import database
+import routers.admin as admin
+import services.archive_service as archive_service
+from database import SessionLocal, SubmissionModel
+from services.archive_service import archive_reader, archive_submissions
+
+# 開発用のアーカイブに書き込まないよう、一時ディレクトリを使っていることを確かめる
+assert archive_reader.directory.startswith(tempfile.gettempdir()), archive_reader.directory
+
+PROBLEM_ID = 7001
+ADMIN_HEADERS = {"Authorization": "Bearer secret"}
+
+
+def _add_submissions(count: int, days_ago: float, label: str) -> list[int]:
+    """days_ago 日前の提出を count 件追加し、IDを返す"""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with SessionLocal() as db:
+        rows = [
+            SubmissionModel(
+                problem_id=PROBLEM_ID,
+                submitter_id=f"{label}{i}",
+                user_code=f"print('{label}{i}')",
+                exit_code=0,
+                is_correct=True,
+                submitted_at=now - timedelta(days=days_ago, seconds=i),
+            )
+            for i in range(count)
+        ]
+        db.add_all(rows)
+        db.commit()
+        return [row.id for row in rows]
+
+
+def test_archive_requires_admin_token():
+    """ADMIN_TOKEN がなければ使えず、トークンが違えば401になるか"""
+
+    async def scenario(client):
+        admin.ADMIN_TOKEN = ""
+        assert (await client.post("/admin/archive")).status_code == 403
+        admin.ADMIN_TOKEN = "secret"
+        try:
+            response = await client.post(
+                "/admin/archive", headers={"Authorization": "Bearer wrong"}
+            )
+            assert response.status_code == 401
+        finally:
+            admin.ADMIN_TOKEN = ""
+
+    asyncio.run(testenv.with_client(scenario))
+
+
+def test_archived_ids_are_not_reused():
+    """末尾の提出をアーカイブしても、新しい提出に同じIDが付かず、履歴が続きから読めるか"""
+
+    async def scenario(client):
+        old_ids = _add_submissions(3, days_ago=400, label="old")
+        admin.ADMIN_TOKEN = "secret"
+        try:
+            response = await client.post(
+                "/admin/archive",
+                params={"older_than_days": 30},
+                headers=ADMIN_HEADERS,
+            )
+        finally:
+            admin.ADMIN_TOKEN = ""
+        assert response.status_code == 200, response.text
+        assert response.json()["archived"] >= 3
+
+        (new_id,) = _add_submissions(1, days_ago=0, label="new")
+        assert new_id > max(old_ids)
+
+        # キーセットページングで、ホットテーブルの提出からアーカイブ済みの提出へ続けて読む
+        items, cursor = [], None
+        while True:
+            params = {"problem_id": PROBLEM_ID, "include_archived": True, "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            page = (await client.get("/submissions/", params=params)).json()
+            items.extend(page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        ids = [item["id"] for item in items]
+        assert len(ids) == len(set(ids))
+        assert ids[0] == new_id and not items[0]["archived"]
+        assert {item["id"] for item in items if item["archived"]} >= set(old_ids)
+        assert all(item["archived"] for item in items[1:])
+
+    asyncio.run(testenv.with_client(scenario))
+
+
+def test_interrupted_archive_is_recovered():
+    """セグメントを書いた後、提出の削除前に中断しても、次の実行で削除を終えるか"""
+    directory = os.path.join(testenv.TMPDIR, "interrupted")
+    ids = _add_submissions(5, days_ago=500, label="crash")
+    original = archive_service._delete_archived_rows
+
+    def crash(session, cutoff):
+        raise RuntimeError("interrupted")
+
+    archive_service._delete_archived_rows = crash
+    try:
+        archive_submissions(older_than_days=30, directory=directory)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("the archive was not interrupted")
+    finally:
+        archive_service._delete_archived_rows = original
+
+    with SessionLocal() as db:
+        assert db.query(SubmissionModel).filter(SubmissionModel.id.in_(ids)).count() == 5
+    # 中断した実行のセグメントは完成している（インデックスがある）
+    assert any(name.endswith(".idx.json") for name in os.listdir(directory))
+
+    assert archive_submissions(older_than_days=30, directory=directory)["archived"] == 0
+    with SessionLocal() as db:
+        assert db.query(SubmissionModel).filter(SubmissionModel.id.in_(ids)).count() == 0
+
+
+def test_reader_reads_only_matching_blocks():
+    """インデックスで絞り込み、条件に合うブロックだけをmmapから展開するか"""
+    directory = os.path.join(testenv.TMPDIR, "blocks")
+    _add_submissions(12, days_ago=600, label="block")
+    original_block_size = archive_service.ARCHIVE_BLOCK_SIZE
+    archive_service.ARCHIVE_BLOCK_SIZE = 4
+    try:
+        archive_submissions(older_than_days=30, directory=directory)
+    finally:
+        archive_service.ARCHIVE_BLOCK_SIZE = original_block_size
+
+    reader = archive_service.ArchiveReader(directory)
+    blocks = [b for index in reader._get_indexes() for b in index["blocks"]]
+    assert len(blocks) >= 3 and all(b["count"] <= 4 for b in blocks)
+
+    read = []
+    original_read = reader._read_block
+
+    def counting_read(segment, block):
+        read.append(block["offset"])
+        return original_read(segment, block)
+
+    reader._read_block = counting_read
+    records = reader.query(submitter_id="block3", limit=10)
+    assert [r["user_code"] for r in records] == ["print('block3')"]
+    assert len(read) == 1
+    # 新しい順に、カーソルより古いものだけを返す
+    everything = reader.query(problem_id=PROBLEM_ID, limit=100)
+    keys = [(r["submitted_at"], r["id"]) for r in everything]
+    assert keys == sorted(keys, reverse=True)
+    rest = reader.query(problem_id=PROBLEM_ID, cursor=keys[5], limit=100)
+    assert [(r["submitted_at"], r["id"]) for r in rest] == keys[6:]
+
+
+def test_legacy_table_rebuilt_with_autoincrement():
+    """AUTOINCREMENT なしの古い submissions テーブルを、データとインデックスを保って作り直すか"""
+    engine = create_engine(f"sqlite:///{os.path.join(testenv.TMPDIR, 'legacy.db')}")
+    ddl = str(CreateTable(SubmissionModel.__table__).compile(engine))
+    assert "AUTOINCREMENT" in ddl
+    with engine.begin() as conn:
+        conn.execute(text(ddl.replace(" AUTOINCREMENT", "")))
+        conn.execute(
+            text("INSERT INTO submissions (id, problem_id) VALUES (1, 1), (2, 1), (3, 2)")
+        )
+        database._migrate_autoincrement(conn)
+        sql = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE name = 'submissions'")
+        ).scalar()
+        assert "AUTOINCREMENT" in sql
+        assert conn.execute(text("SELECT count(*) FROM submissions")).scalar() == 3
+        indexes = {
+            row[0]
+            for row in conn.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index'")
+            )
+        }
+        assert "ix_submissions_submitted" in indexes
+
+        conn.execute(text("DELETE FROM submissions WHERE id = 3"))
+        database.reserve_ids(conn, "submissions", 10)
+        conn.execute(text("INSERT INTO submissions (problem_id) VALUES (3)"))
+        assert conn.execute(text("SELECT max(id) FROM submissions")).scalar() == 11
+
+
+if __name__ == "__main__":
+    print("=== アーカイブのテスト ===")
+    test_archive_requires_admin_token()
+    test_archived_ids_are_not_reused()
+    test_interrupted_archive_is_recovered()
+    test_reader_reads_only_matching_blocks()
+    test_legacy_table_rebuilt_with_autoincrement()
+    print("OK")
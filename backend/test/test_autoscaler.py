@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+サンドボックスの同時実行数の自動調整（services/autoscaler.py）のテスト
+"""
+
+import asyncio
+import os
+from types import SimpleNamespace
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+import services.autoscaler as autoscaler
+from services.autoscaler import AIMDController, SandboxAutoscaler, Signals
+from services.metrics import SANDBOX_CONCURRENCY_LIMIT
+from services.shared_state import SharedSemaphore, SharedState
+
+
+
+def _controller(limit: int = 8) -> AIMDController:
+    return AIMDController(
+        limit,
+        min_limit=2,
+        max_limit=10,
+        latency_tolerance=2.0,
+        queue_wait_s=0.1,
+        max_cpu=2.0,
+        max_memory=0.9,
+        decrease=0.5,
+    )
+
+
+def test_queue_wait_increases_additively():
+    """枠を待つ時間が長ければ1つずつ増やし、最大で止めるか"""
+    controller = _controller(9)
+    waiting = Signals(run_seconds=[1.0] * 10, wait_seconds=[0.5] * 10)
+    assert controller.decide(waiting).limit == 10
+    decision = controller.decide(waiting)
+    assert (decision.limit, decision.action, decision.reason) == (10, "hold", "max")
+    assert controller.decide(Signals(run_seconds=[1.0], wait_seconds=[0.0])).action == "hold"
+
+
+def test_latency_and_pressure_decrease_multiplicatively():
+    """実行時間が基準の倍を超えるか、ホストの圧力が高ければ掛けて減らし、最小で止めるか"""
+    controller = _controller(8)
+    assert controller.decide(Signals(run_seconds=[1.0] * 10)).action == "hold"
+    decision = controller.decide(Signals(run_seconds=[3.0] * 10))
+    assert (decision.limit, decision.reason) == (4, "latency")
+    assert controller.decide(Signals(cpu_pressure=3.0)).reason == "cpu"
+    assert controller.limit == 2
+    assert controller.decide(Signals(memory_pressure=0.95)).reason == "min"
+    assert controller.limit == 2
+
+
+def test_tick_shares_limit_between_processes():
+    """1つの間隔で判断するのは1プロセスだけで、決めた上限を全プロセスが使うか"""
+    shared = SharedState(os.path.join(testenv.TMPDIR, "autoscale.db"))
+
+    def make():
+        semaphore = SharedSemaphore(shared, "sandbox", 4, ttl_s=60)
+        pool = SimpleNamespace(max_idle=2)
+        return SandboxAutoscaler(
+            semaphore, shared, pool=pool, controller=_controller(4), interval_s=60
+        )
+
+    here, there = make(), make()
+    for _ in range(5):
+        here.observe(wait_s=1.0, overhead_s=0.2)
+        there.observe(wait_s=1.0, overhead_s=0.2)
+
+    async def scenario():
+        await here.tick()
+        await there.tick()
+
+    original, autoscaler.host_pressure = autoscaler.host_pressure, lambda: (0.5, 0.5)
+    try:
+        asyncio.run(scenario())
+    finally:
+        autoscaler.host_pressure = original
+    # 判断したのは先に確認したプロセスだけ（1つ増やす）
+    assert here.controller.limit == 5 and there.controller.limit == 4
+    assert here.semaphore.limit == there.semaphore.limit == 5
+    assert here.pool.max_idle == there.pool.max_idle == 2
+    assert SANDBOX_CONCURRENCY_LIMIT.get() == 5
+
+
+if __name__ == "__main__":
+    print("=== 同時実行数の自動調整のテスト ===")
+    test_queue_wait_increases_additively()
+    test_latency_and_pressure_decrease_multiplicatively()
+    test_tick_shares_limit_between_processes()
+    print("OK")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+提出の本文をblobsテーブルに保存する属性（database.py の BlobText）のテスト
+"""
+
+import os
+from datetime import datetime, timezone
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, BlobModel, SubmissionModel, blob_hash
+
+
+def _session_factory(name: str):
+    engine = create_engine(f"sqlite:///{os.path.join(testenv.TMPDIR, name)}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def _submission(code: str, stdout: str) -> SubmissionModel:
+    return SubmissionModel(
+        problem_id=1,
+        user_code=code,
+        stdout=stdout,
+        stderr=None,
+        exit_code=0,
+        submitted_at=datetime.now(timezone.utc),
+    )
+
+
+def test_committed_text_is_released():
+    """コミットした提出は本文の控えを持たず、blobsテーブルから読み直すか"""
+    session_factory = _session_factory("release.db")
+    with session_factory() as db:
+        submission = _submission("print(1)", "1\n")
+        db.add(submission)
+        db.flush()
+        # コミット前（統計の更新など）は控えから読める
+        assert submission.user_code == "print(1)"
+        assert "_pending_blobs" in submission.__dict__
+        db.commit()
+        assert "_pending_blobs" not in submission.__dict__
+        assert db.info.get("pending_blob_owners") is None
+        # 同じセッションではblobsテーブルから読み直す
+        assert submission.user_code == "print(1)" and submission.stdout == "1\n"
+        assert submission.stderr is None
+
+        # 更新した本文も、コミット後は控えを持たない
+        submission.stdout = "2\n"
+        db.commit()
+        assert "_pending_blobs" not in submission.__dict__
+        submission_id = submission.id
+
+    with session_factory() as db:
+        stored = db.get(SubmissionModel, submission_id)
+        assert stored.stdout == "2\n" and stored.user_code == "print(1)"
+
+
+def test_rolled_back_text_is_kept_for_retry():
+    """ロールバックした提出は本文の控えを残し、別のセッションで書き直せるか"""
+    session_factory = _session_factory("rollback.db")
+    submission = _submission("print('retry')", "retry\n")
+    with session_factory() as db:
+        db.add(submission)
+        db.flush()
+        db.rollback()
+    assert submission.__dict__["_pending_blobs"]["user_code"] == "print('retry')"
+
+    submission.id = None
+    with session_factory() as db:
+        db.add(submission)
+        db.commit()
+        assert "_pending_blobs" not in submission.__dict__
+        assert submission.user_code == "print('retry')"
+        assert db.get(BlobModel, blob_hash("retry\n")).text == "retry\n"
+
+
+def test_same_text_is_stored_once():
+    """同じ本文の提出はblobを1行だけ使うか"""
+    session_factory = _session_factory("dedup.db")
+    with session_factory() as db:
+        db.add_all([_submission("print(1)", "1\n") for _ in range(3)])
+        db.commit()
+        db.add(_submission("print(1)", "1\n"))
+        db.commit()
+        assert db.query(BlobModel).count() == 2
+        assert db.query(SubmissionModel).count() == 4
+
+
+if __name__ == "__main__":
+    print("=== blobストレージのテスト ===")
+    test_committed_text_is_released()
+    test_rolled_back_text_is_kept_for_retry()
+    test_same_text_is_stored_once()
+    print("OK")
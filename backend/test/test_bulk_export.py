@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+提出・問題の一括エクスポートと問題の一括インポート（services/bulk_service.py）のテスト
+"""
+
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from sqlalchemy import select
+
+from database import SessionLocal, SubmissionModel
+from services.bulk_service import stream_rows
+
+PROBLEMS = [
+    {
+        "title": f"問題{i}",
+        "description": "2つの整数の和を出力する",
+        "correct_code": 'a, b = map(int, input().split())\nprint(a + b, "\\n")',
+        "test_input": f"{i} {i}",
+        "comparator": "numeric",
+        "comparator_options": {"abs_tol": 0.5},
+    }
+    for i in range(5)
+]
+
+
+async def _chunked(data: bytes, size: int = 7):
+    """本文を細かく分けて送る（行やUTF-8の文字の途中で切れる）"""
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+def test_import_validates_and_roundtrips():
+    """NDJSON・CSVのインポートが不正な行だけを飛ばし、エクスポートと同じ内容に戻るか"""
+    lines = [json.dumps(p, ensure_ascii=False) for p in PROBLEMS[:3]]
+    lines.insert(1, "{not json")
+    lines.insert(3, json.dumps({"title": "正解コードなし", "description": "x"}))
+    lines.append("")
+    ndjson = "\n".join(lines).encode("utf-8")
+
+    async def scenario(client):
+        before = len((await client.get("/problems/")).json())
+        response = await client.post("/problems/import", content=_chunked(ndjson))
+        assert response.status_code == 200, response.text
+        result = response.json()
+        assert result["imported"] == 3 and result["failed"] == 2
+        assert [e["line"] for e in result["errors"]] == [2, 4]
+        assert "correct_code" in result["errors"][1]["error"]
+
+        exported = await client.get("/problems/export", params={"format": "csv"})
+        assert exported.headers["content-type"].startswith("text/csv")
+        rows = list(csv.DictReader(io.StringIO(exported.text)))
+        assert len(rows) == before + 3
+        assert rows[-1]["comparator_options"] == '{"abs_tol":0.5}'
+        assert rows[-1]["version"] == "1"
+
+        # エクスポートしたCSV（複数行のコードを含む）をそのまま取り込める
+        response = await client.post(
+            "/problems/import",
+            params={"format": "csv"},
+            content=_chunked(exported.content),
+        )
+        assert response.json() == {"imported": before + 3, "failed": 0, "errors": []}
+
+        problems = (await client.get("/problems/export")).text.splitlines()
+        assert len(problems) == 2 * (before + 3)
+        first, copy = json.loads(problems[before]), json.loads(problems[-3])
+        for field in PROBLEMS[0]:
+            assert first[field] == copy[field] == PROBLEMS[0][field], field
+        assert copy["id"] != first["id"] and copy["version"] == 1
+
+        bad = await client.post("/problems/import", content=b"\xff\xfe{}")
+        assert bad.status_code == 400
+
+    asyncio.run(testenv.with_client(scenario))
+
+
+def test_export_submissions_filters_and_streams():
+    """提出のエクスポートが条件で絞り込み、新しい順にすべての行を返すか"""
+    start = datetime(2030, 1, 1)
+    with SessionLocal() as db:
+        db.add_all(
+            SubmissionModel(
+                problem_id=9001 + i % 2,
+                submitter_id=f"s{i % 7}",
+                user_code=f"print({i})",
+                stdout=f"{i}\n",
+                exit_code=0 if i % 5 else 1,
+                is_correct=i % 3 == 0,
+                submitted_at=start + timedelta(seconds=i),
+            )
+            for i in range(1200)
+        )
+        db.commit()
+
+    async def scenario(client):
+        response = await client.get(
+            "/submissions/export",
+            params={
+                "problem_id": 9001,
+                "submitted_after": "2030-01-01T00:01:40",
+                "include_code": True,
+            },
+        )
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert 'filename="submissions.ndjson"' in response.headers["content-disposition"]
+        records = [json.loads(line) for line in response.text.splitlines()]
+        # 100秒目以降の偶数番目（problem_id 9001）
+        assert [r["user_code"] for r in records[:2]] == ["print(1198)", "print(1196)"]
+        assert len(records) == 550 and records[-1]["user_code"] == "print(100)"
+        assert "stdout" not in records[0]
+
+        response = await client.get(
+            "/submissions/export",
+            params={"format": "csv", "problem_id": 9002, "verdict": "error"},
+        )
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert len(rows) == 120 and {r["exit_code"] for r in rows} == {"1"}
+        assert rows[0]["is_correct"] in ("true", "false")
+
+    asyncio.run(testenv.with_client(scenario))
+
+
+def test_stream_rows_reads_in_chunks():
+    """全件ではなく、指定した件数ずつ読んで返すか"""
+    statement = (
+        select(SubmissionModel)
+        .filter(SubmissionModel.problem_id.in_([9001, 9002]))
+        .order_by(SubmissionModel.id)
+    )
+    sizes = [
+        len(chunk)
+        for chunk in stream_rows(SessionLocal, statement, lambda row: {"id": row.id}, 500)
+    ]
+    assert sizes == [500, 500, 200]
+
+
+if __name__ == "__main__":
+    print("=== 一括エクスポート・インポートのテスト ===")
+    test_import_validates_and_roundtrips()
+    test_export_submissions_filters_and_streams()
+    test_stream_rows_reads_in_chunks()
+    print("OK")
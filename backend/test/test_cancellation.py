@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+提出処理のキャンセル（クライアントの切断・同じ問題への出し直し）のテスト
+"""
+
+import asyncio
+import os
+import time
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+import services.cancellation as cancellation
+from services.cancellation import SubmissionCancelled, run_cancellable
+from services.shared_state import SharedState
+
+cancellation.DISCONNECT_POLL_INTERVAL_S = 0.01
+cancellation.shared = SharedState(os.path.join(testenv.TMPDIR, "shared_state.db"))
+
+
+class DisconnectingRequest:
+    """指定した時間が経つと切断したと答えるリクエスト"""
+
+    def __init__(self, after_s: float):
+        self.deadline = time.monotonic() + after_s
+
+    async def is_disconnected(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+
+async def _work(seconds: float, log: list, name: str):
+    try:
+        await asyncio.sleep(seconds)
+        log.append(f"{name} finished")
+        return name
+    except asyncio.CancelledError:
+        log.append(f"{name} cancelled")
+        raise
+
+
+def test_superseded_submission_is_cancelled():
+    """同じ提出者・問題の新しい提出が来たら、古い提出をキャンセルするか"""
+    log = []
+
+    async def scenario():
+        old = asyncio.create_task(
+            run_cancellable(_work(5, log, "old"), supersede_key=("s1", 1))
+        )
+        await asyncio.sleep(0.01)
+        other = asyncio.create_task(
+            run_cancellable(_work(0.05, log, "other"), supersede_key=("s2", 1))
+        )
+        new = await run_cancellable(_work(0.05, log, "new"), supersede_key=("s1", 1))
+        try:
+            await old
+        except SubmissionCancelled as e:
+            assert e.reason == "superseded"
+        else:
+            raise AssertionError("SubmissionCancelled was not raised")
+        return new, await other
+
+    assert asyncio.run(scenario()) == ("new", "other")
+    assert log[0] == "old cancelled"
+    assert cancellation._active == {}
+
+
+def test_superseded_in_other_process():
+    """別のプロセスに同じ提出者・問題の新しい提出が来たら、古い提出をキャンセルするか"""
+    log = []
+
+    async def scenario():
+        old = asyncio.create_task(
+            run_cancellable(_work(5, log, "old"), supersede_key=("s1", 2))
+        )
+        await asyncio.sleep(0.05)
+        # 別のプロセスの run_cancellable が登録するのと同じ操作
+        cancellation.shared.claim_owner(repr(("s1", 2)), "other-process", 60)
+        try:
+            await old
+        except SubmissionCancelled as e:
+            return e.reason
+        raise AssertionError("SubmissionCancelled was not raised")
+
+    assert asyncio.run(scenario()) == "superseded"
+    assert log == ["old cancelled"]
+
+
+def test_disconnect_cancels_work():
+    """クライアントが切断したら処理をキャンセルするか"""
+    log = []
+
+    async def scenario():
+        start = time.perf_counter()
+        try:
+            await run_cancellable(_work(5, log, "work"), request=DisconnectingRequest(0.05))
+        except SubmissionCancelled as e:
+            assert e.reason == "disconnect"
+        else:
+            raise AssertionError("SubmissionCancelled was not raised")
+        return time.perf_counter() - start
+
+    assert asyncio.run(scenario()) < 1
+    assert log == ["work cancelled"]
+
+
+def test_connected_request_completes():
+    """切断しなければ結果をそのまま返すか"""
+    log = []
+    result = asyncio.run(
+        run_cancellable(_work(0.05, log, "work"), request=DisconnectingRequest(60))
+    )
+    assert result == "work"
+
+
+if __name__ == "__main__":
+    print("=== 提出処理のキャンセルのテスト ===")
+    test_superseded_submission_is_cancelled()
+    test_superseded_in_other_process()
+    test_disconnect_cancels_work()
+    test_connected_request_completes()
+    print("OK")
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+出力の比較モード（comparators）のテスト
+チェッカーはサンドボックスと同じ形（python -c、入出力は SANDBOX_FILES_DIR のファイル）で実行する
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from types import SimpleNamespace
+
+from services.comparators import (
+    build_checker_program,
+    compare_outputs,
+    judge_output,
+    parse_checker_output,
+)
+from services.sandbox_service import SANDBOX_FILES_DIR_ENV
+
+
+def test_exact_matches_strip_equality():
+    """exactは前後の空白を除いた完全一致と同じ判定になるか"""
+    cases = [
+        ("1\n2\n", "1\n2", True),
+        ("\n  1\n2 \n\n", "1\n2", True),
+        ("1 \n2", "1\n2", False),
+        ("1\n3", "1\n2", False),
+        ("", "", True),
+        (None, "1", False),
+    ]
+    for actual, expected, is_correct in cases:
+        assert compare_outputs(actual, expected).is_correct == is_correct, (actual, expected)
+
+
+def test_mismatch_position_and_snippet():
+    """最初に食い違った行・列と、前後数行だけの差分を返すか"""
+    expected = "\n".join(str(i) for i in range(100_000))
+    actual = expected.replace("\n50000\n", "\n50001\n")
+    result = compare_outputs(actual, expected)
+    mismatch = result.mismatch
+    print(mismatch.snippet)
+    assert not result.is_correct
+    assert (mismatch.line, mismatch.column) == (50001, 5)
+    assert (mismatch.expected, mismatch.actual) == ("50000", "50001")
+    assert "49999" in mismatch.snippet and "50002" in mismatch.snippet
+    assert len(mismatch.snippet.splitlines()) <= 10
+
+
+def test_streaming_chunks():
+    """チャンクの境界が行の途中にあっても文字列と同じ結果になるか"""
+    expected = "".join(f"{i}\n" for i in range(1000))
+    actual = expected.replace("\n500\n", "\n5OO\n")
+    chunks = [actual[i : i + 7] for i in range(0, len(actual), 7)]
+    from_chunks = compare_outputs(iter(chunks), iter([expected]))
+    from_string = compare_outputs(actual, expected)
+    assert from_chunks.mismatch == from_string.mismatch
+    assert compare_outputs(iter(expected), expected).is_correct
+
+
+def test_whitespace_insensitive_modes():
+    """lines は行ごと、tokens は改行も含めて空白の違いを無視するか"""
+    assert compare_outputs("1  2\n3\t\n\n", "1 2\n3", "lines").is_correct
+    assert not compare_outputs("1 2 3", "1 2\n3", "lines").is_correct
+    assert compare_outputs("1 2 3", "1 2\n3", "tokens").is_correct
+    result = compare_outputs("1 2\n3 5", "1 2\n3 4", "tokens")
+    assert (result.mismatch.line, result.mismatch.column) == (2, 3)
+
+
+def test_numeric_tolerance():
+    """数値を許容誤差で比べ、数値以外の語は完全一致で比べるか"""
+    assert compare_outputs("0.333333\n1e3", "0.3333333333\n1000", "numeric").is_correct
+    assert not compare_outputs("0.34", "0.33", "numeric").is_correct
+    assert compare_outputs("0.34", "0.33", "numeric", {"abs_tol": 0.02}).is_correct
+    assert compare_outputs("nan", "nan", "numeric").is_correct
+    assert not compare_outputs("1_000", "1000", "numeric").is_correct
+    assert not compare_outputs("Yes 1.0", "No 1.0", "numeric").is_correct
+
+
+def test_unordered_lines():
+    """行の順序を問わず、同じ行が同じ数だけあるかを比べるか"""
+    assert compare_outputs("b\na\nb\n", "b\nb\na", "unordered_lines").is_correct
+    extra = compare_outputs("b\na\nc", "b\nb\na", "unordered_lines")
+    assert (extra.mismatch.line, extra.mismatch.actual) == (3, "c")
+    missing = compare_outputs("a\nb", "a\nb\nb", "unordered_lines")
+    assert missing.mismatch.expected == "b"
+
+
+def run_checker_like_sandbox(checker_code: str, actual: str, expected: str):
+    """サンドボックスと同じく、ファイルを置いたディレクトリを環境変数で渡してチェッカーを実行する"""
+    code, files = build_checker_program(checker_code, "3", actual, expected)
+    with tempfile.TemporaryDirectory() as directory:
+        for name, content in files.items():
+            with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+                f.write(content if isinstance(content, str) else "".join(content))
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            timeout=10,
+            env={**os.environ, SANDBOX_FILES_DIR_ENV: directory},
+        )
+    return parse_checker_output(result.returncode, result.stdout)
+
+
+def test_checker_script():
+    """チェッカーの判定結果とメッセージを読み取るか（引用符を含む出力も壊れないか）"""
+    checker = (
+        "def check(input_text, expected, actual):\n"
+        "    n = int(input_text)\n"
+        "    values = actual.split()\n"
+        "    if len(values) != n:\n"
+        "        return False, f'{n}個の値を出力してください'\n"
+        "    return True\n"
+    )
+    assert run_checker_like_sandbox(checker, "a ''' b\\n", "").is_correct
+    result = run_checker_like_sandbox(checker, "1 2", "")
+    assert not result.is_correct
+    assert result.mismatch.snippet == "3個の値を出力してください"
+    broken = run_checker_like_sandbox("def check(:\n    pass", "1", "1")
+    assert broken.mismatch.snippet == "チェッカーの実行に失敗しました"
+
+
+def test_judge_does_not_block_event_loop():
+    """大きな出力の比較中も他の処理が進み、判定の期限で比較を打ち切れるか"""
+    # 文字列としては違うが数値としては等しい（文字列の一致で先に判定できない）
+    actual = "\n".join(f"{i}.0" for i in range(100_000))
+    expected = "\n".join(str(i) for i in range(100_000))
+    problem = SimpleNamespace(
+        comparator="numeric", comparator_options=None, checker_code=None, test_input=None
+    )
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        task = asyncio.create_task(ticker())
+        try:
+            assert (await judge_output(problem, actual, expected)).is_correct
+            judged_ticks = ticks
+            try:
+                async with asyncio.timeout(0.01):
+                    await judge_output(problem, actual, expected)
+            except TimeoutError:
+                pass
+            else:
+                raise AssertionError("the judge deadline did not fire")
+        finally:
+            task.cancel()
+        return judged_ticks
+
+    assert asyncio.run(scenario()) > 5
+
+
+if __name__ == "__main__":
+    print("=== 出力の比較モードのテスト ===")
+    test_exact_matches_strip_equality()
+    test_mismatch_position_and_snippet()
+    test_streaming_chunks()
+    test_whitespace_insensitive_modes()
+    test_numeric_tolerance()
+    test_unordered_lines()
+    test_checker_script()
+    test_judge_does_not_block_event_loop()
+    print("OK")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+レスポンス圧縮のミドルウェア（middleware.py の CompressionMiddleware）のテスト
+ASGIのメッセージを直接やり取りし、送られたヘッダーとチャンクを確かめる
+"""
+
+import asyncio
+import gzip
+import os
+import sys
+import zlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import brotli
+
+from middleware import CompressionMiddleware, _negotiate
+
+LARGE = ("提出履歴" * 1000).encode("utf-8")
+
+
+def _app(chunks: list[bytes], headers: list[tuple[bytes, bytes]] | None = None):
+    """chunks を順に本文として送るASGIアプリ（2つ以上ならストリーミング）"""
+
+    async def app(scope, receive, send):
+        raw_headers = list(headers or [(b"content-type", b"application/json")])
+        if len(chunks) == 1:
+            raw_headers.append((b"content-length", str(len(chunks[0])).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": raw_headers})
+        for i, chunk in enumerate(chunks):
+            await send(
+                {"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1}
+            )
+
+    return app
+
+
+def _call(app, accept_encoding: str | None) -> tuple[dict, list[bytes]]:
+    """ミドルウェアを通して呼び、レスポンスのヘッダーと本文のチャンクを返す"""
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else []
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": headers}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(CompressionMiddleware(app)(scope, receive, send))
+    start, *bodies = messages
+    response_headers = {
+        name.decode().lower(): value.decode() for name, value in start["headers"]
+    }
+    return response_headers, [message["body"] for message in bodies]
+
+
+def test_negotiate_prefers_brotli():
+    """br・gzipの順に選び、q=0 や知らない方式は使わないか"""
+    assert _negotiate("gzip, deflate, br").encoding == "br"
+    assert _negotiate("br;q=0, gzip").encoding == "gzip"
+    assert _negotiate("BR;q=0.5").encoding == "br"
+    assert _negotiate("br;q=abc, gzip;q=0.1").encoding == "gzip"
+    assert _negotiate("identity, deflate") is None
+    assert _negotiate("") is None
+
+
+def test_large_response_is_compressed():
+    """大きなレスポンスを選んだ方式で圧縮し、Content-Length と Vary を付け直すか"""
+    for accept, decompress in (("br", brotli.decompress), ("gzip", gzip.decompress)):
+        headers, bodies = _call(_app([LARGE]), accept)
+        assert headers["content-encoding"] == accept
+        assert "accept-encoding" in headers["vary"].lower()
+        assert len(bodies) == 1 and int(headers["content-length"]) == len(bodies[0])
+        assert len(bodies[0]) < len(LARGE)
+        assert decompress(bodies[0]) == LARGE
+
+
+def test_small_or_unaccepted_response_is_untouched():
+    """小さいレスポンス・圧縮を受け付けないクライアントにはそのまま返すか"""
+    small = b'{"ok": true}'
+    for app, accept, body in (
+        (_app([small]), "br, gzip", small),
+        (_app([LARGE]), None, LARGE),
+        (_app([LARGE]), "identity", LARGE),
+    ):
+        headers, bodies = _call(app, accept)
+        assert "content-encoding" not in headers
+        assert headers["content-length"] == str(len(body)) and bodies == [body]
+
+
+def test_already_encoded_response_passes_through():
+    """アプリが圧縮済みのレスポンスは、ストリーミングでも二重に圧縮しないか"""
+    encoded = gzip.compress(LARGE)
+    pieces = [encoded[:100], encoded[100:]]
+    app = _app(pieces, headers=[(b"content-encoding", b"gzip")])
+    headers, bodies = _call(app, "br")
+    assert headers["content-encoding"] == "gzip"
+    assert bodies == pieces
+
+
+def test_streaming_chunks_are_compressed_as_they_arrive():
+    """ストリーミングのチャンクごとに圧縮して送り、各チャンクがその時点で展開できるか"""
+    chunks = [LARGE[:30], LARGE[30:3000], LARGE[3000:]]
+    for accept in ("br", "gzip"):
+        headers, bodies = _call(_app(chunks), accept)
+        assert headers["content-encoding"] == accept
+        assert "content-length" not in headers
+        assert len(bodies) == len(chunks)
+        # 最初のチャンクが小さくても、後続があれば圧縮を始める
+        if accept == "br":
+            decompressor = brotli.Decompressor()
+            decoded = [decompressor.process(body) for body in bodies]
+        else:
+            decompressor = zlib.decompressobj(31)
+            decoded = [decompressor.decompress(body) for body in bodies]
+        # 次のチャンクを待たずに、そこまでの本文がすべて届いている
+        assert decoded == chunks, accept
+
+
+if __name__ == "__main__":
+    print("=== レスポンス圧縮のテスト ===")
+    test_negotiate_prefers_brotli()
+    test_large_response_is_compressed()
+    test_small_or_unaccepted_response_is_untouched()
+    test_already_encoded_response_passes_through()
+    test_streaming_chunks_are_compressed_as_they_arrive()
+    print("OK")
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+サンドボックスコンテナの再利用（services/container_pool.py）のテスト
+在庫の貸し出し・作り直しの方針は偽のDockerクライアントで確かめる。
+Dockerが使える場合は、前の実行の状態（ファイル・プロセス）が次の実行に残らないことも確かめる
+"""
+
+import asyncio
+import os
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from services.container_pool import _RESET_SCRIPT, ContainerPool
+from services.docker_async import ExecResult
+from services.shared_state import SharedState
+
+
+
+class FakeDocker:
+    """ContainerPoolが使う非同期クライアントのメソッドだけを持つ偽物"""
+
+    def __init__(self):
+        self.created = []
+        self.options = {}
+        self.commands = {}
+        self.removed = set()
+        self.leaking = set()
+
+    async def create_container(self, image, command, **kwargs):
+        container_id = f"c{len(self.created) + 1}"
+        self.created.append(container_id)
+        self.options[container_id] = kwargs
+        self.commands[container_id] = []
+        return container_id
+
+    async def start(self, container_id):
+        pass
+
+    async def inspect(self, container_id):
+        return {"State": {"Running": container_id not in self.removed}}
+
+    async def exec_run(self, container_id, cmd, **kwargs):
+        self.commands[container_id].append((cmd, kwargs))
+        if cmd[:2] == ["python", "-c"] and cmd[2] == _RESET_SCRIPT:
+            if container_id not in self.leaking:
+                return ExecResult(0, b'{"processes": [], "files": []}\n')
+            return ExecResult(1, b'{"processes": [42], "files": ["/tmp/x"]}\n')
+        return ExecResult(0, b"")
+
+    async def remove(self, container_id, force=True):
+        self.removed.add(container_id)
+
+
+def _pool(name: str, docker: FakeDocker, **kwargs) -> ContainerPool:
+    shared = SharedState(os.path.join(testenv.TMPDIR, f"{name}.db"))
+    return ContainerPool(shared, client_factory=lambda: docker, **kwargs)
+
+
+def test_container_is_reused_after_reset():
+    """後片付けに成功したコンテナを次の実行で使い回すか"""
+    docker = FakeDocker()
+    pool = _pool("reuse", docker)
+
+    async def scenario():
+        first = await pool.checkout()
+        options = docker.options[first.container_id]
+        host_config = options["host_config"]
+        assert host_config["ReadonlyRootfs"] and host_config["Init"]
+        assert options["network_disabled"]
+        assert "/sandbox" in host_config["Tmpfs"] and "/tmp" in host_config["Tmpfs"]
+        assert first.exec_options["user"] == "sandbox_user"
+
+        await pool.checkin(first, healthy=True)
+        second = await pool.checkout()
+        assert second.container_id == first.container_id and second.runs == 1
+        assert len(docker.created) == 1
+        # 作成時と返却時に後片付けをrootで行う
+        commands = docker.commands[first.container_id]
+        resets = [kw for cmd, kw in commands if cmd[2] == _RESET_SCRIPT]
+        assert len(resets) == 2 and all(kw["user"] == "root" for kw in resets)
+
+    asyncio.run(scenario())
+
+
+def test_recycle_after_runs():
+    """決められた回数使ったコンテナは作り直すか"""
+    docker = FakeDocker()
+    pool = _pool("recycle", docker, recycle_after=2)
+
+    async def scenario():
+        for _ in range(2):
+            pooled = await pool.checkout()
+            await pool.checkin(pooled, healthy=True)
+        assert docker.created[0] in docker.removed
+        assert (await pool.checkout()).container_id != docker.created[0]
+
+    asyncio.run(scenario())
+
+
+def test_leaked_state_discards_container():
+    """後片付けで何か残っていたコンテナは使い回さないか"""
+    docker = FakeDocker()
+    pool = _pool("leak", docker)
+
+    async def scenario():
+        pooled = await pool.checkout()
+        docker.leaking.add(pooled.container_id)
+        await pool.checkin(pooled, healthy=True)
+        assert pooled.container_id in docker.removed
+        assert (await pool.checkout()).container_id != pooled.container_id
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_container_is_discarded():
+    """キャンセル・タイムアウトで止めたコンテナは後片付けせずに捨てるか"""
+    docker = FakeDocker()
+    pool = _pool("cancelled", docker)
+
+    async def scenario():
+        pooled = await pool.checkout()
+        commands = len(docker.commands[pooled.container_id])
+        await pool.checkin(pooled, healthy=False)
+        assert pooled.container_id in docker.removed
+        assert len(docker.commands[pooled.container_id]) == commands
+
+    asyncio.run(scenario())
+
+
+def test_inventory_shared_between_processes():
+    """別のプロセスのプール（同じ共有状態）が返したコンテナを使えて、空きの上限を守るか"""
+    docker = FakeDocker()
+    shared = SharedState(os.path.join(testenv.TMPDIR, "inventory.db"))
+    here = ContainerPool(shared, max_idle=1, client_factory=lambda: docker)
+    there = ContainerPool(shared, max_idle=1, client_factory=lambda: docker)
+
+    async def scenario():
+        first, second = await here.checkout(), await here.checkout()
+        await here.checkin(first, healthy=True)
+        await here.checkin(second, healthy=True)
+        # 空きは1つまでなので2つ目は削除される
+        assert second.container_id in docker.removed
+        assert first.container_id not in docker.removed
+        assert (await there.checkout()).container_id == first.container_id
+
+    asyncio.run(scenario())
+
+
+def test_no_state_leaks_between_runs_in_docker():
+    """（Dockerがある場合）前の実行のファイル・プロセスが次の実行から見えないか"""
+    from services.docker_async import AsyncDockerClient
+
+    async def has_image():
+        client = AsyncDockerClient()
+        try:
+            await client._request("GET", "/images/python-sandbox/json")
+        finally:
+            await client.close()
+
+    try:
+        asyncio.run(has_image())
+    except Exception:
+        print("  Dockerかpython-sandboxイメージがないためスキップします")
+        return
+
+    import services.sandbox_service as sandbox_service
+
+    sandbox_service.SANDBOX_REUSE_CONTAINERS = True
+    try:
+        leave_state = (
+            "import os, subprocess\n"
+            "for path in ('leak.txt', '/tmp/leak.txt', '/dev/shm/leak.txt'):\n"
+            "    open(path, 'w').write('secret')\n"
+            "subprocess.Popen(['sleep', '60'], start_new_session=True)\n"
+            "print('left')\n"
+        )
+        check_state = (
+            "import os\n"
+            "paths = ['leak.txt', '/tmp/leak.txt', '/dev/shm/leak.txt']\n"
+            "print([p for p in paths if os.path.exists(p)])\n"
+            "pids = [p for p in os.listdir('/proc') if p.isdigit() and int(p) != os.getpid()]\n"
+            "print([open(f'/proc/{p}/cmdline').read() for p in pids if os.stat(f'/proc/{p}').st_uid == os.getuid()])\n"
+        )
+        first = sandbox_service.execute_python_code_sync(leave_state)
+        assert first.stdout == "left\n", first
+        second = sandbox_service.execute_python_code_sync(check_state)
+        assert second.stdout == "[]\n[]\n", second
+    finally:
+        sandbox_service.SANDBOX_REUSE_CONTAINERS = False
+        asyncio.run(sandbox_service.container_pool.close())
+
+
+def test_reset_script_compiles():
+    compile(_RESET_SCRIPT, "<reset>", "exec")
+
+
+if __name__ == "__main__":
+    print("=== コンテナの再利用のテスト ===")
+    test_container_is_reused_after_reset()
+    test_recycle_after_runs()
+    test_leaked_state_discards_container()
+    test_cancelled_container_is_discarded()
+    test_inventory_shared_between_processes()
+    test_reset_script_compiles()
+    test_no_state_leaks_between_runs_in_docker()
+    print("OK")
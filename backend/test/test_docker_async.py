@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+非同期のDocker Engine APIクライアント（services/docker_async.py）と、
+それを使うサンドボックスの実行（run_in_sandbox）のテスト
+Unixソケットで応答する偽のDocker Engineを相手にする
+"""
+
+import asyncio
+import json
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+import services.docker_async as docker_async
+import services.sandbox_service as sandbox_service
+from services import tracing
+from services.comparators import build_checker_program, parse_checker_output
+from services.docker_async import (
+    AsyncDockerClient,
+    DockerAPIError,
+    ExecStateError,
+    close_docker_client,
+)
+
+
+
+def _frame(stream: int, data: bytes) -> bytes:
+    return struct.pack(">BxxxL", stream, len(data)) + data
+
+
+class FakeEngine:
+    """
+    Docker Engine APIのうち、サンドボックスが使う部分だけに応答する偽物
+    exec の結果は handler(cmd) が返す（終了コード, 出力のフレーム, 待つ秒数）で決める
+    出力を流し終えた後も、running_polls 回の問い合わせまでは exec を実行中と答える
+    """
+
+    def __init__(self, handler, running_polls: int = 0):
+        self.handler = handler
+        self.running_polls = running_polls
+        self.path = os.path.join(testenv.TMPDIR, f"docker-{id(self)}.sock")
+        self.containers: dict[str, dict] = {}
+        self.removed: list[str] = []
+        self.execs: dict[str, dict] = {}
+        self._ids = 0
+        self._server = None
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_unix_server(self._serve, self.path)
+        docker_async.DOCKER_HOST = f"unix://{self.path}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await close_docker_client()
+        self._server.close()
+        docker_async.DOCKER_HOST = "unix:///var/run/docker.sock"
+
+    def _next_id(self, prefix: str) -> str:
+        self._ids += 1
+        return f"{prefix}{self._ids}"
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, target, _ = request_line.decode().split(" ", 2)
+                length = 0
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                body = json.loads(await reader.readexactly(length)) if length else {}
+                path = re.sub(r"^/v[\d.]+", "", target.split("?")[0])
+                if not await self._handle(method, path, body, writer):
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _respond(writer, status: int, payload=None) -> None:
+        body = json.dumps(payload).encode() if payload is not None else b""
+        writer.write(
+            f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+
+    async def _handle(self, method, path, body, writer) -> bool:
+        """応答したら True、接続を閉じるなら False を返す"""
+        parts = path.strip("/").split("/")
+        if path == "/containers/create":
+            container_id = self._next_id("c")
+            self.containers[container_id] = {"config": body, "running": False}
+            self._respond(writer, 201, {"Id": container_id})
+        elif parts[0] == "containers" and parts[1] not in self.containers:
+            self._respond(writer, 404, {"message": f"No such container: {parts[1]}"})
+        elif parts[0] == "containers" and method == "DELETE":
+            del self.containers[parts[1]]
+            self.removed.append(parts[1])
+            self._respond(writer, 204)
+        elif parts[0] == "containers" and parts[2] == "start":
+            self.containers[parts[1]]["running"] = True
+            self._respond(writer, 204)
+        elif parts[0] == "containers" and parts[2] == "json":
+            running = self.containers[parts[1]]["running"]
+            self._respond(writer, 200, {"State": {"Running": running}})
+        elif parts[0] == "containers" and parts[2] == "exec":
+            exec_id = self._next_id("e")
+            self.execs[exec_id] = {
+                "container": parts[1],
+                "config": body,
+                "exit_code": None,
+                "polls": 0,
+            }
+            self._respond(writer, 201, {"Id": exec_id})
+        elif parts[0] == "exec" and parts[2] == "start":
+            exec_info = self.execs[parts[1]]
+            exit_code, frames, delay = self.handler(exec_info["config"]["Cmd"])
+            # 実際のDockerと同じく、出力を流し終えたら接続を閉じて終わりを知らせる
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: application/vnd.docker.raw-stream\r\n\r\n"
+            )
+            await writer.drain()
+            await asyncio.sleep(delay)
+            writer.write(b"".join(frames))
+            exec_info["exit_code"] = exit_code
+            await writer.drain()
+            return False
+        elif parts[0] == "exec" and parts[2] == "json":
+            exec_info = self.execs[parts[1]]
+            exec_info["polls"] += 1
+            if exec_info["polls"] <= self.running_polls:
+                self._respond(writer, 200, {"Running": True, "ExitCode": None})
+            else:
+                self._respond(
+                    writer, 200, {"Running": False, "ExitCode": exec_info["exit_code"]}
+                )
+        else:
+            self._respond(writer, 404, {"message": "page not found"})
+        await writer.drain()
+        return True
+
+
+def _echo_handler(cmd):
+    """python -c のコードの1行目をそのまま標準出力に返す"""
+    return 0, [_frame(1, cmd[-1].strip().splitlines()[0].encode() + b"\n")], 0
+
+
+def test_exec_demultiplexes_output():
+    """execの出力（標準出力・標準エラーのフレーム）を順に結合し、終了コードを返すか"""
+
+    def handler(cmd):
+        return 3, [_frame(1, b"out\n"), _frame(2, b"err\n"), _frame(1, b"more\n")], 0
+
+    async def scenario():
+        async with FakeEngine(handler) as engine:
+            client = AsyncDockerClient()
+            container_id = await client.create_container(
+                "python-sandbox", ["sleep", "30"], host_config={"Memory": 1}
+            )
+            await client.start(container_id)
+            result = await client.exec_run(container_id, ["python", "-c", "x"], user="u")
+            assert result.exit_code == 3
+            assert result.output == b"out\nerr\nmore\n"
+            assert engine.execs["e2"]["config"]["User"] == "u"
+            await client.remove(container_id)
+            # 削除済みのコンテナの削除は無視し、それ以外の404はエラーにする
+            await client.remove(container_id)
+            try:
+                await client.inspect(container_id)
+            except DockerAPIError as e:
+                assert e.status == 404
+            else:
+                raise AssertionError("DockerAPIError was not raised")
+            await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_exec_waits_for_exit_code():
+    """出力の後もしばらく実行中と答えるexecの終了を待ち、終了コードがなければエラーにするか"""
+
+    def handler(cmd):
+        return (None if cmd[-1] == "lost" else 2), [_frame(2, b"boom\n")], 0
+
+    async def scenario():
+        async with FakeEngine(handler, running_polls=3) as engine:
+            client = AsyncDockerClient()
+            container_id = await client.create_container("python-sandbox", ["sleep", "30"])
+            await client.start(container_id)
+            result = await client.exec_run(container_id, ["python", "-c", "x"])
+            assert result.exit_code == 2
+            assert engine.execs["e2"]["polls"] == 4
+            try:
+                await client.exec_run(container_id, ["python", "-c", "lost"])
+            except ExecStateError:
+                pass
+            else:
+                raise AssertionError("ExecStateError was not raised")
+            await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_run_in_sandbox_removes_container():
+    """実行結果を返し、使ったコンテナを削除するか"""
+
+    async def scenario():
+        async with FakeEngine(_echo_handler) as engine:
+            result = await sandbox_service.run_in_sandbox("hello", stdin_input=None)
+            assert result.stdout == "hello\n" and result.succeeded, result
+            assert engine.removed == ["c1"] and not engine.containers
+
+    asyncio.run(scenario())
+
+
+def test_cancel_and_timeout_remove_running_container():
+    """キャンセル・タイムアウトしたら、実行中のコンテナを削除してから終わるか"""
+
+    def slow(cmd):
+        return 0, [_frame(1, b"late\n")], 60
+
+    async def scenario():
+        async with FakeEngine(slow) as engine:
+            task = asyncio.create_task(sandbox_service.run_in_sandbox("x"))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            assert engine.removed == ["c1"]
+
+            sandbox_service.SANDBOX_TIMEOUT_S = 0.2
+            try:
+                result = await sandbox_service.run_in_sandbox("x")
+            finally:
+                sandbox_service.SANDBOX_TIMEOUT_S = 30
+            assert result.exit_code == 124 and result.error_type == "TimeoutError"
+            assert len(engine.removed) == 2 and not engine.containers
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_pip_install_ends_span():
+    """インストール中にキャンセルされても、pip_install のスパンを終えて親のスパンに戻るか"""
+
+    class HangingDocker:
+        async def exec_run(self, container_id, command, **options):
+            await asyncio.sleep(60)
+
+    async def scenario():
+        tracing.TRACE_SAMPLE_RATE = 1.0
+        with tracing.span("request") as root:
+            task = asyncio.create_task(
+                sandbox_service._install_packages(HangingDocker(), "c1", ["numpy"], {})
+            )
+            await asyncio.sleep(0.05)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            assert tracing.current_trace_id() == root.trace_id
+        return root
+
+    root = asyncio.run(scenario())
+    spans = tracing.trace_buffer.get(root.trace_id)["spans"]
+    assert [span["name"] for span in spans] == ["request", "pip_install"]
+    assert spans[1]["status"] == "error" and spans[1]["parent_id"] == root.span_id
+
+
+def test_autoscaler_observes_container_overhead_only():
+    """自動調整には、ユーザーコードの実行・pip install・タイムアウトを除いたコンテナの操作時間を渡すか"""
+    exec_s = 0.3
+
+    def slow(cmd):
+        # pip install もユーザーコードも exec_s 秒かかる
+        return 0, [_frame(1, b"done\n")], exec_s
+
+    observed = []
+
+    def record(wait_s, overhead_s):
+        observed.append(overhead_s)
+
+    async def scenario():
+        async with FakeEngine(slow):
+            await sandbox_service._execute_locally("x")
+            await sandbox_service._execute_locally("!pip install numpy\nx")
+            sandbox_service.SANDBOX_TIMEOUT_S = 0.2
+            try:
+                result = await sandbox_service._execute_locally("x")
+            finally:
+                sandbox_service.SANDBOX_TIMEOUT_S = 30
+            assert result.exit_code == 124
+
+    original = sandbox_service.sandbox_autoscaler.observe
+    sandbox_service.sandbox_autoscaler.observe = record
+    try:
+        asyncio.run(scenario())
+    finally:
+        sandbox_service.sandbox_autoscaler.observe = original
+    assert len(observed) == 3
+    # コンテナの作成と削除は偽物ではすぐ終わる
+    assert all(0 < overhead_s < 0.15 for overhead_s in observed), observed
+
+
+def test_many_concurrent_runs_without_threads():
+    """多数の実行を同時に待っても、スレッドを増やさずに終わるか"""
+    runs, exec_s = 200, 0.5
+
+    def handler(cmd):
+        return 0, [_frame(1, b"ok\n")], exec_s
+
+    async def scenario():
+        async with FakeEngine(handler) as engine:
+            peak_threads = threading.active_count()
+
+            async def sample():
+                nonlocal peak_threads
+                while True:
+                    peak_threads = max(peak_threads, threading.active_count())
+                    await asyncio.sleep(0.01)
+
+            sampler = asyncio.create_task(sample())
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(sandbox_service.run_in_sandbox(f"{i}") for i in range(runs))
+            )
+            elapsed = time.perf_counter() - start
+            sampler.cancel()
+            assert all(r.stdout == "ok\n" for r in results)
+            assert len(engine.removed) == runs
+            return elapsed, peak_threads
+
+    threads_before = threading.active_count()
+    elapsed, peak_threads = asyncio.run(scenario())
+    print(f"  {runs} concurrent runs: {elapsed:.2f}s, threads {threads_before} -> {peak_threads}")
+    # 実行が直列になっていれば runs * exec_s 秒かかる
+    assert elapsed < runs * exec_s / 10
+    assert peak_threads - threads_before < 5
+
+
+def test_files_uploaded_in_chunks():
+    """大きなファイルを引数の長さの上限より小さく分けて送り、実行するコードから読めるか"""
+    engines = []
+    commands = []
+
+    def run_locally(cmd):
+        # コンテナの代わりにこのホストで実行する（環境変数は最後に作られたexecのもの）
+        config = list(engines[0].execs.values())[-1]["config"]
+        env = dict(item.split("=", 1) for item in config.get("Env") or [])
+        commands.append(cmd)
+        result = subprocess.run(
+            [sys.executable, *cmd[1:]], capture_output=True, env={**os.environ, **env}
+        )
+        frames = [_frame(1, result.stdout)] if result.stdout else []
+        if result.stderr:
+            frames.append(_frame(2, result.stderr))
+        return result.returncode, frames, 0
+
+    output = "あいう 123\n" * 40000  # UTF-8で約60万バイト
+    checker = (
+        "def check(input_text, expected, actual):\n"
+        f"    return actual == expected and len(actual) == {len(output)}\n"
+    )
+    # 出力は文字列のまとまりのまま渡す（チャンクの境目は文字の途中になりうる）
+    chunks = [output[i : i + 1000] for i in range(0, len(output), 1000)]
+    code, files = build_checker_program(checker, "入力", iter(chunks), output)
+
+    async def scenario():
+        async with FakeEngine(run_locally) as engine:
+            engines.append(engine)
+            return await sandbox_service.run_in_sandbox(code, files=files)
+
+    try:
+        result = asyncio.run(scenario())
+    finally:
+        for cmd in commands:
+            for path in cmd[3::2]:
+                shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    assert parse_checker_output(result.exit_code, result.stdout).is_correct, result
+    uploads = [cmd for cmd in commands if len(cmd) > 3]
+    assert len(uploads) >= 2
+    for cmd in uploads:
+        assert max(len(arg.encode()) for arg in cmd) < 128 * 1024
+        assert sum(len(arg.encode()) for arg in cmd) < 1024 * 1024
+
+
+if __name__ == "__main__":
+    print("=== 非同期Dockerクライアントのテスト ===")
+    test_exec_demultiplexes_output()
+    test_exec_waits_for_exit_code()
+    test_run_in_sandbox_removes_container()
+    test_cancel_and_timeout_remove_running_container()
+    test_cancelled_pip_install_ends_span()
+    test_autoscaler_observes_container_overhead_only()
+    test_many_concurrent_runs_without_threads()
+    test_files_uploaded_in_chunks()
+    print("OK")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+バックエンドのコールドスタート（main.pyのインポート時間）のテスト
+重いSDKがインポート時に読み込まれていないこと、
+-X importtime で計測したインポート時間が予算内であることを確認する
+"""
+
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# main.pyのインポートにかけてよい時間（ミリ秒）
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1000"))
+
+# 初回使用時まで読み込みを遅延すべきモジュール
+LAZY_MODULES = ["docker", "nbformat", "google.genai", "openai", "huggingface_hub"]
+
+
+def _run(args):
+    env = {k: v for k, v in os.environ.items() if k != "GOOGLE_API_KEY"}
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def measure_import_time_ms() -> float:
+    """-X importtime の出力からmainの累積インポート時間を取り出す"""
+    result = _run(["-X", "importtime", "-c", "import main"])
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == "main":
+            return int(parts[1]) / 1000
+    raise RuntimeError("main not found in -X importtime output")
+
+
+def test_heavy_modules_are_lazy():
+    """インポートしただけではSDKが読み込まれないか"""
+    result = _run(
+        [
+            "-c",
+            "import sys, main; "
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))",
+        ]
+    )
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    print(f"  インポート時に読み込まれたSDK: {loaded or 'なし'}")
+    assert loaded == []
+
+
+def test_import_time_budget():
+    """インポート時間が予算内か（ばらつきを避けるため3回の最小値で判定）"""
+    elapsed_ms = min(measure_import_time_ms() for _ in range(3))
+    print(f"  import main: {elapsed_ms:.0f} ms (予算 {IMPORT_TIME_BUDGET_MS:.0f} ms)")
+    assert elapsed_ms <= IMPORT_TIME_BUDGET_MS
+
+
+if __name__ == "__main__":
+    print("=== コールドスタートのテスト ===")
+    test_heavy_modules_are_lazy()
+    test_import_time_budget()
+    print("OK")
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+LLMプロバイダーのルーター（ヘッジ・フォールバック）のテスト
+ローカルのスタブプロバイダーだけを使う
+"""
+
+import asyncio
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+import httpx
+from fastapi import FastAPI
+
+from services import llm_providers
+from services.llm_providers import LLMRouter, LLMUnavailableError, StubProvider
+
+
+def _warm_up(router: LLMRouter, name: str, latency_s: float, samples: int = 50):
+    for _ in range(samples):
+        router.stats[name].record("success", latency_s)
+
+
+def test_fallback_on_error():
+    """最初のプロバイダーが失敗したら次のプロバイダーの結果を返すか"""
+    router = LLMRouter(
+        [
+            StubProvider("broken", latency_ms=5, failure_rate=1.0),
+            StubProvider("backup", latency_ms=5, response="backup advice"),
+        ]
+    )
+    response = asyncio.run(router.generate("prompt"))
+    assert response.provider == "backup"
+    assert response.text == "backup advice"
+    assert router.stats["broken"].error_rate == 1.0
+
+
+def test_fallback_on_timeout():
+    """タイムアウトしたプロバイダーの次にフォールバックするか"""
+    router = LLMRouter(
+        [StubProvider("slow", latency_ms=500), StubProvider("fast", latency_ms=5)],
+        request_timeout=0.05,
+    )
+    response = asyncio.run(router.generate("prompt"))
+    assert response.provider == "fast"
+
+
+def test_hedged_request_wins():
+    """直近のp95を超えたらヘッジリクエストを送り、速い方を返すか"""
+    router = LLMRouter(
+        [
+            StubProvider("primary", latency_ms=400),
+            StubProvider("secondary", latency_ms=10, response="hedged advice"),
+        ]
+    )
+    _warm_up(router, "primary", 0.02)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        response = await router.generate("prompt")
+        return response, loop.time() - start
+
+    response, elapsed = asyncio.run(run())
+    print(f"  hedged response in {elapsed * 1000:.0f} ms from {response.provider}")
+    assert response.hedged
+    assert response.provider == "secondary"
+    assert elapsed < 0.2
+
+
+def test_all_providers_fail():
+    """すべて失敗したらLLMUnavailableErrorを送出するか"""
+    router = LLMRouter(
+        [
+            StubProvider("a", latency_ms=1, failure_rate=1.0),
+            StubProvider("b", latency_ms=1, failure_rate=1.0),
+        ]
+    )
+    try:
+        asyncio.run(router.generate("prompt"))
+    except LLMUnavailableError as e:
+        assert "a:" in str(e) and "b:" in str(e)
+    else:
+        raise AssertionError("LLMUnavailableError was not raised")
+
+
+def test_failing_provider_is_deprioritized():
+    """連続して失敗したプロバイダーが後回しになるか"""
+    router = LLMRouter(
+        [
+            StubProvider("flaky", latency_ms=1, failure_rate=1.0),
+            StubProvider("steady", latency_ms=1),
+        ]
+    )
+    for _ in range(3):
+        asyncio.run(router.generate("prompt"))
+    assert router.stats["flaky"].cooling_down
+    assert [p.name for p in router._ordered_providers()] == ["steady", "flaky"]
+    summary = {row["provider"]: row for row in router.stats_summary()}
+    assert summary["steady"]["error_rate"] == 0.0
+
+
+def test_provider_stats_require_admin_token():
+    """プロバイダーの統計（GET /admin/llm-providers）には ADMIN_TOKEN が必要か"""
+    import routers.admin as admin
+
+    app = FastAPI()
+    app.include_router(admin.router)
+    url = "/admin/llm-providers"
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            admin.ADMIN_TOKEN = ""
+            assert (await client.get(url)).status_code == 403
+            admin.ADMIN_TOKEN = "secret"
+            assert (await client.get(url)).status_code == 401
+            wrong = {"Authorization": "Bearer wrong"}
+            assert (await client.get(url, headers=wrong)).status_code == 401
+            response = await client.get(url, headers={"Authorization": "Bearer secret"})
+            assert response.status_code == 200, response.text
+            return response.json()
+
+    originals = admin.ADMIN_TOKEN, llm_providers._router
+    llm_providers._router = LLMRouter([StubProvider("stub", latency_ms=1)])
+    try:
+        summary = asyncio.run(scenario())
+    finally:
+        admin.ADMIN_TOKEN, llm_providers._router = originals
+    assert [row["provider"] for row in summary] == ["stub"]
+
+
+if __name__ == "__main__":
+    print("=== LLMルーターのテスト ===")
+    test_fallback_on_error()
+    test_fallback_on_timeout()
+    test_hedged_request_wins()
+    test_all_providers_fail()
+    test_failing_provider_is_deprioritized()
+    test_provider_stats_require_admin_token()
+    print("OK")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Prometheus形式のメトリクス（services/metrics.py と /metrics）のテスト
+"""
+
+import asyncio
+import re
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+import routers.submissions as submissions
+from services.metrics import Counter, Gauge, Histogram
+from services.sandbox_service import CodeExecutionResult
+
+# テキスト形式の1行（コメントかサンプル）
+_HELP = re.compile(r"^# HELP ([a-zA-Z_:][a-zA-Z0-9_:]*) .+$")
+_TYPE = re.compile(r"^# TYPE ([a-zA-Z_:][a-zA-Z0-9_:]*) (counter|gauge|histogram)$")
+_SAMPLE = re.compile(
+    r'^([a-zA-Z_:][a-zA-Z0-9_:]*)'
+    r'(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"(?:,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*\})?'
+    r" (-?[0-9.e+-]+|\+Inf|NaN)$"
+)
+
+
+def _parse(text: str) -> tuple[dict[str, str], dict[str, float]]:
+    """各メトリクスの型と、サンプル（ラベルを含む名前 -> 値）を返す（形式が違えば失敗する）"""
+    assert text.endswith("\n")
+    types, samples, helps = {}, {}, set()
+    for line in text.splitlines():
+        if match := _HELP.match(line):
+            helps.add(match.group(1))
+        elif match := _TYPE.match(line):
+            assert match.group(1) not in types, f"duplicate TYPE: {line}"
+            types[match.group(1)] = match.group(2)
+        else:
+            match = _SAMPLE.match(line)
+            assert match, f"malformed line: {line!r}"
+            name = match.group(1)
+            base = re.sub(r"_(bucket|sum|count)$", "", name)
+            # サンプルの前に、そのメトリクスの HELP と TYPE がある
+            assert name in types or (base in types and types[base] == "histogram"), line
+            assert name in helps or base in helps, line
+            samples[name + (match.group(2) or "")] = float(match.group(3))
+    return types, samples
+
+
+def test_samples_are_rendered_with_labels():
+    """ラベルのエスケープ、ヒストグラムの累積バケット・_sum・_count を正しく出力するか"""
+    counter = Counter("test_events_total", "Events", labelnames=("kind", "path"))
+    counter.inc(kind="a", path='C:\\tmp\\"x"\n')
+    counter.inc(2, kind="a", path='C:\\tmp\\"x"\n')
+    gauge = Gauge("test_level", "Level without labels")
+    histogram = Histogram("test_seconds", "Durations", labelnames=("stage",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, stage="run")
+
+    lines = counter.render() + gauge.render() + histogram.render()
+    types, samples = _parse("\n".join(lines) + "\n")
+    assert types == {
+        "test_events_total": "counter",
+        "test_level": "gauge",
+        "test_seconds": "histogram",
+    }
+    assert samples == {
+        'test_events_total{kind="a",path="C:\\\\tmp\\\\\\"x\\"\\n"}': 3,
+        # ラベルのないゲージは、まだ値がなくても0を出す
+        "test_level": 0,
+        # バケットの上限ちょうどの値はそのバケットに入る
+        'test_seconds_bucket{stage="run",le="0.1"}': 2,
+        'test_seconds_bucket{stage="run",le="1"}': 3,
+        'test_seconds_bucket{stage="run",le="+Inf"}': 4,
+        'test_seconds_sum{stage="run"}': 3.65,
+        'test_seconds_count{stage="run"}': 4,
+    }
+
+
+def test_metrics_endpoint_exposes_submission_metrics():
+    """/metrics がテキスト形式のContent-Typeで、提出後の段階・結果のメトリクスを返すか"""
+
+    async def fake_execute(user_code: str, stdin_input=None, files=None):
+        return CodeExecutionResult(
+            stdout="3\n", stderr="", execution_time_ms=1.0, exit_code=0, succeeded=True
+        )
+
+    async def fake_advice(**kwargs) -> str:
+        return "正解です。"
+
+    async def scenario(client):
+        problem = {"title": "和", "description": "x", "correct_code": "print(3)"}
+        problem_id = (await client.post("/problems/", json=problem)).json()["id"]
+        response = await client.post(
+            "/submissions/", json={"problem_id": problem_id, "user_code": "print(3)"}
+        )
+        assert response.status_code == 200, response.text
+        return await client.get("/metrics")
+
+    originals = (
+        submissions.execute_python_code_in_docker,
+        submissions.generate_advice_with_huggingface,
+    )
+    submissions.execute_python_code_in_docker = fake_execute
+    submissions.generate_advice_with_huggingface = fake_advice
+    try:
+        response = asyncio.run(testenv.with_client(scenario))
+    finally:
+        (
+            submissions.execute_python_code_in_docker,
+            submissions.generate_advice_with_huggingface,
+        ) = originals
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+    types, samples = _parse(response.text)
+    assert types["submissions_total"] == "counter"
+    assert types["submission_stage_seconds"] == "histogram"
+    assert types["sandbox_runs_in_flight"] == "gauge"
+    assert samples['submissions_total{result="correct"}'] >= 1
+    for stage in ("user_run", "reference_run", "judge", "db_commit"):
+        count = samples[f'submission_stage_seconds_count{{stage="{stage}"}}']
+        assert samples[f'submission_stage_seconds_bucket{{stage="{stage}",le="+Inf"}}'] == count
+        assert count >= 1, stage
+
+
+if __name__ == "__main__":
+    print("=== メトリクスのテスト ===")
+    test_samples_are_rendered_with_labels()
+    test_metrics_endpoint_exposes_submission_metrics()
+    print("OK")
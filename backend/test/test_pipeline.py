@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+提出処理のステージグラフと、正解コードの実行結果キャッシュのテスト
+"""
+
+import asyncio
+import time
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from services.pipeline import Stage, StageDeadlineExceeded, run_stage_graph
+from services.reference_cache import ReferenceCache, reference_key
+from services.sandbox_service import CodeExecutionResult
+
+
+def _sleep_then(seconds: float, value):
+    async def run(**inputs):
+        await asyncio.sleep(seconds)
+        return value
+
+    return run
+
+
+def test_independent_stages_run_concurrently():
+    """依存しないステージは同時に実行され、全体が最も遅いステージ程度で終わるか"""
+
+    async def combine(user, reference):
+        return user + reference
+
+    stages = [
+        Stage("user", _sleep_then(0.2, 1)),
+        Stage("reference", _sleep_then(0.2, 2)),
+        Stage("context", _sleep_then(0.2, 3)),
+        Stage("judge", combine, after=("user", "reference")),
+    ]
+    start = time.perf_counter()
+    results = asyncio.run(run_stage_graph(stages))
+    elapsed = time.perf_counter() - start
+    print(f"  3 stages of 200 ms finished in {elapsed * 1000:.0f} ms")
+    assert results == {"user": 1, "reference": 2, "context": 3, "judge": 3}
+    assert elapsed < 0.35
+
+
+def test_optional_stage_deadline():
+    """任意のステージが期限を過ぎたら結果をNoneにして続行するか"""
+
+    async def judge(user, reference):
+        return reference is None
+
+    stages = [
+        Stage("user", _sleep_then(0.01, 1)),
+        Stage("reference", _sleep_then(5, 2), deadline_s=0.05, required=False),
+        Stage("judge", judge, after=("user", "reference")),
+    ]
+    errors = {}
+    results = asyncio.run(run_stage_graph(stages, errors=errors))
+    assert results["reference"] is None and results["judge"] is True
+    # 期限切れと失敗を区別できる
+    assert list(errors) == ["reference"]
+    assert isinstance(errors["reference"], StageDeadlineExceeded)
+
+
+def test_required_stage_failure_cancels_others():
+    """必須のステージが失敗したら残りのステージをキャンセルして例外を送出するか"""
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    async def run():
+        stages = [
+            Stage("user", _sleep_then(5, 1), deadline_s=0.05),
+            Stage("reference", slow),
+        ]
+        start = time.perf_counter()
+        try:
+            await run_stage_graph(stages)
+        except StageDeadlineExceeded as e:
+            assert "user" in str(e)
+        else:
+            raise AssertionError("StageDeadlineExceeded was not raised")
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    assert elapsed < 1
+    assert cancelled == ["slow"]
+
+
+def test_stage_order_is_checked():
+    """未定義や後ろにあるステージへの依存を拒否するか"""
+    try:
+        asyncio.run(run_stage_graph([Stage("judge", _sleep_then(0, 1), after=("user",))]))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError was not raised")
+
+
+def test_reference_cache_shares_runs():
+    """同じ問題の正解コードは同時の提出でも1回だけ実行し、結果を再利用するか"""
+    cache = ReferenceCache(maxsize=2)
+    runs = []
+
+    def runner(stdout: str, exit_code: int = 0):
+        async def run():
+            runs.append(stdout)
+            await asyncio.sleep(0.05)
+            return CodeExecutionResult(
+                stdout=stdout,
+                stderr="",
+                execution_time_ms=50.0,
+                exit_code=exit_code,
+                succeeded=exit_code == 0,
+            )
+
+        return run
+
+    async def scenario():
+        key = reference_key("print(3)", None)
+        results = await asyncio.gather(
+            *(cache.get_or_run(key, runner("3\n")) for _ in range(10))
+        )
+        assert all(r.stdout == "3\n" for r in results)
+        await cache.get_or_run(key, runner("3\n"))
+        # 失敗した実行はキャッシュしない
+        failing = reference_key("raise", None)
+        await cache.get_or_run(failing, runner("error", exit_code=1))
+        await cache.get_or_run(failing, runner("error", exit_code=1))
+
+    asyncio.run(scenario())
+    assert runs == ["3\n", "error", "error"]
+    assert reference_key("a", "b") != reference_key("a", None)
+
+
+async def _submit_with(
+    fake_execute, problem: dict, code: str, force_llm_advice: bool = True
+) -> dict:
+    """サンドボックス実行とアドバイス生成を偽物にして、問題を作って提出する"""
+    import routers.submissions as submissions
+
+    async def fake_advice(**kwargs) -> str:
+        return "アドバイス"
+
+    async def scenario(client):
+        problem_id = (await client.post("/problems/", json=problem)).json()["id"]
+        response = await client.post(
+            "/submissions/",
+            json={
+                "problem_id": problem_id,
+                "user_code": code,
+                "force_llm_advice": force_llm_advice,
+            },
+        )
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    originals = (
+        submissions.execute_python_code_in_docker,
+        submissions.generate_advice_with_huggingface,
+        submissions.REFERENCE_RUN_DEADLINE_S,
+    )
+    submissions.execute_python_code_in_docker = fake_execute
+    submissions.generate_advice_with_huggingface = fake_advice
+    submissions.REFERENCE_RUN_DEADLINE_S = 0.1
+    try:
+        return await testenv.with_client(scenario)
+    finally:
+        (
+            submissions.execute_python_code_in_docker,
+            submissions.generate_advice_with_huggingface,
+            submissions.REFERENCE_RUN_DEADLINE_S,
+        ) = originals
+
+
+def test_reference_deadline_leaves_submission_unjudged():
+    """正解コードの実行が期限切れなら判定せず（None）、エラーなら従来どおり終了状態で判定するか"""
+    user_result = CodeExecutionResult(
+        stdout="1\n", stderr="", execution_time_ms=1.0, exit_code=0, succeeded=True
+    )
+
+    async def slow_reference(user_code: str, stdin_input=None):
+        if user_code == "print(1)":
+            return user_result
+        await asyncio.sleep(5)
+        return user_result
+
+    async def broken_reference(user_code: str, stdin_input=None):
+        if user_code == "print(1)":
+            return user_result
+        raise RuntimeError("sandbox unavailable")
+
+    problem = {"title": "遅い正解", "description": "x", "correct_code": "print(2)"}
+    slow = asyncio.run(_submit_with(slow_reference, {**problem, "test_input": "slow"}, "print(1)"))
+    assert slow["is_correct"] is None and slow["correct_stdout"] is None
+    assert "時間内に終わりませんでした" in slow["message"]
+
+    broken = asyncio.run(
+        _submit_with(broken_reference, {**problem, "test_input": "broken"}, "print(1)")
+    )
+    assert broken["is_correct"] is True
+
+
+def test_rule_advice_does_not_wait_for_reference():
+    """定型のヒントは正解コードの実行を待たず、ユーザーコードの実行結果だけで作るか"""
+    import routers.submissions as submissions
+
+    # 正解コードの実行は、定型のヒントができるまで終わらない（期限は0.1秒）
+    rule_advice_done = asyncio.Event()
+    user_result = CodeExecutionResult(
+        stdout="",
+        stderr=(
+            "Traceback (most recent call last):\n"
+            '  File "<string>", line 1, in <module>\n'
+            "ZeroDivisionError: division by zero\n"
+        ),
+        execution_time_ms=1.0,
+        exit_code=1,
+        succeeded=False,
+    )
+
+    async def waiting_reference(user_code: str, stdin_input=None):
+        if user_code == "print(1 / 0)":
+            return user_result
+        await rule_advice_done.wait()
+        return CodeExecutionResult(
+            stdout="2\n", stderr="", execution_time_ms=1.0, exit_code=0, succeeded=True
+        )
+
+    def recording_rule_advice(*args, **kwargs):
+        rule_advice_done.set()
+        return original_rule_advice(*args, **kwargs)
+
+    original_rule_advice = submissions.generate_rule_advice
+    submissions.generate_rule_advice = recording_rule_advice
+    try:
+        problem = {"title": "ルール", "description": "x", "correct_code": "print(2)"}
+        result = asyncio.run(
+            _submit_with(
+                waiting_reference, {**problem, "test_input": "rule"}, "print(1 / 0)", False
+            )
+        )
+    finally:
+        submissions.generate_rule_advice = original_rule_advice
+    assert result["advice_source"] == "rule" and "ZeroDivisionError" in result["advice_text"]
+    assert result["correct_stdout"] == "2\n" and result["is_correct"] is False
+
+
+if __name__ == "__main__":
+    print("=== ステージグラフのテスト ===")
+    test_independent_stages_run_concurrently()
+    test_optional_stage_deadline()
+    test_required_stage_failure_cancels_others()
+    test_stage_order_is_checked()
+    test_reference_cache_shares_runs()
+    test_reference_deadline_leaves_submission_unjudged()
+    test_rule_advice_does_not_wait_for_reference()
+    print("OK")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+問題の取得の条件付きリクエスト（ETag・Last-Modified による304）のテスト
+"""
+
+import asyncio
+from datetime import timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+
+PROBLEM = {
+    "title": "足し算",
+    "description": "2つの整数の和を出力する",
+    "correct_code": "print(sum(map(int, input().split())))",
+    "test_input": "1 2",
+}
+
+
+def test_etag_returns_not_modified():
+    """同じETagなら本文なしの304を返し、問題を更新すると新しいETagで200を返すか"""
+
+    async def scenario(client):
+        problem_id = (await client.post("/problems/", json=PROBLEM)).json()["id"]
+        for path in ("/problems/", f"/problems/{problem_id}"):
+            first = await client.get(path)
+            assert first.status_code == 200
+            etag = first.headers["etag"]
+
+            cached = await client.get(path, headers={"If-None-Match": etag})
+            assert cached.status_code == 304 and cached.content == b""
+            assert cached.headers["etag"] == etag
+            # 弱いETag・複数のETag・* のどれでも一致とみなす
+            for value in (f"W/{etag}", f'"other", {etag}', "*"):
+                response = await client.get(path, headers={"If-None-Match": value})
+                assert response.status_code == 304, value
+            other = await client.get(path, headers={"If-None-Match": '"other"'})
+            assert other.status_code == 200 and other.json() == first.json()
+
+        await client.put(f"/problems/{problem_id}", json={**PROBLEM, "test_input": "2 5"})
+        updated = await client.get(f"/problems/{problem_id}", headers={"If-None-Match": etag})
+        assert updated.status_code == 200 and updated.json()["test_input"] == "2 5"
+        assert updated.headers["etag"] != etag
+
+    asyncio.run(testenv.with_client(scenario))
+
+
+def test_if_modified_since_compares_dates():
+    """If-Modified-Since を日時として比べ、Last-Modified 以降なら304を返すか"""
+
+    async def scenario(client):
+        problem_id = (await client.post("/problems/", json=PROBLEM)).json()["id"]
+        path = f"/problems/{problem_id}"
+        first = await client.get(path)
+        last_modified = first.headers["last-modified"]
+        modified_at = parsedate_to_datetime(last_modified)
+
+        async def status(value: str) -> int:
+            return (await client.get(path, headers={"If-Modified-Since": value})).status_code
+
+        assert await status(last_modified) == 304
+        # 文字列が違っても、同じ時刻・より後の時刻なら変更なし
+        assert await status(format_datetime(modified_at + timedelta(hours=1), usegmt=True)) == 304
+        jst = modified_at.astimezone(timezone(timedelta(hours=9)))
+        assert await status(format_datetime(jst)) == 304
+        assert await status(format_datetime(modified_at - timedelta(seconds=1), usegmt=True)) == 200
+        # 日時として読めない値は無視して本文を返す
+        assert await status("not a date") == 200
+        # If-None-Match があれば If-Modified-Since は使わない
+        response = await client.get(
+            path, headers={"If-None-Match": '"other"', "If-Modified-Since": last_modified}
+        )
+        assert response.status_code == 200
+
+    asyncio.run(testenv.with_client(scenario))
+
+
+if __name__ == "__main__":
+    print("=== 問題の条件付きリクエストのテスト ===")
+    test_etag_returns_not_modified()
+    test_if_modified_since_compares_dates()
+    print("OK")
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+問題ごとの提出統計（services/stats_service.py と GET /problems/{id}/stats）のテスト
+"""
+
+import asyncio
+import os
+from datetime import datetime, timezone
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import routers.submissions as submissions
+from database import Base, ProblemStatsModel, SessionLocal, SubmissionModel
+from services.sandbox_service import CodeExecutionResult, classify_error_type
+from services.stats_service import (
+    backfill_problem_stats,
+    summarize_problem_stats,
+    update_problem_stats,
+)
+
+ZERO_DIVISION = (
+    "Traceback (most recent call last):\n"
+    '  File "<string>", line 1, in <module>\n'
+    "ZeroDivisionError: division by zero\n"
+)
+
+
+async def _fake_execute(user_code: str, stdin_input=None, files=None):
+    """コード末尾のコメント（# 12 なら12ms）を実行時間として、コードに応じた結果を返す"""
+    code, _, elapsed = user_code.partition("#")
+    execution_time_ms = float(elapsed) if elapsed else 1.0
+    if code.strip() == "1/0":
+        return CodeExecutionResult(
+            stdout="",
+            stderr=ZERO_DIVISION,
+            execution_time_ms=execution_time_ms,
+            exit_code=1,
+            error_type=classify_error_type(1, ZERO_DIVISION),
+            succeeded=False,
+        )
+    stdout = "3\n" if code.strip() == "print(3)" else "4\n"
+    return CodeExecutionResult(
+        stdout=stdout, stderr="", execution_time_ms=execution_time_ms, exit_code=0, succeeded=True
+    )
+
+
+async def _fake_advice(**kwargs) -> str:
+    return "アドバイス"
+
+
+def _run_with_fake_sandbox(scenario):
+    originals = (
+        submissions.execute_python_code_in_docker,
+        submissions.generate_advice_with_huggingface,
+    )
+    submissions.execute_python_code_in_docker = _fake_execute
+    submissions.generate_advice_with_huggingface = _fake_advice
+    try:
+        return asyncio.run(testenv.with_client(scenario))
+    finally:
+        (
+            submissions.execute_python_code_in_docker,
+            submissions.generate_advice_with_huggingface,
+        ) = originals
+
+
+async def _create_problem(client, title: str) -> int:
+    problem = {"title": title, "description": "3を出力する", "correct_code": "print(3)"}
+    response = await client.post("/problems/", json=problem)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+async def _submit_mix(client, problem_id: int):
+    """正解10件（1〜10ms）・不正解5件（11〜15ms）・実行エラー5件（16〜20ms）を提出する"""
+    codes = (
+        [f"print(3)  # {ms}" for ms in range(1, 11)]
+        + [f"print(4)  # {ms}" for ms in range(11, 16)]
+        + [f"1/0  # {ms}" for ms in range(16, 21)]
+    )
+    for code in codes:
+        response = await client.post(
+            "/submissions/", json={"problem_id": problem_id, "user_code": code}
+        )
+        assert response.status_code == 200, response.text
+
+
+def _close(actual: float, expected: float) -> bool:
+    # 分位点スケッチの相対誤差（1%）の範囲で一致する
+    return abs(actual - expected) <= expected * 0.01
+
+
+def _session_factory(name: str):
+    engine = create_engine(f"sqlite:///{os.path.join(testenv.TMPDIR, name)}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def _submission(problem_id: int, is_correct, exit_code: int = 0) -> SubmissionModel:
+    return SubmissionModel(
+        problem_id=problem_id,
+        user_code="print(1)",
+        exit_code=exit_code,
+        is_correct=is_correct,
+        execution_time_ms=10.0,
+        submitted_at=datetime.now(timezone.utc),
+    )
+
+
+def test_unjudged_submissions_are_left_out_of_pass_rate():
+    """判定できなかった提出は unjudged_count に数え、正解率の分母に入れないか"""
+    session_factory = _session_factory("unjudged.db")
+    with session_factory() as db:
+        submissions = [
+            _submission(1, True),
+            _submission(1, False),
+            _submission(1, None),
+            _submission(1, None),
+        ]
+        db.add_all(submissions)
+        update_problem_stats(db, submissions)
+        db.commit()
+        summary = summarize_problem_stats(1, db.get(ProblemStatsModel, 1))
+
+    assert summary["attempts"] == 4
+    assert summary["correct_count"] == 1
+    assert summary["unjudged_count"] == 2
+    assert summary["pass_rate"] == 0.5
+
+    # 判定できた提出がなければ正解率は出さない
+    with session_factory() as db:
+        submissions = [_submission(2, None)]
+        db.add_all(submissions)
+        update_problem_stats(db, submissions)
+        db.commit()
+        summary = summarize_problem_stats(2, db.get(ProblemStatsModel, 2))
+    assert summary["unjudged_count"] == 1 and summary["pass_rate"] is None
+
+
+def test_stats_endpoint_counts_submissions():
+    """提出の結果ごとの件数・エラータイプ・実行時間の分位点をAPIで返し、知らない問題は404か"""
+
+    async def scenario(client):
+        problem_id = await _create_problem(client, "統計")
+        empty = await client.get(f"/problems/{problem_id}/stats")
+        assert empty.status_code == 200, empty.text
+        assert empty.json()["attempts"] == 0 and empty.json()["pass_rate"] is None
+
+        await _submit_mix(client, problem_id)
+        response = await client.get(f"/problems/{problem_id}/stats")
+        missing = await client.get("/problems/999999/stats")
+        return response, missing
+
+    response, missing = _run_with_fake_sandbox(scenario)
+    assert response.status_code == 200, response.text
+    stats = response.json()
+    assert stats["attempts"] == 20
+    assert stats["correct_count"] == 10
+    assert stats["error_count"] == 5
+    assert stats["unjudged_count"] == 0
+    assert stats["pass_rate"] == 0.5
+    assert stats["error_type_counts"] == {"ZeroDivisionError": 5}
+    assert stats["most_common_error_type"] == "ZeroDivisionError"
+    assert _close(stats["median_execution_time_ms"], 10)
+    assert _close(stats["p95_execution_time_ms"], 19)
+    assert missing.status_code == 404
+
+
+def test_backfill_rebuilds_stats_for_existing_submissions():
+    """統計のない既存DBでは提出から同じ統計を作り直し、統計があれば作り直さないか"""
+
+    async def scenario(client):
+        problem_id = await _create_problem(client, "移行")
+        await _submit_mix(client, problem_id)
+        before = (await client.get(f"/problems/{problem_id}/stats")).json()
+
+        with SessionLocal() as db:
+            # error_type列がなかった頃の提出（標準エラーから判定し直す）
+            db.add(
+                SubmissionModel(
+                    problem_id=problem_id,
+                    user_code="[][0]",
+                    stderr="IndexError: list index out of range\n",
+                    exit_code=1,
+                    is_correct=False,
+                    execution_time_ms=5.0,
+                    submitted_at=datetime.now(timezone.utc),
+                )
+            )
+            # 統計テーブル導入前のDBと同じ状態にする
+            db.query(ProblemStatsModel).delete()
+            db.commit()
+            backfill_problem_stats(db)
+        rebuilt = (await client.get(f"/problems/{problem_id}/stats")).json()
+
+        # 統計がすでにあれば作り直さない
+        with SessionLocal() as db:
+            db.get(ProblemStatsModel, problem_id).attempts = 100
+            db.commit()
+            backfill_problem_stats(db)
+            kept = db.get(ProblemStatsModel, problem_id).attempts
+        return before, rebuilt, kept
+
+    before, rebuilt, kept = _run_with_fake_sandbox(scenario)
+    assert rebuilt["attempts"] == before["attempts"] + 1
+    assert rebuilt["correct_count"] == before["correct_count"]
+    assert rebuilt["error_count"] == before["error_count"] + 1
+    assert rebuilt["error_type_counts"] == {"ZeroDivisionError": 5, "IndexError": 1}
+    assert _close(rebuilt["median_execution_time_ms"], 10)
+    assert kept == 100
+
+
+def test_delete_problem_removes_stats():
+    """問題を削除すると統計の行も消え、統計APIは404になるか"""
+
+    async def scenario(client):
+        problem_id = await _create_problem(client, "削除")
+        await _submit_mix(client, problem_id)
+        with SessionLocal() as db:
+            assert db.get(ProblemStatsModel, problem_id) is not None
+        response = await client.delete(f"/problems/{problem_id}")
+        assert response.status_code == 200, response.text
+        with SessionLocal() as db:
+            remaining = db.get(ProblemStatsModel, problem_id)
+        return remaining, await client.get(f"/problems/{problem_id}/stats")
+
+    remaining, response = _run_with_fake_sandbox(scenario)
+    assert remaining is None
+    assert response.status_code == 404
+
+
+if __name__ == "__main__":
+    print("=== 問題ごとの提出統計のテスト ===")
+    test_unjudged_submissions_are_left_out_of_pass_rate()
+    test_stats_endpoint_counts_submissions()
+    test_backfill_rebuilds_stats_for_existing_submissions()
+    test_delete_problem_removes_stats()
+    print("OK")
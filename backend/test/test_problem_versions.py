@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+問題のバージョン（services/problem_versions.py）のテスト
+サンドボックス実行とアドバイス生成はプロセス内の偽物に置き換え、APIを通して確かめる
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+import routers.submissions as submissions
+from services.sandbox_service import CodeExecutionResult
+from services.problem_versions import VersionedCache, version_fields, version_hash
+
+PROBLEM = {
+    "title": "足し算",
+    "description": "2つの整数の和を出力する",
+    "correct_code": "print(sum(map(int, input().split())))",
+    "test_input": "1 2",
+}
+
+
+async def _with_client(scenario):
+    calls = {"advice": 0}
+
+    async def fake_execute(user_code: str, stdin_input=None) -> CodeExecutionResult:
+        # 正解コードの出力は問題のテスト入力で決まり、提出は "print(3)" のように固定の値を出す
+        if user_code.startswith("print(sum"):
+            stdout = f"{sum(map(int, stdin_input.split()))}\n"
+        else:
+            stdout = user_code[len("print(") : -1] + "\n"
+        return CodeExecutionResult(
+            stdout=stdout, stderr="", execution_time_ms=1.0, exit_code=0, succeeded=True
+        )
+
+    async def fake_advice(**kwargs) -> str:
+        calls["advice"] += 1
+        return "正解です。" if kwargs["is_correct"] else "出力を確認しましょう。"
+
+    originals = (
+        submissions.execute_python_code_in_docker,
+        submissions.generate_advice_with_huggingface,
+    )
+    submissions.execute_python_code_in_docker = fake_execute
+    submissions.generate_advice_with_huggingface = fake_advice
+    try:
+        await testenv.with_client(scenario, calls)
+    finally:
+        (
+            submissions.execute_python_code_in_docker,
+            submissions.generate_advice_with_huggingface,
+        ) = originals
+
+
+async def _submit(client, problem_id: int, code: str) -> dict:
+    response = await client.post(
+        "/submissions/",
+        json={"problem_id": problem_id, "user_code": code, "force_llm_advice": True},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_update_records_new_version():
+    """内容を変えた更新だけが新しいバージョンを作り、以前のバージョンが残るか"""
+
+    async def scenario(client, calls):
+        created = (await client.post("/problems/", json=PROBLEM)).json()
+        assert created["version"] == 1 and created["version_hash"]
+        problem_id = created["id"]
+
+        # 同じ内容での更新ではバージョンは増えない
+        same = (await client.put(f"/problems/{problem_id}", json=PROBLEM)).json()
+        assert same["version"] == 1 and same["version_hash"] == created["version_hash"]
+
+        changed = (
+            await client.put(f"/problems/{problem_id}", json={**PROBLEM, "test_input": "2 5"})
+        ).json()
+        assert changed["version"] == 2 and changed["version_hash"] != created["version_hash"]
+
+        versions = (await client.get(f"/problems/{problem_id}/versions")).json()
+        assert [v["version"] for v in versions] == [1, 2]
+        first = (await client.get(f"/problems/{problem_id}/versions/1")).json()
+        assert first["test_input"] == "1 2" and first["comparator"] == "exact"
+        missing = await client.get(f"/problems/{problem_id}/versions/3")
+        assert missing.status_code == 404
+        assert (await client.get("/problems/999999/versions")).status_code == 404
+
+    asyncio.run(_with_client(scenario))
+
+
+def test_submissions_reference_judged_version():
+    """提出に判定に使ったバージョンが記録され、更新後は新しいバージョンで判定されるか"""
+
+    async def scenario(client, calls):
+        problem_id = (await client.post("/problems/", json=PROBLEM)).json()["id"]
+        assert (await _submit(client, problem_id, "print(3)"))["is_correct"]
+        # 同じバージョン・同じ結果へのアドバイスは使い回す
+        await _submit(client, problem_id, "print(3)")
+        assert calls["advice"] == 1
+
+        await client.put(f"/problems/{problem_id}", json={**PROBLEM, "test_input": "2 5"})
+        result = await _submit(client, problem_id, "print(3)")
+        assert not result["is_correct"] and result["correct_stdout"] == "7\n"
+        assert calls["advice"] == 2
+
+        page = (await client.get("/submissions/", params={"problem_id": problem_id})).json()
+        assert [item["problem_version"] for item in page["items"]] == [2, 1, 1]
+
+    asyncio.run(_with_client(scenario))
+
+
+def test_deleted_problem_id_not_reused():
+    """最後の問題を削除しても、新しい問題は別のIDになり、バージョンが1から始まるか"""
+
+    async def scenario(client, calls):
+        old_id = (await client.post("/problems/", json=PROBLEM)).json()["id"]
+        await client.put(f"/problems/{old_id}", json={**PROBLEM, "test_input": "2 5"})
+        assert (await client.delete(f"/problems/{old_id}")).status_code == 200
+
+        created = (await client.post("/problems/", json=PROBLEM)).json()
+        assert created["id"] > old_id and created["version"] == 1
+        versions = (await client.get(f"/problems/{created['id']}/versions")).json()
+        assert [v["version"] for v in versions] == [1]
+        # 削除した問題のバージョンは、過去の提出のためにそのまま残る
+        old_versions = (await client.get(f"/problems/{old_id}/versions")).json()
+        assert [v["test_input"] for v in old_versions] == ["1 2", "2 5"]
+
+    asyncio.run(_with_client(scenario))
+
+
+def test_versioned_cache_keeps_versions_apart():
+    """バージョンごとに値を分けて保持し、古いものから押し出すか"""
+    base = {**PROBLEM, "comparator": None, "comparator_options": None, "checker_code": None}
+    v1 = version_hash(version_fields(SimpleNamespace(**base)))
+    v2 = version_hash(version_fields(SimpleNamespace(**{**base, "test_input": "2 5"})))
+    # 比較モードの列がない（NULL）問題は exact と同じ内容とみなす
+    assert v1 == version_hash(version_fields(SimpleNamespace(**{**base, "comparator": "exact"})))
+    cache = VersionedCache(maxsize=2)
+    assert cache.get_or_compute(v1, lambda: "one") == "one"
+    assert cache.get_or_compute(v1, lambda: "changed") == "one"
+    assert cache.get_or_compute(v2, lambda: "two") == "two"
+    assert cache.get_or_compute(None, lambda: "none") == "none"
+    assert cache.get(None) is None
+    cache.put(v2, "advice", "three")
+    assert cache.get(v1) is None and cache.get(v2) == "two"
+
+
+if __name__ == "__main__":
+    print("=== 問題のバージョンのテスト ===")
+    test_update_records_new_version()
+    test_submissions_reference_judged_version()
+    test_deleted_problem_id_not_reused()
+    test_versioned_cache_keeps_versions_apart()
+    print("OK")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+トークン数の上限付きプロンプト生成のテスト
+"""
+
+import os
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from services.prompt_builder import (
+    build_advice_prompt,
+    estimate_tokens,
+    first_mismatch,
+    strip_notebook_boilerplate,
+    summarize_traceback,
+    truncate_middle,
+)
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_large_output_fits_budget():
+    """10万行の出力と長いトレースバックでも上限内に収まるか"""
+    stdout = "\n".join(f"line {i}: {i * i}" for i in range(100_000))
+    stderr = "Traceback (most recent call last):\n" + (
+        '  File "<string>", line 3, in f\n    return f(n - 1)\n' * 1000
+    ) + "RecursionError: maximum recursion depth exceeded"
+    prompt = build_advice_prompt(
+        problem_title="平方数",
+        problem_description="0から99999までの平方数を出力してください。",
+        user_code="for i in range(100000):\n    print(f'line {i}: {i * i}')",
+        execution_stdout=stdout,
+        execution_stderr=stderr,
+        correct_code="print('ok')",
+        token_budget=3000,
+    )
+    print(f"  tokens: {prompt.tokens} sections: {prompt.section_tokens}")
+    assert prompt.truncated
+    assert prompt.tokens <= 3000
+    assert "line 0: 0" in prompt.text and "line 99999: 9999800001" in prompt.text
+    assert "RecursionError" in prompt.text
+    assert prompt.text.count("RecursionError") == 1
+
+
+def test_small_prompt_is_not_truncated():
+    """小さい提出では内容を省略しないか"""
+    prompt = build_advice_prompt(
+        problem_title="和",
+        problem_description="2つの整数の和を出力してください。",
+        user_code="print(sum(map(int, input().split())))",
+        execution_stdout="3\n",
+        execution_stderr="",
+        correct_code="a, b = map(int, input().split())\nprint(a + b)",
+        is_correct=True,
+    )
+    assert not prompt.truncated
+    assert "print(sum(map(int, input().split())))" in prompt.text
+    assert "【参考：正解コード】" in prompt.text
+
+
+def test_first_mismatch():
+    """正解の出力と最初に食い違う行を返すか"""
+    assert first_mismatch("1\n2\n3\n", "1\n2\n3") is None
+    assert first_mismatch("1\n5\n3", "1\n2\n3") == (2, "2", "5")
+    assert first_mismatch("1\n2", "1\n2\n3") == (3, "3", None)
+    assert first_mismatch("1\n23", "1\n2") == (2, "2", "23")
+
+
+def test_traceback_summary_keeps_last_frame():
+    """トレースバックを最後のフレームと例外の行にまとめるか"""
+    stderr = (
+        "Traceback (most recent call last):\n"
+        '  File "<string>", line 9, in <module>\n'
+        "    main()\n"
+        '  File "<string>", line 5, in main\n'
+        "    print(values[3])\n"
+        "IndexError: list index out of range\n"
+    )
+    summary = summarize_traceback(stderr)
+    assert "line 9" not in summary
+    assert "print(values[3])" in summary
+    assert summary.endswith("IndexError: list index out of range")
+
+
+def test_notebook_boilerplate_is_stripped():
+    """ノートブックからコードセルだけを取り出し、マジックやpip行を除くか"""
+    with open(os.path.join(TEST_DIR, "test_notebook.ipynb"), encoding="utf-8") as f:
+        notebook = f.read()
+    code = strip_notebook_boilerplate(notebook)
+    assert '"cell_type"' not in code
+    cleaned = strip_notebook_boilerplate("%matplotlib inline\n!pip install numpy\nx = 1")
+    assert cleaned == "x = 1"
+
+
+def test_truncate_middle():
+    """先頭と末尾を残して上限程度に縮めるか"""
+    text = "\n".join(str(i) for i in range(10_000))
+    truncated = truncate_middle(text, 200)
+    assert truncated.startswith("0\n1\n") and truncated.endswith("9999")
+    assert "中略" in truncated
+    assert estimate_tokens(truncated) <= 220
+    assert truncate_middle("short", 200) == "short"
+
+
+if __name__ == "__main__":
+    print("=== プロンプト生成のテスト ===")
+    test_large_output_fits_budget()
+    test_small_prompt_is_not_truncated()
+    test_first_mismatch()
+    test_traceback_summary_keeps_last_frame()
+    test_notebook_boilerplate_is_stripped()
+    test_truncate_middle()
+    print("OK")
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+問題統計用の分位点スケッチのテスト
+"""
+
+import random
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from services.stats_service import QuantileSketch
+
+
+def test_quantile_accuracy():
+    """分位点が相対誤差の範囲内に収まるか"""
+    rng = random.Random(0)
+    values = sorted(rng.lognormvariate(6, 1) for _ in range(20000))
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        estimate = sketch.quantile(q)
+        print(f"  p{int(q * 100)}: exact={exact:.1f} estimate={estimate:.1f}")
+        assert abs(estimate - exact) / exact <= 0.02
+
+
+def test_json_round_trip():
+    """JSONに保存して復元しても同じ結果になるか"""
+    sketch = QuantileSketch()
+    for value in (0, 5, 12.5, 300, 300, 4000):
+        sketch.add(value)
+    restored = QuantileSketch.from_json(sketch.to_json())
+    assert restored.count == sketch.count
+    assert restored.quantile(0.5) == sketch.quantile(0.5)
+    assert QuantileSketch().quantile(0.5) is None
+
+
+if __name__ == "__main__":
+    print("=== 分位点スケッチのテスト ===")
+    test_quantile_accuracy()
+    test_json_round_trip()
+    print("OK")
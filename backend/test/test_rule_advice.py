@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+よくあるエラーに対するルールベースのアドバイスのテスト
+サンドボックスと同じ形（python -c、標準入力を埋め込んだコード）で実行したトレースバックを使う
+"""
+
+import subprocess
+import sys
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from services.rule_advice import generate_rule_advice
+from services.sandbox_service import user_code_line_offset
+
+STDIN = "1 2\n3 4"
+
+
+def run_like_sandbox(code: str):
+    """サンドボックスと同じくコードの前に標準入力を埋め込んで実行する"""
+    full_code = f"""
+import sys
+from io import StringIO
+sys.stdin = StringIO('''{STDIN}''')
+
+{code}
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", full_code], capture_output=True, text=True, timeout=10
+    )
+    return result.returncode, result.stdout + result.stderr
+
+
+def advice_for(code: str):
+    exit_code, stderr = run_like_sandbox(code)
+    return generate_rule_advice(exit_code, stderr, code, user_code_line_offset(STDIN))
+
+
+def test_name_error_suggests_similar_name():
+    """NameErrorで似た名前を提案し、提出コードの行番号を示すか"""
+    advice = advice_for("total = 0\nfor i in range(3):\n    totl += i")
+    print(f"  {advice.text!r}")
+    assert advice.rule == "name_error"
+    assert advice.line == 3
+    assert "`total`" in advice.text
+
+
+def test_common_errors_have_rules():
+    """初学者によくあるエラーに定型のヒントがあるか"""
+    cases = {
+        "for i in range(3)\n    print(i)": "missing_colon",
+        "print((1 + 2)": "unclosed_bracket",
+        "x = input()\nprint(x + 1)": "str_number_mix",
+        "print(10 / 0)": "zero_division",
+        "values = [1, 2]\nprint(values[2])": "index_out_of_range",
+        "print(int('abc'))": "invalid_number",
+        "a = input()\nb = input()\nc = input()": "eof_input",
+        "print（1）": "invalid_character",
+    }
+    for code, rule in cases.items():
+        advice = advice_for(code)
+        assert advice is not None and advice.rule == rule, (code, advice)
+
+
+def test_unknown_errors_fall_back_to_llm():
+    """確信のないエラーや正常終了ではNoneを返すか"""
+    assert advice_for("raise Exception('custom')") is None
+    assert advice_for("print(1)") is None
+    assert generate_rule_advice(1, "Docker error: connection refused") is None
+
+
+def test_timeout():
+    """タイムアウトには無限ループのヒントを返すか"""
+    advice = generate_rule_advice(124, "Code execution timed out (30 seconds)")
+    assert advice.rule == "timeout"
+
+
+if __name__ == "__main__":
+    print("=== ルールベースのアドバイスのテスト ===")
+    test_name_error_suggests_similar_name()
+    test_common_errors_have_rules()
+    test_unknown_errors_fall_back_to_llm()
+    test_timeout()
+    print("OK")
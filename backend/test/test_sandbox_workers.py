@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+サンドボックスワーカーへの振り分けのテスト
+1台のマシンで複数のワーカープロセスを --simulate-ms で起動して確かめる
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+import httpx
+from fastapi import FastAPI
+
+import services.sandbox_dispatcher as dispatcher_module
+from services.sandbox_dispatcher import NoWorkersAvailable, SandboxDispatcher
+from services.sandbox_rpc import encode_message, read_message, write_message
+
+SIMULATE_MS = 100
+CAPACITY = 2
+# APIとワーカーで共有する秘密（他のテストが先にモジュールを読み込んでいてもよいよう、直接設定する）
+TOKEN = "test-worker-token"
+dispatcher_module.SANDBOX_WORKER_TOKEN = TOKEN
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_workers(count: int) -> tuple[list[subprocess.Popen], list[str]]:
+    processes, addresses = [], []
+    for _ in range(count):
+        port = _free_port()
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(BACKEND_DIR, "sandbox_worker.py"),
+                    "--port",
+                    str(port),
+                    "--capacity",
+                    str(CAPACITY),
+                    "--simulate-ms",
+                    str(SIMULATE_MS),
+                ],
+                cwd=BACKEND_DIR,
+                env={**os.environ, "SANDBOX_WORKER_TOKEN": TOKEN},
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        )
+        addresses.append(f"127.0.0.1:{port}")
+    # 待ち受けを始めるまで待つ
+    deadline = time.monotonic() + 10
+    for address in addresses:
+        host, port = address.split(":")
+        while True:
+            try:
+                socket.create_connection((host, int(port)), timeout=0.2).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+    return processes, addresses
+
+
+def stop_workers(processes: list[subprocess.Popen]) -> None:
+    for process in processes:
+        process.kill()
+        process.wait()
+
+
+def test_least_load_dispatch():
+    """同時実行数を超えないように複数のワーカーへ均等に振り分け、並列に実行するか"""
+    processes, addresses = start_workers(3)
+    try:
+
+        async def scenario():
+            dispatcher = SandboxDispatcher(",".join(addresses), static_capacity=CAPACITY)
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(dispatcher.execute("print(1)") for _ in range(24))
+            )
+            elapsed = time.perf_counter() - start
+            await dispatcher.close()
+            return results, elapsed
+
+        results, elapsed = asyncio.run(scenario())
+        counts = Counter(r["stdout"].split()[-1] for r in results)
+        print(f"  24 jobs on 3 workers x {CAPACITY}: {elapsed * 1000:.0f} ms, {dict(counts)}")
+        assert sorted(counts.values()) == [8, 8, 8]
+        # 24件 / 同時6件 = 4巡分の時間で終わる（直列なら2.4秒）
+        assert elapsed < 4 * SIMULATE_MS / 1000 * 2.5
+    finally:
+        stop_workers(processes)
+
+
+def test_retry_on_worker_loss():
+    """実行中にワーカーが落ちても、別のワーカーで再実行して結果を返すか"""
+    processes, addresses = start_workers(2)
+    try:
+
+        async def scenario():
+            dispatcher = SandboxDispatcher(",".join(addresses), static_capacity=CAPACITY)
+            jobs = [asyncio.create_task(dispatcher.execute("print(1)")) for _ in range(8)]
+            await asyncio.sleep(SIMULATE_MS / 1000 / 2)
+            processes[0].kill()
+            results = await asyncio.gather(*jobs)
+            summary = {w["address"]: w for w in await dispatcher.summary()}
+            await dispatcher.close()
+            return results, summary
+
+        results, summary = asyncio.run(scenario())
+        assert all(r["exit_code"] == 0 for r in results)
+        # 落ちたワーカーのジョブも、待っていたジョブも残ったワーカーで実行される
+        assert all(r["stdout"].split()[-1] == addresses[1] for r in results)
+        assert summary[addresses[0]]["failures"] == 1
+        assert not summary[addresses[0]]["available"]
+    finally:
+        stop_workers(processes)
+
+
+def test_message_framing():
+    """長さ付きメッセージを分割して受け取っても1つずつ読めるか"""
+
+    async def scenario():
+        reader = asyncio.StreamReader()
+        data = encode_message({"id": 1, "result": {"stdout": "あ" * 1000}})
+        data += encode_message({"id": 2, "method": "status"})
+        for i in range(0, len(data), 7):
+            reader.feed_data(data[i : i + 7])
+        reader.feed_eof()
+        messages = []
+        while (message := await read_message(reader)) is not None:
+            messages.append(message)
+        return messages
+
+    messages = asyncio.run(scenario())
+    assert [m["id"] for m in messages] == [1, 2]
+    assert messages[0]["result"]["stdout"] == "あ" * 1000
+
+
+def test_registration_and_expiry():
+    """ハートビートで登録したワーカーが、途絶えると外れるか"""
+
+    async def scenario():
+        dispatcher = SandboxDispatcher()
+        assert not await dispatcher.has_workers()
+        worker = await dispatcher.register("127.0.0.1:1", capacity=3)
+        assert await dispatcher.has_workers() and worker.capacity == 3
+        worker.last_seen -= dispatcher_module.SANDBOX_WORKER_TTL_S + 1
+        assert not await dispatcher.has_workers()
+
+    asyncio.run(scenario())
+
+
+def test_registration_requires_token():
+    """ワーカーの登録には SANDBOX_WORKER_TOKEN が、一覧には ADMIN_TOKEN が必要か"""
+    import routers.admin as admin
+
+    app = FastAPI()
+    app.include_router(admin.router)
+    registration = {"address": "127.0.0.1:2", "capacity": 1}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            url = "/admin/sandbox-workers"
+            admin.SANDBOX_WORKER_TOKEN = ""
+            assert (await client.post(url, json=registration)).status_code == 403
+            admin.SANDBOX_WORKER_TOKEN = TOKEN
+            assert (await client.post(url, json=registration)).status_code == 401
+            wrong = {"Authorization": "Bearer wrong"}
+            assert (await client.post(url, json=registration, headers=wrong)).status_code == 401
+            right = {"Authorization": f"Bearer {TOKEN}"}
+            response = await client.post(url, json=registration, headers=right)
+            assert response.status_code == 200, response.text
+
+            # 一覧（ワーカーのアドレス）は管理用のトークンで見る（ワーカーのトークンでは見られない）
+            admin.ADMIN_TOKEN = ""
+            assert (await client.get(url)).status_code == 403
+            admin.ADMIN_TOKEN = "secret"
+            assert (await client.get(url)).status_code == 401
+            assert (await client.get(url, headers=right)).status_code == 401
+            response = await client.get(url, headers={"Authorization": "Bearer secret"})
+            assert response.status_code == 200, response.text
+            assert registration["address"] in {w["address"] for w in response.json()}
+
+    originals = admin.SANDBOX_WORKER_TOKEN, admin.ADMIN_TOKEN
+    try:
+        asyncio.run(scenario())
+    finally:
+        admin.SANDBOX_WORKER_TOKEN, admin.ADMIN_TOKEN = originals
+
+
+def test_worker_rejects_connection_without_token():
+    """トークンが違う・helloのない接続では、ワーカーが実行せずに接続を閉じるか"""
+    processes, addresses = start_workers(1)
+    try:
+
+        async def scenario():
+            host, port = addresses[0].split(":")
+            reader, writer = await asyncio.open_connection(host, int(port))
+            await write_message(
+                writer, {"id": 1, "method": "execute", "params": {"user_code": "print(1)"}}
+            )
+            reply = await read_message(reader)
+            assert reply == {"id": 1, "error": "Invalid worker token"}
+            assert await read_message(reader) is None
+            writer.close()
+
+            original = dispatcher_module.SANDBOX_WORKER_TOKEN
+            dispatcher_module.SANDBOX_WORKER_TOKEN = "wrong"
+            dispatcher = SandboxDispatcher(addresses[0], static_capacity=CAPACITY)
+            try:
+                await dispatcher.execute("print(1)")
+            except NoWorkersAvailable as e:
+                assert "rejected" in str(e)
+            else:
+                raise AssertionError("a worker accepted a connection with a wrong token")
+            finally:
+                dispatcher_module.SANDBOX_WORKER_TOKEN = original
+                await dispatcher.close()
+
+        asyncio.run(scenario())
+    finally:
+        stop_workers(processes)
+
+
+if __name__ == "__main__":
+    print("=== サンドボックスワーカーのテスト ===")
+    test_least_load_dispatch()
+    test_retry_on_worker_loss()
+    test_message_framing()
+    test_registration_and_expiry()
+    test_registration_requires_token()
+    test_worker_rejects_connection_without_token()
+    print("OK")
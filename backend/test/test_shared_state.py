@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+ワーカープロセス間で共有する状態（services/shared_state.py）のテスト
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from services.problem_cache import ProblemCache
+from services.reference_cache import ReferenceCache
+from services.sandbox_service import CodeExecutionResult
+from services import shared_state
+from services.shared_state import LocalSemaphore, SharedState
+
+# 別のプロセスで、共有のセマフォを通して実行した区間（開始・終了時刻）を出力する
+_SEMAPHORE_CHILD = """
+import asyncio, json, sys, time
+from services.shared_state import SharedSemaphore, SharedState
+
+path, limit, jobs = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+semaphore = SharedSemaphore(SharedState(path), "test", limit, ttl_s=60)
+
+async def job():
+    lease_id = await semaphore.acquire()
+    start = time.time()
+    await asyncio.sleep(0.05)
+    end = time.time()
+    await semaphore.release(lease_id)
+    return start, end
+
+async def main():
+    return await asyncio.gather(*(job() for _ in range(jobs)))
+
+print(json.dumps(asyncio.run(main())))
+"""
+
+
+def _state(name: str) -> SharedState:
+    return SharedState(os.path.join(testenv.TMPDIR, f"{name}.db"))
+
+
+def _result(stdout: str) -> CodeExecutionResult:
+    return CodeExecutionResult(
+        stdout=stdout, stderr="", execution_time_ms=1.0, exit_code=0, succeeded=True
+    )
+
+
+def test_global_limit_across_processes():
+    """複数のプロセスから取得しても、同時に確保される枠が上限を超えないか"""
+    path = os.path.join(testenv.TMPDIR, "semaphore.db")
+    limit, processes, jobs = 3, 4, 6
+    children = [
+        subprocess.Popen(
+            [sys.executable, "-c", _SEMAPHORE_CHILD, path, str(limit), str(jobs)],
+            cwd=BACKEND_DIR,
+            stdout=subprocess.PIPE,
+        )
+        for _ in range(processes)
+    ]
+    intervals = []
+    for child in children:
+        stdout, _ = child.communicate(timeout=60)
+        assert child.returncode == 0
+        intervals.extend(json.loads(stdout))
+    assert len(intervals) == processes * jobs
+
+    events = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    running = peak = 0
+    for _, delta in events:
+        running += delta
+        peak = max(peak, running)
+    print(f"  peak concurrency across {processes} processes: {peak} (limit {limit})")
+    assert peak <= limit
+    assert SharedState(path).leases_in_use("test") == 0
+
+
+def test_expired_lease_is_reclaimed():
+    """解放されずに残った枠は期限が切れると再び使えるか"""
+    state = _state("expiry")
+    assert state.try_acquire_lease("pool", 1, ttl_s=-1) is not None
+    assert state.try_acquire_lease("pool", 1, ttl_s=60) is not None
+    assert state.try_acquire_lease("pool", 1, ttl_s=60) is None
+
+
+def test_waiting_tickets_are_served_in_order():
+    """枠が空いたら先に待ち始めた順番から確保し、後から来たものや順番のない呼び出しは追い越せないか"""
+    state = _state("tickets")
+    holder = state.try_acquire_lease("pool", 1, ttl_s=60)
+    assert state.try_acquire_lease("pool", 1, 60, "first") is None
+    assert state.try_acquire_lease("pool", 1, 60, "second") is None
+    state.release_lease(holder)
+
+    assert state.try_acquire_lease("pool", 1, 60, "second") is None
+    assert state.try_acquire_lease("pool", 1, 60) is None
+    first = state.try_acquire_lease("pool", 1, 60, "first")
+    assert first is not None
+    state.release_lease(first)
+    assert state.try_acquire_lease("pool", 1, 60, "second") is not None
+
+    # 待つのをやめた順番や、確認が途絶えた順番は列を止めない
+    assert state.try_acquire_lease("pool", 1, 60, "gone") is None
+    state.release_ticket("gone")
+    original = shared_state.SHARED_LEASE_TICKET_TTL_S
+    shared_state.SHARED_LEASE_TICKET_TTL_S = -1
+    try:
+        assert state.try_acquire_lease("pool", 1, 60, "stale") is None
+    finally:
+        shared_state.SHARED_LEASE_TICKET_TTL_S = original
+    assert state.try_acquire_lease("pool", 2, 60) is not None
+
+
+def test_local_semaphore_is_fifo():
+    """プロセス内のセマフォが待ち始めた順に枠を渡し、キャンセル・上限の変更に追従するか"""
+    order = []
+
+    async def scenario():
+        semaphore = LocalSemaphore("test", 1)
+        holder = await semaphore.acquire()
+
+        async def wait(name: str):
+            lease_id = await semaphore.acquire()
+            order.append(name)
+            return lease_id
+
+        tasks = {name: asyncio.create_task(wait(name)) for name in ("a", "b", "c", "d")}
+        await asyncio.sleep(0)
+        # 待っている途中でキャンセルされたものは飛ばす
+        tasks["b"].cancel()
+        await semaphore.release(holder)
+        await asyncio.sleep(0)
+        assert order == ["a"] and semaphore.in_use() == 1
+        await semaphore.release(tasks["a"].result())
+        await asyncio.sleep(0)
+        assert order == ["a", "c"]
+
+        # 上限を上げたら、待っているものにすぐ渡す
+        semaphore.limit = 2
+        await asyncio.sleep(0)
+        assert order == ["a", "c", "d"] and semaphore.in_use() == 2
+        for name in ("c", "d"):
+            await semaphore.release(tasks[name].result())
+        assert semaphore.in_use() == 0
+        assert tasks["b"].cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_single_worker_uses_process_state():
+    """UVICORN_WORKERS が1（既定）なら、実行枠・キャッシュ・出し直しの検知に共有状態を使わないか"""
+    import services.problem_cache as problem_cache
+    import services.reference_cache as reference_cache
+    import services.sandbox_service as sandbox_service
+
+    assert shared_state.UVICORN_WORKERS == 1
+    assert isinstance(sandbox_service.sandbox_slots, LocalSemaphore)
+    assert problem_cache.problem_cache.shared is None
+    assert reference_cache.reference_cache.shared is None
+    # 出し直しの検知はテストで共有状態を差し替えることがあるため、既定の値を確かめる
+    assert shared_state.cross_process_state is None
+
+
+def test_reference_cache_shared_between_processes():
+    """別のプロセスのキャッシュ（同じ共有状態）が同時に求めても、実行は1回だけか"""
+    state = _state("reference")
+    first, second = ReferenceCache(shared=state), ReferenceCache(shared=state)
+    calls = []
+
+    async def run():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return _result("42\n")
+
+    async def scenario():
+        return await asyncio.gather(
+            first.get_or_run("key", run), second.get_or_run("key", run)
+        )
+
+    results = asyncio.run(scenario())
+    assert [r.stdout for r in results] == ["42\n", "42\n"]
+    assert len(calls) == 1
+    # 後から作ったキャッシュも共有状態から読める
+    third = ReferenceCache(shared=state)
+    assert asyncio.run(third.get_or_run("key", run)).stdout == "42\n"
+    assert len(calls) == 1
+
+
+class FakeDB:
+    """ProblemCacheが使う db.get だけを持つ偽物"""
+
+    def __init__(self):
+        self.titles = {1: "A"}
+
+    def get(self, model, problem_id):
+        now = datetime.now(timezone.utc)
+        return SimpleNamespace(
+            id=problem_id,
+            title=self.titles[problem_id],
+            description="",
+            correct_code="print(1)",
+            test_input=None,
+            comparator="exact",
+            comparator_options=None,
+            checker_code=None,
+            created_at=now,
+            updated_at=now,
+        )
+
+
+def test_problem_cache_invalidated_by_other_process():
+    """別のプロセスで問題を更新したら、このプロセスのキャッシュも破棄されるか"""
+    state = _state("problems")
+    db = FakeDB()
+    here, there = ProblemCache(shared=state), ProblemCache(shared=state)
+
+    async def scenario():
+        assert (await here.get(db, 1)).value.title == "A"
+        db.titles[1] = "B"
+        assert (await here.get(db, 1)).value.title == "A"
+        await there.invalidate(1)
+        assert (await here.get(db, 1)).value.title == "B"
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    print("=== 共有状態のテスト ===")
+    test_global_limit_across_processes()
+    test_expired_lease_is_reclaimed()
+    test_waiting_tickets_are_served_in_order()
+    test_local_semaphore_is_fifo()
+    test_single_worker_uses_process_state()
+    test_reference_cache_shared_between_processes()
+    test_problem_cache_invalidated_by_other_process()
+    print("OK")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+提出履歴のキーセットページング（GET /submissions/ の cursor）のテスト
+"""
+
+import asyncio
+import base64
+from datetime import datetime, timedelta
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from database import SessionLocal, SubmissionModel
+
+PROBLEM_IDS = (8001, 8002)
+START = datetime(2031, 1, 1)
+
+
+def _add_submissions() -> list[SubmissionModel]:
+    """3件ずつ同じ提出日時を持つ提出を追加する（同じ日時はIDの順で並べる必要がある）"""
+    with SessionLocal() as db:
+        rows = [
+            SubmissionModel(
+                problem_id=PROBLEM_IDS[i % 2],
+                submitter_id=f"u{i % 3}",
+                user_code=f"print({i})",
+                exit_code=1 if i % 5 == 0 else 0,
+                is_correct=i % 4 == 0,
+                submitted_at=START + timedelta(minutes=i // 3),
+            )
+            for i in range(40)
+        ]
+        db.add_all(rows)
+        db.commit()
+        for row in rows:
+            db.refresh(row)
+        db.expunge_all()
+        return rows
+
+
+async def _read_all(client, params: dict, limit: int) -> list[int]:
+    """next_cursor をたどって全ページを読み、提出IDを並んだ順に返す"""
+    ids, cursor = [], None
+    while True:
+        page_params = {**params, "limit": limit}
+        if cursor is not None:
+            page_params["cursor"] = cursor
+        response = await client.get("/submissions/", params=page_params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        assert len(page["items"]) <= limit
+        ids.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def _expected(rows: list[SubmissionModel], keep) -> list[int]:
+    matching = [row for row in rows if keep(row)]
+    matching.sort(key=lambda row: (row.submitted_at, row.id), reverse=True)
+    return [row.id for row in matching]
+
+
+def test_cursor_round_trips_with_filters():
+    """絞り込み条件ごとに、ページをたどると重複・抜けなく新しい順に全件を返すか"""
+    in_range = lambda row: row.problem_id in PROBLEM_IDS  # noqa: E731
+    cases = [
+        ({}, in_range),
+        ({"problem_id": 8001}, lambda row: row.problem_id == 8001),
+        (
+            {"problem_id": 8002, "submitter_id": "u1"},
+            lambda row: row.problem_id == 8002 and row.submitter_id == "u1",
+        ),
+        ({"verdict": "error"}, lambda row: in_range(row) and row.exit_code != 0),
+        (
+            {"verdict": "incorrect", "problem_id": 8001},
+            lambda row: row.problem_id == 8001 and not row.is_correct and row.exit_code == 0,
+        ),
+        (
+            {
+                "submitted_after": (START + timedelta(minutes=2)).isoformat(),
+                "submitted_before": (START + timedelta(minutes=9)).isoformat(),
+            },
+            lambda row: START + timedelta(minutes=2)
+            <= row.submitted_at
+            < START + timedelta(minutes=9),
+        ),
+    ]
+
+    async def scenario(client):
+        # テーブルは起動処理で作られる
+        rows = _add_submissions()
+        for params, keep in cases:
+            expected = _expected(rows, keep)
+            assert expected, params
+            for limit in (1, 2, 3, 7, 500):
+                params_in_range = dict(params)
+                if not any(key.startswith("submitted_") for key in params):
+                    params_in_range["submitted_after"] = START.isoformat()
+                ids = await _read_all(client, params_in_range, limit)
+                assert ids == expected, (params, limit)
+
+    asyncio.run(testenv.with_client(scenario))
+
+
+def test_invalid_cursor_is_rejected():
+    """壊れたカーソルは500ではなく400になるか"""
+
+    def encode(raw: str) -> str:
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+    async def scenario(client):
+        for cursor in (
+            "not base64!",
+            encode("no separator"),
+            encode("2031-01-01T00:00:00|abc"),
+            encode("yesterday|12"),
+            "ｶｰｿﾙ",
+        ):
+            response = await client.get("/submissions/", params={"cursor": cursor})
+            assert response.status_code == 400, (cursor, response.text)
+            assert response.json()["detail"] == "Invalid cursor"
+
+        # タイムゾーン付きの日時もUTCに直して使える
+        response = await client.get(
+            "/submissions/",
+            params={"cursor": encode("2031-01-01T09:00:00+09:00|1"), "problem_id": 8001},
+        )
+        assert response.status_code == 200 and response.json()["items"] == []
+
+    asyncio.run(testenv.with_client(scenario))
+
+
+if __name__ == "__main__":
+    print("=== 提出履歴のページングのテスト ===")
+    test_cursor_round_trips_with_filters()
+    test_invalid_cursor_is_rejected()
+    print("OK")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+提出結果のグループコミット（services/submission_writer.py）のテスト
+"""
+
+import asyncio
+import os
+from datetime import datetime, timezone
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, SubmissionModel
+from services.submission_writer import SubmissionWriter
+
+
+def _session_factory(name: str):
+    engine = create_engine(
+        f"sqlite:///{os.path.join(testenv.TMPDIR, name)}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def _submission(code: str) -> SubmissionModel:
+    return SubmissionModel(
+        problem_id=1,
+        user_code=code,
+        exit_code=0,
+        is_correct=True,
+        submitted_at=datetime.now(timezone.utc),
+    )
+
+
+def _saved_codes(session_factory) -> list[str]:
+    with session_factory() as db:
+        return [row.user_code for row in db.query(SubmissionModel).order_by(SubmissionModel.id)]
+
+
+def test_concurrent_writes_share_one_commit():
+    """窓の中の書き込みを1回のコミットにまとめ、最大件数で分け、それぞれのIDを返すか"""
+    session_factory = _session_factory("batch.db")
+    batches = []
+
+    def record_batch(session, submissions):
+        batches.append([submission.user_code for submission in submissions])
+
+    async def scenario():
+        writer = SubmissionWriter(
+            session_factory, window_ms=200, max_batch=4, before_commit=record_batch
+        )
+        ids = await asyncio.gather(*(writer.write(_submission(f"print({i})")) for i in range(10)))
+        await writer.stop()
+        return ids
+
+    ids = asyncio.run(scenario())
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert sorted(ids) == ids and len(set(ids)) == 10
+    assert _saved_codes(session_factory) == [f"print({i})" for i in range(10)]
+
+
+def test_failed_batch_retries_one_by_one():
+    """バッチのコミットが失敗したら1件ずつやり直し、失敗した提出の呼び出し元にだけ例外を返すか"""
+    session_factory = _session_factory("retry.db")
+    calls = []
+
+    def reject_bad(session, submissions):
+        calls.append(len(submissions))
+        if any(submission.user_code == "bad" for submission in submissions):
+            raise RuntimeError("stats update failed")
+
+    async def scenario():
+        writer = SubmissionWriter(session_factory, window_ms=200, before_commit=reject_bad)
+        results = await asyncio.gather(
+            *(writer.write(_submission(code)) for code in ("ok1", "bad", "ok2")),
+            return_exceptions=True,
+        )
+        # 失敗の後もライターは動き続ける
+        after = await writer.write(_submission("ok3"))
+        await writer.stop()
+        return results, after
+
+    (first, failed, second), after = asyncio.run(scenario())
+    assert isinstance(failed, RuntimeError) and str(failed) == "stats update failed"
+    assert isinstance(first, int) and isinstance(second, int)
+    assert len({first, second, after}) == 3
+    # まとめたコミット1回 + 1件ずつのやり直し3回 + 最後の書き込み
+    assert calls == [3, 1, 1, 1, 1]
+    assert _saved_codes(session_factory) == ["ok1", "ok2", "ok3"]
+
+
+def test_stop_flushes_queued_writes():
+    """停止する前にキューに残った提出をコミットするか"""
+    session_factory = _session_factory("stop.db")
+
+    async def scenario():
+        writer = SubmissionWriter(session_factory, window_ms=1000)
+        tasks = [asyncio.create_task(writer.write(_submission(f"q{i}"))) for i in range(3)]
+        await asyncio.sleep(0)
+        await writer.stop()
+        return [task.result() for task in tasks]
+
+    ids = asyncio.run(scenario())
+    assert len(set(ids)) == 3
+    assert _saved_codes(session_factory) == ["q0", "q1", "q2"]
+
+
+if __name__ == "__main__":
+    print("=== グループコミットのテスト ===")
+    test_concurrent_writes_share_one_commit()
+    test_failed_batch_retries_one_by_one()
+    test_stop_flushes_queued_writes()
+    print("OK")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+リクエストトレーシングのテスト
+"""
+
+import asyncio
+import logging
+
+# 一時ディレクトリのDB・アーカイブ・共有状態を使う（database.py などの読み込み前に import する）
+import testenv
+
+import httpx
+from fastapi import FastAPI
+
+from services import tracing
+
+
+def test_nested_spans_share_trace():
+    """子スパンが同じトレースに親子関係付きで記録されるか"""
+    tracing.TRACE_SAMPLE_RATE = 1.0
+    with tracing.span("request") as root:
+        with tracing.span("user_run") as child:
+            assert tracing.current_trace_id() == root.trace_id
+    assert tracing.current_trace_id() is None
+
+    trace = tracing.trace_buffer.get(root.trace_id)
+    names = [span["name"] for span in trace["spans"]]
+    print(f"  spans: {names}")
+    assert names == ["request", "user_run"]
+    assert trace["spans"][1]["parent_id"] == root.span_id
+    assert child.duration_ms <= root.duration_ms
+
+
+def test_sampling_keeps_slow_traces():
+    """サンプリング対象外でも遅いトレースはエクスポートされるか"""
+    tracing.TRACE_SAMPLE_RATE = 0.0
+    tracing.TRACE_SLOW_MS = 1e9
+    with tracing.span("request") as fast:
+        pass
+    assert tracing.trace_buffer.get(fast.trace_id) is None
+
+    tracing.TRACE_SLOW_MS = 0
+    with tracing.span("request") as slow:
+        pass
+    assert tracing.trace_buffer.get(slow.trace_id) is not None
+
+
+def test_context_propagates_to_executor():
+    """copy_contextで渡したスレッド内のスパンが同じトレースに入るか"""
+    import contextvars
+
+    tracing.TRACE_SAMPLE_RATE = 1.0
+
+    def work():
+        with tracing.span("sandbox"):
+            return tracing.current_trace_id()
+
+    async def main():
+        with tracing.span("request") as root:
+            context = contextvars.copy_context()
+            trace_id = await asyncio.get_running_loop().run_in_executor(
+                None, context.run, work
+            )
+        return root, trace_id
+
+    root, trace_id = asyncio.run(main())
+    assert trace_id == root.trace_id
+    trace = tracing.trace_buffer.get(root.trace_id)
+    assert [span["name"] for span in trace["spans"]] == ["request", "sandbox"]
+
+
+def test_log_records_have_trace_id():
+    """ログレコードにトレースIDが付くか"""
+    tracing.install_log_record_factory()
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger("test_tracing")
+    logger.addHandler(handler)
+    with tracing.span("request") as root:
+        logger.warning("inside")
+    logger.warning("outside")
+    assert records[0].trace_id == root.trace_id
+    assert records[1].trace_id == "-"
+
+
+def test_trace_endpoints_require_admin_token():
+    """トレースの一覧・取得には ADMIN_TOKEN が必要か（提出のコードや出力が含まれるため）"""
+    import routers.admin as admin
+
+    app = FastAPI()
+    app.include_router(admin.router)
+    tracing.TRACE_SAMPLE_RATE = 1.0
+    with tracing.span("request") as root:
+        pass
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for url in ("/admin/traces", f"/admin/traces/{root.trace_id}"):
+                admin.ADMIN_TOKEN = ""
+                assert (await client.get(url)).status_code == 403, url
+                admin.ADMIN_TOKEN = "secret"
+                assert (await client.get(url)).status_code == 401, url
+                wrong = {"Authorization": "Bearer wrong"}
+                assert (await client.get(url, headers=wrong)).status_code == 401, url
+                right = {"Authorization": "Bearer secret"}
+                response = await client.get(url, headers=right)
+                assert response.status_code == 200, response.text
+
+    original = admin.ADMIN_TOKEN
+    try:
+        asyncio.run(scenario())
+    finally:
+        admin.ADMIN_TOKEN = original
+
+
+if __name__ == "__main__":
+    print("=== トレーシングのテスト ===")
+    test_nested_spans_share_trace()
+    test_sampling_keeps_slow_traces()
+    test_context_propagates_to_executor()
+    test_log_records_have_trace_id()
+    test_trace_endpoints_require_admin_token()
+    print("OK")
@@ -0,0 +1,37 @@
+# テストとベンチマークで共通の一時環境
+"""
+開発用のDB・アーカイブ・共有状態（backend/ 以下）に書き込まないよう、一時ディレクトリを使う
+database.py や services.shared_state より先に import する必要がある
+（pytestで複数のモジュールを実行するときは、最初の import で決まった一時ディレクトリを全体で使う）
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+
+_tmpdir = tempfile.TemporaryDirectory()
+# テストごとのファイル（DBやソケット）を置くディレクトリ
+TMPDIR = _tmpdir.name
+
+os.environ.setdefault("DATABASE_PATH", os.path.join(TMPDIR, "test.db"))
+os.environ.setdefault("ARCHIVE_DIR", os.path.join(TMPDIR, "archive"))
+os.environ.setdefault("SHARED_STATE_PATH", os.path.join(TMPDIR, "shared_state.db"))
+
+
+async def with_client(scenario, *args, base_url: str = "http://test", timeout: float = 5):
+    """アプリを起動し、ASGIで直接呼び出すクライアントを scenario(client, *args) に渡す"""
+    import httpx
+
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    # ASGITransportはlifespanを実行しないため、ここで起動・終了処理を行う
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url=base_url, timeout=timeout
+        ) as client:
+            return await scenario(client, *args)
@@ -69,6 +69,10 @@ export async function submitCode(submission: SubmissionCreate): Promise<Submissi
         if (!response.ok) {
             const errorText = await response.text();
             console.error(`Submit API Error: ${response.status} - ${errorText}`);
+            if (response.status === 409) {
+                // 同じ問題に新しい提出をしたため、この提出の処理は取り消された
+                throw new ApiError(response.status, "新しい提出を受け付けたため、この提出は取り消されました");
+            }
             throw new ApiError(response.status, "コードの提出に失敗しました");
         }
 
@@ -106,6 +110,10 @@ export async function submitCodeFile(problemId: number, file: File): Promise<Sub
         if (!response.ok) {
             const errorText = await response.text();
             console.error(`Submit File API Error: ${response.status} - ${errorText}`);
+            if (response.status === 409) {
+                // 同じ問題に新しい提出をしたため、この提出の処理は取り消された
+                throw new ApiError(response.status, "新しい提出を受け付けたため、この提出は取り消されました");
+            }
             throw new ApiError(response.status, "コードファイルの提出に失敗しました");
         }
 
@@ -1,11 +1,28 @@
 // API関連の型定義
 
+// 出力の比較モード
+export type Comparator =
+    | "exact"
+    | "lines"
+    | "tokens"
+    | "numeric"
+    | "unordered_lines"
+    | "checker";
+
+export interface ComparatorOptions {
+    abs_tol?: number;  // numeric の絶対誤差
+    rel_tol?: number;  // numeric の相対誤差
+}
+
 export interface Problem {
     id: number;
     title: string;
     description: string;
     correct_code: string;
     test_input?: string | null;  // test_inputフィールドを追加
+    comparator?: Comparator;  // 出力の比較モード
+    comparator_options?: ComparatorOptions | null;
+    checker_code?: string | null;  // comparator が "checker" のときのチェッカースクリプト
     created_at: string;
     updated_at: string;
 }
@@ -17,12 +34,25 @@ export interface ProblemCreate {
     description: string;
     correct_code: string;
     test_input?: string | null;
+    comparator?: Comparator;
+    comparator_options?: ComparatorOptions | null;
+    checker_code?: string | null;
 }
 
 export interface SubmissionCreate {
     problem_id: number;
     user_code: string;
     code_type?: "python" | "notebook";
+    submitter_id?: string | null;  // 提出者の識別子
+    force_llm_advice?: boolean;  // よくあるエラーでもAIでアドバイスを生成する
+}
+
+export interface OutputMismatch {
+    line?: number | null;  // 提出コードの出力での行番号（1始まり）
+    column?: number | null;  // 行内の位置（1始まり）
+    expected?: string | null;
+    actual?: string | null;
+    snippet: string;  // 前後数行の差分
 }
 
 export interface SubmissionResponse {
@@ -32,7 +62,9 @@ export interface SubmissionResponse {
     execution_time_ms?: number | null;  // 実行時間（ミリ秒）
     exit_code?: number | null;  // 終了コード
     advice_text?: string | null;  // AIからのアドバイス（将来用）
-    is_correct: boolean;  // 正解判定結果
+    advice_source?: "rule" | "llm" | null;  // アドバイスの生成元
+    is_correct: boolean | null;  // 正解判定結果（正解コードの実行や判定が時間内に終わらなければnull）
+    mismatch?: OutputMismatch | null;  // 正解の出力と最初に食い違った位置
     // お手本の実行結果
     correct_stdout?: string | null;  // お手本の標準出力
     correct_stderr?: string | null;  // お手本の標準エラー